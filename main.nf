@@ -27,6 +27,52 @@ validateBoolean(params.tree_classification, 'tree_classification')
 validateMinimumInteger(params.tree_reference_count, 'tree_reference_count', 3)
 validatePositiveInteger(params.tree_assignment_neighbors, 'tree_assignment_neighbors')
 validateFraction(params.tree_trim_gap_fraction, 'tree_trim_gap_fraction')
+validateNonNegativeInteger(params.tree_bundle_bases, 'tree_bundle_bases')
+validateNonNegativeInteger(params.cmsearch_shard_bases, 'cmsearch_shard_bases')
+validatePositiveInteger(params.cmsearch_window_bases, 'cmsearch_window_bases')
+validateNonNegativeInteger(params.cmsearch_window_overlap, 'cmsearch_window_overlap')
+if ((params.cmsearch_window_overlap as long) >= (params.cmsearch_window_bases as long)) {
+    throw new IllegalArgumentException(
+        '--cmsearch_window_overlap must be smaller than --cmsearch_window_bases'
+    )
+}
+validatePositiveInteger(params.cmsearch_cache_max_mb, 'cmsearch_cache_max_mb')
+validateNonNegativeInteger(params.sample_batch_bases, 'sample_batch_bases')
+if ((params.sample_batch_bases as long) > 0 && (params.cmsearch_shard_bases as long) > 0) {
+    throw new IllegalArgumentException(
+        '--sample_batch_bases and --cmsearch_shard_bases cannot be combined'
+    )
+}
+validateBoolean(params.deduplicate_sequences, 'deduplicate_sequences')
+if (params.deduplicate_sequences && (params.sample_batch_bases as long) > 0) {
+    throw new IllegalArgumentException(
+        '--deduplicate_sequences and --sample_batch_bases cannot be combined'
+    )
+}
+cmsearch_cache_directory = params.cmsearch_cache_dir \
+    ? resolveProjectPath(params.cmsearch_cache_dir) \
+    : ''
+cmsearch_cache_report = ''
+validatePositiveInteger(params.annotation_cache_max_mb, 'annotation_cache_max_mb')
+annotation_cache_file = params.annotation_cache \
+    ? resolveProjectPath(params.annotation_cache) \
+    : ''
+if (annotation_cache_file && (params.sample_batch_bases as long) > 0) {
+    throw new IllegalArgumentException(
+        '--annotation_cache and --sample_batch_bases cannot be combined'
+    )
+}
+validateNonNegativeInteger(params.blast_first_pass_targets, 'blast_first_pass_targets')
+if ((params.blast_first_pass_targets as int) > 0 && (params.sample_batch_bases as long) > 0) {
+    throw new IllegalArgumentException(
+        '--blast_first_pass_targets and --sample_batch_bases cannot be combined'
+    )
+}
+if ((params.blast_first_pass_targets as int) > 0 && annotation_cache_file) {
+    throw new IllegalArgumentException(
+        '--blast_first_pass_targets and --annotation_cache cannot be combined'
+    )
+}
 if ((params.tree_assignment_neighbors as int) > (params.tree_reference_count as int)) {
     throw new IllegalArgumentException(
         '--tree_assignment_neighbors cannot exceed --tree_reference_count'
@@ -43,6 +89,11 @@ if (params.tree_classification && database_config.legacy) {
         '--tree_classification requires a managed curated or img database profile'
     )
 }
+if (annotation_cache_file && database_config.legacy) {
+    throw new IllegalArgumentException(
+        '--annotation_cache requires a managed curated or img database profile'
+    )
+}
 
 
 workflow {
@@ -54,6 +105,12 @@ workflow {
         .map { file ->
             sample_id = file.baseName
             validateIdentifier(sample_id, 'sample')
+            // Deduplicated records are annotated as the pseudo-sample "unique".
+            if (params.deduplicate_sequences && sample_id == 'unique') {
+                throw new IllegalArgumentException(
+                    "Sample identifier 'unique' is reserved with --deduplicate_sequences"
+                )
+            }
             tuple(sample_id, file)
         }
 
@@ -76,29 +133,259 @@ workflow {
         }
 
     sample_model_combinations = fna_files.combine(cm_models)
+    search_models = cm_models.map { model_id, cm_model, marker, db_prefix, taxonomy_file, source_records_file, legacy_database ->
+        tuple(model_id, cm_model)
+    }
 
-    CMSEARCH(sample_model_combinations)
-    cmsearch_files_by_sample = CMSEARCH.out
-        .map { sample_id, model_id, cmsearch_out, fna_file, cm_model, marker, db_prefix, taxonomy_file, source_records_file, legacy_database ->
-            tuple(sample_id, cmsearch_out)
+    model_annotations = sample_model_combinations
+        .map { sample_id, fna_file, model_id, cm_model, marker, db_prefix, taxonomy_file, source_records_file, legacy_database ->
+            tuple(sample_id, model_id, marker, db_prefix, taxonomy_file, source_records_file, legacy_database)
+        }
+
+    if ((params.sample_batch_bases as long) > 0) {
+        // Batches of small assemblies run as one task each; see
+        // scripts/annotate_batch.py for why results match per-sample tasks.
+        batch_inputs = fna_files
+            .toSortedList { left, right -> left[0] <=> right[0] }
+            .flatMap { samples -> sampleBatches(samples, params.sample_batch_bases as long) }
+        batch_models = cm_models
+            .map { model_id, cm_model, marker, db_prefix, taxonomy_file, source_records_file, legacy_database ->
+                cm_model
+            }
+            .collect()
+        batch_databases = cm_models
+            .map { model_id, cm_model, marker, db_prefix, taxonomy_file, source_records_file, legacy_database ->
+                "${model_id}=${db_prefix}"
+            }
+            .collect()
+        model_ids = cm_models
+            .map { model_id, cm_model, marker, db_prefix, taxonomy_file, source_records_file, legacy_database ->
+                model_id
+            }
+            .collect()
+        ANNOTATE_BATCH(batch_inputs, batch_models, batch_databases)
+        cmsearch_cache_statuses = ANNOTATE_BATCH.out.cache.flatMap { statuses -> statuses.tokenize() }
+        batch_outputs = ANNOTATE_BATCH.out.results
+            .combine(model_ids.map { ids -> [ids] })
+            .flatMap { batch_id, sample_ids, fasta_outputs, hits_outputs, metadata_outputs, m8_outputs, summary_outputs, top_hit_outputs, batch_model_ids ->
+                def outputs = [fasta_outputs, hits_outputs, metadata_outputs, m8_outputs, summary_outputs, top_hit_outputs]
+                    .collectMany { files -> files instanceof Collection ? files : [files] }
+                    .collectEntries { output -> [(output.name): output] }
+                def batch_samples = sample_ids instanceof Collection ? sample_ids : [sample_ids]
+                batch_samples.collectMany { sample_id ->
+                    batch_model_ids.collect { model_id ->
+                        def prefix = "${sample_id}_${model_id}"
+                        tuple(
+                            sample_id,
+                            model_id,
+                            outputs["${prefix}.fna"],
+                            outputs["${prefix}.hits.tsv"],
+                            outputs["${prefix}.meta.tsv"],
+                            outputs["${prefix}.m8"],
+                            outputs["${prefix}.summary.tsv"],
+                            outputs["${prefix}.top_hits.tsv"]
+                        )
+                    }
+                }
+            }
+        extracted_hits = batch_outputs
+            .map { sample_id, model_id, fasta_file, hits_file, metadata_file, m8, summary, top_hits ->
+                tuple(sample_id, model_id, fasta_file, hits_file, metadata_file)
+            }
+            .join(model_annotations, by: [0, 1])
+        annotation_outputs = batch_outputs
+            .map { sample_id, model_id, fasta_file, hits_file, metadata_file, m8, summary, top_hits ->
+                tuple(sample_id, model_id, m8, summary, top_hits, metadata_file)
+            }
+        search_outputs = annotation_outputs
+    } else {
+        if ((params.cmsearch_shard_bases as long) > 0) {
+            // Shards are searched independently against the whole-assembly
+            // search space, so E-values and inclusion match an unsharded search.
+            SHARD_ASSEMBLY(fna_files)
+            search_inputs = SHARD_ASSEMBLY.out
+                .flatMap { sample_id, shard_outputs, window_map, search_space ->
+                    def shard_files = shard_outputs instanceof Collection \
+                        ? shard_outputs \
+                        : [shard_outputs]
+                    def search_space_mb = search_space.text.trim()
+                    shard_files.collect { shard_file ->
+                        tuple(sample_id, shard_file, shard_file.baseName, search_space_mb)
+                    }
+                }
+                .combine(search_models)
+            window_maps = SHARD_ASSEMBLY.out
+                .map { sample_id, shard_outputs, window_map, search_space ->
+                    tuple(sample_id, window_map)
+                }
+        } else {
+            search_inputs = fna_files
+                .map { sample_id, fna_file -> tuple(sample_id, fna_file, '', '') }
+                .combine(search_models)
+            window_maps = fna_files
+                .map { sample_id, fna_file ->
+                    tuple(sample_id, file("${projectDir}/config/no_windows.json"))
+                }
         }
-        .groupTuple()
-    RESOLVE_MODEL_HITS(cmsearch_files_by_sample)
-    extraction_inputs = CMSEARCH.out
-        .map { sample_id, model_id, cmsearch_out, fna_file, cm_model, marker, db_prefix, taxonomy_file, source_records_file, legacy_database ->
-            tuple(sample_id, model_id, fna_file, cm_model, marker, db_prefix, taxonomy_file, source_records_file, legacy_database)
+
+        CMSEARCH(search_inputs)
+        cmsearch_cache_statuses = CMSEARCH.out.cache
+        cmsearch_files_by_sample = CMSEARCH.out.tables
+            .groupTuple()
+            .join(window_maps)
+        RESOLVE_MODEL_HITS(cmsearch_files_by_sample)
+        // One extraction task per sample reads the assembly once for every model.
+        extraction_inputs = sample_model_combinations
+            .map { sample_id, fna_file, model_id, cm_model, marker, db_prefix, taxonomy_file, source_records_file, legacy_database ->
+                tuple(sample_id, fna_file, cm_model)
+            }
+            .groupTuple()
+            .map { sample_id, sample_fna_files, sample_cm_models ->
+                tuple(sample_id, sample_fna_files[0], sample_cm_models)
+            }
+            .combine(RESOLVE_MODEL_HITS.out, by: 0)
+        EXTRACT_HITS(extraction_inputs)
+        sample_extracted_hits = EXTRACT_HITS.out
+            .flatMap { sample_id, fasta_outputs, hits_outputs, metadata_outputs ->
+                def fasta_files = fasta_outputs instanceof Collection \
+                    ? fasta_outputs \
+                    : [fasta_outputs]
+                fasta_files.collect { fasta_file ->
+                    def model_id = fasta_file.name - "${sample_id}_" - ~/\.fna$/
+                    tuple(
+                        sample_id,
+                        model_id,
+                        fasta_file,
+                        fasta_file.resolveSibling("${sample_id}_${model_id}.hits.tsv"),
+                        fasta_file.resolveSibling("${sample_id}_${model_id}.meta.tsv")
+                    )
+                }
+            }
+            .join(model_annotations, by: [0, 1])
+        if (params.deduplicate_sequences) {
+            // Each distinct sequence of a model is annotated once, as a record
+            // of the sample "unique"; see scripts/sequence_dedup.py.
+            sample_hit_tables = sample_extracted_hits
+                .map { sample_id, model_id, fasta_file, hits_file, metadata_file, marker, db_prefix, taxonomy_file, source_records_file, legacy_database ->
+                    tuple(model_id, fasta_file, hits_file)
+                }
+                .groupTuple()
+            COLLAPSE_SEQUENCES(sample_hit_tables)
+            model_settings = cm_models
+                .map { model_id, cm_model, marker, db_prefix, taxonomy_file, source_records_file, legacy_database ->
+                    tuple(model_id, marker, db_prefix, taxonomy_file, source_records_file, legacy_database)
+                }
+            extracted_hits = COLLAPSE_SEQUENCES.out.sequences
+                .join(model_settings)
+                .map { model_id, fasta_file, hits_file, metadata_file, marker, db_prefix, taxonomy_file, source_records_file, legacy_database ->
+                    tuple(
+                        'unique',
+                        model_id,
+                        fasta_file,
+                        hits_file,
+                        metadata_file,
+                        marker,
+                        db_prefix,
+                        taxonomy_file,
+                        source_records_file,
+                        legacy_database
+                    )
+                }
+            BLAST_ANNOTATE(extracted_hits)
+            search_outputs = BLAST_ANNOTATE.out.annotations
+            expansion_inputs = BLAST_ANNOTATE.out.annotations
+                .map { sample_id, model_id, m8, summary, top_hits, metadata ->
+                    tuple(model_id, m8, summary, top_hits)
+                }
+                .join(sample_hit_tables)
+            EXPAND_ANNOTATIONS(expansion_inputs)
+            sample_metadata = sample_extracted_hits
+                .map { sample_id, model_id, fasta_file, hits_file, metadata_file, marker, db_prefix, taxonomy_file, source_records_file, legacy_database ->
+                    tuple(sample_id, model_id, metadata_file)
+                }
+            annotation_outputs = EXPAND_ANNOTATIONS.out
+                .flatMap { model_id, m8_outputs, summary_outputs, top_hit_outputs ->
+                    def outputs = [m8_outputs, summary_outputs, top_hit_outputs]
+                        .collectMany { files -> files instanceof Collection ? files : [files] }
+                        .collectEntries { output -> [(output.name): output] }
+                    outputs.keySet()
+                        .findAll { name -> name.endsWith("_${model_id}.m8") }
+                        .collect { name ->
+                            def prefix = name - ~/\.m8$/
+                            tuple(
+                                prefix.substring(0, prefix.length() - "_${model_id}".length()),
+                                model_id,
+                                outputs[name],
+                                outputs["${prefix}.summary.tsv".toString()],
+                                outputs["${prefix}.top_hits.tsv".toString()]
+                            )
+                        }
+                }
+                .join(sample_metadata, by: [0, 1])
+            unique_members = COLLAPSE_SEQUENCES.out.members.collect()
+        } else {
+            extracted_hits = sample_extracted_hits
+            BLAST_ANNOTATE(extracted_hits)
+            search_outputs = BLAST_ANNOTATE.out.annotations
+            annotation_outputs = BLAST_ANNOTATE.out.annotations
         }
-        .combine(RESOLVE_MODEL_HITS.out, by: 0)
-    EXTRACT_HITS(extraction_inputs)
-    BLAST_ANNOTATE(EXTRACT_HITS.out)
+    }
+    if (cmsearch_cache_directory) {
+        cmsearch_cache_statuses
+            .toList()
+            .subscribe { statuses ->
+                cmsearch_cache_report = "cmsearch cache: ${statuses.count { it == 'hit' }} " +
+                    "of ${statuses.size()} searches reused from ${cmsearch_cache_directory}"
+            }
+    }
 
     if (params.tree_classification) {
-        PREPARE_TREE_TASKS(EXTRACT_HITS.out)
-        tree_task_inputs = PREPARE_TREE_TASKS.out.tasks.flatMap { sample_id, model_id, task_directories ->
+        // Tree routing reuses the annotation search of the detected marker.
+        tree_preparation_inputs = extracted_hits.join(
+            search_outputs.map { sample_id, model_id, m8, summary, top_hits, metadata ->
+                tuple(sample_id, model_id, m8)
+            },
+            by: [0, 1]
+        )
+        PREPARE_TREE_TASKS(tree_preparation_inputs)
+        reference_alignment_stores = tree_model_ids.collectEntries { marker, model ->
+            [
+                marker,
+                referenceAlignmentStore(
+                    database_config,
+                    marker,
+                    model,
+                    file(resolveProjectPath("${params.modeldir}/${model}.cm"), checkIfExists: true)
+                )
+            ]
+        }
+        tree_directories = PREPARE_TREE_TASKS.out.tasks.flatMap { sample_id, model_id, task_directories ->
             def directories = task_directories instanceof Collection \
                 ? task_directories \
                 : [task_directories]
-            directories.collect { task_directory ->
+            directories.collect { task_directory -> tuple(sample_id, model_id, task_directory) }
+        }
+        if ((params.tree_bundle_bases as long) > 0) {
+            // Bundles of small tree tasks run as one task each; see
+            // scripts/tree_bundle.py for why results match per-query tasks.
+            tree_bundle_models = tree_model_ids.collect { marker, model ->
+                file(resolveProjectPath("${params.modeldir}/${model}.cm"), checkIfExists: true)
+            }
+            TREE_CLASSIFY_BUNDLE(
+                tree_directories.map { sample_id, model_id, bundle ->
+                    tuple(sample_id, model_id, bundle, tree_bundle_models, reference_alignment_stores)
+                }
+            )
+            tree_results = TREE_CLASSIFY_BUNDLE.out.flatMap { sample_id, model_id, query_directories ->
+                def directories = query_directories instanceof Collection \
+                    ? query_directories \
+                    : [query_directories]
+                directories.collect { tree_directory ->
+                    tuple(sample_id, model_id, tree_directory.name, tree_directory)
+                }
+            }
+        } else {
+            tree_task_inputs = tree_directories.map { sample_id, model_id, task_directory ->
                 def task_config = new JsonSlurper().parse(
                     new File(task_directory.toString(), 'task.json')
                 )
@@ -109,13 +396,15 @@ workflow {
                     model_id,
                     task_config.query_key.toString(),
                     task_directory,
+                    marker,
                     file(resolveProjectPath("${params.modeldir}/${model}.cm"), checkIfExists: true),
-                    databasePrefixForMarker(database_config, marker)
+                    reference_alignment_stores[marker]
                 )
             }
+            TREE_CLASSIFY(tree_task_inputs)
+            tree_results = TREE_CLASSIFY.out
         }
-        TREE_CLASSIFY(tree_task_inputs)
-        tree_assignment_files = TREE_CLASSIFY.out
+        tree_assignment_files = tree_results
             .map { sample_id, model_id, query_key, tree_directory ->
                 file("${tree_directory}/${query_key}.tree_assignment.tsv")
             }
@@ -125,7 +414,7 @@ workflow {
                 files ?: [file("${projectDir}/config/empty.tree_assignment.tsv")]
             }
             .ifEmpty([file("${projectDir}/config/empty.tree_assignment.tsv")])
-        tree_neighbor_files = TREE_CLASSIFY.out
+        tree_neighbor_files = tree_results
             .map { sample_id, model_id, query_key, tree_directory ->
                 file("${tree_directory}/${query_key}.tree_neighbors.tsv")
             }
@@ -134,6 +423,11 @@ workflow {
                 files ?: [file("${projectDir}/config/empty.tree_neighbors.tsv")]
             }
             .ifEmpty([file("${projectDir}/config/empty.tree_neighbors.tsv")])
+        if (params.deduplicate_sequences) {
+            EXPAND_TREE_RESULTS(unique_members, tree_assignment_files, tree_neighbor_files)
+            tree_assignment_files = EXPAND_TREE_RESULTS.out.assignments
+            tree_neighbor_files = EXPAND_TREE_RESULTS.out.neighbors
+        }
     } else {
         tree_assignment_files = Channel.value(
             [file("${projectDir}/config/empty.tree_assignment.tsv")]
@@ -143,16 +437,16 @@ workflow {
         )
     }
 
-    summary_files = BLAST_ANNOTATE.out
+    summary_files = annotation_outputs
         .map { sample_id, model_id, m8, summary, top_hits, metadata -> summary }
         .collect()
-    metadata_files = BLAST_ANNOTATE.out
+    metadata_files = annotation_outputs
         .map { sample_id, model_id, m8, summary, top_hits, metadata -> metadata }
         .collect()
-    m8_files = BLAST_ANNOTATE.out
+    m8_files = annotation_outputs
         .map { sample_id, model_id, m8, summary, top_hits, metadata -> m8 }
         .collect()
-    top_hit_files = BLAST_ANNOTATE.out
+    top_hit_files = annotation_outputs
         .map { sample_id, model_id, m8, summary, top_hits, metadata -> top_hits }
         .collect()
 
@@ -167,8 +461,33 @@ workflow {
 }
 
 
+process SHARD_ASSEMBLY {
+    tag "${sample_id}"
+
+    input:
+    tuple val(sample_id), path(fna_file)
+
+    output:
+    tuple \
+        val(sample_id), \
+        path("shards/shard_*.fna"), \
+        path("shards/windows.json"), \
+        path("shards/search_space_mb.txt")
+
+    script:
+    """
+    python3 "${projectDir}/scripts/assembly_shards.py" \
+        --fasta "${fna_file}" \
+        --output-directory shards \
+        --shard-bases "${params.cmsearch_shard_bases}" \
+        --window-bases "${params.cmsearch_window_bases}" \
+        --window-overlap "${params.cmsearch_window_overlap}"
+    """
+}
+
+
 process CMSEARCH {
-    tag "${sample_id}_${model_id}"
+    tag "${sample_id}_${model_id}${shard_id ? '.' + shard_id : ''}"
     publishDir "${params.outdir}/out", mode: 'copy', pattern: '*.out'
     cpus params.threads_per_job
 
@@ -176,36 +495,32 @@ process CMSEARCH {
     tuple \
         val(sample_id), \
         path(fna_file), \
+        val(shard_id), \
+        val(search_space_mb), \
         val(model_id), \
-        path(cm_model), \
-        val(marker), \
-        val(db_prefix), \
-        val(taxonomy_file), \
-        val(source_records_file), \
-        val(legacy_database)
+        path(cm_model)
 
     output:
     tuple \
         val(sample_id), \
-        val(model_id), \
-        path("${sample_id}_${model_id}.out"), \
-        path(fna_file), \
-        path(cm_model), \
-        val(marker), \
-        val(db_prefix), \
-        val(taxonomy_file), \
-        val(source_records_file), \
-        val(legacy_database)
+        path("${sample_id}_${model_id}${shard_id ? '.' + shard_id : ''}.out"), \
+        emit: tables
+    env(CMSEARCH_CACHE), emit: cache
 
     script:
+    tblout = "${sample_id}_${model_id}${shard_id ? '.' + shard_id : ''}.out"
+    search_space_argument = search_space_mb ? "--search-space-mb ${search_space_mb}" : ''
+    cache_arguments = cmsearch_cache_directory \
+        ? "--cache-directory ${shellQuote(cmsearch_cache_directory)} --max-mb ${params.cmsearch_cache_max_mb}" \
+        : ''
     """
-    cmsearch \
-        --anytrunc \
+    CMSEARCH_CACHE=\$(python3 "${projectDir}/scripts/cmsearch_cache.py" \
+        ${cache_arguments} \
         --cpu "${task.cpus}" \
-        -o /dev/null \
-        --tblout "${sample_id}_${model_id}.out" \
+        ${search_space_argument} \
+        --tblout "${tblout}" \
         "${cm_model}" \
-        "${fna_file}"
+        "${fna_file}")
     """
 }
 
@@ -214,7 +529,7 @@ process RESOLVE_MODEL_HITS {
     tag "${sample_id}"
 
     input:
-    tuple val(sample_id), path(cmsearch_files)
+    tuple val(sample_id), path(cmsearch_files), path(window_map)
 
     output:
     tuple val(sample_id), path("${sample_id}.accepted-hits.tsv")
@@ -226,64 +541,178 @@ process RESOLVE_MODEL_HITS {
     """
     python3 "${projectDir}/scripts/resolve_model_hits.py" \
         ${cmsearch_arguments} \
+        --windows "${window_map}" \
         --output "${sample_id}.accepted-hits.tsv"
     """
 }
 
 
 process EXTRACT_HITS {
-    tag "${sample_id}_${model_id}"
+    tag "${sample_id}"
     publishDir "${params.outdir}/extracted", mode: 'copy', pattern: '*.fna'
     publishDir "${params.outdir}/stats", mode: 'copy', pattern: '*.hits.tsv'
 
     input:
     tuple \
         val(sample_id), \
-        val(model_id), \
         path(fna_file), \
-        path(cm_model), \
-        val(marker), \
-        val(db_prefix), \
-        val(taxonomy_file), \
-        val(source_records_file), \
-        val(legacy_database), \
+        path(cm_models), \
         path(accepted_hits)
 
     output:
     tuple \
         val(sample_id), \
-        val(model_id), \
-        path("${sample_id}_${model_id}.fna"), \
-        path("${sample_id}_${model_id}.hits.tsv"), \
-        path("${sample_id}_${model_id}.meta.tsv"), \
-        val(marker), \
-        val(db_prefix), \
-        val(taxonomy_file), \
-        val(source_records_file), \
-        val(legacy_database)
+        path("${sample_id}_*.fna"), \
+        path("${sample_id}_*.hits.tsv"), \
+        path("${sample_id}_*.meta.tsv")
 
     script:
+    model_arguments = (cm_models instanceof Collection ? cm_models : [cm_models])
+        .collect { "--model-file ${shellQuote(it)}" }
+        .join(' ')
     """
     python3 "${projectDir}/scripts/extract_hits.py" \
-        --model-file "${cm_model}" \
+        ${model_arguments} \
         --fasta "${fna_file}" \
         --sample "${sample_id}" \
-        --model "${model_id}" \
         --accepted-hits "${accepted_hits}" \
         --minimum-length "${params.min_extract_length}" \
-        --fasta-output "${sample_id}_${model_id}.fna" \
-        --hits-output "${sample_id}_${model_id}.hits.tsv" \
-        --metadata-output "${sample_id}_${model_id}.meta.tsv"
+        --output-directory .
     """
 }
 
 
-process BLAST_ANNOTATE {
-    tag "${sample_id}_${model_id}"
+process ANNOTATE_BATCH {
+    tag "${batch_id}"
+    publishDir "${params.outdir}/out", mode: 'copy', pattern: '*.out'
+    publishDir "${params.outdir}/extracted", mode: 'copy', pattern: '*.fna'
+    publishDir "${params.outdir}/stats", mode: 'copy', pattern: '*.hits.tsv'
     publishDir "${params.outdir}/m8", mode: 'copy', pattern: '*.m8'
     publishDir "${params.outdir}/m8", mode: 'copy', pattern: '*.top_hits.tsv'
     cpus params.threads_per_job
 
+    input:
+    tuple val(batch_id), val(sample_ids), path(fna_files)
+    path(cm_models)
+    val(model_databases)
+
+    output:
+    tuple \
+        val(batch_id), \
+        val(sample_ids), \
+        path('*.fna'), \
+        path('*.hits.tsv'), \
+        path('*.meta.tsv'), \
+        path('*.m8'), \
+        path('*.summary.tsv'), \
+        path('*.top_hits.tsv'), \
+        emit: results
+    path('*.out'), emit: tables
+    env(CMSEARCH_CACHE), emit: cache
+
+    script:
+    fasta_arguments = (fna_files instanceof Collection ? fna_files : [fna_files])
+        .collect { "--fasta ${shellQuote(it)}" }
+        .join(' ')
+    model_arguments = (cm_models instanceof Collection ? cm_models : [cm_models])
+        .collect { "--model-file ${shellQuote(it)}" }
+        .join(' ')
+    database_arguments = model_databases
+        .collect { "--db-prefix ${shellQuote(it)}" }
+        .join(' ')
+    taxonomy_argument = database_config.legacy \
+        ? '' \
+        : "--taxonomy-db ${shellQuote(database_config.taxonomy_file)}"
+    source_records_argument = database_config.legacy \
+        ? '' \
+        : "--source-records-db ${shellQuote(database_config.source_records_file)}"
+    lookup_argument = referenceLookupArgument(database_config.legacy)
+    cache_arguments = cmsearch_cache_directory \
+        ? "--cmsearch-cache-directory ${shellQuote(cmsearch_cache_directory)} --cmsearch-cache-max-mb ${params.cmsearch_cache_max_mb}" \
+        : ''
+    """
+    CMSEARCH_CACHE=\$(python3 "${projectDir}/scripts/annotate_batch.py" \
+        ${fasta_arguments} \
+        ${model_arguments} \
+        ${database_arguments} \
+        ${taxonomy_argument} \
+        ${source_records_argument} \
+        ${lookup_argument} \
+        ${cache_arguments} \
+        --minimum-length "${params.min_extract_length}" \
+        --threads "${task.cpus}" \
+        --max-targets "${params.max_blast_targets}" \
+        --top-hits "${params.top_hits}")
+    """
+}
+
+
+process COLLAPSE_SEQUENCES {
+    tag "${model_id}"
+    publishDir "${params.outdir}/stats", mode: 'copy', pattern: '*.members.tsv'
+
+    input:
+    tuple val(model_id), path(fasta_files), path(hits_tables)
+
+    output:
+    tuple \
+        val(model_id), \
+        path("unique_${model_id}.fna"), \
+        path("unique_${model_id}.hits.tsv"), \
+        path("unique_${model_id}.meta.tsv"), \
+        emit: sequences
+    path("unique_${model_id}.members.tsv"), emit: members
+
+    script:
+    """
+    python3 "${projectDir}/scripts/sequence_dedup.py" collapse \
+        --model "${model_id}" \
+        --output-prefix "unique_${model_id}" \
+        ${hits_tables}
+    """
+}
+
+
+process EXPAND_ANNOTATIONS {
+    tag "${model_id}"
+    publishDir "${params.outdir}/m8", mode: 'copy', pattern: '*.m8'
+    publishDir "${params.outdir}/m8", mode: 'copy', pattern: '*.top_hits.tsv'
+
+    input:
+    tuple \
+        val(model_id), \
+        path(unique_m8, stageAs: 'unique/*'), \
+        path(unique_summary, stageAs: 'unique/*'), \
+        path(unique_top_hits, stageAs: 'unique/*'), \
+        path(fasta_files), \
+        path(hits_tables)
+
+    output:
+    tuple \
+        val(model_id), \
+        path("*_${model_id}.m8"), \
+        path("*_${model_id}.summary.tsv"), \
+        path("*_${model_id}.top_hits.tsv")
+
+    script:
+    """
+    python3 "${projectDir}/scripts/sequence_dedup.py" expand-annotations \
+        --m8 "${unique_m8}" \
+        --summary "${unique_summary}" \
+        --top-hits "${unique_top_hits}" \
+        ${hits_tables}
+    """
+}
+
+
+process BLAST_ANNOTATE {
+    tag "${sample_id}_${model_id}"
+    // Deduplicated runs publish the per-sample files of EXPAND_ANNOTATIONS.
+    publishDir "${params.outdir}/m8", mode: 'copy', pattern: '*.m8', enabled: !params.deduplicate_sequences
+    publishDir "${params.outdir}/m8", mode: 'copy', pattern: '*.top_hits.tsv', enabled: !params.deduplicate_sequences
+    publishDir "${params.outdir}/m8", mode: 'copy', pattern: '*.blast_passes.tsv'
+    cpus params.threads_per_job
+
     input:
     tuple \
         val(sample_id), \
@@ -304,7 +733,9 @@ process BLAST_ANNOTATE {
         path("${sample_id}_${model_id}.m8"), \
         path("${sample_id}_${model_id}.summary.tsv"), \
         path("${sample_id}_${model_id}.top_hits.tsv"), \
-        path(metadata)
+        path(metadata), \
+        emit: annotations
+    path("${sample_id}_${model_id}.blast_passes.tsv"), optional: true, emit: passes
 
     script:
     db_prefix_argument = shellQuote(db_prefix)
@@ -314,31 +745,73 @@ process BLAST_ANNOTATE {
     source_records_argument = legacy_database \
         ? '' \
         : "--source-records-db ${shellQuote(source_records_file)}"
+    lookup_argument = referenceLookupArgument(legacy_database)
     blast_fetch_targets = Math.max(
         (params.max_blast_targets as int) + 1,
         params.top_hits as int
     )
-    """
-    blastn \
-        -outfmt 6 \
-        -db ${db_prefix_argument} \
-        -query "${extracted_fna}" \
-        -max_target_seqs "${blast_fetch_targets}" \
-        -max_hsps 1 \
-        -num_threads "${task.cpus}" \
-        -out "${sample_id}_${model_id}.m8"
-
-    python3 "${projectDir}/scripts/annotate_hits.py" \
-        --hits "${hits_table}" \
-        --m8 "${sample_id}_${model_id}.m8" \
-        ${taxonomy_argument} \
-        ${source_records_argument} \
-        --query-fasta "${extracted_fna}" \
-        --top-hits "${params.top_hits}" \
-        --top-hits-output "${sample_id}_${model_id}.top_hits.tsv" \
-        --max-targets "${params.max_blast_targets}" \
-        --output "${sample_id}_${model_id}.summary.tsv"
-    """
+    if (annotation_cache_file) {
+        """
+        python3 "${projectDir}/scripts/annotation_cache.py" \
+            --cache-db ${shellQuote(annotation_cache_file)} \
+            --max-mb "${params.annotation_cache_max_mb}" \
+            --profile-directory ${shellQuote(database_config.profile_directory)} \
+            --db ${db_prefix_argument} \
+            --threads "${task.cpus}" \
+            --hits "${hits_table}" \
+            --query-fasta "${extracted_fna}" \
+            --m8-output "${sample_id}_${model_id}.m8" \
+            ${taxonomy_argument} \
+            ${source_records_argument} \
+            ${lookup_argument} \
+            --top-hits "${params.top_hits}" \
+            --top-hits-output "${sample_id}_${model_id}.top_hits.tsv" \
+            --max-targets "${params.max_blast_targets}" \
+            --output "${sample_id}_${model_id}.summary.tsv"
+        """
+    } else {
+        // Adaptive searches re-run only the queries whose annotation needs
+        // the full target count; see scripts/adaptive_blast.py.
+        blast_command = (params.blast_first_pass_targets as int) > 0 \
+            ? """
+            python3 "${projectDir}/scripts/adaptive_blast.py" \
+                --query-fasta "${extracted_fna}" \
+                --db ${db_prefix_argument} \
+                --m8-output "${sample_id}_${model_id}.m8" \
+                --passes-output "${sample_id}_${model_id}.blast_passes.tsv" \
+                --threads "${task.cpus}" \
+                --first-pass-targets "${params.blast_first_pass_targets}" \
+                --top-hits "${params.top_hits}" \
+                --max-targets "${params.max_blast_targets}" \
+                ${source_records_argument} \
+                ${lookup_argument}
+            """ \
+            : """
+            blastn \
+                -outfmt 6 \
+                -db ${db_prefix_argument} \
+                -query "${extracted_fna}" \
+                -max_target_seqs "${blast_fetch_targets}" \
+                -max_hsps 1 \
+                -num_threads "${task.cpus}" \
+                -out "${sample_id}_${model_id}.m8"
+            """
+        """
+        ${blast_command}
+
+        python3 "${projectDir}/scripts/annotate_hits.py" \
+            --hits "${hits_table}" \
+            --m8 "${sample_id}_${model_id}.m8" \
+            ${taxonomy_argument} \
+            ${source_records_argument} \
+            ${lookup_argument} \
+            --query-fasta "${extracted_fna}" \
+            --top-hits "${params.top_hits}" \
+            --top-hits-output "${sample_id}_${model_id}.top_hits.tsv" \
+            --max-targets "${params.max_blast_targets}" \
+            --output "${sample_id}_${model_id}.summary.tsv"
+        """
+    }
 }
 
 
@@ -357,7 +830,8 @@ process PREPARE_TREE_TASKS {
         val(db_prefix), \
         val(taxonomy_file), \
         val(source_records_file), \
-        val(legacy_database)
+        val(legacy_database), \
+        path(annotation_m8, stageAs: 'annotation/*')
 
     output:
     tuple \
@@ -381,35 +855,34 @@ process PREPARE_TREE_TASKS {
         params.tree_reference_count as int,
         100
     ) + 1
-    database_16s = shellQuote(databasePrefixForMarker(database_config, '16S'))
-    database_18s = shellQuote(databasePrefixForMarker(database_config, '18S'))
+    database_16s = shellQuote("16S=${databasePrefixForMarker(database_config, '16S')}")
+    database_18s = shellQuote("18S=${databasePrefixForMarker(database_config, '18S')}")
     taxonomy_argument = shellQuote(taxonomy_file)
     source_records_argument = shellQuote(source_records_file)
+    lookup_argument = referenceLookupArgument(false)
+    // Adaptive annotation searches ask for at least the first-pass count.
+    annotation_targets = Math.max(
+        (params.max_blast_targets as int) + 1,
+        params.top_hits as int
+    )
+    reused_targets = (params.blast_first_pass_targets as int) > 0 \
+        ? Math.min(
+            Math.max(params.blast_first_pass_targets as int, params.top_hits as int),
+            annotation_targets
+        ) \
+        : annotation_targets
     """
-    blastn \
-        -outfmt 6 \
-        -db ${database_16s} \
-        -query "${extracted_fna}" \
-        -max_target_seqs "${fetch_targets}" \
-        -max_hsps 1 \
-        -num_threads "${task.cpus}" \
-        -out 16S.tree_route.m8
-
-    blastn \
-        -outfmt 6 \
-        -db ${database_18s} \
-        -query "${extracted_fna}" \
-        -max_target_seqs "${fetch_targets}" \
-        -max_hsps 1 \
-        -num_threads "${task.cpus}" \
-        -out 18S.tree_route.m8
-
     python3 "${projectDir}/scripts/tree_reference_selection.py" prepare \
         --query-fasta "${extracted_fna}" \
-        --blast 16S=16S.tree_route.m8 \
-        --blast 18S=18S.tree_route.m8 \
+        --database ${database_16s} \
+        --database ${database_18s} \
+        --reuse-blast "${marker}=${annotation_m8}" \
+        --reuse-blast-targets "${reused_targets}" \
+        --search-targets "${fetch_targets}" \
+        --threads "${task.cpus}" \
         --taxonomy-db ${taxonomy_argument} \
         --source-records-db ${source_records_argument} \
+        ${lookup_argument} \
         --sample "${sample_id}" \
         --detected-model "${model_id}" \
         --detected-marker "${marker}" \
@@ -417,6 +890,7 @@ process PREPARE_TREE_TASKS {
         --reference-count "${params.tree_reference_count}" \
         --route-hits 100 \
         --output-directory tree_inputs \
+        --bundle-bases "${params.tree_bundle_bases}" \
         --skipped-assignments-output "${sample_id}_${model_id}.skipped.tree_assignment.tsv"
     """
 }
@@ -433,8 +907,9 @@ process TREE_CLASSIFY {
         val(model_id), \
         val(query_key), \
         path(tree_task, name: 'tree_input'), \
+        val(tree_marker), \
         path(cm_model), \
-        val(db_prefix)
+        val(alignment_store)
 
     output:
     tuple \
@@ -444,62 +919,86 @@ process TREE_CLASSIFY {
         path("${query_key}")
 
     script:
-    db_prefix_argument = shellQuote(db_prefix)
+    // With a stored alignment of the references, cmalign aligns only the query.
+    alignment_argument = alignment_store \
+        ? "--reference-alignment ${shellQuote("${tree_marker}=${alignment_store}")}" \
+        : ''
+    """
+    python3 "${projectDir}/scripts/tree_bundle.py" \
+        --task "${tree_task}" \
+        --covariance-model ${shellQuote("${tree_marker}=${cm_model}")} \
+        ${alignment_argument} \
+        --maximum-gap-fraction "${params.tree_trim_gap_fraction}" \
+        --assignment-neighbors "${params.tree_assignment_neighbors}" \
+        --cmalign-cpu "${task.cpus}"
     """
-    mkdir "${query_key}"
-    cp -R "${tree_task}/." "${query_key}/"
+}
 
-    blastdbcmd \
-        -db ${db_prefix_argument} \
-        -entry_batch "${query_key}/reference_ids.txt" \
-        -outfmt %f \
-        -out "${query_key}/references.fna"
 
-    python3 "${projectDir}/scripts/tree_reference_selection.py" alignment-input \
-        --task-directory "${query_key}" \
-        --reference-fasta "${query_key}/references.fna" \
-        --output "${query_key}/cmalign_input.fna"
+process TREE_CLASSIFY_BUNDLE {
+    tag "${sample_id}_${model_id}_${tree_bundle.name}"
+    publishDir "${params.outdir}/phylogeny/${sample_id}/${model_id}", mode: 'copy'
+    cpus params.threads_per_job
 
-    cmalign \
-        --cpu "${task.cpus}" \
-        --outformat AFA \
-        -o "${query_key}/cmalign.fna" \
-        "${cm_model}" \
-        "${query_key}/cmalign_input.fna"
-
-    python3 "${projectDir}/scripts/tree_phylogeny.py" trim \
-        --input "${query_key}/cmalign.fna" \
-        --output "${query_key}/cmalign.trimmed.fna" \
-        --qc "${query_key}/alignment_qc.json" \
-        --maximum-gap-fraction "${params.tree_trim_gap_fraction}"
-
-    outgroup=\$(awk 'NR > 1 {value=\$1} END {print value}' "${query_key}/references.tsv")
-    test -n "\${outgroup}"
-    iqtree3 \
-        -s "${query_key}/cmalign.trimmed.fna" \
-        -st DNA \
-        -m GTR+F+R4 \
-        -fast \
-        -alrt 1000 \
-        -keep-ident \
-        -o "\${outgroup}" \
-        -T 1 \
-        -seed 1 \
-        -pre "${query_key}/iqtree" \
-        -redo \
-        -quiet
-
-    python3 "${projectDir}/scripts/tree_phylogeny.py" classify \
-        --tree "${query_key}/iqtree.treefile" \
-        --references "${query_key}/references.tsv" \
-        --task "${query_key}/task.json" \
-        --assignment-output "${query_key}/${query_key}.tree_assignment.tsv" \
-        --neighbors-output "${query_key}/${query_key}.tree_neighbors.tsv" \
+    input:
+    tuple \
+        val(sample_id), \
+        val(model_id), \
+        path(tree_bundle), \
+        path(cm_models), \
+        val(alignment_stores)
+
+    output:
+    tuple \
+        val(sample_id), \
+        val(model_id), \
+        path('q_*')
+
+    script:
+    model_arguments = tree_model_ids
+        .collect { marker, model ->
+            "--covariance-model ${shellQuote("${marker}=${model}.cm")}"
+        }
+        .join(' ')
+    alignment_arguments = alignment_stores
+        .findAll { marker, store -> store }
+        .collect { marker, store ->
+            "--reference-alignment ${shellQuote("${marker}=${store}")}"
+        }
+        .join(' ')
+    """
+    python3 "${projectDir}/scripts/tree_bundle.py" \
+        --bundle "${tree_bundle}" \
+        ${model_arguments} \
+        ${alignment_arguments} \
+        --maximum-gap-fraction "${params.tree_trim_gap_fraction}" \
         --assignment-neighbors "${params.tree_assignment_neighbors}" \
-        --inference-model GTR+F+R4
+        --workers "${task.cpus}"
+    """
+}
+
 
-    cmalign -h 2>&1 | sed -n '1p' > "${query_key}/tool_versions.txt"
-    iqtree3 --version >> "${query_key}/tool_versions.txt"
+process EXPAND_TREE_RESULTS {
+    input:
+    path(members_files)
+    path(assignment_files, stageAs: 'unique/*')
+    path(neighbor_files, stageAs: 'unique/*')
+
+    output:
+    path('deduplicated.tree_assignment.tsv'), emit: assignments
+    path('deduplicated.tree_neighbors.tsv'), emit: neighbors
+
+    script:
+    member_arguments = (members_files instanceof Collection ? members_files : [members_files])
+        .collect { members_file -> "--members ${shellQuote(members_file.toString())}" }
+        .join(' ')
+    """
+    python3 "${projectDir}/scripts/sequence_dedup.py" expand-tree \
+        ${member_arguments} \
+        --assignments ${assignment_files} \
+        --neighbors ${neighbor_files} \
+        --assignment-output deduplicated.tree_assignment.tsv \
+        --neighbor-output deduplicated.tree_neighbors.tsv
     """
 }
 
@@ -542,6 +1041,37 @@ workflow.onComplete {
     println "Pipeline completed at: $workflow.complete"
     println "Execution status: ${workflow.success ? 'OK' : 'failed'}"
     println "Results directory: ${params.outdir}"
+    if (cmsearch_cache_report) {
+        println cmsearch_cache_report
+    }
+}
+
+
+def sampleBatches(samples, batchBases) {
+    def batches = []
+    def batch = []
+    def batchBytes = 0L
+    samples.each { sample ->
+        def fastaBytes = sample[1].size()
+        if (batch && batchBytes + fastaBytes > batchBases) {
+            batches << batch
+            batch = []
+            batchBytes = 0L
+        }
+        batch << sample
+        batchBytes += fastaBytes
+    }
+    if (batch) {
+        batches << batch
+    }
+    def width = batches.size().toString().length()
+    return batches.withIndex().collect { members, index ->
+        tuple(
+            "batch_${(index + 1).toString().padLeft(width, '0')}",
+            members.collect { it[0] },
+            members.collect { it[1] }
+        )
+    }
 }
 
 
@@ -624,9 +1154,11 @@ def loadDatabaseConfig(databasePath, profile) {
         log.warn 'Using deprecated legacy SILVA 138.1/PR2 4.12 database layout.'
         return [
             legacy: true,
+            profile_directory: null,
             prefixes: ['16S': legacyPrefix, '18S': legacyPrefix],
             taxonomy_file: null,
-            source_records_file: null
+            source_records_file: null,
+            reference_alignments: [:]
         ]
     }
 
@@ -683,11 +1215,29 @@ def loadDatabaseConfig(databasePath, profile) {
             "Missing source-record Parquet: ${sourceRecordsFile}"
         )
     }
+    def alignmentStores = manifest.reference_alignments ?: [:]
+    def referenceAlignments = alignmentStores.collectEntries { marker, alignment ->
+        def store = resolveContainedPath(
+            profileDir,
+            alignment.path.toString(),
+            "reference alignments for ${marker}"
+        )
+        [
+            marker.toString(),
+            [
+                path: store.toString(),
+                model: alignment.model.toString(),
+                model_sha256: alignment.model_sha256.toString()
+            ]
+        ]
+    }
     return [
         legacy: false,
+        profile_directory: profileDir.canonicalPath,
         prefixes: prefixes,
         taxonomy_file: taxonomyFile.toString(),
-        source_records_file: sourceRecordsFile.toString()
+        source_records_file: sourceRecordsFile.toString(),
+        reference_alignments: referenceAlignments
     ]
 }
 
@@ -702,6 +1252,21 @@ def resolveContainedPath(root, relativePath, label) {
 }
 
 
+// Stored reference rows are valid only for the covariance model they were
+// aligned to; any other model falls back to a joint cmalign alignment.
+def referenceAlignmentStore(databaseConfig, marker, model, cmModel) {
+    def store = databaseConfig.reference_alignments[marker]
+    if (!store || store.model != model || !new File(store.path).isFile()) {
+        return ''
+    }
+    def digest = java.security.MessageDigest.getInstance('SHA-256')
+    cmModel.toFile().withInputStream { stream ->
+        stream.eachByte(1 << 20) { buffer, count -> digest.update(buffer, 0, count) }
+    }
+    return digest.digest().encodeHex().toString() == store.model_sha256 ? store.path : ''
+}
+
+
 def databasePrefixForMarker(databaseConfig, marker) {
     def prefix = databaseConfig.prefixes[marker]
     if (!prefix) {
@@ -731,6 +1296,14 @@ def shellQuote(value) {
 }
 
 
+def referenceLookupArgument(legacyDatabase) {
+    if (legacyDatabase || !params.reference_lookup_socket) {
+        return ''
+    }
+    return "--lookup-socket ${shellQuote(params.reference_lookup_socket)}"
+}
+
+
 def validateIdentifier(identifier, kind) {
     if (!(identifier ==~ /[A-Za-z0-9][A-Za-z0-9._-]*/)) {
         throw new IllegalArgumentException(
@@ -838,9 +1411,25 @@ def helpMessage() {
                                  Named tree neighbors used for taxonomy LCA (default: 5)
       --tree_trim_gap_fraction [n]
                                  Remove columns above this gap fraction (default: 0.9)
+      --tree_bundle_bases [n]     Classify tree queries in bundles of up to n FASTA bytes; 0 disables (default: 0)
       --database_path [path]      BLAST database directory (default: resources/database)
       --database_profile [name]   Database profile: curated or img (default: curated)
       --model_marker_map [path]   JSON mapping models to 16S rRNA gene or 18S rRNA gene markers
+      --reference_lookup_socket [path]
+                                 Optional reference_lookup.py server socket for metadata reads
+      --cmsearch_shard_bases [n]  Search assemblies in shards of about n bases; 0 disables (default: 0)
+      --cmsearch_window_bases [n] Longest contig piece in a shard (default: 1000000)
+      --cmsearch_window_overlap [n]
+                                 Bases shared by neighbouring contig pieces (default: 10000)
+      --cmsearch_cache_dir [path] Reuse cmsearch tables across runs from this directory
+      --sample_batch_bases [n]    Process assemblies in batches of up to n FASTA bytes; 0 disables (default: 0)
+      --cmsearch_cache_max_mb [n] Least recently used tables are evicted above n MB (default: 4096)
+      --deduplicate_sequences     Annotate identical extracted sequences once across samples
+      --annotation_cache [path]   Reuse per-sequence BLAST annotations across runs from this SQLite file
+      --annotation_cache_max_mb [n]
+                                 Least recently used annotations are evicted above n MB (default: 1024)
+      --blast_first_pass_targets [n]
+                                 BLAST n targets first; re-search unresolved queries only; 0 disables (default: 0)
       --version                   Print the SSUextract version
       --help                      Print this help message
     """.stripIndent()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""Two-pass BLAST searches that request the full target count only when needed.
+
+The first pass asks BLAST for a small number of target sequences per query.
+Annotation needs the equal-best hits, the overall top hits, and the best hit of
+each reported reference source, so a query is resolved by the first pass when
+BLAST returned fewer targets than requested, or when a lower-scoring hit closes
+its equal-best set and every reported source of the database already has a
+hit. The remaining queries are searched again with the full target count, and
+their rows replace the first-pass rows.
+
+A pass table records, for every query, the pass and target count of its rows.
+BLAST's gapped-extension cutoffs depend on ``-max_target_seqs``, so in rare
+cases a first-pass row can differ from the corresponding row of a full search;
+the mode is therefore opt-in.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Mapping
+
+from annotate_hits import load_m8_lines
+from blast_table import BlastTable, load_blast_table
+from top_hit_reporting import (
+    REPORTED_SOURCES,
+    load_query_sequences,
+    load_reference_records,
+    source_subject_masks,
+)
+
+if TYPE_CHECKING:
+    import numpy as np
+
+PASS_FIELDS = ["name", "blast_pass", "max_target_seqs"]
+
+
+def full_target_count(max_targets: int, top_hits: int) -> int:
+    """Return the target count of a single search; one target is the overflow sentinel."""
+
+    return max(max_targets + 1, top_hits)
+
+
+def blastn_command(
+    query: str | Path,
+    db_prefix: str | Path,
+    m8_output: str | Path,
+    max_target_seqs: int,
+    threads: int,
+    blastn: str = "blastn",
+) -> list[str]:
+    return [
+        blastn,
+        "-outfmt", "6",
+        "-db", str(db_prefix),
+        "-query", str(query),
+        "-max_target_seqs", str(max_target_seqs),
+        "-max_hsps", "1",
+        "-num_threads", str(threads),
+        "-out", str(m8_output),
+    ]
+
+
+def database_sources(source_records_file: str | Path | None) -> frozenset[str]:
+    """Return the reported reference sources present in the source-record table."""
+
+    if source_records_file is None:
+        return frozenset()
+    import duckdb
+
+    connection = duckdb.connect(":memory:")
+    try:
+        connection.execute("SET threads = 1")
+        rows = connection.execute(
+            "SELECT DISTINCT reference_source FROM read_parquet(?)",
+            [str(source_records_file)],
+        ).fetchall()
+    finally:
+        connection.close()
+    return frozenset(str(source) for (source,) in rows) & frozenset(REPORTED_SOURCES)
+
+
+def unresolved_queries(
+    blast_hits: BlastTable,
+    target_count: int,
+    sources: Iterable[str] = (),
+    source_masks: Mapping[str, np.ndarray] | None = None,
+) -> list[str]:
+    """Return the queries whose annotation may need hits beyond ``target_count``.
+
+    ``source_masks`` are the per-source subject masks of ``blast_hits``; they
+    are required when ``sources`` is not empty.
+    """
+
+    sources = tuple(sources)
+    unresolved = []
+    for query in blast_hits.queries:
+        count = blast_hits.hit_count(query)
+        if count < target_count:
+            continue
+        if blast_hits.tied_count(query) == count or any(
+            blast_hits.first_rank(query, source_masks[source]) is None
+            for source in sources
+        ):
+            unresolved.append(query)
+    return unresolved
+
+
+def adaptive_search(
+    query_fasta: str | Path,
+    db_prefix: str | Path,
+    *,
+    m8_output: str | Path,
+    passes_output: str | Path,
+    threads: int,
+    max_targets: int,
+    top_hits: int,
+    first_pass_targets: int,
+    source_records_file: str | Path | None = None,
+    lookup_socket: str | Path | None = None,
+    blastn: str = "blastn",
+) -> list[str]:
+    """Write the m8 rows and pass table of every query; return the re-searched queries.
+
+    The m8 output lists queries in FASTA order, as a single BLAST search would.
+    """
+
+    if first_pass_targets < 1:
+        raise ValueError("first_pass_targets must be positive")
+    full_targets = full_target_count(max_targets, top_hits)
+    first_targets = min(max(first_pass_targets, top_hits), full_targets)
+    sequences = load_query_sequences(query_fasta)
+    m8_output = Path(m8_output)
+    with tempfile.TemporaryDirectory(
+        prefix=".adaptive-blast.", dir=m8_output.parent
+    ) as temporary:
+        first_m8 = Path(temporary) / "first.m8"
+        subprocess.run(
+            blastn_command(
+                query_fasta, db_prefix, first_m8, first_targets, threads, blastn
+            ),
+            check=True,
+        )
+        unresolved: list[str] = []
+        if first_targets < full_targets:
+            blast_hits = load_blast_table(first_m8)
+            sources = database_sources(source_records_file)
+            source_masks = None
+            if sources:
+                source_masks = source_subject_masks(
+                    blast_hits,
+                    load_reference_records(
+                        source_records_file, set(blast_hits.subjects), lookup_socket
+                    ),
+                )
+            unresolved = unresolved_queries(
+                blast_hits, first_targets, sorted(sources), source_masks
+            )
+            del blast_hits
+        second_pass = set(unresolved)
+        second_lines: dict[str, list[str]] = {}
+        if second_pass:
+            second_fasta = Path(temporary) / "second.fna"
+            with second_fasta.open("w") as handle:
+                for name in sequences:
+                    if name in second_pass:
+                        handle.write(f">{name}\n{sequences[name]}\n")
+            second_m8 = Path(temporary) / "second.m8"
+            subprocess.run(
+                blastn_command(
+                    second_fasta, db_prefix, second_m8, full_targets, threads, blastn
+                ),
+                check=True,
+            )
+            second_lines = load_m8_lines(second_m8)
+        first_lines = load_m8_lines(first_m8)
+
+    with m8_output.open("w") as handle:
+        for name in sequences:
+            lines = second_lines if name in second_pass else first_lines
+            for rest in lines.get(name, []):
+                handle.write(name + rest)
+    with Path(passes_output).open("w", newline="") as handle:
+        writer = csv.writer(handle, delimiter="\t", lineterminator="\n")
+        writer.writerow(PASS_FIELDS)
+        for name in sequences:
+            if name in second_pass:
+                writer.writerow([name, 2, full_targets])
+            else:
+                writer.writerow([name, 1, first_targets])
+    return [name for name in sequences if name in second_pass]
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=(
+            "BLAST extracted records with a small target count, then re-search "
+            "only the records whose annotation needs the full count."
+        )
+    )
+    parser.add_argument("--query-fasta", required=True)
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--m8-output", required=True)
+    parser.add_argument("--passes-output", required=True)
+    parser.add_argument("--threads", required=True, type=int)
+    parser.add_argument("--first-pass-targets", required=True, type=int)
+    parser.add_argument("--top-hits", type=int, default=5)
+    parser.add_argument("--max-targets", type=int, default=500)
+    parser.add_argument("--source-records-db")
+    parser.add_argument("--lookup-socket")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    adaptive_search(
+        args.query_fasta,
+        args.db,
+        m8_output=args.m8_output,
+        passes_output=args.passes_output,
+        threads=args.threads,
+        max_targets=args.max_targets,
+        top_hits=args.top_hits,
+        first_pass_targets=args.first_pass_targets,
+        source_records_file=args.source_records_db,
+        lookup_socket=args.lookup_socket,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Search, extract, and BLAST-annotate a batch of small assemblies in one task.
+
+Per-sample outputs are written to the working directory under the names the
+per-sample workflow tasks use; the cmsearch cache status of every search is
+printed to standard output.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from local_runner import ModelTask, RunSettings, run_batch, validate_identifier
+
+
+def _model_database(value: str) -> tuple[str, Path]:
+    model_id, separator, prefix = value.partition("=")
+    if not separator or not prefix:
+        raise argparse.ArgumentTypeError("expected MODEL=DATABASE_PREFIX")
+    return model_id, Path(prefix)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Annotate a batch of assemblies with one BLAST search per model."
+    )
+    parser.add_argument("--fasta", action="append", required=True, type=Path)
+    parser.add_argument("--model-file", action="append", required=True, type=Path)
+    parser.add_argument(
+        "--db-prefix", action="append", required=True, type=_model_database
+    )
+    parser.add_argument("--minimum-length", required=True, type=int)
+    parser.add_argument("--threads", required=True, type=int)
+    parser.add_argument("--max-targets", required=True, type=int)
+    parser.add_argument("--top-hits", required=True, type=int)
+    parser.add_argument("--taxonomy-db", type=Path)
+    parser.add_argument("--source-records-db", type=Path)
+    parser.add_argument("--lookup-socket")
+    parser.add_argument("--cmsearch-cache-directory", type=Path)
+    parser.add_argument("--cmsearch-cache-max-mb", type=int, default=4096)
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    samples: dict[str, Path] = {}
+    for fasta in args.fasta:
+        sample_id = validate_identifier(fasta.stem, "sample")
+        if sample_id in samples:
+            raise ValueError(f"Batch files share the sample identifier {sample_id!r}")
+        samples[sample_id] = fasta
+    databases = dict(args.db_prefix)
+    models = []
+    for model_file in args.model_file:
+        model_id = validate_identifier(model_file.stem, "model")
+        if model_id not in databases:
+            raise ValueError(f"No --db-prefix for model {model_id!r}")
+        models.append(ModelTask(model_id, model_file, databases[model_id]))
+    settings = RunSettings(
+        min_extract_length=args.minimum_length,
+        threads_per_job=args.threads,
+        max_blast_targets=args.max_targets,
+        top_hits=args.top_hits,
+        taxonomy_file=args.taxonomy_db,
+        source_records_file=args.source_records_db,
+        lookup_socket=args.lookup_socket,
+        cmsearch_cache=args.cmsearch_cache_directory,
+        cmsearch_cache_max_mb=args.cmsearch_cache_max_mb,
+    )
+    cache_statuses = run_batch(samples, models, settings, Path.cwd())
+    sys.stdout.write(" ".join(cache_statuses) + "\n")
+
+
+if __name__ == "__main__":
+    main()
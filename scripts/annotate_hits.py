@@ -6,11 +6,14 @@ import argparse
 import csv
 import json
 from dataclasses import dataclass, replace
+from functools import cache
 from pathlib import Path
+from typing import Callable, Mapping, Sequence
 
-import duckdb
-
+from blast_table import load_blast_table
 from hit_processing import HIT_FIELDS
+from reference_lookup import TAXONOMY_TABLE, fetch_rows
+from taxonomy_index import TaxonomyIndex, load_taxonomy_index
 from taxonomy_utils import common_value as _shared_common_value
 from taxonomy_utils import lowest_common_ancestor, taxonomy_path
 from tree_schema import SUMMARY_TREE_FIELDS
@@ -54,21 +57,22 @@ SUMMARY_FIELDS = [
     "query_sequence",
     *SUMMARY_TREE_FIELDS,
 ]
-
-
-@dataclass(frozen=True)
-class BlastHit:
-    subject: str
-    percent_identity: float
-    alignment_length: int
-    mismatches: int
-    gap_opens: int
-    query_start: int
-    query_end: int
-    subject_start: int
-    subject_end: int
-    evalue: float
-    bit_score: float
+# Summary columns that describe the extracted record rather than its annotation.
+RECORD_SUMMARY_FIELDS = [
+    "name",
+    "sample",
+    "model",
+    "length",
+    "coordinates",
+    "strand",
+    "sequence_type",
+    "contig_name",
+    "query_sequence",
+    "is_assembled",
+]
+# Tied records below this count take the string LCA, which is faster than the
+# fixed cost of one vectorized search of the taxonomy index.
+INDEXED_LCA_MIN_RECORDS = 32
 
 
 @dataclass(frozen=True)
@@ -84,109 +88,28 @@ class TaxonomyRecord:
     centroid_names: str
     centroid_taxonomy: str
     centroid_taxonomy_source: str
+    taxon_id: int | None = None
 
 
-def _blast_rank_key(hit: BlastHit) -> tuple[float, float, int, str]:
-    return (
-        -hit.bit_score,
-        -hit.percent_identity,
-        -hit.alignment_length,
-        hit.subject,
-    )
-
+def load_m8_lines(m8_file: str | Path) -> dict[str, list[str]]:
+    """Return each query's BLAST m8 lines, without the query column, in file order."""
 
-def load_blast_hits(m8_file: str | Path) -> dict[str, list[BlastHit]]:
-    hits_by_query: dict[str, list[BlastHit]] = {}
+    lines: dict[str, list[str]] = {}
     with Path(m8_file).open() as handle:
-        for line_number, raw_line in enumerate(handle, start=1):
-            line = raw_line.rstrip("\n")
-            if not line:
-                continue
-            fields = line.split("\t")
-            if len(fields) != 12:
-                raise ValueError(
-                    f"Malformed BLAST m8 row at {m8_file}:{line_number}: "
-                    f"expected 12 fields, found {len(fields)}"
-                )
-            query = fields[0]
-            hits_by_query.setdefault(query, []).append(
-                BlastHit(
-                    subject=fields[1],
-                    percent_identity=float(fields[2]),
-                    alignment_length=int(fields[3]),
-                    mismatches=int(fields[4]),
-                    gap_opens=int(fields[5]),
-                    query_start=int(fields[6]),
-                    query_end=int(fields[7]),
-                    subject_start=int(fields[8]),
-                    subject_end=int(fields[9]),
-                    evalue=float(fields[10]),
-                    bit_score=float(fields[11]),
-                )
-            )
-    for query, hits in hits_by_query.items():
-        unique_subjects: dict[str, BlastHit] = {}
-        for hit in sorted(hits, key=_blast_rank_key):
-            unique_subjects.setdefault(hit.subject, hit)
-        hits_by_query[query] = list(unique_subjects.values())
-    return hits_by_query
+        for line in handle:
+            query, separator, rest = line.partition("\t")
+            lines.setdefault(query, []).append(separator + rest)
+    return lines
 
 
 def load_taxonomy_records(
     taxonomy_file: str | Path,
     subjects: set[str],
+    lookup_socket: str | Path | None = None,
 ) -> dict[str, TaxonomyRecord]:
     if not subjects:
         return {}
-    placeholders = ",".join("?" for _ in subjects)
-    parameters = [str(Path(taxonomy_file)), *sorted(subjects)]
-    connection = duckdb.connect(":memory:")
-    try:
-        connection.execute("SET threads = 1")
-        columns = {
-            str(row[0])
-            for row in connection.execute(
-                "DESCRIBE SELECT * FROM read_parquet(?)",
-                [str(Path(taxonomy_file))],
-            ).fetchall()
-        }
-        centroid_columns = {
-            "centroid_names",
-            "centroid_taxonomy",
-            "centroid_taxonomy_source",
-        }
-        present_centroid_columns = centroid_columns.intersection(columns)
-        if present_centroid_columns and present_centroid_columns != centroid_columns:
-            raise ValueError("Preferred taxonomy has an incomplete centroid schema")
-        centroid_fields = (
-            ("centroid_names", "centroid_taxonomy", "centroid_taxonomy_source")
-            if present_centroid_columns
-            else (
-                "'' AS centroid_names",
-                "'' AS centroid_taxonomy",
-                "'' AS centroid_taxonomy_source",
-            )
-        )
-        query = f"""
-            SELECT
-                sequence_id,
-                reference_source,
-                taxonomy,
-                taxonomy_source,
-                domain,
-                compartment,
-                assignment_method,
-                cross_domain_conflict,
-                taxonomy_alternatives,
-                {centroid_fields[0]},
-                {centroid_fields[1]},
-                {centroid_fields[2]}
-            FROM read_parquet(?)
-            WHERE sequence_id IN ({placeholders})
-        """
-        rows = connection.execute(query, parameters).fetchall()
-    finally:
-        connection.close()
+    rows = fetch_rows(TAXONOMY_TABLE, taxonomy_file, subjects, lookup_socket)
     records: dict[str, TaxonomyRecord] = {}
     for row in rows:
         sequence_id = str(row[0])
@@ -204,6 +127,7 @@ def load_taxonomy_records(
             centroid_names=str(row[9] or ""),
             centroid_taxonomy=str(row[10] or ""),
             centroid_taxonomy_source=str(row[11] or ""),
+            taxon_id=None if row[12] is None else int(row[12]),
         )
         if records[sequence_id].centroid_names:
             try:
@@ -244,6 +168,29 @@ def lowest_common_taxonomy(taxonomies: list[str]) -> str:
     return ";".join(lowest_common_ancestor(paths))
 
 
+def tied_lowest_common_taxonomy(
+    records: list[TaxonomyRecord],
+    load_index: Callable[[], TaxonomyIndex | None] | None,
+) -> str:
+    """LCA of the records' taxonomies, from their released node identifiers if possible.
+
+    ``load_index`` is called only when at least ``INDEXED_LCA_MIN_RECORDS``
+    records carry a node identifier; smaller sets compare their paths faster.
+    """
+
+    taxon_ids = [record.taxon_id for record in records if record.taxon_id is not None]
+    taxonomy_index = None
+    if (
+        load_index is not None
+        and len(taxon_ids) >= INDEXED_LCA_MIN_RECORDS
+        and not any(record.taxonomy and record.taxon_id is None for record in records)
+    ):
+        taxonomy_index = load_index()
+    if taxonomy_index is None:
+        return lowest_common_taxonomy([record.taxonomy for record in records])
+    return ";".join(taxonomy_index.lowest_common_path(taxon_ids))
+
+
 def common_value(values: list[str]) -> str:
     return _shared_common_value(values, conflict="mixed")
 
@@ -296,35 +243,34 @@ def annotate_hits(
     source_records_file: str | Path | None = None,
     top_hits_output: str | Path | None = None,
     top_hits: int = 5,
+    lookup_socket: str | Path | None = None,
+    cached_summaries: Mapping[str, Mapping[str, str]] | None = None,
+    cached_top_hits: Mapping[str, Sequence[Mapping[str, str]]] | None = None,
 ) -> None:
+    """Write the summary and top-hit rows of every extracted record.
+
+    Records named in ``cached_summaries`` and ``cached_top_hits`` take their
+    annotation from those earlier results, which need no BLAST rows in
+    ``m8_file``; their record columns still come from the hit table and FASTA.
+    """
+
     if max_targets < 1:
         raise ValueError("max_targets must be positive")
     if top_hits < 1:
         raise ValueError("top_hits must be positive")
-    blast_hits = load_blast_hits(m8_file)
-    best_hits = {
-        query: sorted(
-            (hit for hit in hits if hit.bit_score == hits[0].bit_score),
-            key=lambda hit: (
-                -hit.percent_identity,
-                -hit.alignment_length,
-                hit.subject,
-            ),
-        )
-        for query, hits in blast_hits.items()
-        if hits
-    }
+    blast_hits = load_blast_table(m8_file)
     taxonomy_records: dict[str, TaxonomyRecord] = {}
     reference_records: dict[str, ReferenceRecord] = {}
-    subjects = {
-        hit.subject
-        for query_hits in blast_hits.values()
-        for hit in query_hits
-    }
+    subjects = set(blast_hits.subjects)
+    taxonomy_index = None
     if taxonomy_file is not None:
-        taxonomy_records = load_taxonomy_records(taxonomy_file, subjects)
+        taxonomy_records = load_taxonomy_records(taxonomy_file, subjects, lookup_socket)
+        # The node table is read on the first query with indexed tied records.
+        taxonomy_index = cache(lambda: load_taxonomy_index(taxonomy_file))
     if source_records_file is not None:
-        reference_records = load_reference_records(source_records_file, subjects)
+        reference_records = load_reference_records(
+            source_records_file, subjects, lookup_socket
+        )
     query_sequences = load_query_sequences(query_fasta) if query_fasta else {}
 
     with Path(hits_file).open(newline="") as hits_handle:
@@ -354,6 +300,7 @@ def annotate_hits(
             reference_records,
             query_sequences,
             top_hits,
+            cached_top_hits,
         )
 
     with Path(output_file).open("w", newline="") as output_handle:
@@ -365,7 +312,16 @@ def annotate_hits(
         )
         writer.writeheader()
         for row in hit_rows:
-            tied_hits = best_hits.get(row["name"], [])
+            if cached_summaries is not None and row["name"] in cached_summaries:
+                record = {**row, "query_sequence": query_sequences.get(row["name"], "")}
+                writer.writerow(
+                    {
+                        **cached_summaries[row["name"]],
+                        **{field: record[field] for field in RECORD_SUMMARY_FIELDS},
+                    }
+                )
+                continue
+            tied_hits = blast_hits.tied_hits(row["name"])
             blast_hit = tied_hits[0] if tied_hits else None
             tied_taxonomies = [
                 taxonomy_records[hit.subject]
@@ -410,9 +366,7 @@ def annotate_hits(
                 taxonomy = (
                     taxonomy_domain
                     if ties_truncated
-                    else lowest_common_taxonomy(
-                        [record.taxonomy for record in tied_taxonomies]
-                    )
+                    else tied_lowest_common_taxonomy(tied_taxonomies, taxonomy_index)
                 )
                 if not taxonomy and tied_taxonomies:
                     taxonomy = taxonomy_domain or "Unclassified"
@@ -490,7 +444,7 @@ def annotate_hits(
             )
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Add the highest-bit-score BLAST hit to an SSUextract hit table."
     )
@@ -516,17 +470,21 @@ def parse_args() -> argparse.Namespace:
         "--source-records-db",
         help="Source-record Parquet for public reference identifiers and versions.",
     )
+    parser.add_argument(
+        "--lookup-socket",
+        help="Optional reference_lookup.py server socket; absent sockets read Parquet.",
+    )
     parser.add_argument(
         "--max-targets",
         type=int,
         default=500,
         help="Policy limit; BLAST must request one additional overflow target.",
     )
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-def main() -> None:
-    args = parse_args()
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
     annotate_hits(
         args.hits,
         args.m8,
@@ -537,6 +495,7 @@ def main() -> None:
         source_records_file=args.source_records_db,
         top_hits_output=args.top_hits_output,
         top_hits=args.top_hits,
+        lookup_socket=args.lookup_socket,
     )
 
 
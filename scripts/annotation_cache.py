@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""Persistent per-sequence BLAST annotation cache shared between runs.
+
+An entry holds the BLAST rows, summary annotation, and reported top hits of
+one extracted sequence. It is keyed by the reference-database sequence
+identifier (a hash of the sequence after whitespace, case, and U/T
+normalization), the SHA-256 of the database profile manifest, the searched
+BLAST database of the profile, the BLAST version, and the annotation
+parameters, so records seen in earlier runs against the same release skip
+BLAST. Opening the cache for another manifest removes the entries of every
+other release. The cache is one SQLite file bounded in size; least recently
+used entries are evicted first.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import json
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, Sequence
+
+import annotate_hits
+from adaptive_blast import blastn_command, full_target_count
+from annotate_hits import RECORD_SUMMARY_FIELDS, load_m8_lines
+from database_manager import MANIFEST_NAME, load_manifest
+from database_sources import sequence_identifier
+from top_hit_reporting import RECORD_TOP_HIT_FIELDS, load_query_sequences
+
+CACHE_VERSION = 2
+_LOCK_TIMEOUT_SECONDS = 600
+# SQLite limits the number of bound parameters of one statement.
+_KEYS_PER_STATEMENT = 500
+
+
+@dataclass(frozen=True)
+class CachedAnnotation:
+    """BLAST rows and annotation of one sequence, without its record columns."""
+
+    m8: list[str]
+    summary: dict[str, str]
+    top_hits: list[dict[str, str]]
+
+
+def release_digest(profile_directory: str | Path) -> str:
+    """Return the SHA-256 of a validated profile manifest."""
+
+    directory = Path(profile_directory)
+    load_manifest(directory)
+    return hashlib.sha256((directory / MANIFEST_NAME).read_bytes()).hexdigest()
+
+
+def blast_version(blastn: str = "blastn") -> str:
+    result = subprocess.run(
+        [blastn, "-version"], check=True, capture_output=True, text=True
+    )
+    lines = result.stdout.splitlines()
+    if not lines:
+        raise ValueError(f"{blastn} -version did not report a version")
+    return lines[0].strip()
+
+
+def annotation_key(
+    identifier: str,
+    release: str,
+    database: str,
+    version: str,
+    max_targets: int,
+    top_hits: int,
+) -> str:
+    """Return the cache key of one sequence's annotation.
+
+    ``database`` names the searched BLAST database within the release; one
+    profile manifest covers the database of every marker.
+    """
+
+    document = {
+        "cache_version": CACHE_VERSION,
+        "sequence": identifier,
+        "release": release,
+        "database": database,
+        "blast": version,
+        "max_targets": max_targets,
+        "top_hits": top_hits,
+    }
+    return hashlib.sha256(json.dumps(document, sort_keys=True).encode()).hexdigest()
+
+
+def _chunks(keys: Sequence[str]) -> Iterator[Sequence[str]]:
+    for start in range(0, len(keys), _KEYS_PER_STATEMENT):
+        yield keys[start : start + _KEYS_PER_STATEMENT]
+
+
+class AnnotationCache:
+    """A SQLite file of per-sequence annotations with least-recently-used eviction."""
+
+    def __init__(self, path: str | Path, release: str, max_bytes: int) -> None:
+        if max_bytes < 1:
+            raise ValueError("annotation cache size must be positive")
+        self.path = Path(path)
+        self.release = release
+        self.max_bytes = max_bytes
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=_LOCK_TIMEOUT_SECONDS)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS annotations ("
+                "key TEXT PRIMARY KEY, release TEXT NOT NULL, "
+                "payload TEXT NOT NULL, last_used INTEGER NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS annotations_release ON annotations (release)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS annotations_last_used "
+                "ON annotations (last_used)"
+            )
+            self.connection.execute(
+                "DELETE FROM annotations WHERE release <> ?", (release,)
+            )
+
+    def __enter__(self) -> AnnotationCache:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def fetch(self, keys: Iterable[str]) -> dict[str, CachedAnnotation]:
+        """Return the cached entries among ``keys`` and mark them as used."""
+
+        wanted = sorted(set(keys))
+        found: dict[str, CachedAnnotation] = {}
+        now = time.time_ns()
+        with self.connection:
+            for chunk in _chunks(wanted):
+                placeholders = ",".join("?" * len(chunk))
+                for key, payload in self.connection.execute(
+                    f"SELECT key, payload FROM annotations WHERE key IN ({placeholders})",
+                    chunk,
+                ):
+                    found[key] = CachedAnnotation(**json.loads(payload))
+                self.connection.execute(
+                    f"UPDATE annotations SET last_used = ? WHERE key IN ({placeholders})",
+                    (now, *chunk),
+                )
+        return found
+
+    def store(self, entries: dict[str, CachedAnnotation]) -> None:
+        now = time.time_ns()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO annotations VALUES (?, ?, ?, ?)",
+                (
+                    (
+                        key,
+                        self.release,
+                        json.dumps(
+                            {
+                                "m8": entry.m8,
+                                "summary": entry.summary,
+                                "top_hits": entry.top_hits,
+                            },
+                            sort_keys=True,
+                        ),
+                        now,
+                    )
+                    for key, entry in entries.items()
+                ),
+            )
+        self.evict()
+
+    def evict(self) -> None:
+        with self.connection:
+            (total,) = self.connection.execute(
+                "SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM annotations"
+            ).fetchone()
+            if total <= self.max_bytes:
+                return
+            evicted = []
+            for key, size in self.connection.execute(
+                "SELECT key, LENGTH(payload) FROM annotations ORDER BY last_used, key"
+            ):
+                if total <= self.max_bytes:
+                    break
+                evicted.append(key)
+                total -= size
+            for chunk in _chunks(evicted):
+                self.connection.execute(
+                    f"DELETE FROM annotations WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+
+
+def _rows_by_name(path: str | Path) -> dict[str, list[dict[str, str]]]:
+    rows: dict[str, list[dict[str, str]]] = {}
+    with Path(path).open(newline="") as handle:
+        for row in csv.DictReader(handle, delimiter="\t"):
+            rows.setdefault(row["name"], []).append(row)
+    return rows
+
+
+def cached_blast_annotation(
+    hits_file: str | Path,
+    query_fasta: str | Path,
+    db_prefix: str | Path,
+    *,
+    m8_output: str | Path,
+    summary_output: str | Path,
+    top_hits_output: str | Path,
+    threads: int,
+    max_targets: int,
+    top_hits: int,
+    cache: AnnotationCache,
+    taxonomy_file: str | Path | None = None,
+    source_records_file: str | Path | None = None,
+    lookup_socket: str | Path | None = None,
+    blastn: str = "blastn",
+) -> tuple[int, int]:
+    """BLAST and annotate only the records whose sequences are not cached.
+
+    Writes the same m8, summary, and top-hit files as BLAST followed by
+    ``annotate_hits`` for every record, and returns the numbers of records
+    served from the cache and searched.
+    """
+
+    sequences = load_query_sequences(query_fasta)
+    version = blast_version(blastn)
+    # Release prefixes are blast/<marker>, so the name identifies the database.
+    database = Path(db_prefix).name
+    keys = {
+        name: annotation_key(
+            sequence_identifier(sequence, f"record {name}"),
+            cache.release,
+            database,
+            version,
+            max_targets,
+            top_hits,
+        )
+        for name, sequence in sequences.items()
+    }
+    cached = cache.fetch(keys.values())
+    misses = [name for name, key in keys.items() if key not in cached]
+    m8_output = Path(m8_output)
+    with tempfile.TemporaryDirectory(
+        prefix=".annotation-cache.", dir=m8_output.parent
+    ) as temporary:
+        misses_m8 = Path(temporary) / "misses.m8"
+        misses_m8.touch()
+        if misses:
+            misses_fasta = Path(temporary) / "misses.fna"
+            with misses_fasta.open("w") as handle:
+                for name in misses:
+                    handle.write(f">{name}\n{sequences[name]}\n")
+            subprocess.run(
+                blastn_command(
+                    misses_fasta,
+                    db_prefix,
+                    misses_m8,
+                    full_target_count(max_targets, top_hits),
+                    threads,
+                    blastn,
+                ),
+                check=True,
+            )
+        annotate_hits.annotate_hits(
+            hits_file,
+            misses_m8,
+            summary_output,
+            taxonomy_file,
+            max_targets,
+            query_fasta=query_fasta,
+            source_records_file=source_records_file,
+            top_hits_output=top_hits_output,
+            top_hits=top_hits,
+            lookup_socket=lookup_socket,
+            cached_summaries={
+                name: cached[key].summary for name, key in keys.items() if key in cached
+            },
+            cached_top_hits={
+                name: cached[key].top_hits for name, key in keys.items() if key in cached
+            },
+        )
+        searched_lines = load_m8_lines(misses_m8)
+
+    # BLAST writes queries in FASTA order.
+    with m8_output.open("w") as handle:
+        for name, key in keys.items():
+            lines = cached[key].m8 if key in cached else searched_lines.get(name, [])
+            for rest in lines:
+                handle.write(name + rest)
+
+    summaries = _rows_by_name(summary_output)
+    reported = _rows_by_name(top_hits_output)
+    entries: dict[str, CachedAnnotation] = {}
+    for name in misses:
+        if keys[name] in entries or name not in summaries:
+            continue
+        (summary,) = summaries[name]
+        entries[keys[name]] = CachedAnnotation(
+            m8=searched_lines.get(name, []),
+            summary={
+                field: value
+                for field, value in summary.items()
+                if field not in RECORD_SUMMARY_FIELDS
+            },
+            top_hits=[
+                {
+                    field: value
+                    for field, value in row.items()
+                    if field not in RECORD_TOP_HIT_FIELDS
+                }
+                for row in reported.get(name, [])
+            ],
+        )
+    cache.store(entries)
+    return len(keys) - len(misses), len(misses)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="BLAST-annotate extracted records through a persistent annotation cache."
+    )
+    parser.add_argument("--cache-db", required=True, type=Path)
+    parser.add_argument("--max-mb", type=int, default=1024)
+    parser.add_argument(
+        "--profile-directory",
+        required=True,
+        type=Path,
+        help="installed database profile whose manifest keys the cache",
+    )
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--threads", required=True, type=int)
+    parser.add_argument("--hits", required=True)
+    parser.add_argument("--query-fasta", required=True)
+    parser.add_argument("--m8-output", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--top-hits-output", required=True)
+    parser.add_argument("--top-hits", type=int, default=5)
+    parser.add_argument("--max-targets", type=int, default=500)
+    parser.add_argument("--taxonomy-db")
+    parser.add_argument("--source-records-db")
+    parser.add_argument("--lookup-socket")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    with AnnotationCache(
+        args.cache_db, release_digest(args.profile_directory), args.max_mb * 1024 * 1024
+    ) as cache:
+        reused, searched = cached_blast_annotation(
+            args.hits,
+            args.query_fasta,
+            args.db,
+            m8_output=args.m8_output,
+            summary_output=args.output,
+            top_hits_output=args.top_hits_output,
+            threads=args.threads,
+            max_targets=args.max_targets,
+            top_hits=args.top_hits,
+            cache=cache,
+            taxonomy_file=args.taxonomy_db,
+            source_records_file=args.source_records_db,
+            lookup_socket=args.lookup_socket,
+        )
+    sys.stdout.write(f"annotation cache: {reused} reused, {searched} searched\n")
+
+
+if __name__ == "__main__":
+    main()
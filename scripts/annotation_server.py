@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""Resident single-assembly annotation over a Unix socket.
+
+``serve`` resolves the database profile and covariance models once, keeps the
+taxonomy and source-record tables in a resident reference lookup server, and
+answers FASTA submissions with the ``cmsearch_summary.tsv`` and
+``blast_top_hits.tsv`` text that a BLAST-mode run of the same assembly
+publishes. At most ``--workers`` submissions run at once and at most
+``--queue-size`` more wait; further connections are declined as soon as they
+are accepted, before their submission is read, so that clients can retry
+instead of piling up behind a slow assembly.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+from dataclasses import replace
+from pathlib import Path
+
+from database_manager import DatabaseError
+from local_runner import (
+    ModelTask,
+    RunSettings,
+    add_workflow_arguments,
+    finalize,
+    resolve_workflow,
+    run_sample,
+    validate_identifier,
+)
+from reference_lookup import SOURCE_RECORDS_TABLE, TAXONOMY_TABLE, ReferenceLookupServer
+
+PROTOCOL_VERSION = 1
+_MAXIMUM_MESSAGE_BYTES = 1024 * 1024 * 1024
+RESULT_FILES = {"summary": "cmsearch_summary.tsv", "top_hits": "blast_top_hits.tsv"}
+BUSY_RESPONSE = {"busy": "annotation queue is full; retry later"}
+
+
+class AnnotationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Annotate submitted assemblies with bounded concurrency and queueing."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path: str | Path,
+        models: list[ModelTask],
+        settings: RunSettings,
+        *,
+        workers: int = 1,
+        queue_size: int = 4,
+    ) -> None:
+        if workers < 1 or queue_size < 0:
+            raise ValueError("workers must be positive and queue_size non-negative")
+        self.models = models
+        self.settings = settings
+        self.running = threading.BoundedSemaphore(workers)
+        self.admitted = threading.BoundedSemaphore(workers + queue_size)
+        self.request_queue_size = workers + queue_size
+        Path(socket_path).unlink(missing_ok=True)
+        super().__init__(str(socket_path), _AnnotationHandler)
+
+    def process_request(self, request: socket.socket, client_address: object) -> None:
+        # Admission is decided per connection, so a declined client costs one
+        # short write and connection threads never exceed workers + queue_size.
+        if not self.admitted.acquire(blocking=False):
+            try:
+                request.sendall(json.dumps(BUSY_RESPONSE).encode() + b"\n")
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self.admitted.release()
+            raise
+
+    def process_request_thread(self, request: socket.socket, client_address: object) -> None:
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.admitted.release()
+
+    def annotate(self, request: object) -> dict[str, object]:
+        if not isinstance(request, dict) or request.get("protocol_version") != PROTOCOL_VERSION:
+            return {"error": "unsupported protocol"}
+        sample = request.get("sample", "query")
+        fasta = request.get("fasta")
+        if not isinstance(sample, str) or not isinstance(fasta, str) or not fasta:
+            return {"error": "a submission needs a sample identifier and FASTA text"}
+        with self.running:
+            return self._annotate(validate_identifier(sample, "sample"), fasta)
+
+    def _annotate(self, sample: str, fasta: str) -> dict[str, object]:
+        with tempfile.TemporaryDirectory(prefix="ssuextract-annotate.") as temporary:
+            work_directory = Path(temporary)
+            query = work_directory / "query" / f"{sample}.fna"
+            query.parent.mkdir()
+            query.write_text(fasta)
+            try:
+                run_sample(sample, query, self.models, self.settings, work_directory)
+            except subprocess.CalledProcessError as error:
+                raise ValueError(f"annotation of {sample} failed: {error}") from error
+            finalize(work_directory)
+            return {
+                key: (work_directory / name).read_text()
+                for key, name in RESULT_FILES.items()
+            }
+
+
+class _AnnotationHandler(socketserver.StreamRequestHandler):
+    server: AnnotationServer
+
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline(_MAXIMUM_MESSAGE_BYTES))
+        except ValueError:
+            request = None
+        try:
+            response = self.server.annotate(request)
+        except Exception as error:
+            # Every admitted submission gets exactly one response line.
+            response = {"error": str(error) or type(error).__name__}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+def submit(
+    socket_path: str | Path, fasta_file: str | Path, sample: str | None = None
+) -> dict[str, object]:
+    """Send one assembly to a running server and return its response."""
+
+    path = Path(fasta_file)
+    request = {
+        "protocol_version": PROTOCOL_VERSION,
+        "sample": sample or path.stem,
+        "fasta": path.read_text(),
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(socket_path))
+        try:
+            client.sendall(json.dumps(request).encode() + b"\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # A declining server replies and closes without reading the
+            # submission; its reply is still waiting to be read.
+            pass
+        with client.makefile("rb") as stream:
+            response = json.loads(stream.readline(_MAXIMUM_MESSAGE_BYTES))
+    if not isinstance(response, dict):
+        raise ValueError("Malformed annotation server response")
+    return response
+
+
+def _start_lookup_server(settings: RunSettings, directory: Path) -> ReferenceLookupServer:
+    lookup = ReferenceLookupServer(
+        directory / "reference-lookup.sock",
+        {
+            TAXONOMY_TABLE: settings.taxonomy_file,
+            SOURCE_RECORDS_TABLE: settings.source_records_file,
+        },
+    )
+    threading.Thread(target=lookup.serve_forever, daemon=True).start()
+    return lookup
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Keep a database profile warm and annotate submitted assemblies."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve = subparsers.add_parser("serve", help="resolve the profile once and serve submissions")
+    serve.add_argument("--socket", required=True, type=Path)
+    add_workflow_arguments(serve)
+    serve.add_argument("--workers", type=int, default=1)
+    serve.add_argument(
+        "--queue-size",
+        type=int,
+        default=4,
+        help="submissions that may wait for a worker before new ones are declined",
+    )
+    client = subparsers.add_parser(
+        "submit",
+        help="annotate one FASTA with a running server; exits 75 when the server is busy",
+    )
+    client.add_argument("--socket", required=True, type=Path)
+    client.add_argument("--fasta", required=True, type=Path)
+    client.add_argument("--sample", help="sample identifier (default: FASTA file stem)")
+    client.add_argument("--top-hits-output", type=Path)
+    return parser.parse_args(argv)
+
+
+def _serve(args: argparse.Namespace) -> int:
+    databases, models, settings = resolve_workflow(args)
+    with tempfile.TemporaryDirectory(prefix="ssuextract-server.") as temporary:
+        lookup = None
+        if not databases.legacy and settings.lookup_socket is None:
+            lookup = _start_lookup_server(settings, Path(temporary))
+            settings = replace(settings, lookup_socket=lookup.server_address)
+        server = AnnotationServer(
+            args.socket,
+            models,
+            settings,
+            workers=args.workers,
+            queue_size=args.queue_size,
+        )
+        print(f"annotation-server: serving {args.socket}", file=sys.stderr, flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            args.socket.unlink(missing_ok=True)
+            if lookup is not None:
+                lookup.shutdown()
+                lookup.server_close()
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    try:
+        if args.command == "serve":
+            return _serve(args)
+        response = submit(args.socket, args.fasta, args.sample)
+    except (DatabaseError, OSError, ValueError) as error:
+        print(f"annotation-server: {error}", file=sys.stderr)
+        return 1
+    if "busy" in response or "error" in response:
+        print(f"annotation-server: {response.get('busy') or response['error']}", file=sys.stderr)
+        return 75 if "busy" in response else 1
+    sys.stdout.write(str(response["summary"]))
+    if args.top_hits_output is not None:
+        args.top_hits_output.write_text(str(response["top_hits"]))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -13,13 +13,22 @@ import subprocess
 import tarfile
 import tempfile
 from collections import Counter, defaultdict
-from dataclasses import dataclass
+from contextlib import ExitStack
+from dataclasses import dataclass, field
 from pathlib import Path, PurePosixPath
-from typing import Iterable, Mapping, Sequence
+from typing import Iterable, Iterator, Mapping, Sequence, TextIO
 
 import build_database_release as builder
 import database_manager as manager
 from atomic_io import fsync_directory, fsync_file, replace_and_fsync
+from database_release_io import _write_fasta_record
+from reference_alignments import (
+    cmalign_match_command,
+    model_sha256,
+    read_match_alignment,
+    reference_alignments_path,
+)
+from sequence_index import sequence_index_path
 
 
 _IDENTIFIER = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
@@ -28,8 +37,10 @@ _TABLE_PATHS = {
     "source_records": "tables/source_records.parquet",
     "taxonomy_assignments": "tables/taxonomy_assignments.parquet",
     "preferred": "tables/preferred_taxonomy.parquet",
+    "taxonomy_nodes": "tables/taxonomy_nodes.parquet",
     "img_location": "tables/img_location.parquet",
 }
+_SEQUENCE_INDEXED_TABLES = ("preferred", "source_records")
 
 
 class AssemblyError(RuntimeError):
@@ -65,6 +76,50 @@ class AssemblyResult:
     archive: ArchiveMetadata | None
 
 
+@dataclass(frozen=True)
+class StreamedRelease:
+    """Release rows streamed from sorted spill files instead of a held model.
+
+    ``groups`` come from ``iter_sequence_groups`` of the release builder, possibly
+    through ``iter_groups_with_derived_assignments``, so every identifier was
+    computed from its sequence. The release tables
+    are staged in an on-disk DuckDB database capped at ``memory_limit_bytes``.
+    """
+
+    groups: Iterable[builder.SequenceGroup]
+    memory_limit_bytes: int
+    spill_directory: Path | None = None
+
+
+@dataclass
+class _ReleaseSummary:
+    """Row counts of a staged release, in total and per marker and source."""
+
+    counts: Counter[str] = field(default_factory=Counter)
+    marker_sequences: Counter[str] = field(default_factory=Counter)
+    marker_sources: Counter[str] = field(default_factory=Counter)
+    source_versions: Counter[tuple[str, str]] = field(default_factory=Counter)
+
+    def add(
+        self,
+        sequences: Sequence[builder.SequenceRecord],
+        source_records: Sequence[builder.SourceRecord],
+        taxonomy_assignments: Sequence[builder.TaxonomyAssignment],
+        preferred_taxonomy: Sequence[builder.PreferredTaxonomy],
+    ) -> None:
+        self.counts["sequences"] += len(sequences)
+        self.counts["source_records"] += len(source_records)
+        self.counts["taxonomy_assignments"] += len(taxonomy_assignments)
+        self.counts["preferred_taxonomy"] += len(preferred_taxonomy)
+        for sequence in sequences:
+            for raw_marker in sequence.markers:
+                marker = _require_identifier(raw_marker, "sequence marker")
+                self.marker_sequences[marker] += 1
+        for source in source_records:
+            self.marker_sources[_require_identifier(source.marker, "source marker")] += 1
+            self.source_versions[(source.reference_source, source.source_version)] += 1
+
+
 def _require_identifier(value: str, label: str) -> str:
     if not isinstance(value, str) or not _IDENTIFIER.fullmatch(value):
         raise AssemblyError(f"{label} must be a safe, non-empty identifier")
@@ -101,25 +156,130 @@ def _makeblastdb_version(executable: str, *, cwd: Path) -> str:
     return " | ".join(lines)
 
 
+def _cmalign_version(executable: str, *, cwd: Path) -> str:
+    output = _run([executable, "-h"], cwd=cwd)
+    lines = [line.lstrip("# ").strip() for line in output.stdout.splitlines()]
+    return next((line for line in lines if line.startswith("INFERNAL")), "")
+
+
+def _fasta_identifiers(path: Path) -> set[str]:
+    with path.open(encoding="ascii") as handle:
+        return {line[1:].split()[0] for line in handle if line.startswith(">")}
+
+
+def _align_references(
+    staging: Path,
+    fasta: Path,
+    marker: str,
+    cm_model: Path,
+    cmalign: str,
+    cpu: int,
+) -> dict[str, str]:
+    """Store the match-column row of every marker sequence for ``cm_model``."""
+
+    if not cm_model.is_file():
+        raise AssemblyError(f"Covariance model for {marker} is not a file: {cm_model}")
+    relative = PurePosixPath(reference_alignments_path(marker, cm_model.stem))
+    with tempfile.TemporaryDirectory(prefix=f".{marker}.cmalign.", dir=staging.parent) as tmp:
+        aligned = Path(tmp) / f"{marker}.afa"
+        _run(
+            cmalign_match_command(cm_model.resolve(), fasta, aligned, cpu, cmalign),
+            cwd=staging,
+        )
+        try:
+            rows = read_match_alignment(aligned)
+        except ValueError as error:
+            raise AssemblyError(f"Invalid {marker} reference alignment: {error}") from error
+    if set(rows) != _fasta_identifiers(staging / fasta):
+        raise AssemblyError(f"cmalign did not align every {marker} sequence exactly once")
+    builder.write_reference_alignments_parquet(staging / relative, rows)
+    return {
+        "path": relative.as_posix(),
+        "model": cm_model.stem,
+        "model_sha256": model_sha256(cm_model),
+    }
+
+
 def _marker_sequences(
     model: builder.DatabaseModel,
-) -> tuple[dict[str, tuple[builder.SequenceRecord, ...]], dict[str, int]]:
+) -> dict[str, tuple[builder.SequenceRecord, ...]]:
     members: dict[str, list[builder.SequenceRecord]] = defaultdict(list)
-    source_counts: Counter[str] = Counter()
     for sequence in model.sequences:
         for raw_marker in sequence.markers:
             marker = _require_identifier(raw_marker, "sequence marker")
             members[marker].append(sequence)
-    for source in model.source_records:
-        marker = _require_identifier(source.marker, "source marker")
-        source_counts[marker] += 1
-    if not members:
-        raise AssemblyError("Database model has no marker memberships")
-    marker_sequences = {
+    return {
         marker: tuple(sorted(sequences, key=lambda record: record.sequence_id))
         for marker, sequences in sorted(members.items())
     }
-    return marker_sequences, dict(source_counts)
+
+
+def _stage_model(
+    staging: Path,
+    model: builder.DatabaseModel,
+    img_locations: tuple[builder.ImgLocation, ...],
+) -> _ReleaseSummary:
+    builder.validate_release(model, img_locations)
+    summary = _ReleaseSummary()
+    summary.add(
+        model.sequences,
+        model.source_records,
+        model.taxonomy_assignments,
+        model.preferred_taxonomy,
+    )
+    marker_sequences = _marker_sequences(model)
+    builder.write_release_tables(staging / "tables", model, img_locations)
+    for marker, sequences in marker_sequences.items():
+        builder.write_marker_fasta(staging / "fasta" / f"{marker}.fasta", sequences)
+    return summary
+
+
+def _stage_stream(
+    staging: Path,
+    release: StreamedRelease,
+    img_locations: tuple[builder.ImgLocation, ...],
+) -> _ReleaseSummary:
+    """Write the tables and marker FASTA files in one pass over the groups."""
+
+    summary = _ReleaseSummary()
+    directory = staging / "fasta"
+    directory.mkdir(parents=True, exist_ok=True)
+    with ExitStack() as stack:
+        handles: dict[str, TextIO] = {}
+
+        def observed() -> Iterator[builder.SequenceGroup]:
+            for group in release.groups:
+                preferred = (
+                    ()
+                    if group.preferred_taxonomy is None
+                    else (group.preferred_taxonomy,)
+                )
+                summary.add(
+                    (group.sequence,),
+                    group.source_records,
+                    group.taxonomy_assignments,
+                    preferred,
+                )
+                for marker in group.sequence.markers:
+                    if marker not in handles:
+                        handles[marker] = stack.enter_context(
+                            (directory / f"{marker}.fasta").open(
+                                "w", encoding="ascii", newline="\n"
+                            )
+                        )
+                    _write_fasta_record(handles[marker], group.sequence, 80)
+                yield group
+
+        builder.write_streamed_release(
+            staging / "tables",
+            observed(),
+            img_locations,
+            memory_limit_bytes=release.memory_limit_bytes,
+            spill_directory=release.spill_directory,
+            hashed=True,
+            marker_fasta=False,
+        )
+    return summary
 
 
 def _write_json(path: Path, value: object) -> None:
@@ -144,37 +304,36 @@ def _normalize_permissions(root: Path) -> None:
 
 
 def _provenance(
-    model: builder.DatabaseModel,
+    summary: _ReleaseSummary,
     profile: str,
     version: str,
-    marker_sequences: dict[str, tuple[builder.SequenceRecord, ...]],
-    source_counts: dict[str, int],
     makeblastdb_version: str,
     provenance_details: Mapping[str, object] | None,
+    cmalign_version: str | None = None,
 ) -> dict[str, object]:
-    source_versions = Counter(
-        (record.reference_source, record.source_version) for record in model.source_records
-    )
     provenance = {
         "schema_version": 1,
         "profile": profile,
         "version": version,
         "counts": {
-            "sequences": len(model.sequences),
-            "source_records": len(model.source_records),
-            "taxonomy_assignments": len(model.taxonomy_assignments),
-            "preferred_taxonomy": len(model.preferred_taxonomy),
+            name: summary.counts[name]
+            for name in (
+                "sequences",
+                "source_records",
+                "taxonomy_assignments",
+                "preferred_taxonomy",
+            )
         },
         "markers": {
             marker: {
-                "sequences": len(records),
-                "source_records": source_counts[marker],
+                "sequences": count,
+                "source_records": summary.marker_sources[marker],
             }
-            for marker, records in marker_sequences.items()
+            for marker, count in sorted(summary.marker_sequences.items())
         },
         "sources": [
             {"name": source, "version": source_version, "source_records": count}
-            for (source, source_version), count in sorted(source_versions.items())
+            for (source, source_version), count in sorted(summary.source_versions.items())
         ],
         "tools": {
             "makeblastdb": {
@@ -194,6 +353,18 @@ def _provenance(
             }
         },
     }
+    if cmalign_version is not None:
+        provenance["tools"]["cmalign"] = {
+            "version": cmalign_version,
+            "command_template": [
+                "cmalign",
+                "--matchonly",
+                "--outformat",
+                "AFA",
+                "{model}.cm",
+                "fasta/{marker}.fasta",
+            ],
+        }
     if provenance_details:
         provenance["release_build"] = dict(provenance_details)
     return provenance
@@ -218,7 +389,7 @@ def _copy_release_files(staging: Path, files: Mapping[str, str | Path]) -> None:
 
 def _assemble_staging_profile(
     staging: Path,
-    model: builder.DatabaseModel,
+    release: builder.DatabaseModel | StreamedRelease,
     profile: str,
     version: str,
     img_locations: tuple[builder.ImgLocation, ...],
@@ -226,16 +397,26 @@ def _assemble_staging_profile(
     blastdbcmd: str,
     provenance_details: Mapping[str, object] | None,
     release_files: Mapping[str, str | Path],
+    covariance_models: Mapping[str, str | Path],
+    cmalign: str,
+    cmalign_cpu: int,
 ) -> dict[str, object]:
-    builder.validate_release(model, img_locations)
-    marker_sequences, source_counts = _marker_sequences(model)
-
-    builder.write_release_tables(staging / "tables", model, img_locations)
+    if isinstance(release, StreamedRelease):
+        summary = _stage_stream(staging, release, img_locations)
+    else:
+        summary = _stage_model(staging, release, img_locations)
+    if not summary.marker_sequences:
+        raise AssemblyError("Database model has no marker memberships")
+    unknown_models = sorted(set(covariance_models) - summary.marker_sequences.keys())
+    if unknown_models:
+        raise AssemblyError(
+            "Covariance models name markers without sequences: " + ", ".join(unknown_models)
+        )
     blast_databases: dict[str, dict[str, str]] = {}
-    for marker, sequences in marker_sequences.items():
+    reference_alignments: dict[str, dict[str, str]] = {}
+    for marker in sorted(summary.marker_sequences):
         fasta = Path("fasta") / f"{marker}.fasta"
         prefix = Path("blast") / marker
-        builder.write_marker_fasta(staging / fasta, sequences)
         (staging / prefix).parent.mkdir(parents=True, exist_ok=True)
         _run(
             [
@@ -255,6 +436,15 @@ def _assemble_staging_profile(
             cwd=staging,
         )
         blast_databases[marker] = {"prefix": prefix.as_posix()}
+        if marker in covariance_models:
+            reference_alignments[marker] = _align_references(
+                staging,
+                fasta,
+                marker,
+                Path(covariance_models[marker]),
+                cmalign,
+                cmalign_cpu,
+            )
         (staging / fasta).unlink()
     fasta_directory = staging / "fasta"
     if fasta_directory.exists():
@@ -266,13 +456,12 @@ def _assemble_staging_profile(
     _write_json(
         provenance_path,
         _provenance(
-            model,
+            summary,
             profile,
             version,
-            marker_sequences,
-            source_counts,
             _makeblastdb_version(makeblastdb, cwd=staging),
             provenance_details,
+            _cmalign_version(cmalign, cwd=staging) if reference_alignments else None,
         ),
     )
     artifact_paths = sorted(
@@ -287,8 +476,14 @@ def _assemble_staging_profile(
         "artifacts": [_artifact(path, staging) for path in artifact_paths],
         "blast_databases": blast_databases,
         "taxonomy_database": dict(_TABLE_PATHS),
+        "sequence_indexes": {
+            table: sequence_index_path(PurePosixPath(_TABLE_PATHS[table])).as_posix()
+            for table in _SEQUENCE_INDEXED_TABLES
+        },
         "provenance": "provenance.json",
     }
+    if reference_alignments:
+        manifest["reference_alignments"] = reference_alignments
     evidence_catalog = staging / "EVIDENCE" / "img_taxonomy_evidence.jsonl"
     if evidence_catalog.is_file():
         manifest["taxonomy_evidence_catalog"] = PurePosixPath(
@@ -296,7 +491,7 @@ def _assemble_staging_profile(
         ).as_posix()
     _write_json(staging / manager.MANIFEST_NAME, manifest)
     _normalize_permissions(staging)
-    manager.validate_profile_directory(staging, profile, blastdbcmd)
+    manager.validate_profile_directory(staging, profile, blastdbcmd, record=False)
     return manifest
 
 
@@ -434,7 +629,7 @@ def _stage_profile_archive(
 
 
 def assemble_database_profile(
-    model: builder.DatabaseModel,
+    release: builder.DatabaseModel | StreamedRelease,
     profile_directory: str | Path,
     *,
     profile: str,
@@ -446,8 +641,17 @@ def assemble_database_profile(
     zstd: str = "zstd",
     provenance_details: Mapping[str, object] | None = None,
     release_files: Mapping[str, str | Path] | None = None,
+    covariance_models: Mapping[str, str | Path] | None = None,
+    cmalign: str = "cmalign",
+    cmalign_cpu: int = 1,
 ) -> AssemblyResult:
-    """Stage and validate both outputs, with rollback on reported publish failures."""
+    """Stage and validate both outputs, with rollback on reported publish failures.
+
+    ``release`` is a built model or a :class:`StreamedRelease`; both produce the
+    same profile. ``covariance_models`` maps markers to the tree covariance
+    model whose match-column alignment of every marker sequence the profile
+    stores.
+    """
 
     profile = _require_identifier(profile, "profile")
     version = _require_identifier(version, "version")
@@ -479,7 +683,7 @@ def assemble_database_profile(
     try:
         manifest = _assemble_staging_profile(
             staging,
-            model,
+            release,
             profile,
             version,
             tuple(img_locations),
@@ -487,6 +691,9 @@ def assemble_database_profile(
             blastdbcmd,
             provenance_details,
             release_files or {},
+            covariance_models or {},
+            cmalign,
+            cmalign_cpu,
         )
         if archive_destination is not None:
             archive_staging_directory, staged_archive = _stage_profile_archive(
@@ -574,15 +781,51 @@ def _parser() -> argparse.ArgumentParser:
     parser.add_argument("--makeblastdb", default="makeblastdb")
     parser.add_argument("--blastdbcmd", default="blastdbcmd")
     parser.add_argument("--zstd", default="zstd")
+    parser.add_argument(
+        "--covariance-model",
+        action="append",
+        default=[],
+        metavar="MARKER=CM",
+        help="store the cmalign match-column alignment of the marker's sequences",
+    )
+    parser.add_argument("--cmalign", default="cmalign")
+    parser.add_argument("--cmalign-cpu", type=int, default=1)
+    parser.add_argument(
+        "--memory-limit-mib",
+        type=int,
+        help="stream the release through sorted spill files within this memory budget",
+    )
+    parser.add_argument(
+        "--spill-directory",
+        type=Path,
+        help="directory for sort spill files (default: a temporary directory)",
+    )
     return parser
 
 
 def main(argv: Sequence[str] | None = None) -> int:
     args = _parser().parse_args(argv)
-    model = builder.build_deduplicated_model(builder.read_prepared_jsonl(args.records_jsonl))
+    records = builder.read_prepared_jsonl(args.records_jsonl)
+    if args.memory_limit_mib is not None:
+        share = builder.streaming_memory_share(args.memory_limit_mib)
+        release: builder.DatabaseModel | StreamedRelease = StreamedRelease(
+            builder.iter_sequence_groups(
+                records, memory_limit_bytes=share, spill_directory=args.spill_directory
+            ),
+            share,
+            args.spill_directory,
+        )
+    else:
+        release = builder.build_deduplicated_model(records)
     locations = builder.read_img_metadata_tsv(args.img_metadata) if args.img_metadata else ()
+    covariance_models: dict[str, str] = {}
+    for value in args.covariance_model:
+        marker, separator, path = value.partition("=")
+        if not separator or not marker or not path or marker in covariance_models:
+            raise AssemblyError(f"Invalid covariance model assignment: {value!r}")
+        covariance_models[marker] = path
     result = assemble_database_profile(
-        model,
+        release,
         args.output_root / args.profile,
         profile=args.profile,
         version=args.version,
@@ -591,6 +834,9 @@ def main(argv: Sequence[str] | None = None) -> int:
         blastdbcmd=args.blastdbcmd,
         archive_path=args.archive,
         zstd=args.zstd,
+        covariance_models=covariance_models,
+        cmalign=args.cmalign,
+        cmalign_cpu=args.cmalign_cpu,
     )
     summary = {
         "profile_directory": str(result.profile_directory),
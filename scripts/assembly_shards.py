@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""Split an assembly into size-balanced shards for independent cmsearch tasks.
+
+Contigs longer than the window size are cut into windows that overlap by at
+least the longest expected hit, so every hit lies wholly inside one window.
+Window records are named ``<contig>/<start>-<end>`` (1-based, inclusive) and
+listed in a window map; ``hit_processing.parse_cmsearch_tblout`` uses the map
+to return hits in contig coordinates. Because cmsearch E-values and filter
+thresholds scale with the searched residues, the shard plan also records the
+search space of the whole unsharded assembly for ``cmsearch -Z``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import heapq
+import json
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Sequence
+
+from Bio import SeqIO
+
+from fasta_index import FastaIndexError, IndexedFasta
+
+WINDOW_MAP_VERSION = 1
+SEARCH_SPACE_FILE = "search_space_mb.txt"
+WINDOW_MAP_FILE = "windows.json"
+
+
+@dataclass(frozen=True)
+class SequenceWindow:
+    name: str
+    contig: str
+    offset: int
+    length: int
+
+
+@dataclass(frozen=True)
+class _Piece:
+    contig: str
+    start: int
+    end: int
+    order: int
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start
+
+
+def search_space_mb(residues: int) -> float:
+    """Return cmsearch's default search space: both strands, in megabases."""
+
+    return residues * 2 / 1e6
+
+
+def window_pieces(
+    length: int, window_bases: int, overlap_bases: int
+) -> list[tuple[int, int]]:
+    """Return 0-based half-open windows covering a contig."""
+
+    if length <= window_bases:
+        return [(0, length)]
+    step = window_bases - overlap_bases
+    count = math.ceil((length - overlap_bases) / step)
+    return [
+        (index * step, min(length, index * step + window_bases)) for index in range(count)
+    ]
+
+
+def plan_shards(
+    lengths: Sequence[tuple[str, int]],
+    shard_bases: int,
+    window_bases: int,
+    overlap_bases: int,
+) -> list[list[_Piece]]:
+    """Assign contigs and contig windows to shards of balanced total length.
+
+    Pieces are placed longest first on the currently smallest shard; within a
+    shard they keep assembly order.
+    """
+
+    if overlap_bases < 0 or window_bases <= overlap_bases:
+        raise ValueError("Window size must exceed the window overlap")
+    if shard_bases < 1:
+        raise ValueError("Shard size must be positive")
+    pieces: list[_Piece] = []
+    for contig, length in lengths:
+        for start, end in window_pieces(length, window_bases, overlap_bases):
+            pieces.append(_Piece(contig, start, end, len(pieces)))
+    total = sum(piece.length for piece in pieces)
+    shard_count = max(1, min(len(pieces), math.ceil(total / shard_bases)))
+    heap = [(0, index) for index in range(shard_count)]
+    shards: list[list[_Piece]] = [[] for _ in range(shard_count)]
+    for piece in sorted(pieces, key=lambda piece: (-piece.length, piece.order)):
+        size, index = heapq.heappop(heap)
+        shards[index].append(piece)
+        heapq.heappush(heap, (size + piece.length, index))
+    return [sorted(shard, key=lambda piece: piece.order) for shard in shards if shard]
+
+
+def _window_name(piece: _Piece) -> str:
+    return f"{piece.contig}/{piece.start + 1}-{piece.end}"
+
+
+class _ParsedAssembly:
+    """In-memory fallback for FASTA files that cannot be indexed."""
+
+    def __init__(self, fasta_file: Path) -> None:
+        self.sequences: dict[str, str] = {}
+        self.duplicates: set[str] = set()
+        for record in SeqIO.parse(fasta_file, "fasta"):
+            if record.id in self.sequences:
+                self.duplicates.add(record.id)
+            self.sequences[record.id] = str(record.seq)
+
+    def fetch(self, name: str, start: int, end: int) -> str:
+        return self.sequences[name][start - 1 : end]
+
+    def close(self) -> None:
+        self.sequences.clear()
+
+
+def _open_assembly(
+    fasta_file: Path,
+) -> tuple[IndexedFasta | _ParsedAssembly, dict[str, int]]:
+    try:
+        assembly = IndexedFasta(fasta_file)
+    except FastaIndexError:
+        parsed = _ParsedAssembly(fasta_file)
+        return parsed, {name: len(sequence) for name, sequence in parsed.sequences.items()}
+    return assembly, {name: entry.length for name, entry in assembly.entries.items()}
+
+
+def shard_assembly(
+    fasta_file: str | Path,
+    output_directory: str | Path,
+    *,
+    shard_bases: int,
+    window_bases: int,
+    overlap_bases: int,
+    line_width: int = 80,
+) -> list[Path]:
+    """Write shard FASTA files, the window map, and the search-space size."""
+
+    output = Path(output_directory)
+    output.mkdir(parents=True, exist_ok=True)
+    assembly, lengths = _open_assembly(Path(fasta_file))
+    try:
+        if assembly.duplicates:
+            raise ValueError(
+                "Duplicate FASTA identifier: " + ", ".join(sorted(assembly.duplicates))
+            )
+        shards = plan_shards(list(lengths.items()), shard_bases, window_bases, overlap_bases)
+        windows: list[list[object]] = []
+        shard_files: list[Path] = []
+        width = len(str(len(shards)))
+        for number, shard in enumerate(shards, start=1):
+            shard_file = output / f"shard_{number:0{width}d}.fna"
+            with shard_file.open("w") as handle:
+                for piece in shard:
+                    name = piece.contig
+                    if piece.length != lengths[piece.contig]:
+                        name = _window_name(piece)
+                        if name in lengths:
+                            raise ValueError(
+                                f"Window name {name!r} collides with an assembly record"
+                            )
+                        windows.append([name, piece.contig, piece.start, piece.length])
+                    sequence = (
+                        assembly.fetch(piece.contig, piece.start + 1, piece.end)
+                        if piece.length
+                        else ""
+                    )
+                    handle.write(f">{name}\n")
+                    for start in range(0, len(sequence), line_width):
+                        handle.write(sequence[start : start + line_width] + "\n")
+            shard_files.append(shard_file)
+    finally:
+        assembly.close()
+
+    residues = sum(lengths.values())
+    (output / WINDOW_MAP_FILE).write_text(
+        json.dumps(
+            {
+                "schema_version": WINDOW_MAP_VERSION,
+                "residues": residues,
+                "windows": windows,
+            },
+            indent=2,
+        )
+        + "\n"
+    )
+    (output / SEARCH_SPACE_FILE).write_text(f"{search_space_mb(residues)!r}\n")
+    return shard_files
+
+
+def read_window_map(path: str | Path) -> dict[str, SequenceWindow]:
+    data = json.loads(Path(path).read_text())
+    if not isinstance(data, dict) or data.get("schema_version") != WINDOW_MAP_VERSION:
+        raise ValueError(f"Unsupported window map: {path}")
+    windows: dict[str, SequenceWindow] = {}
+    for row in data.get("windows", []):
+        if (
+            not isinstance(row, list)
+            or len(row) != 4
+            or not all(isinstance(value, str) for value in row[:2])
+            or not all(type(value) is int and value >= 0 for value in row[2:])
+        ):
+            raise ValueError(f"Malformed window in {path}: {row!r}")
+        window = SequenceWindow(*row)
+        if window.name in windows:
+            raise ValueError(f"Duplicate window in {path}: {window.name}")
+        windows[window.name] = window
+    return windows
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Split an assembly into size-balanced, windowed cmsearch shards."
+    )
+    parser.add_argument("--fasta", required=True, type=Path)
+    parser.add_argument("--output-directory", required=True, type=Path)
+    parser.add_argument("--shard-bases", required=True, type=int)
+    parser.add_argument("--window-bases", required=True, type=int)
+    parser.add_argument("--window-overlap", required=True, type=int)
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    shard_assembly(
+        args.fasta,
+        args.output_directory,
+        shard_bases=args.shard_bases,
+        window_bases=args.window_bases,
+        overlap_bases=args.window_overlap,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Time release Parquet writes against the row-insert baseline.
+
+Release tables are loaded into DuckDB from one NumPy buffer per column. The
+baseline loads the same rows with ``executemany`` row inserts, the path the
+column buffers replaced, and copies them through the same export. The benchmark
+writes a synthetic ``source_records.parquet`` both ways, reports each wall
+time, and fails unless both files and their sequence indexes are identical.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Sequence
+
+from database_contracts import SourceRecord
+from database_release_io import (
+    _SOURCE_RECORD_COLUMNS,
+    _connect,
+    _create_table,
+    _export_parquet,
+    _source_record_row,
+    write_source_records_parquet,
+)
+from sequence_index import sequence_index_path
+
+
+def synthetic_source_records(count: int) -> list[SourceRecord]:
+    """Return ``count`` source records shaped like a deduplicated release."""
+
+    return [
+        SourceRecord(
+            source_record_id=f"SRC_{index:09d}",
+            sequence_id=f"SSU_{index // 3:09d}",
+            reference_source=("SILVA", "PR2", "MIDORI2")[index % 3],
+            source_version="1.0",
+            source_identifier=f"ACC{index:09d}.1",
+            original_header=f"ACC{index:09d}.1 Bacteria;Taxon_{index % 9973}",
+            marker="16S" if index % 4 else "18S",
+            taxon_oid=None if index % 5 else str(2_500_000_000 + index),
+        )
+        for index in range(count)
+    ]
+
+
+def row_insert_parquet(
+    path: Path,
+    columns: Sequence[tuple[str, str]],
+    rows: Sequence[tuple[object, ...]],
+    *,
+    sequence_index_column: str | None = None,
+) -> Path:
+    """Write ``rows`` with one ``INSERT`` per row through the release export."""
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = _connect()
+    try:
+        _create_table(connection, "release_table", columns)
+        connection.executemany(
+            f"INSERT INTO release_table VALUES ({', '.join('?' for _ in columns)})",
+            rows,
+        )
+        _export_parquet(
+            connection,
+            "release_table",
+            "rowid",
+            path,
+            sequence_index_column=sequence_index_column,
+        )
+    finally:
+        connection.close()
+    return path
+
+
+def _row_insert_source_records(path: Path, records: Sequence[SourceRecord]) -> Path:
+    rows = [
+        _source_record_row(record)
+        for record in sorted(
+            records, key=lambda item: (item.sequence_id, item.source_record_id)
+        )
+    ]
+    return row_insert_parquet(
+        path, _SOURCE_RECORD_COLUMNS, rows, sequence_index_column="sequence_id"
+    )
+
+
+def _timed(function, *args) -> tuple[Path, float]:
+    started = time.perf_counter()
+    path = function(*args)
+    return path, time.perf_counter() - started
+
+
+def run_benchmark(rows: int, directory: Path) -> dict[str, float]:
+    """Write ``rows`` source records both ways; return wall seconds per path."""
+
+    records = synthetic_source_records(rows)
+    baseline, baseline_seconds = _timed(
+        _row_insert_source_records, directory / "row_inserts" / "source_records.parquet",
+        records,
+    )
+    columnar, columnar_seconds = _timed(
+        write_source_records_parquet, directory / "columnar" / "source_records.parquet",
+        records,
+    )
+    for expected, observed in (
+        (baseline, columnar),
+        (sequence_index_path(baseline), sequence_index_path(columnar)),
+    ):
+        if expected.read_bytes() != observed.read_bytes():
+            raise RuntimeError(f"{observed.name} differs from the row-insert baseline")
+    return {"row_inserts": baseline_seconds, "column_buffers": columnar_seconds}
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare release Parquet writes with the row-insert baseline."
+    )
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=1_000_000,
+        help="synthetic source records to write (default: 1,000,000)",
+    )
+    parser.add_argument(
+        "--work-directory",
+        type=Path,
+        help="directory for the written tables (default: a temporary directory)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    if args.rows < 1:
+        print("benchmark_release_parquet: --rows must be positive", file=sys.stderr)
+        return 2
+    if args.work_directory is not None:
+        args.work_directory.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(
+        prefix="ssuextract-parquet-benchmark.", dir=args.work_directory
+    ) as temporary:
+        seconds = run_benchmark(args.rows, Path(temporary))
+    print("path\trows\twall_seconds")
+    for path, value in seconds.items():
+        print(f"{path}\t{args.rows}\t{value:.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
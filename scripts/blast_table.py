@@ -0,0 +1,265 @@
+"""Columnar BLAST m8 tables ranked and deduplicated with NumPy group operations.
+
+A table holds the tabular BLAST rows of every query of one search. Rows of a
+query are contiguous and in rank order: bit score, percent identity, and
+alignment length descending, then subject. Only the best-ranked row of each
+subject is kept, and the equal-best rows (those with the top bit score of the
+query) are counted per query. ``BlastHit`` objects are created only for the
+rows a caller asks for.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from itertools import repeat
+from pathlib import Path
+from typing import Iterable, Iterator, TextIO
+
+import numpy as np
+
+M8_FIELD_COUNT = 12
+# Characters parsed per block; bounds the temporary per-field string lists.
+_BLOCK_CHARACTERS = 1 << 24
+_INTEGER_COLUMNS = {
+    "alignment_length": 3,
+    "mismatches": 4,
+    "gap_opens": 5,
+    "query_start": 6,
+    "query_end": 7,
+    "subject_start": 8,
+    "subject_end": 9,
+}
+_FLOAT_COLUMNS = {"percent_identity": 2, "evalue": 10, "bit_score": 11}
+
+
+@dataclass(frozen=True)
+class BlastHit:
+    subject: str
+    percent_identity: float
+    alignment_length: int
+    mismatches: int
+    gap_opens: int
+    query_start: int
+    query_end: int
+    subject_start: int
+    subject_end: int
+    evalue: float
+    bit_score: float
+
+
+class BlastTable:
+    """Ranked, subject-deduplicated BLAST rows of many queries."""
+
+    def __init__(
+        self,
+        queries: list[str],
+        subjects: list[str],
+        offsets: np.ndarray,
+        tied: np.ndarray,
+        columns: dict[str, np.ndarray],
+    ) -> None:
+        self.queries = queries
+        self.subjects = subjects
+        self._query_index = {query: index for index, query in enumerate(queries)}
+        self._subject_index = {subject: index for index, subject in enumerate(subjects)}
+        self._offsets = offsets
+        self._tied = tied
+        self._columns = columns
+
+    def __contains__(self, query: object) -> bool:
+        return query in self._query_index
+
+    def __len__(self) -> int:
+        return len(self.queries)
+
+    def _bounds(self, query: str) -> tuple[int, int, int]:
+        index = self._query_index.get(query)
+        if index is None:
+            return 0, 0, 0
+        return (
+            int(self._offsets[index]),
+            int(self._offsets[index + 1]),
+            int(self._tied[index]),
+        )
+
+    def _hits(self, start: int, stop: int) -> list[BlastHit]:
+        values = {
+            field: column[start:stop].tolist() for field, column in self._columns.items()
+        }
+        subjects = values.pop("subject")
+        return [
+            BlastHit(
+                subject=self.subjects[code],
+                **{field: column[position] for field, column in values.items()},
+            )
+            for position, code in enumerate(subjects)
+        ]
+
+    def hit_count(self, query: str) -> int:
+        start, stop, _tied = self._bounds(query)
+        return stop - start
+
+    def tied_count(self, query: str) -> int:
+        """Return the number of subjects sharing the query's best bit score."""
+
+        return self._bounds(query)[2]
+
+    def hits(self, query: str, limit: int | None = None) -> list[BlastHit]:
+        """Return the query's hits in rank order, at most ``limit`` of them."""
+
+        start, stop, _tied = self._bounds(query)
+        if limit is not None:
+            stop = min(stop, start + limit)
+        return self._hits(start, stop)
+
+    def hits_at(self, query: str, ranks: Iterable[int]) -> list[BlastHit]:
+        """Return the query's hits at the given zero-based ranks."""
+
+        start, _stop, _tied = self._bounds(query)
+        return [self._hits(start + rank, start + rank + 1)[0] for rank in ranks]
+
+    def tied_hits(self, query: str) -> list[BlastHit]:
+        """Return the equal-best hits, ordered by identity, length, then subject."""
+
+        start, _stop, tied = self._bounds(query)
+        return self._hits(start, start + tied)
+
+    def subject_mask(self, subjects: Iterable[str]) -> np.ndarray:
+        """Return a boolean mask over subject codes marking ``subjects``."""
+
+        mask = np.zeros(len(self.subjects), dtype=bool)
+        codes = [
+            self._subject_index[subject]
+            for subject in subjects
+            if subject in self._subject_index
+        ]
+        mask[codes] = True
+        return mask
+
+    def first_rank(self, query: str, subject_mask: np.ndarray) -> int | None:
+        """Return the zero-based rank of the query's best hit in ``subject_mask``."""
+
+        start, stop, _tied = self._bounds(query)
+        matches = np.flatnonzero(subject_mask[self._columns["subject"][start:stop]])
+        return int(matches[0]) if matches.size else None
+
+
+def _blocks(handle: TextIO) -> Iterator[str]:
+    """Yield the text of ``handle`` in blocks of whole lines."""
+
+    remainder = ""
+    while block := handle.read(_BLOCK_CHARACTERS):
+        block = remainder + block
+        end = block.rfind("\n") + 1
+        remainder = block[end:]
+        if end:
+            yield block[:end]
+    if remainder:
+        yield remainder + "\n"
+
+
+def _first_rows(values: list[str], index: dict[str, int], row: int) -> np.ndarray:
+    """Return, per value, the file row of its first appearance."""
+
+    return np.fromiter(
+        map(index.setdefault, values, range(row, row + len(values))),
+        dtype=np.int64,
+        count=len(values),
+    )
+
+
+def load_blast_table(m8_file: str | Path) -> BlastTable:
+    query_index: dict[str, int] = {}
+    subject_index: dict[str, int] = {}
+    parts: dict[str, list[np.ndarray]] = {
+        field: []
+        for field in ("query", "subject", *_INTEGER_COLUMNS, *_FLOAT_COLUMNS)
+    }
+    line_number = 0
+    row = 0
+    with Path(m8_file).open() as handle:
+        for block in _blocks(handle):
+            lines = block.split("\n")[:-1]
+            tabs = np.fromiter(
+                map(str.count, lines, repeat("\t")), dtype=np.int64, count=len(lines)
+            )
+            blank = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines)) == 0
+            malformed = np.flatnonzero((tabs != M8_FIELD_COUNT - 1) & ~blank)
+            if malformed.size:
+                offset = int(malformed[0])
+                raise ValueError(
+                    f"Malformed BLAST m8 row at {m8_file}:{line_number + offset + 1}: "
+                    f"expected {M8_FIELD_COUNT} fields, found {tabs[offset] + 1}"
+                )
+            line_number += len(lines)
+            if blank.any():
+                lines = [line for line in lines if line]
+            if not lines:
+                continue
+            fields = "\t".join(lines).split("\t")
+            parts["query"].append(
+                _first_rows(fields[0::M8_FIELD_COUNT], query_index, row)
+            )
+            parts["subject"].append(
+                _first_rows(fields[1::M8_FIELD_COUNT], subject_index, row)
+            )
+            row += len(lines)
+            for field, column in _INTEGER_COLUMNS.items():
+                parts[field].append(
+                    np.array(fields[column::M8_FIELD_COUNT], dtype=np.int64)
+                )
+            for field, column in _FLOAT_COLUMNS.items():
+                parts[field].append(
+                    np.array(fields[column::M8_FIELD_COUNT], dtype=np.float64)
+                )
+
+    columns = {
+        field: (
+            np.concatenate(arrays)
+            if arrays
+            else np.empty(0, dtype=np.float64 if field in _FLOAT_COLUMNS else np.int64)
+        )
+        for field, arrays in parts.items()
+    }
+    del parts
+    # Dictionaries keep first-appearance order, so dense codes follow file order.
+    queries = list(query_index)
+    subjects = list(subject_index)
+    for field in ("query", "subject"):
+        columns[field] = np.unique(columns[field], return_inverse=True)[1]
+    subject_rank = np.empty(len(subjects), dtype=np.int64)
+    subject_rank[sorted(range(len(subjects)), key=subjects.__getitem__)] = np.arange(
+        len(subjects)
+    )
+
+    query = columns["query"]
+    subject = columns["subject"]
+    order = np.lexsort(
+        (
+            subject_rank[subject],
+            -columns["alignment_length"],
+            -columns["percent_identity"],
+            -columns["bit_score"],
+            query,
+        )
+    )
+    # The first row of each (query, subject) pair in rank order is its best.
+    _pairs, first = np.unique(
+        query[order] * max(len(subjects), 1) + subject[order], return_index=True
+    )
+    keep = np.zeros(order.size, dtype=bool)
+    keep[first] = True
+    order = order[keep]
+    for field in columns:
+        columns[field] = columns[field][order]
+
+    query = columns.pop("query")
+    counts = np.bincount(query, minlength=len(queries))
+    offsets = np.zeros(len(queries) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    best_scores = columns["bit_score"][offsets[:-1]]
+    tied = np.bincount(
+        query[columns["bit_score"] == np.repeat(best_scores, counts)],
+        minlength=len(queries),
+    )
+    return BlastTable(queries, subjects, offsets, tied, columns)
@@ -20,6 +20,7 @@ from typing import Iterable, Iterator, Mapping, Sequence
 import assemble_database_profile as assembler
 import build_database_release as builder
 import classify_img_clusters as classifier
+import database_manager as manager
 import database_sources
 import img_search_provenance
 
@@ -27,6 +28,7 @@ import img_search_provenance
 REPO = Path(__file__).resolve().parents[1]
 DEFAULT_SOURCE_CONFIG = REPO / "config" / "database_sources.json"
 DEFAULT_NOTICES = REPO / "resources" / "database_notices"
+DEFAULT_MODEL_DIRECTORY = REPO / "resources" / "models"
 CURATED_SOURCE_NAMES = (
     "silva_ssu_nr99_fasta",
     "silva_ssu_taxonomy",
@@ -42,6 +44,7 @@ IMG_SOURCE_NAMES = (
 )
 SOURCE_TREE_FILES = (
     "config/database_sources.json",
+    "config/model_markers.json",
     "config/img_search_execution.json",
     "pixi.lock",
     "pixi.toml",
@@ -49,6 +52,8 @@ SOURCE_TREE_FILES = (
     "resources/database_notices/PR2_LICENSE.txt",
     "resources/database_notices/README.md",
     "resources/database_notices/SILVA_NOTICE.txt",
+    "resources/models/RF00177.cm",
+    "resources/models/RF01960.cm",
     "scripts/atomic_io.py",
     "scripts/assemble_database_profile.py",
     "scripts/build_database_profiles.py",
@@ -64,6 +69,7 @@ SOURCE_TREE_FILES = (
     "scripts/extract_img_cluster_centroids.py",
     "scripts/img_chunked_search.py",
     "scripts/img_search_provenance.py",
+    "scripts/reference_alignments.py",
     "scripts/search_img_marker.sh",
     "scripts/taxonomy_utils.py",
 )
@@ -377,14 +383,17 @@ def iter_curated_records(
             "SILVA FASTA and taxonomy versions differ: "
             f"{silva_version!r} != {taxonomy_version!r}"
         )
+    # Sequences are validated once, while build_deduplicated_model hashes them.
     yield from builder.iter_curated_silva_records(
         paths["silva_ssu_nr99_fasta"],
         paths["silva_ssu_taxonomy"],
         source_version=silva_version,
+        validate=False,
     )
     yield from builder.iter_curated_pr2_records(
         paths["pr2_ssu_fasta"],
         source_version=_source_version(catalog, "pr2_ssu_fasta"),
+        validate=False,
     )
 
 
@@ -395,11 +404,13 @@ def iter_img_records(
         paths["eukcensus_16s_fasta"],
         "16S",
         source_version=_source_version(catalog, "eukcensus_16s_fasta"),
+        validate=False,
     )
     yield from builder.iter_img_records(
         paths["eukcensus_18s_fasta"],
         "18S",
         source_version=_source_version(catalog, "eukcensus_18s_fasta"),
+        validate=False,
     )
 
 
@@ -816,8 +827,40 @@ def _provenance_details(
     return details
 
 
+def _covariance_models(args: argparse.Namespace) -> dict[str, Path]:
+    """Return the tree covariance model of each marker, unless alignments are skipped."""
+
+    if not getattr(args, "reference_alignments", False):
+        return {}
+    directory = getattr(args, "model_directory", DEFAULT_MODEL_DIRECTORY)
+    return {
+        marker: Path(directory) / f"{model}.cm"
+        for model, marker in sorted(manager.load_marker_mapping().items())
+    }
+
+
+def _release(
+    records: Iterable[builder.PreparedSourceRecord], args: argparse.Namespace
+) -> builder.DatabaseModel | assembler.StreamedRelease:
+    """Return the deduplicated release, streamed when a memory limit is set."""
+
+    if args.memory_limit_mib is None:
+        return builder.build_deduplicated_model(records, workers=args.hash_workers)
+    share = builder.streaming_memory_share(args.memory_limit_mib)
+    return assembler.StreamedRelease(
+        builder.iter_sequence_groups(
+            records,
+            memory_limit_bytes=share,
+            spill_directory=args.spill_directory,
+            workers=args.hash_workers,
+        ),
+        share,
+        args.spill_directory,
+    )
+
+
 def _assemble(
-    model: builder.DatabaseModel,
+    release: builder.DatabaseModel | assembler.StreamedRelease,
     args: argparse.Namespace,
     profile: str,
     catalog: Mapping[str, object],
@@ -829,7 +872,7 @@ def _assemble(
 ) -> assembler.AssemblyResult:
     archive = args.archive_directory / f"ssuextract-db-{profile}-v{args.version}.tar.zst"
     return assembler.assemble_database_profile(
-        model,
+        release,
         args.output_root / profile,
         profile=profile,
         version=args.version,
@@ -847,14 +890,16 @@ def _assemble(
             **_release_files(profile, args.notices),
             **(extra_release_files or {}),
         },
+        covariance_models=_covariance_models(args),
+        cmalign_cpu=getattr(args, "cmalign_cpu", 1),
     )
 
 
 def build_curated(args: argparse.Namespace) -> assembler.AssemblyResult:
     catalog = load_source_catalog(args.source_config)
     paths = _source_paths(catalog, args.source_directory, CURATED_SOURCE_NAMES)
-    model = builder.build_deduplicated_model(iter_curated_records(paths, catalog))
-    return _assemble(model, args, "curated", catalog, CURATED_SOURCE_NAMES)
+    release = _release(iter_curated_records(paths, catalog), args)
+    return _assemble(release, args, "curated", catalog, CURATED_SOURCE_NAMES)
 
 
 def build_img(args: argparse.Namespace) -> assembler.AssemblyResult:
@@ -895,16 +940,30 @@ def build_img(args: argparse.Namespace) -> assembler.AssemblyResult:
         prepared = itertools.chain(
             iter_curated_records(paths, catalog), iter_img_records(paths, catalog)
         )
-        model = builder.build_deduplicated_model(prepared)
-        derived = builder.ingest_derived_cluster_assignments(
-            read_assignment_rows(assignment_paths, evidence_maps), model.source_records
-        )
-        model = builder.add_taxonomy_assignments(model, derived)
-        taxon_oids = {
-            record.taxon_oid
-            for record in model.source_records
-            if record.reference_source == "IMG" and record.taxon_oid is not None
-        }
+        release = _release(prepared, args)
+        rows = read_assignment_rows(assignment_paths, evidence_maps)
+        if isinstance(release, assembler.StreamedRelease):
+            release = assembler.StreamedRelease(
+                builder.iter_groups_with_derived_assignments(release.groups, rows),
+                release.memory_limit_bytes,
+                release.spill_directory,
+            )
+            # Locations are written with the tables, before the streamed source
+            # records are complete, so their taxa come from a scan of the
+            # IMG FASTA headers.
+            taxon_oids = {
+                record.taxon_oid
+                for record in iter_img_records(paths, catalog)
+                if record.taxon_oid is not None
+            }
+        else:
+            derived = builder.ingest_derived_cluster_assignments(rows, release.source_records)
+            release = builder.add_taxonomy_assignments(release, derived)
+            taxon_oids = {
+                record.taxon_oid
+                for record in release.source_records
+                if record.reference_source == "IMG" and record.taxon_oid is not None
+            }
         locations, corrections = read_img_locations(
             paths["eukcensus_img_metadata"], taxon_oids
         )
@@ -921,7 +980,7 @@ def build_img(args: argparse.Namespace) -> assembler.AssemblyResult:
         qc_files["QC/taxonomy_calibration.json"] = args.calibration
         qc_files["EVIDENCE/img_taxonomy_evidence.jsonl"] = evidence_path
         return _assemble(
-            model,
+            release,
             args,
             "img",
             catalog,
@@ -951,6 +1010,35 @@ def _parser() -> argparse.ArgumentParser:
     )
     parser.add_argument("--calibration", type=Path)
     parser.add_argument("--curated-manifest", type=Path)
+    parser.add_argument(
+        "--hash-workers",
+        type=int,
+        default=1,
+        help="processes that validate and hash source sequences (default: 1)",
+    )
+    parser.add_argument(
+        "--memory-limit-mib",
+        type=int,
+        help="stream the release through sorted spill files within this memory budget",
+    )
+    parser.add_argument(
+        "--spill-directory",
+        type=Path,
+        help="directory for sort spill files (default: a temporary directory)",
+    )
+    parser.add_argument("--model-directory", type=Path, default=DEFAULT_MODEL_DIRECTORY)
+    parser.add_argument(
+        "--no-reference-alignments",
+        dest="reference_alignments",
+        action="store_false",
+        help="do not store cmalign alignments of the tree reference sequences",
+    )
+    parser.add_argument(
+        "--cmalign-cpu",
+        type=int,
+        default=1,
+        help="cmalign threads for the stored reference alignments (default: 1)",
+    )
     return parser
 
 
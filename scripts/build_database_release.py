@@ -11,8 +11,13 @@ from __future__ import annotations
 import argparse
 import csv
 import hashlib
+import heapq
+import itertools
 import json
+import pickle
+import tempfile
 from collections import defaultdict
+from operator import itemgetter
 from pathlib import Path
 from typing import Iterable, Iterator, Mapping, Sequence
 
@@ -32,6 +37,7 @@ from database_contracts import (
     Pr2Header,
     ReleaseValidationError,
     SILVA_PROKARYOTIC_RANKS,
+    SequenceGroup,
     SequenceRecord,
     SilvaHeader,
     SourceIntegrityError,
@@ -45,6 +51,7 @@ from database_sources import (
     clean_img_metadata_row,
     fetch_artifact,
     fetch_configured_source,
+    identify_source_records,
     include_pr2_header,
     include_silva_header,
     iter_curated_pr2_records,
@@ -70,10 +77,13 @@ from database_release_io import (
     write_img_location_parquet,
     write_marker_fasta,
     write_preferred_taxonomy_parquet,
+    write_reference_alignments_parquet,
     write_release_tables,
     write_sequences_parquet,
     write_source_records_parquet,
+    write_streamed_release,
     write_taxonomy_assignments_parquet,
+    write_taxonomy_nodes_parquet,
 )
 from taxonomy_utils import common_value
 from taxonomy_utils import lowest_common_ancestor as _shared_lca
@@ -229,51 +239,49 @@ def select_preferred_taxonomy(
     )
 
 
-def build_deduplicated_model(records: Iterable[PreparedSourceRecord]) -> DatabaseModel:
-    """Deduplicate by normalized exact sequence while preserving every source row."""
+def _prepared_order(record: PreparedSourceRecord) -> tuple[str, str, str, str, str]:
+    return (
+        record.reference_source,
+        record.source_version,
+        record.source_identifier,
+        record.original_header,
+        record.marker,
+    )
 
-    prepared = sorted(
-        records,
-        key=lambda record: (
-            record.reference_source,
-            record.source_version,
-            record.source_identifier,
-            record.original_header,
-            record.marker,
-        ),
+
+def _duplicate_source_error(order: tuple[str, ...]) -> ReleaseValidationError:
+    reference_source, _, source_identifier, *_ = order
+    return ReleaseValidationError(
+        f"Duplicate source record identity: {reference_source}:{source_identifier}"
     )
-    sequences_by_id: dict[str, list[PreparedSourceRecord]] = defaultdict(list)
+
+
+def _sequence_group(
+    sequence_id: str, members: Sequence[PreparedSourceRecord]
+) -> SequenceGroup:
+    """Build every release row of one exact sequence from members in prepared order."""
+
+    normalized_sequences = {
+        normalize_sequence_for_hashing(record.sequence) for record in members
+    }
+    if len(normalized_sequences) != 1:  # defensive: IDs already derive from this value
+        raise ReleaseValidationError(f"hash collision for {sequence_id}")
     source_records: list[SourceRecord] = []
     assignments: list[TaxonomyAssignment] = []
-    seen_source_ids: set[str] = set()
-
-    for record in prepared:
-        sequence_id = sequence_identifier(record.sequence)
-        sequences_by_id[sequence_id].append(record)
-        source_record_id = _stable_id(
-            "SRC_",
-            record.reference_source,
-            record.source_version,
-            record.source_identifier,
-            record.original_header,
-            record.marker,
-        )
-        if source_record_id in seen_source_ids:
-            raise ReleaseValidationError(
-                f"Duplicate source record identity: {record.reference_source}:{record.source_identifier}"
+    for record in members:
+        source_record_id = _stable_id("SRC_", *_prepared_order(record))
+        source_records.append(
+            SourceRecord(
+                source_record_id,
+                sequence_id,
+                record.reference_source,
+                record.source_version,
+                record.source_identifier,
+                record.original_header,
+                record.marker,
+                record.taxon_oid,
             )
-        seen_source_ids.add(source_record_id)
-        source_record = SourceRecord(
-            source_record_id,
-            sequence_id,
-            record.reference_source,
-            record.source_version,
-            record.source_identifier,
-            record.original_header,
-            record.marker,
-            record.taxon_oid,
         )
-        source_records.append(source_record)
         if record.taxonomy:
             taxonomy = _taxonomy_tuple(record.taxonomy)
             assignment_id = _stable_id(
@@ -298,32 +306,282 @@ def build_deduplicated_model(records: Iterable[PreparedSourceRecord]) -> Databas
                     record.evidence,
                 )
             )
+    markers = tuple(sorted({record.marker for record in members}))
+    return SequenceGroup(
+        SequenceRecord(sequence_id, normalized_sequences.pop(), markers),
+        tuple(source_records),
+        tuple(assignments),
+        select_preferred_taxonomy(sequence_id, assignments) if assignments else None,
+    )
+
 
-    sequence_records = []
+def _in_memory_sequence_groups(
+    identified: Iterable[tuple[str, PreparedSourceRecord]],
+) -> Iterator[SequenceGroup]:
+    prepared = sorted(identified, key=lambda entry: _prepared_order(entry[1]))
+    sequences_by_id: dict[str, list[PreparedSourceRecord]] = defaultdict(list)
+    seen_source_ids: set[tuple[str, str, str, str, str]] = set()
+    for sequence_id, record in prepared:
+        order = _prepared_order(record)
+        if order in seen_source_ids:
+            raise _duplicate_source_error(order)
+        seen_source_ids.add(order)
+        sequences_by_id[sequence_id].append(record)
     for sequence_id, members in sorted(sequences_by_id.items()):
-        normalized_sequences = {
-            normalize_sequence_for_hashing(record.sequence) for record in members
-        }
-        if len(normalized_sequences) != 1:  # defensive: IDs already derive from this value
-            raise ReleaseValidationError(f"hash collision for {sequence_id}")
-        markers = tuple(sorted({record.marker for record in members}))
-        sequence_records.append(
-            SequenceRecord(sequence_id, normalized_sequences.pop(), markers)
-        )
+        yield _sequence_group(sequence_id, members)
 
-    by_sequence: dict[str, list[TaxonomyAssignment]] = defaultdict(list)
-    for assignment in assignments:
-        by_sequence[assignment.sequence_id].append(assignment)
-    preferred = [
-        select_preferred_taxonomy(sequence.sequence_id, by_sequence[sequence.sequence_id])
-        for sequence in sequence_records
-        if by_sequence[sequence.sequence_id]
-    ]
+
+# Python object overhead per buffered record, beyond its string payloads.
+_SPILL_RECORD_OVERHEAD = 1024
+
+
+def _buffered_bytes(record: PreparedSourceRecord) -> int:
+    return (
+        _SPILL_RECORD_OVERHEAD
+        + len(record.sequence)
+        + len(record.original_header)
+        + sum(len(taxon) for taxon in record.taxonomy)
+    )
+
+
+def _write_run(path: Path, entries: Iterable[tuple[object, ...]]) -> Path:
+    with path.open("wb") as handle:
+        for entry in entries:
+            pickle.dump(entry, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _read_run(path: Path) -> Iterator[tuple]:
+    with path.open("rb") as handle:
+        while True:
+            try:
+                yield pickle.load(handle)
+            except EOFError:
+                return
+
+
+def _spill_entry_order(entry: tuple) -> tuple[str, tuple[str, ...]]:
+    return entry[0], entry[1]
+
+
+def iter_sequence_groups(
+    records: Iterable[PreparedSourceRecord],
+    *,
+    memory_limit_bytes: int | None = None,
+    spill_directory: str | Path | None = None,
+    workers: int = 1,
+) -> Iterator[SequenceGroup]:
+    """Yield deduplicated sequence groups in ``sequence_id`` order.
+
+    Sequences are validated and hashed once, by ``workers`` processes, and the
+    identifier travels with each record into the release rows.
+    Without a memory limit every record is sorted in memory. With a limit, records
+    are hashed as they arrive and buffered until the buffer reaches the limit;
+    each full buffer is sorted by sequence identifier and spilled to disk as a
+    run, and the runs are merged. Only one record per run and the current group
+    stay resident while groups are yielded. Duplicate source identities are
+    detected from separately spilled identity runs before the first group.
+    """
+
+    if memory_limit_bytes is not None and memory_limit_bytes < 1:
+        raise ValueError("memory_limit_bytes must be positive")
+    identified = identify_source_records(records, workers=workers)
+    if memory_limit_bytes is None:
+        yield from _in_memory_sequence_groups(identified)
+        return
+    with tempfile.TemporaryDirectory(
+        prefix="ssuextract-dedup-", dir=spill_directory
+    ) as temporary:
+        directory = Path(temporary)
+        runs: list[Path] = []
+        identity_runs: list[Path] = []
+        buffered: list[tuple[str, tuple[str, ...], PreparedSourceRecord]] = []
+        buffered_bytes = 0
+
+        def spill() -> None:
+            nonlocal buffered, buffered_bytes
+            buffered.sort(key=_spill_entry_order)
+            index = len(runs)
+            runs.append(_write_run(directory / f"records-{index:05d}.pickle", buffered))
+            identity_runs.append(
+                _write_run(
+                    directory / f"identities-{index:05d}.pickle",
+                    sorted((entry[1], entry[0]) for entry in buffered),
+                )
+            )
+            buffered = []
+            buffered_bytes = 0
+
+        for sequence_id, record in identified:
+            buffered.append((sequence_id, _prepared_order(record), record))
+            buffered_bytes += _buffered_bytes(record)
+            if buffered_bytes >= memory_limit_bytes:
+                spill()
+        if runs and buffered:
+            spill()
+
+        if runs:
+            identities = heapq.merge(*(_read_run(path) for path in identity_runs))
+            entries = heapq.merge(
+                *(_read_run(path) for path in runs), key=_spill_entry_order
+            )
+        else:
+            identities = iter(sorted((entry[1], entry[0]) for entry in buffered))
+            buffered.sort(key=_spill_entry_order)
+            entries = iter(buffered)
+        previous = None
+        for order, _ in identities:
+            if order == previous:
+                raise _duplicate_source_error(order)
+            previous = order
+
+        for sequence_id, members in itertools.groupby(entries, key=itemgetter(0)):
+            yield _sequence_group(sequence_id, [entry[2] for entry in members])
+
+
+def build_deduplicated_model(
+    records: Iterable[PreparedSourceRecord],
+    *,
+    memory_limit_bytes: int | None = None,
+    spill_directory: str | Path | None = None,
+    workers: int = 1,
+) -> DatabaseModel:
+    """Deduplicate by normalized exact sequence while preserving every source row.
+
+    ``memory_limit_bytes`` bounds the sort buffer and ``workers`` sets the
+    hashing processes as in :func:`iter_sequence_groups`; the resulting model
+    is identical for every setting.
+    """
+
+    sequences: list[SequenceRecord] = []
+    source_records: list[SourceRecord] = []
+    assignments: list[TaxonomyAssignment] = []
+    preferred: list[PreferredTaxonomy] = []
+    for group in iter_sequence_groups(
+        records,
+        memory_limit_bytes=memory_limit_bytes,
+        spill_directory=spill_directory,
+        workers=workers,
+    ):
+        sequences.append(group.sequence)
+        source_records.extend(group.source_records)
+        assignments.extend(group.taxonomy_assignments)
+        if group.preferred_taxonomy is not None:
+            preferred.append(group.preferred_taxonomy)
+    hashed = tuple(sequences)
     return DatabaseModel(
-        tuple(sequence_records),
+        hashed,
         tuple(sorted(source_records, key=lambda record: record.source_record_id)),
         tuple(sorted(assignments, key=lambda assignment: assignment.taxonomy_assignment_id)),
         tuple(sorted(preferred, key=lambda taxonomy: taxonomy.sequence_id)),
+        hashed_sequences=hashed,
+    )
+
+
+# Validated fields of one derived assignment row: taxonomy, taxonomy source,
+# compartment, method, evidence, centroid name, centroid taxonomy, and centroid
+# taxonomy source.
+_DerivedAssignment = tuple[
+    tuple[str, ...], str, str, str, str, str, tuple[str, ...], str
+]
+
+
+def _derived_assignment_fields(
+    row: Mapping[str, object], row_number: int
+) -> _DerivedAssignment:
+    taxonomy_source = str(row.get("taxonomy_source", "")).strip()
+    method = str(row.get("method", row.get("assignment_method", ""))).strip()
+    evidence = str(row.get("evidence", "")).strip()
+    centroid_name = str(row.get("centroid_name", "")).strip()
+    centroid_taxonomy_text = str(row.get("centroid_taxonomy", "")).strip()
+    centroid_taxonomy_source = str(
+        row.get("centroid_taxonomy_source", "")
+    ).strip()
+    if not taxonomy_source or method not in {
+        "updated_reference_cluster",
+        "updated_reference_derived",
+        "updated_reference_unclassified",
+    } or not evidence:
+        raise TaxonomyError(
+            "Derived IMG assignments require taxonomy_source, an updated-reference method, "
+            "and evidence"
+        )
+    taxonomy = _taxonomy_tuple(row.get("taxonomy", ""))
+    centroid_taxonomy = (
+        _taxonomy_tuple(centroid_taxonomy_text)
+        if centroid_taxonomy_text
+        else ()
+    )
+    if any(character in centroid_name for character in "\r\n\t|"):
+        raise TaxonomyError(
+            f"Derived IMG assignment has an invalid centroid name on row {row_number}"
+        )
+    if method == "updated_reference_cluster":
+        if not centroid_name or not centroid_taxonomy or not centroid_taxonomy_source:
+            raise TaxonomyError(
+                "Cluster-derived IMG assignments require centroid name, taxonomy, "
+                "and taxonomy source"
+            )
+        if centroid_taxonomy[: len(taxonomy)] != taxonomy:
+            raise TaxonomyError(
+                "Cluster-derived IMG member taxonomy must be a prefix of the "
+                "centroid taxonomy"
+            )
+    elif method == "updated_reference_unclassified" and not centroid_name:
+        raise TaxonomyError(
+            "Unclassified IMG cluster assignments require a centroid name"
+        )
+    compartment = str(row.get("compartment", "")).strip()
+    return (
+        taxonomy,
+        taxonomy_source,
+        compartment,
+        method,
+        evidence,
+        centroid_name,
+        centroid_taxonomy,
+        centroid_taxonomy_source,
+    )
+
+
+def _derived_assignment(
+    source_record: SourceRecord, fields: _DerivedAssignment
+) -> TaxonomyAssignment:
+    (
+        taxonomy,
+        taxonomy_source,
+        compartment,
+        method,
+        evidence,
+        centroid_name,
+        centroid_taxonomy,
+        centroid_taxonomy_source,
+    ) = fields
+    assignment_id = _stable_id(
+        "TAX_",
+        source_record.source_record_id,
+        ";".join(taxonomy),
+        taxonomy_source,
+        compartment,
+        method,
+        evidence,
+        centroid_name,
+        ";".join(centroid_taxonomy),
+        centroid_taxonomy_source,
+    )
+    return TaxonomyAssignment(
+        assignment_id,
+        source_record.source_record_id,
+        source_record.sequence_id,
+        taxonomy,
+        taxonomy_source,
+        taxonomy[0],
+        compartment,
+        method,
+        evidence,
+        centroid_name,
+        centroid_taxonomy,
+        centroid_taxonomy_source,
     )
 
 
@@ -339,81 +597,67 @@ def ingest_derived_cluster_assignments(
     assignments: list[TaxonomyAssignment] = []
     for row_number, row in enumerate(rows, 1):
         source_identifier = str(row.get("source_identifier", "")).strip()
-        taxonomy_source = str(row.get("taxonomy_source", "")).strip()
-        method = str(row.get("method", row.get("assignment_method", ""))).strip()
-        evidence = str(row.get("evidence", "")).strip()
-        centroid_name = str(row.get("centroid_name", "")).strip()
-        centroid_taxonomy_text = str(row.get("centroid_taxonomy", "")).strip()
-        centroid_taxonomy_source = str(
-            row.get("centroid_taxonomy_source", "")
-        ).strip()
         if source_identifier not in by_identifier:
             raise TaxonomyError(f"Unknown IMG source_identifier on assignment row {row_number}")
-        if not taxonomy_source or method not in {
-            "updated_reference_cluster",
-            "updated_reference_derived",
-            "updated_reference_unclassified",
-        } or not evidence:
-            raise TaxonomyError(
-                "Derived IMG assignments require taxonomy_source, an updated-reference method, "
-                "and evidence"
-            )
-        taxonomy = _taxonomy_tuple(row.get("taxonomy", ""))
-        centroid_taxonomy = (
-            _taxonomy_tuple(centroid_taxonomy_text)
-            if centroid_taxonomy_text
-            else ()
+        fields = _derived_assignment_fields(row, row_number)
+        assignments.extend(
+            _derived_assignment(source_record, fields)
+            for source_record in by_identifier[source_identifier]
         )
-        if any(character in centroid_name for character in "\r\n\t|"):
-            raise TaxonomyError(
-                f"Derived IMG assignment has an invalid centroid name on row {row_number}"
-            )
-        if method == "updated_reference_cluster":
-            if not centroid_name or not centroid_taxonomy or not centroid_taxonomy_source:
-                raise TaxonomyError(
-                    "Cluster-derived IMG assignments require centroid name, taxonomy, "
-                    "and taxonomy source"
-                )
-            if centroid_taxonomy[: len(taxonomy)] != taxonomy:
-                raise TaxonomyError(
-                    "Cluster-derived IMG member taxonomy must be a prefix of the "
-                    "centroid taxonomy"
-                )
-        elif method == "updated_reference_unclassified" and not centroid_name:
-            raise TaxonomyError(
-                "Unclassified IMG cluster assignments require a centroid name"
-            )
-        compartment = str(row.get("compartment", "")).strip()
-        for source_record in by_identifier[source_identifier]:
-            assignment_id = _stable_id(
-                "TAX_",
-                source_record.source_record_id,
-                ";".join(taxonomy),
-                taxonomy_source,
-                compartment,
-                method,
-                evidence,
-                centroid_name,
-                ";".join(centroid_taxonomy),
-                centroid_taxonomy_source,
+    return tuple(sorted(assignments, key=lambda assignment: assignment.taxonomy_assignment_id))
+
+
+def iter_groups_with_derived_assignments(
+    groups: Iterable[SequenceGroup], rows: Iterable[Mapping[str, object]]
+) -> Iterator[SequenceGroup]:
+    """Merge explicit IMG cluster-derived assignments into streamed sequence groups.
+
+    Each group matches the sequence's rows in :func:`add_taxonomy_assignments`
+    applied to :func:`ingest_derived_cluster_assignments`. Only the assignment
+    rows, which carry no sequences, are held in memory. An assignment row that
+    names no IMG source record is reported once every group has been read.
+    """
+
+    by_identifier: dict[str, list[tuple[int, _DerivedAssignment]]] = defaultdict(list)
+    for row_number, row in enumerate(rows, 1):
+        source_identifier = str(row.get("source_identifier", "")).strip()
+        by_identifier[source_identifier].append(
+            (row_number, _derived_assignment_fields(row, row_number))
+        )
+    matched: set[str] = set()
+    for group in groups:
+        derived = []
+        for source_record in group.source_records:
+            if source_record.reference_source.upper() != "IMG":
+                continue
+            entries = by_identifier.get(source_record.source_identifier, ())
+            if entries:
+                matched.add(source_record.source_identifier)
+            derived.extend(
+                _derived_assignment(source_record, fields) for _, fields in entries
             )
-            assignments.append(
-                TaxonomyAssignment(
-                    assignment_id,
-                    source_record.source_record_id,
-                    source_record.sequence_id,
-                    taxonomy,
-                    taxonomy_source,
-                    taxonomy[0],
-                    compartment,
-                    method,
-                    evidence,
-                    centroid_name,
-                    centroid_taxonomy,
-                    centroid_taxonomy_source,
-                )
+        assignments = tuple(
+            sorted(
+                (*group.taxonomy_assignments, *derived),
+                key=lambda assignment: assignment.taxonomy_assignment_id,
             )
-    return tuple(sorted(assignments, key=lambda assignment: assignment.taxonomy_assignment_id))
+        )
+        yield SequenceGroup(
+            group.sequence,
+            group.source_records,
+            assignments,
+            select_preferred_taxonomy(group.sequence.sequence_id, assignments)
+            if assignments
+            else None,
+        )
+    unknown = [
+        row_number
+        for source_identifier, entries in by_identifier.items()
+        if source_identifier not in matched
+        for row_number, _ in entries
+    ]
+    if unknown:
+        raise TaxonomyError(f"Unknown IMG source_identifier on assignment row {min(unknown)}")
 
 
 def add_taxonomy_assignments(
@@ -435,7 +679,13 @@ def add_taxonomy_assignments(
         for sequence in model.sequences
         if by_sequence[sequence.sequence_id]
     )
-    return DatabaseModel(model.sequences, model.source_records, assignments, preferred)
+    return DatabaseModel(
+        model.sequences,
+        model.source_records,
+        assignments,
+        preferred,
+        hashed_sequences=model.hashed_sequences,
+    )
 
 
 
@@ -458,10 +708,40 @@ def read_img_metadata_tsv(path: Path) -> tuple[ImgLocation, ...]:
         return clean_img_metadata(csv.DictReader(handle, delimiter="\t"))
 
 
+def streaming_memory_share(memory_limit_mib: int) -> int:
+    """Return the bytes of a ``--memory-limit-mib`` budget given to each stage.
+
+    The record sort buffer and the DuckDB staging database share the limit.
+    """
+
+    if memory_limit_mib < 2:
+        raise BuildError("--memory-limit-mib must be at least 2")
+    return memory_limit_mib * 1024 * 1024 // 2
+
+
 def _build_prepared(args: argparse.Namespace) -> None:
-    model = build_deduplicated_model(read_prepared_jsonl(args.records_jsonl))
     locations = read_img_metadata_tsv(args.img_metadata) if args.img_metadata else ()
     output = args.output
+    if args.memory_limit_mib is not None:
+        share = streaming_memory_share(args.memory_limit_mib)
+        groups = iter_sequence_groups(
+            read_prepared_jsonl(args.records_jsonl),
+            memory_limit_bytes=share,
+            spill_directory=args.spill_directory,
+            workers=args.hash_workers,
+        )
+        write_streamed_release(
+            output,
+            groups,
+            locations,
+            memory_limit_bytes=share,
+            spill_directory=args.spill_directory,
+            hashed=True,
+        )
+        return
+    model = build_deduplicated_model(
+        read_prepared_jsonl(args.records_jsonl), workers=args.hash_workers
+    )
     output.mkdir(parents=True, exist_ok=True)
     validate_release(model, locations)
     write_marker_fasta(output / "markers.fasta", model.sequences)
@@ -482,6 +762,22 @@ def _parser() -> argparse.ArgumentParser:
     build.add_argument("--records-jsonl", type=Path, required=True)
     build.add_argument("--img-metadata", type=Path)
     build.add_argument("--output", type=Path, required=True)
+    build.add_argument(
+        "--memory-limit-mib",
+        type=int,
+        help="stream the build through sorted spill files within this memory budget",
+    )
+    build.add_argument(
+        "--spill-directory",
+        type=Path,
+        help="directory for sort spill files (default: a temporary directory)",
+    )
+    build.add_argument(
+        "--hash-workers",
+        type=int,
+        default=1,
+        help="processes that validate and hash sequences (default: 1)",
+    )
     return parser
 
 
@@ -21,6 +21,7 @@ import duckdb
 import classify_img_clusters as classifier
 import database_manager as manager
 from atomic_io import replace_and_fsync
+from taxonomy_index import KeyedTaxonomyIndex
 
 
 RANKS = {
@@ -463,6 +464,7 @@ def _prediction(
     query: str,
     hits: Sequence[classifier.BlastHit],
     taxonomy: Mapping[str, classifier.TaxonomyRecord],
+    taxonomy_index: KeyedTaxonomyIndex | None = None,
 ) -> tuple[str, ...]:
     non_self = [hit for hit in hits if hit.subject != query]
     eligible = [
@@ -498,6 +500,8 @@ def _prediction(
     if truncated:
         domains = {record.domain for record in records}
         return (next(iter(domains)),) if len(domains) == 1 else ()
+    if taxonomy_index is not None:
+        return taxonomy_index.lowest_common_path(hit.subject for hit in candidates)
     return classifier.lowest_common_ancestor(record.taxonomy for record in records)
 
 
@@ -523,6 +527,9 @@ def evaluate_calibration(
     taxonomy = classifier.load_taxonomy(
         profile / "tables" / "preferred_taxonomy.parquet", all_subjects
     )
+    taxonomy_index = KeyedTaxonomyIndex(
+        {subject: record.taxonomy for subject, record in taxonomy.items()}
+    )
 
     totals: Counter[tuple[str, str, str, int]] = Counter()
     calls: Counter[tuple[str, str, str, int]] = Counter()
@@ -539,6 +546,7 @@ def evaluate_calibration(
             row["sequence_id"],
             hits_by_marker.get(marker, {}).get(row["sequence_id"], ()),
             taxonomy,
+            taxonomy_index,
         )
         rank_names = RANKS[source]
         for index, _rank in enumerate(rank_names[:-1] if source == "PR2" else rank_names):
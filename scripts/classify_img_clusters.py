@@ -36,6 +36,7 @@ from img_classification_data import (
     _taxonomy_record,
 )
 import img_search_provenance
+from taxonomy_index import KeyedTaxonomyIndex
 from taxonomy_utils import common_value as _shared_common_value
 from taxonomy_utils import lowest_common_ancestor as _shared_lca
 
@@ -177,6 +178,7 @@ def _classify_cluster(
     marker: str | None = None,
     calibration_strata: Mapping[str, CalibrationStratum] | None = None,
     propagation_rank_cap: int | None = None,
+    taxonomy_index: KeyedTaxonomyIndex | None = None,
 ) -> dict[str, object]:
     eligible = [hit for hit in hits if hit.query_coverage >= MIN_QUERY_COVERAGE]
     base: dict[str, object] = {
@@ -268,6 +270,8 @@ def _classify_cluster(
     if truncated:
         domains = sorted({record.domain for record in records if record.domain})
         taxonomy = (domains[0],) if len(domains) == 1 else ()
+    elif taxonomy_index is not None:
+        taxonomy = taxonomy_index.lowest_common_path(hit.subject for hit in candidates)
     else:
         taxonomy = lowest_common_ancestor(record.taxonomy for record in records)
 
@@ -385,6 +389,9 @@ def classify_clusters(
         preview = ", ".join(unmatched_queries[:5])
         raise ValueError(f"BLAST queries do not match a cluster centroid or ID: {preview}")
 
+    taxonomy_index = KeyedTaxonomyIndex(
+        {subject: record.taxonomy for subject, record in taxonomy_records.items()}
+    )
     assignments: list[dict[str, str]] = []
     outcomes: list[dict[str, object]] = []
     qc: Counter[str] = Counter()
@@ -407,6 +414,7 @@ def classify_clusters(
             marker=marker,
             calibration_strata=calibration_strata,
             propagation_rank_cap=propagation_rank_cap,
+            taxonomy_index=taxonomy_index,
         )
         outcomes.append(outcome)
         qc["clusters_total"] += 1
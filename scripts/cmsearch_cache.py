@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""Content-addressed cache of cmsearch hit tables shared between runs.
+
+A table is stored under the SHA-256 of the assembly, the covariance model, the
+Infernal version reported by ``cmsearch -h``, and the options that change
+results. Assemblies that are searched again after a database or BLAST change
+therefore reuse their tables. The cache is bounded in size; entries are
+evicted least recently used first, with file modification times recording use.
+Only the ``#`` comment lines of a reused table, which name the original input
+paths and date, can differ from a fresh search.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Sequence
+
+from atomic_io import replace_and_fsync
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".tblout"
+_CHUNK_BYTES = 1024 * 1024
+
+
+def file_sha256(path: str | Path) -> str:
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as handle:
+        for chunk in iter(lambda: handle.read(_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def infernal_version(cmsearch: str = "cmsearch") -> str:
+    """Return the ``# INFERNAL ...`` banner line of ``cmsearch -h``."""
+
+    result = subprocess.run(
+        [cmsearch, "-h"], check=True, capture_output=True, text=True
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith("# INFERNAL"):
+            return line[2:].strip()
+    raise ValueError(f"{cmsearch} -h did not report an Infernal version")
+
+
+def cache_key(
+    fasta_sha256: str, model_sha256: str, version: str, options: Sequence[str]
+) -> str:
+    document = {
+        "cache_version": CACHE_VERSION,
+        "fasta_sha256": fasta_sha256,
+        "model_sha256": model_sha256,
+        "infernal": version,
+        "options": list(options),
+    }
+    return hashlib.sha256(
+        json.dumps(document, sort_keys=True).encode()
+    ).hexdigest()
+
+
+class CmsearchCache:
+    """A directory of cached tables with least-recently-used eviction."""
+
+    def __init__(self, directory: str | Path, max_bytes: int) -> None:
+        if max_bytes < 1:
+            raise ValueError("cmsearch cache size must be positive")
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}{CACHE_SUFFIX}"
+
+    def fetch(self, key: str, destination: str | Path) -> bool:
+        """Copy a cached table to ``destination``; return whether it existed."""
+
+        path = self.path(key)
+        try:
+            shutil.copyfile(path, destination)
+        except FileNotFoundError:
+            return False
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by a concurrent task after the copy completed.
+            pass
+        return True
+
+    def store(self, key: str, table: str | Path) -> None:
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(
+            dir=path.parent, prefix=f".{key}.", suffix=".partial"
+        )
+        try:
+            with os.fdopen(descriptor, "wb") as handle, Path(table).open("rb") as source:
+                shutil.copyfileobj(source, handle)
+            replace_and_fsync(temporary, path)
+        except BaseException:
+            Path(temporary).unlink(missing_ok=True)
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for path in self.directory.glob(f"*/*{CACHE_SUFFIX}"):
+            try:
+                status = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((status.st_mtime_ns, str(path), status.st_size))
+        total = sum(size for _, _, size in entries)
+        for _, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            Path(path).unlink(missing_ok=True)
+            total -= size
+
+
+def search_options(search_space_mb: str | None) -> list[str]:
+    """Return the cmsearch options that change the hit table."""
+
+    options = ["--anytrunc"]
+    if search_space_mb:
+        options += ["-Z", search_space_mb]
+    return options
+
+
+def cached_cmsearch(
+    model_file: str | Path,
+    fasta_file: str | Path,
+    tblout: str | Path,
+    *,
+    cpus: int,
+    search_space_mb: str | None = None,
+    cache: CmsearchCache | None = None,
+    cmsearch: str = "cmsearch",
+) -> str:
+    """Run cmsearch or reuse its cached table; return ``hit``, ``miss``, or ``off``."""
+
+    options = search_options(search_space_mb)
+    command = [
+        cmsearch,
+        *options,
+        "--cpu", str(cpus),
+        "-o", os.devnull,
+        "--tblout", str(tblout),
+        str(model_file),
+        str(fasta_file),
+    ]
+    if cache is None:
+        subprocess.run(command, check=True)
+        return "off"
+    key = cache_key(
+        file_sha256(fasta_file),
+        file_sha256(model_file),
+        infernal_version(cmsearch),
+        options,
+    )
+    if cache.fetch(key, tblout):
+        return "hit"
+    subprocess.run(command, check=True)
+    cache.store(key, tblout)
+    return "miss"
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Run cmsearch through a persistent, content-addressed table cache."
+    )
+    parser.add_argument(
+        "--cache-directory", type=Path, help="cache root; omit to search without a cache"
+    )
+    parser.add_argument("--max-mb", type=int, default=4096)
+    parser.add_argument("--cpu", required=True, type=int)
+    parser.add_argument("--search-space-mb")
+    parser.add_argument("--tblout", required=True, type=Path)
+    parser.add_argument("model_file", type=Path)
+    parser.add_argument("fasta_file", type=Path)
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    status = cached_cmsearch(
+        args.model_file,
+        args.fasta_file,
+        args.tblout,
+        cpus=args.cpu,
+        search_space_mb=args.search_space_mb,
+        cache=(
+            CmsearchCache(args.cache_directory, args.max_mb * 1024 * 1024)
+            if args.cache_directory
+            else None
+        ),
+    )
+    sys.stdout.write(f"{status}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 PR2_RANKS = (
@@ -189,3 +189,18 @@ class DatabaseModel:
     source_records: tuple[SourceRecord, ...]
     taxonomy_assignments: tuple[TaxonomyAssignment, ...]
     preferred_taxonomy: tuple[PreferredTaxonomy, ...]
+    # The sequences tuple whose identifiers were computed from the sequences
+    # while the model was built; validation rehashes any other tuple.
+    hashed_sequences: tuple[SequenceRecord, ...] | None = field(
+        default=None, compare=False, repr=False
+    )
+
+
+@dataclass(frozen=True)
+class SequenceGroup:
+    """One deduplicated sequence with every release row that references it."""
+
+    sequence: SequenceRecord
+    source_records: tuple[SourceRecord, ...]
+    taxonomy_assignments: tuple[TaxonomyAssignment, ...]
+    preferred_taxonomy: PreferredTaxonomy | None
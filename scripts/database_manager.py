@@ -19,6 +19,7 @@ import time
 import urllib.request
 import uuid
 import warnings
+from dataclasses import dataclass
 from pathlib import Path, PurePosixPath
 from typing import BinaryIO, Callable, TextIO
 from urllib.parse import urlparse
@@ -35,6 +36,7 @@ from database_updates import (
     discover_latest_catalog,
     validate_zenodo_config,
 )
+from taxonomy_index import TAXONOMY_NODES_NAME
 
 
 REPO = Path(__file__).resolve().parents[1]
@@ -42,6 +44,7 @@ DEFAULT_CATALOG = REPO / "config" / "database_catalog.json"
 DEFAULT_MARKERS = REPO / "config" / "model_markers.json"
 DEFAULT_ROOT = REPO / "resources" / "database"
 MANIFEST_NAME = "manifest.json"
+VALIDATION_LEDGER_NAME = ".validation-ledger.json"
 LEGACY_PREFIX = "silva-138-1_pr2-4-12"
 SCHEMA_VERSION = 1
 
@@ -317,6 +320,12 @@ def load_marker_mapping(
     return models
 
 
+def _prefix_covers(prefix: PurePosixPath, path: PurePosixPath) -> bool:
+    return path.parent == prefix.parent and (
+        path.name == prefix.name or path.name.startswith(prefix.name + ".")
+    )
+
+
 def load_manifest(profile_directory: str | Path, expected_profile: str | None = None) -> dict:
     directory = Path(profile_directory)
     manifest = _require_object(
@@ -357,11 +366,7 @@ def load_manifest(profile_directory: str | Path, expected_profile: str | None =
         prefix = _safe_relative_path(
             database.get("prefix"), f"BLAST database {marker!r} prefix", ManifestError
         )
-        if not any(
-            path.parent == prefix.parent
-            and (path.name == prefix.name or path.name.startswith(prefix.name + "."))
-            for path in artifact_paths
-        ):
+        if not any(_prefix_covers(prefix, path) for path in artifact_paths):
             raise ManifestError(
                 f"BLAST database {marker!r} prefix {prefix} has no manifest-listed artifacts"
             )
@@ -379,6 +384,59 @@ def load_manifest(profile_directory: str | Path, expected_profile: str | None =
             f"Preferred taxonomy database is not a manifest-listed artifact: "
             f"{preferred_taxonomy}"
         )
+    if "taxonomy_nodes" in taxonomy_database:
+        taxonomy_nodes = _safe_relative_path(
+            taxonomy_database["taxonomy_nodes"], "taxonomy node table", ManifestError
+        )
+        # Runtime readers find the node table beside the preferred taxonomy.
+        if taxonomy_nodes != preferred_taxonomy.with_name(TAXONOMY_NODES_NAME):
+            raise ManifestError(
+                f"Taxonomy node table must be {TAXONOMY_NODES_NAME} beside "
+                f"the preferred taxonomy database: {taxonomy_nodes}"
+            )
+        if taxonomy_nodes not in artifact_paths:
+            raise ManifestError(
+                f"Taxonomy node table is not a manifest-listed artifact: {taxonomy_nodes}"
+            )
+    if "sequence_indexes" in manifest:
+        sequence_indexes = _require_object(
+            manifest["sequence_indexes"], "manifest sequence_indexes", ManifestError
+        )
+        for table, raw_path in sequence_indexes.items():
+            index_path = _safe_relative_path(
+                raw_path, f"sequence index for {table!r}", ManifestError
+            )
+            if index_path not in artifact_paths:
+                raise ManifestError(
+                    f"Sequence index is not a manifest-listed artifact: {index_path}"
+                )
+    if "reference_alignments" in manifest:
+        reference_alignments = _require_object(
+            manifest["reference_alignments"], "manifest reference_alignments", ManifestError
+        )
+        for marker, raw_alignment in reference_alignments.items():
+            if marker not in databases:
+                raise ManifestError(
+                    f"Reference alignments name a marker without a BLAST database: {marker!r}"
+                )
+            alignment = _require_object(
+                raw_alignment, f"reference alignments {marker!r}", ManifestError
+            )
+            _require_identifier(
+                alignment.get("model"), f"reference alignment model for {marker!r}", ManifestError
+            )
+            _require_sha256(
+                alignment.get("model_sha256"),
+                f"reference alignment model sha256 for {marker!r}",
+                ManifestError,
+            )
+            alignment_path = _safe_relative_path(
+                alignment.get("path"), f"reference alignments {marker!r} path", ManifestError
+            )
+            if alignment_path not in artifact_paths:
+                raise ManifestError(
+                    f"Reference alignments are not a manifest-listed artifact: {alignment_path}"
+                )
     return manifest
 
 
@@ -405,16 +463,99 @@ def _validate_blast_prefix(prefix: Path, blastdbcmd: str) -> None:
         raise IntegrityError(f"Invalid BLAST database prefix {prefix}: {detail}") from error
 
 
+def _stat_signature(path: Path) -> dict[str, int]:
+    status = path.stat()
+    return {
+        "bytes": status.st_size,
+        "mtime_ns": status.st_mtime_ns,
+        "inode": status.st_ino,
+    }
+
+
+def _load_validation_ledger(directory: Path, manifest_sha256: str) -> dict:
+    """Return trusted ledger entries, or none when the ledger is stale or unreadable."""
+
+    try:
+        ledger = json.loads((directory / VALIDATION_LEDGER_NAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {"artifacts": {}, "blast_databases": []}
+    if (
+        not isinstance(ledger, dict)
+        or ledger.get("schema_version") != SCHEMA_VERSION
+        or ledger.get("manifest_sha256") != manifest_sha256
+        or type(ledger.get("recorded_ns")) is not int
+        or not isinstance(ledger.get("artifacts"), dict)
+        or not isinstance(ledger.get("blast_databases"), list)
+    ):
+        return {"artifacts": {}, "blast_databases": []}
+    # Like git's racy-index rule, a file modified in the same clock tick as the
+    # ledger write may have changed without a visible stat difference.
+    artifacts = {
+        path: entry
+        for path, entry in ledger["artifacts"].items()
+        if isinstance(entry, dict)
+        and type(entry.get("mtime_ns")) is int
+        and entry["mtime_ns"] < ledger["recorded_ns"]
+    }
+    return {"artifacts": artifacts, "blast_databases": ledger["blast_databases"]}
+
+
+def _write_validation_ledger(
+    directory: Path,
+    manifest_sha256: str,
+    recorded_ns: int,
+    artifacts: dict[str, dict],
+    blast_databases: list[str],
+) -> None:
+    """Publish the ledger atomically; read-only profiles simply stay unledgered."""
+
+    ledger = {
+        "schema_version": SCHEMA_VERSION,
+        "manifest_sha256": manifest_sha256,
+        "recorded_ns": recorded_ns,
+        "artifacts": artifacts,
+        "blast_databases": sorted(blast_databases),
+    }
+    temporary = directory / f"{VALIDATION_LEDGER_NAME}.{uuid.uuid4().hex}.tmp"
+    try:
+        temporary.write_text(json.dumps(ledger, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        # POSIX rename replaces the previous ledger atomically.
+        temporary.rename(directory / VALIDATION_LEDGER_NAME)
+    except OSError:
+        temporary.unlink(missing_ok=True)
+
+
 def validate_profile_directory(
     profile_directory: str | Path,
     expected_profile: str | None = None,
     blastdbcmd: str = "blastdbcmd",
+    full: bool = True,
+    record: bool = True,
 ) -> dict:
+    """Validate manifest artifacts and BLAST prefixes, then record a stat ledger.
+
+    With ``full=False``, artifacts whose path, size, mtime_ns, and inode match
+    the ledger written for the same manifest digest are not rehashed, and BLAST
+    prefixes whose artifacts are all unchanged are not reopened. ``record=False``
+    leaves the directory untouched, as required for archive staging.
+    """
+
     directory = Path(profile_directory).resolve()
     if not directory.is_dir():
         raise IntegrityError(f"Database profile directory does not exist: {directory}")
     manifest = load_manifest(directory, expected_profile=expected_profile)
+    manifest_sha256 = _sha256(directory / MANIFEST_NAME)
+    recorded_ns = time.time_ns()
+    ledger = (
+        {"artifacts": {}, "blast_databases": []}
+        if full
+        else _load_validation_ledger(directory, manifest_sha256)
+    )
 
+    validated: dict[str, dict] = {}
+    prefixes: list[str] = []
+    rehashed: list[PurePosixPath] = []
+    reopened: list[PurePosixPath] = []
     for artifact in manifest["artifacts"]:
         relative = _safe_relative_path(artifact["path"], "artifact path", ManifestError)
         path = (directory / Path(relative)).resolve()
@@ -422,34 +563,49 @@ def validate_profile_directory(
             raise IntegrityError(f"Artifact escapes profile directory: {relative}")
         if not path.is_file() or path.is_symlink():
             raise IntegrityError(f"Manifest artifact is not a regular file: {relative}")
-        actual_size = path.stat().st_size
+        signature = _stat_signature(path)
+        actual_size = signature["bytes"]
         if actual_size == 0:
             raise IntegrityError(f"Manifest artifact is empty: {relative}")
         if actual_size != artifact["bytes"]:
             raise IntegrityError(
                 f"Artifact size mismatch for {relative}: expected {artifact['bytes']}, found {actual_size}"
             )
+        entry = {**signature, "sha256": artifact["sha256"]}
+        validated[str(relative)] = entry
+        if ledger["artifacts"].get(str(relative)) == entry:
+            continue
         actual_digest = _sha256(path)
         if actual_digest != artifact["sha256"]:
             raise IntegrityError(
                 f"Artifact SHA-256 mismatch for {relative}: expected {artifact['sha256']}, "
                 f"found {actual_digest}"
             )
+        rehashed.append(relative)
 
     for database in manifest["blast_databases"].values():
         relative = _safe_relative_path(database["prefix"], "BLAST prefix", ManifestError)
         prefix = (directory / Path(relative)).resolve()
         if not _inside(directory, prefix):
             raise IntegrityError(f"BLAST prefix escapes profile directory: {relative}")
+        prefixes.append(str(relative))
+        if str(relative) in ledger["blast_databases"] and not any(
+            _prefix_covers(relative, path) for path in rehashed
+        ):
+            continue
         _validate_blast_prefix(prefix, blastdbcmd)
+        reopened.append(relative)
+
+    if record and (rehashed or reopened):
+        _write_validation_ledger(directory, manifest_sha256, recorded_ns, validated, prefixes)
     return manifest
 
 
 def validate_profile(
-    root: str | Path, profile: str, blastdbcmd: str = "blastdbcmd"
+    root: str | Path, profile: str, blastdbcmd: str = "blastdbcmd", full: bool = True
 ) -> dict:
     _require_identifier(profile, "profile", ManifestError)
-    return validate_profile_directory(Path(root) / profile, profile, blastdbcmd)
+    return validate_profile_directory(Path(root) / profile, profile, blastdbcmd, full=full)
 
 
 def installed_version(root: str | Path, profile: str) -> str:
@@ -503,6 +659,77 @@ def detect_legacy_database(
     return prefix
 
 
+def _legacy_database(root: str | Path, blastdbcmd: str) -> Path | None:
+    legacy = detect_legacy_database(root, blastdbcmd)
+    if legacy is not None:
+        warnings.warn(
+            "Using the legacy unprofiled SSUextract database; reinstall the curated "
+            "profile because legacy support will be removed in a future release",
+            LegacyDatabaseWarning,
+            stacklevel=3,
+        )
+    return legacy
+
+
+@dataclass(frozen=True)
+class ProfileDatabases:
+    """BLAST prefixes by marker and taxonomy tables of one usable profile."""
+
+    legacy: bool
+    prefixes: dict[str, Path]
+    taxonomy_file: Path | None
+    source_records_file: Path | None
+
+
+def resolve_profile_databases(
+    root: str | Path,
+    profile: str,
+    blastdbcmd: str = "blastdbcmd",
+    full: bool = True,
+) -> ProfileDatabases:
+    """Resolve every runtime path of a profile, as the workflow does at startup."""
+
+    _require_identifier(profile, "profile", ManifestError)
+    directory = Path(root).resolve() / profile
+    if directory.exists():
+        manifest = validate_profile_directory(directory, profile, blastdbcmd, full=full)
+        prefixes = {
+            marker: directory / Path(
+                _safe_relative_path(database["prefix"], "BLAST prefix", ManifestError)
+            )
+            for marker, database in manifest["blast_databases"].items()
+        }
+        tables = {}
+        for key, label in (
+            ("preferred", "preferred taxonomy database"),
+            ("source_records", "source-record database"),
+        ):
+            relative = _safe_relative_path(
+                manifest["taxonomy_database"].get(key), label, ManifestError
+            )
+            path = (directory / Path(relative)).resolve()
+            if not _inside(directory, path) or not path.is_file() or not path.stat().st_size:
+                raise IntegrityError(f"Missing {label}: {relative}")
+            tables[key] = path
+        return ProfileDatabases(
+            legacy=False,
+            prefixes=prefixes,
+            taxonomy_file=tables["preferred"],
+            source_records_file=tables["source_records"],
+        )
+
+    if profile == "curated":
+        legacy = _legacy_database(root, blastdbcmd)
+        if legacy is not None:
+            return ProfileDatabases(
+                legacy=True,
+                prefixes={"16S": legacy, "18S": legacy},
+                taxonomy_file=None,
+                source_records_file=None,
+            )
+    raise IntegrityError(f"Database profile is not installed: {directory}")
+
+
 def resolve_database(
     root: str | Path,
     profile: str,
@@ -532,14 +759,8 @@ def resolve_database(
         return directory / Path(relative)
 
     if profile == "curated":
-        legacy = detect_legacy_database(root, blastdbcmd)
+        legacy = _legacy_database(root, blastdbcmd)
         if legacy is not None:
-            warnings.warn(
-                "Using the legacy unprofiled SSUextract database; reinstall the curated "
-                "profile because legacy support will be removed in a future release",
-                LegacyDatabaseWarning,
-                stacklevel=2,
-            )
             return legacy
     raise IntegrityError(f"Database profile is not installed: {directory}")
 
@@ -921,6 +1142,11 @@ def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     validate.add_argument("--root", type=Path, default=DEFAULT_ROOT)
     validate.add_argument("--profile", required=True)
     validate.add_argument("--blastdbcmd", default="blastdbcmd")
+    validate.add_argument(
+        "--full",
+        action="store_true",
+        help="rehash every artifact and reopen every BLAST prefix, ignoring the ledger",
+    )
 
     version = subparsers.add_parser("version", help="print an installed profile version")
     version.add_argument("--root", type=Path, default=DEFAULT_ROOT)
@@ -1014,7 +1240,7 @@ def main(argv: list[str] | None = None) -> int:
                     )
                 )
         elif args.command == "validate":
-            validate_profile(args.root, args.profile, args.blastdbcmd)
+            validate_profile(args.root, args.profile, args.blastdbcmd, full=args.full)
             print((args.root / args.profile).resolve())
         elif args.command == "version":
             print(installed_version(args.root, args.profile))
@@ -7,9 +7,12 @@ import json
 import os
 import tempfile
 from collections import defaultdict
+from contextlib import nullcontext
 from dataclasses import asdict
 from pathlib import Path
-from typing import Iterable, Sequence
+from typing import Iterable, Mapping, Sequence
+
+import numpy as np
 
 from atomic_io import replace_and_fsync
 from database_contracts import (
@@ -21,6 +24,7 @@ from database_contracts import (
     PREFERRED_COMPARTMENTS,
     PreferredTaxonomy,
     ReleaseValidationError,
+    SequenceGroup,
     SequenceRecord,
     SourceRecord,
     TaxonomyAssignment,
@@ -30,6 +34,10 @@ from database_sources import (
     sequence_identifier,
     validate_privacy_columns,
 )
+from reference_alignments import REFERENCE_ALIGNMENT_COLUMNS
+from sequence_index import ROW_GROUP_ROWS, build_sequence_index, sequence_index_path
+from taxonomy_index import TAXONOMY_NODE_COLUMNS, TAXONOMY_NODES_NAME, TaxonomyNodes
+from taxonomy_utils import taxonomy_path
 
 
 def _duplicates(values: Iterable[str]) -> set[str]:
@@ -43,19 +51,25 @@ def _duplicates(values: Iterable[str]) -> set[str]:
 
 
 def validate_release(model: DatabaseModel, img_locations: Iterable[ImgLocation] = ()) -> None:
-    """Apply release-blocking integrity, privacy, taxonomy, and sequence checks."""
+    """Apply release-blocking integrity, privacy, taxonomy, and sequence checks.
+
+    Sequence hashes are recomputed unless the model still holds the sequences
+    it was built and hashed with.
+    """
 
     errors: list[str] = []
+    hashed = model.hashed_sequences is model.sequences
     sequence_ids = {record.sequence_id for record in model.sequences}
     duplicate_sequences = _duplicates(record.sequence_id for record in model.sequences)
     if duplicate_sequences:
         errors.append(f"duplicate subject IDs: {sorted(duplicate_sequences)}")
     for record in model.sequences:
-        try:
-            if sequence_identifier(record.sequence) != record.sequence_id:
-                errors.append(f"invalid sequence hash for {record.sequence_id}")
-        except FastaFormatError as error:
-            errors.append(str(error))
+        if not hashed:
+            try:
+                if sequence_identifier(record.sequence) != record.sequence_id:
+                    errors.append(f"invalid sequence hash for {record.sequence_id}")
+            except FastaFormatError as error:
+                errors.append(str(error))
         if not record.markers:
             errors.append(f"sequence has no marker membership: {record.sequence_id}")
 
@@ -229,10 +243,20 @@ def validate_release(model: DatabaseModel, img_locations: Iterable[ImgLocation]
         raise ReleaseValidationError("Release validation failed: " + "; ".join(errors))
 
 
+def _write_fasta_record(handle, record: SequenceRecord, line_width: int) -> None:
+    handle.write(f">{record.sequence_id}\n")
+    for offset in range(0, len(record.sequence), line_width):
+        handle.write(record.sequence[offset : offset + line_width] + "\n")
+
+
 def write_marker_fasta(
     path: str | Path, sequences: Iterable[SequenceRecord], *, line_width: int = 80
 ) -> Path:
-    """Atomically write unique marker FASTA sorted by stable sequence ID."""
+    """Atomically write unique marker FASTA sorted by stable sequence ID.
+
+    Identifiers are written as carried by the records; :func:`validate_release`
+    is the check that each one is the hash of its sequence.
+    """
 
     if line_width < 1:
         raise ValueError("line_width must be positive")
@@ -249,11 +273,7 @@ def write_marker_fasta(
     try:
         with os.fdopen(descriptor, "w", encoding="ascii", newline="\n") as handle:
             for record in records:
-                if sequence_identifier(record.sequence) != record.sequence_id:
-                    raise ReleaseValidationError(f"invalid sequence/hash pair: {record.sequence_id}")
-                handle.write(f">{record.sequence_id}\n")
-                for offset in range(0, len(record.sequence), line_width):
-                    handle.write(record.sequence[offset : offset + line_width] + "\n")
+                _write_fasta_record(handle, record, line_width)
             handle.flush()
             os.fsync(handle.fileno())
         replace_and_fsync(temporary, target)
@@ -263,79 +283,309 @@ def write_marker_fasta(
     return target
 
 
-def _write_parquet(
-    path: Path,
-    create_sql: str,
-    insert_sql: str,
-    rows: Sequence[tuple[object, ...]],
-) -> Path:
+_NUMPY_COLUMN_TYPES = {"BIGINT": np.int64, "BOOLEAN": np.bool_, "DOUBLE": np.float64}
+
+
+def _column_buffers(
+    columns: Sequence[tuple[str, str]], rows: Sequence[tuple[object, ...]]
+) -> tuple[dict[str, np.ndarray], list[str]]:
+    """Build one NumPy buffer per column and the SELECT list that restores NULLs."""
+
+    buffers: dict[str, np.ndarray] = {}
+    expressions: list[str] = []
+    for position, (name, column_type) in enumerate(columns):
+        values = [row[position] for row in rows]
+        if column_type == "VARCHAR":
+            # DuckDB cannot infer the type of an all-NULL object column, so
+            # missing strings travel as a separate mask.
+            nulls = [value is None for value in values]
+            buffers[name] = np.array(
+                ["" if value is None else value for value in values], dtype=object
+            )
+            if any(nulls):
+                buffers[f"{name}__null"] = np.array(nulls, dtype=np.bool_)
+                expressions.append(f"CASE WHEN {name}__null THEN NULL ELSE {name} END")
+                continue
+        elif column_type == "DOUBLE":
+            # NumPy NaN reaches DuckDB as NULL; release validation rejects NaN values.
+            buffers[name] = np.array(
+                [np.nan if value is None else value for value in values], dtype=np.float64
+            )
+        elif column_type == "BIGINT" and any(value is None for value in values):
+            buffers[name] = np.array(
+                [0 if value is None else value for value in values], dtype=np.int64
+            )
+            buffers[f"{name}__null"] = np.array(
+                [value is None for value in values], dtype=np.bool_
+            )
+            expressions.append(f"CASE WHEN {name}__null THEN NULL ELSE {name} END")
+            continue
+        else:
+            buffers[name] = np.array(values, dtype=_NUMPY_COLUMN_TYPES[column_type])
+        expressions.append(name)
+    return buffers, expressions
+
+
+def _connect(
+    database: str | Path = ":memory:",
+    *,
+    memory_limit_bytes: int | None = None,
+    temporary_directory: Path | None = None,
+):
     try:
         import duckdb
     except ImportError as error:  # pragma: no cover - dependency is pinned by pixi
         raise BuildError("DuckDB is required to write release Parquet files") from error
+    connection = duckdb.connect(str(database))
+    # A single writer thread keeps Parquet bytes independent of the Slurm
+    # allocation used for a release rebuild.
+    connection.execute("SET threads = 1")
+    # Object buffers only carry VARCHAR columns. Sampling them for a type probes
+    # for pandas once per sampled value, which dominates loads without pandas.
+    connection.execute("SET pandas_analyze_sample = 0")
+    if memory_limit_bytes is not None:
+        connection.execute(f"SET memory_limit = '{int(memory_limit_bytes)}B'")
+    if temporary_directory is not None:
+        connection.execute("SET temp_directory = ?", [str(temporary_directory)])
+    return connection
+
+
+def _create_table(connection, table: str, columns: Sequence[tuple[str, str]]) -> None:
+    connection.execute(
+        f"CREATE TABLE {table}("
+        + ", ".join(f"{name} {column_type}" for name, column_type in columns)
+        + ")"
+    )
+
+
+def _append_rows(
+    connection,
+    table: str,
+    columns: Sequence[tuple[str, str]],
+    rows: Sequence[tuple[object, ...]],
+) -> None:
+    if not rows:
+        return
+    # Column buffers load in one statement; row-wise inserts are orders of
+    # magnitude slower for full source releases.
+    buffers, expressions = _column_buffers(columns, rows)
+    connection.register("release_columns", buffers)
+    try:
+        connection.execute(
+            f"INSERT INTO {table} SELECT {', '.join(expressions)} FROM release_columns"
+        )
+    finally:
+        connection.unregister("release_columns")
+
+
+def _export_parquet(
+    connection,
+    table: str,
+    order_by: str,
+    temporary: Path,
+    *,
+    sequence_index_column: str | None = None,
+) -> Path | None:
+    """Copy one table to ``temporary`` and stage its sequence index beside it."""
+
+    connection.execute(
+        f"COPY (SELECT * FROM {table} ORDER BY {order_by}) TO ? "
+        f"(FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE {ROW_GROUP_ROWS})",
+        [str(temporary)],
+    )
+    with temporary.open("rb") as handle:
+        os.fsync(handle.fileno())
+    if sequence_index_column is None:
+        return None
+    # Rows are written in key order, so each row group's statistics are its
+    # first and last key.
+    row_groups = connection.execute(
+        """
+        SELECT stats_min_value, stats_max_value, row_group_num_rows
+        FROM parquet_metadata(?)
+        WHERE path_in_schema = ?
+        ORDER BY row_group_id
+        """,
+        [str(temporary), sequence_index_column],
+    ).fetchall()
+    try:
+        index = build_sequence_index(
+            temporary.name,
+            temporary.stat().st_size,
+            [(str(first), str(last), int(rows)) for first, last, rows in row_groups],
+        )
+    except ValueError as error:
+        raise BuildError(str(error)) from error
+    index_temporary = sequence_index_path(temporary)
+    index_temporary.write_text(
+        json.dumps(index, sort_keys=True, separators=(",", ":")) + "\n",
+        encoding="utf-8",
+    )
+    return index_temporary
+
+
+def _write_parquet(
+    path: Path,
+    columns: Sequence[tuple[str, str]],
+    rows: Sequence[tuple[object, ...]],
+    *,
+    sequence_index_column: str | None = None,
+) -> Path:
     path.parent.mkdir(parents=True, exist_ok=True)
     with tempfile.TemporaryDirectory(prefix=f".{path.name}.", dir=path.parent) as staging:
         temporary = Path(staging) / path.name
-        connection = duckdb.connect(":memory:")
+        connection = _connect()
         try:
-            # A single writer thread keeps Parquet bytes independent of the Slurm
-            # allocation used for a release rebuild.
-            connection.execute("SET threads = 1")
-            connection.execute(create_sql)
-            if rows:
-                connection.executemany(insert_sql, rows)
-            connection.execute(
-                "COPY release_table TO ? (FORMAT PARQUET, COMPRESSION ZSTD)",
-                [str(temporary)],
+            _create_table(connection, "release_table", columns)
+            _append_rows(connection, "release_table", columns, rows)
+            # Copying in rowid order makes row-group boundaries independent of
+            # how the rows were loaded into release_table.
+            index_temporary = _export_parquet(
+                connection,
+                "release_table",
+                "rowid",
+                temporary,
+                sequence_index_column=sequence_index_column,
             )
-            with temporary.open("rb") as handle:
-                os.fsync(handle.fileno())
-            replace_and_fsync(temporary, path)
         finally:
             connection.close()
+        replace_and_fsync(temporary, path)
+        if index_temporary is not None:
+            replace_and_fsync(index_temporary, sequence_index_path(path))
     return path
 
 
+_SEQUENCE_COLUMNS = (
+    ("sequence_id", "VARCHAR"),
+    ("length", "BIGINT"),
+    ("sha256", "VARCHAR"),
+    ("markers", "VARCHAR"),
+)
+_SOURCE_RECORD_COLUMNS = (
+    ("source_record_id", "VARCHAR"),
+    ("sequence_id", "VARCHAR"),
+    ("reference_source", "VARCHAR"),
+    ("source_version", "VARCHAR"),
+    ("source_identifier", "VARCHAR"),
+    ("original_header", "VARCHAR"),
+    ("marker", "VARCHAR"),
+    ("taxon_oid", "VARCHAR"),
+)
+_TAXONOMY_ASSIGNMENT_COLUMNS = (
+    ("taxonomy_assignment_id", "VARCHAR"),
+    ("source_record_id", "VARCHAR"),
+    ("sequence_id", "VARCHAR"),
+    ("taxonomy", "VARCHAR"),
+    ("taxonomy_source", "VARCHAR"),
+    ("domain", "VARCHAR"),
+    ("compartment", "VARCHAR"),
+    ("assignment_method", "VARCHAR"),
+    ("evidence", "VARCHAR"),
+    ("centroid_name", "VARCHAR"),
+    ("centroid_taxonomy", "VARCHAR"),
+    ("centroid_taxonomy_source", "VARCHAR"),
+)
+_PREFERRED_TAXONOMY_COLUMNS = (
+    ("sequence_id", "VARCHAR"),
+    ("reference_source", "VARCHAR"),
+    ("taxonomy", "VARCHAR"),
+    ("taxonomy_source", "VARCHAR"),
+    ("domain", "VARCHAR"),
+    ("compartment", "VARCHAR"),
+    ("assignment_method", "VARCHAR"),
+    ("cross_domain_conflict", "BOOLEAN"),
+    ("taxonomy_alternatives", "VARCHAR"),
+    ("centroid_names", "VARCHAR"),
+    ("centroid_taxonomy", "VARCHAR"),
+    ("centroid_taxonomy_source", "VARCHAR"),
+    ("taxon_id", "BIGINT"),
+)
+
+
+def _sequence_row(record: SequenceRecord) -> tuple[object, ...]:
+    return (
+        record.sequence_id,
+        len(record.sequence),
+        hashlib.sha256(record.sequence.encode("ascii")).hexdigest(),
+        ";".join(record.markers),
+    )
+
+
+def _source_record_row(record: SourceRecord) -> tuple[object, ...]:
+    return (
+        record.source_record_id,
+        record.sequence_id,
+        record.reference_source,
+        record.source_version,
+        record.source_identifier,
+        record.original_header,
+        record.marker,
+        record.taxon_oid,
+    )
+
+
+def _taxonomy_assignment_row(record: TaxonomyAssignment) -> tuple[object, ...]:
+    return (
+        record.taxonomy_assignment_id,
+        record.source_record_id,
+        record.sequence_id,
+        ";".join(record.taxonomy),
+        record.taxonomy_source,
+        record.domain,
+        record.compartment,
+        record.assignment_method,
+        record.evidence,
+        record.centroid_name,
+        ";".join(record.centroid_taxonomy),
+        record.centroid_taxonomy_source,
+    )
+
+
+def _taxon_id(record: PreferredTaxonomy, nodes: TaxonomyNodes) -> int | None:
+    # Runtime LCAs parse the stored string, so nodes follow the parsed path.
+    try:
+        return nodes.add(taxonomy_path(";".join(record.taxonomy)))
+    except ValueError:
+        return None
+
+
+def _preferred_taxonomy_row(
+    record: PreferredTaxonomy, nodes: TaxonomyNodes
+) -> tuple[object, ...]:
+    return (
+        record.sequence_id,
+        record.reference_source,
+        ";".join(record.taxonomy),
+        record.taxonomy_source,
+        record.domain,
+        record.compartment,
+        record.assignment_method,
+        record.cross_domain_conflict,
+        record.taxonomy_alternatives,
+        record.centroid_names,
+        ";".join(record.centroid_taxonomy),
+        record.centroid_taxonomy_source,
+        _taxon_id(record, nodes),
+    )
+
+
 def write_sequences_parquet(path: str | Path, records: Iterable[SequenceRecord]) -> Path:
     rows = [
-        (
-            record.sequence_id,
-            len(record.sequence),
-            hashlib.sha256(record.sequence.encode("ascii")).hexdigest(),
-            ";".join(record.markers),
-        )
+        _sequence_row(record)
         for record in sorted(records, key=lambda item: item.sequence_id)
     ]
-    return _write_parquet(
-        Path(path),
-        "CREATE TABLE release_table(sequence_id VARCHAR, length BIGINT, sha256 VARCHAR, markers VARCHAR)",
-        "INSERT INTO release_table VALUES (?, ?, ?, ?)",
-        rows,
-    )
+    return _write_parquet(Path(path), _SEQUENCE_COLUMNS, rows)
 
 
 def write_source_records_parquet(path: str | Path, records: Iterable[SourceRecord]) -> Path:
     rows = [
-        (
-            record.source_record_id,
-            record.sequence_id,
-            record.reference_source,
-            record.source_version,
-            record.source_identifier,
-            record.original_header,
-            record.marker,
-            record.taxon_oid,
+        _source_record_row(record)
+        for record in sorted(
+            records, key=lambda item: (item.sequence_id, item.source_record_id)
         )
-        for record in sorted(records, key=lambda item: item.source_record_id)
     ]
     return _write_parquet(
-        Path(path),
-        """CREATE TABLE release_table(
-            source_record_id VARCHAR, sequence_id VARCHAR, reference_source VARCHAR,
-            source_version VARCHAR, source_identifier VARCHAR, original_header VARCHAR,
-            marker VARCHAR, taxon_oid VARCHAR)""",
-        "INSERT INTO release_table VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-        rows,
+        Path(path), _SOURCE_RECORD_COLUMNS, rows, sequence_index_column="sequence_id"
     )
 
 
@@ -343,64 +593,39 @@ def write_taxonomy_assignments_parquet(
     path: str | Path, records: Iterable[TaxonomyAssignment]
 ) -> Path:
     rows = [
-        (
-            record.taxonomy_assignment_id,
-            record.source_record_id,
-            record.sequence_id,
-            ";".join(record.taxonomy),
-            record.taxonomy_source,
-            record.domain,
-            record.compartment,
-            record.assignment_method,
-            record.evidence,
-            record.centroid_name,
-            ";".join(record.centroid_taxonomy),
-            record.centroid_taxonomy_source,
-        )
+        _taxonomy_assignment_row(record)
         for record in sorted(records, key=lambda item: item.taxonomy_assignment_id)
     ]
-    return _write_parquet(
-        Path(path),
-        """CREATE TABLE release_table(
-            taxonomy_assignment_id VARCHAR, source_record_id VARCHAR, sequence_id VARCHAR,
-            taxonomy VARCHAR, taxonomy_source VARCHAR, domain VARCHAR, compartment VARCHAR,
-            assignment_method VARCHAR, evidence VARCHAR, centroid_name VARCHAR,
-            centroid_taxonomy VARCHAR, centroid_taxonomy_source VARCHAR)""",
-        "INSERT INTO release_table VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        rows,
-    )
+    return _write_parquet(Path(path), _TAXONOMY_ASSIGNMENT_COLUMNS, rows)
 
 
 def write_preferred_taxonomy_parquet(
-    path: str | Path, records: Iterable[PreferredTaxonomy]
+    path: str | Path,
+    records: Iterable[PreferredTaxonomy],
+    nodes: TaxonomyNodes | None = None,
 ) -> Path:
+    """Write preferred taxonomy rows, adding their paths to ``nodes``."""
+
+    nodes = TaxonomyNodes() if nodes is None else nodes
     rows = [
-        (
-            record.sequence_id,
-            record.reference_source,
-            ";".join(record.taxonomy),
-            record.taxonomy_source,
-            record.domain,
-            record.compartment,
-            record.assignment_method,
-            record.cross_domain_conflict,
-            record.taxonomy_alternatives,
-            record.centroid_names,
-            ";".join(record.centroid_taxonomy),
-            record.centroid_taxonomy_source,
-        )
+        _preferred_taxonomy_row(record, nodes)
         for record in sorted(records, key=lambda item: item.sequence_id)
     ]
     return _write_parquet(
-        Path(path),
-        """CREATE TABLE release_table(
-            sequence_id VARCHAR, reference_source VARCHAR, taxonomy VARCHAR,
-            taxonomy_source VARCHAR, domain VARCHAR, compartment VARCHAR,
-            assignment_method VARCHAR, cross_domain_conflict BOOLEAN,
-            taxonomy_alternatives VARCHAR, centroid_names VARCHAR,
-            centroid_taxonomy VARCHAR, centroid_taxonomy_source VARCHAR)""",
-        "INSERT INTO release_table VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        rows,
+        Path(path), _PREFERRED_TAXONOMY_COLUMNS, rows, sequence_index_column="sequence_id"
+    )
+
+
+def write_taxonomy_nodes_parquet(path: str | Path, nodes: TaxonomyNodes) -> Path:
+    return _write_parquet(Path(path), TAXONOMY_NODE_COLUMNS, nodes.rows())
+
+
+def write_reference_alignments_parquet(
+    path: str | Path, alignments: Mapping[str, str]
+) -> Path:
+    rows = [(sequence_id, alignments[sequence_id]) for sequence_id in sorted(alignments)]
+    return _write_parquet(
+        Path(path), REFERENCE_ALIGNMENT_COLUMNS, rows, sequence_index_column="sequence_id"
     )
 
 
@@ -412,8 +637,11 @@ def write_img_location_parquet(path: str | Path, records: Iterable[ImgLocation])
     ]
     return _write_parquet(
         Path(path),
-        "CREATE TABLE release_table(taxon_oid VARCHAR, latitude DOUBLE, longitude DOUBLE)",
-        "INSERT INTO release_table VALUES (?, ?, ?)",
+        (
+            ("taxon_oid", "VARCHAR"),
+            ("latitude", "DOUBLE"),
+            ("longitude", "DOUBLE"),
+        ),
         rows,
     )
 
@@ -429,7 +657,187 @@ def write_release_tables(
     write_taxonomy_assignments_parquet(
         output / "taxonomy_assignments.parquet", model.taxonomy_assignments
     )
+    nodes = TaxonomyNodes()
     write_preferred_taxonomy_parquet(
-        output / "preferred_taxonomy.parquet", model.preferred_taxonomy
+        output / "preferred_taxonomy.parquet", model.preferred_taxonomy, nodes
     )
+    write_taxonomy_nodes_parquet(output / TAXONOMY_NODES_NAME, nodes)
     write_img_location_parquet(output / "img_location.parquet", locations)
+
+
+# Release tables written from sequence groups: staging table, columns, row
+# builder, Parquet sort key, and the column indexed by sequence identifier.
+_STREAMED_TABLES = (
+    ("sequences", _SEQUENCE_COLUMNS, _sequence_row, "sequence_id", None),
+    (
+        "source_records",
+        _SOURCE_RECORD_COLUMNS,
+        _source_record_row,
+        "sequence_id, source_record_id",
+        "sequence_id",
+    ),
+    (
+        "taxonomy_assignments",
+        _TAXONOMY_ASSIGNMENT_COLUMNS,
+        _taxonomy_assignment_row,
+        "taxonomy_assignment_id",
+        None,
+    ),
+    (
+        "preferred_taxonomy",
+        _PREFERRED_TAXONOMY_COLUMNS,
+        _preferred_taxonomy_row,
+        "sequence_id",
+        "sequence_id",
+    ),
+)
+
+
+def write_streamed_release(
+    output_directory: str | Path,
+    groups: Iterable[SequenceGroup],
+    img_locations: Iterable[ImgLocation] = (),
+    *,
+    memory_limit_bytes: int,
+    spill_directory: str | Path | None = None,
+    line_width: int = 80,
+    hashed: bool = False,
+    marker_fasta: bool = True,
+) -> int:
+    """Write marker FASTA and release tables from groups in ``sequence_id`` order.
+
+    The output matches :func:`write_marker_fasta` plus :func:`write_release_tables`
+    for the same release, byte for byte; ``marker_fasta=False`` writes only the
+    tables. Rows are appended in row-group batches
+    to an on-disk DuckDB staging database capped at ``memory_limit_bytes``, which
+    spills the final sorts to ``spill_directory``. Each group is validated on its
+    own; strictly increasing sequence identifiers and unique row identifiers
+    extend those checks to the whole release. With ``hashed``, the groups come
+    from :func:`iter_sequence_groups`, which computed every identifier from its
+    sequence, so the sequences are not hashed again. Nothing is published until
+    every file is written. Returns the number of sequences.
+    """
+
+    if line_width < 1:
+        raise ValueError("line_width must be positive")
+    output = Path(output_directory)
+    output.mkdir(parents=True, exist_ok=True)
+    locations = tuple(img_locations)
+    validate_release(DatabaseModel((), (), (), ()), locations)
+    sequence_count = 0
+    nodes = TaxonomyNodes()
+    with tempfile.TemporaryDirectory(prefix=".release.", dir=output) as staging_name:
+        staging = Path(staging_name)
+        spill = Path(spill_directory) if spill_directory is not None else staging / "spill"
+        connection = _connect(
+            staging / "release.duckdb",
+            memory_limit_bytes=memory_limit_bytes,
+            temporary_directory=spill,
+        )
+        try:
+            for table, columns, _, _, _ in _STREAMED_TABLES:
+                _create_table(connection, table, columns)
+            pending: dict[str, list[tuple[object, ...]]] = {
+                table: [] for table, *_ in _STREAMED_TABLES
+            }
+
+            def flush() -> None:
+                for table, columns, _, _, _ in _STREAMED_TABLES:
+                    _append_rows(connection, table, columns, pending[table])
+                    pending[table] = []
+
+            fasta = staging / "markers.fasta"
+            previous_id = None
+            with (
+                fasta.open("w", encoding="ascii", newline="\n")
+                if marker_fasta
+                else nullcontext()
+            ) as handle:
+                for group in groups:
+                    sequence_id = group.sequence.sequence_id
+                    if previous_id is not None and sequence_id <= previous_id:
+                        raise ReleaseValidationError(
+                            f"sequence groups are not in sequence_id order: {sequence_id}"
+                        )
+                    previous_id = sequence_id
+                    preferred = (
+                        ()
+                        if group.preferred_taxonomy is None
+                        else (group.preferred_taxonomy,)
+                    )
+                    sequences = (group.sequence,)
+                    validate_release(
+                        DatabaseModel(
+                            sequences,
+                            group.source_records,
+                            group.taxonomy_assignments,
+                            preferred,
+                            hashed_sequences=sequences if hashed else None,
+                        )
+                    )
+                    if handle is not None:
+                        _write_fasta_record(handle, group.sequence, line_width)
+                    pending["sequences"].append(_sequence_row(group.sequence))
+                    pending["source_records"].extend(
+                        _source_record_row(record)
+                        for record in sorted(
+                            group.source_records, key=lambda item: item.source_record_id
+                        )
+                    )
+                    pending["taxonomy_assignments"].extend(
+                        _taxonomy_assignment_row(record)
+                        for record in group.taxonomy_assignments
+                    )
+                    pending["preferred_taxonomy"].extend(
+                        _preferred_taxonomy_row(record, nodes) for record in preferred
+                    )
+                    sequence_count += 1
+                    if len(pending["source_records"]) >= ROW_GROUP_ROWS:
+                        flush()
+                flush()
+                if handle is not None:
+                    handle.flush()
+                    os.fsync(handle.fileno())
+
+            for table, column in (
+                ("source_records", "source_record_id"),
+                ("taxonomy_assignments", "taxonomy_assignment_id"),
+            ):
+                duplicates = [
+                    row[0]
+                    for row in connection.execute(
+                        f"SELECT {column} FROM {table} GROUP BY {column} "
+                        f"HAVING count(*) > 1 ORDER BY {column} LIMIT 5"
+                    ).fetchall()
+                ]
+                if duplicates:
+                    raise ReleaseValidationError(
+                        f"Release validation failed: duplicate {column}s: {duplicates}"
+                    )
+
+            staged: list[tuple[Path, Path]] = []
+            for table, _, _, order_by, sequence_index_column in _STREAMED_TABLES:
+                temporary = staging / f"{table}.parquet"
+                index_temporary = _export_parquet(
+                    connection,
+                    table,
+                    order_by,
+                    temporary,
+                    sequence_index_column=sequence_index_column,
+                )
+                staged.append((temporary, output / temporary.name))
+                if index_temporary is not None:
+                    staged.append(
+                        (index_temporary, sequence_index_path(output / temporary.name))
+                    )
+        finally:
+            connection.close()
+        write_taxonomy_nodes_parquet(staging / TAXONOMY_NODES_NAME, nodes)
+        staged.append((staging / TAXONOMY_NODES_NAME, output / TAXONOMY_NODES_NAME))
+        write_img_location_parquet(staging / "img_location.parquet", locations)
+        staged.append((staging / "img_location.parquet", output / "img_location.parquet"))
+        if marker_fasta:
+            staged.append((fasta, output / "markers.fasta"))
+        for temporary, target in staged:
+            replace_and_fsync(temporary, target)
+    return sequence_count
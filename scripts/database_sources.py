@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 import base64
+import collections
 import gzip
 import hashlib
 import json
@@ -11,6 +12,7 @@ import os
 import re
 import tempfile
 import urllib.request
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
 from typing import Callable, Iterable, Iterator, Mapping, Sequence, TextIO
 
@@ -190,23 +192,29 @@ def validate_nucleotide_sequence(sequence: str, label: str = "sequence") -> str:
     return normalized
 
 
-def sequence_identifier(sequence: str) -> str:
-    normalized = validate_nucleotide_sequence(sequence)
+def sequence_identifier(sequence: str, label: str = "sequence") -> str:
+    normalized = validate_nucleotide_sequence(sequence, label)
     digest = hashlib.sha256(normalized.encode("ascii")).digest()
     # NCBI BLAST local identifiers are limited to 50 characters. Unpadded
     # base64url preserves all 256 digest bits in 43 safe characters.
     return "SSU_" + base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
 
 
-def iter_fasta(path: str | Path) -> Iterator[FastaRecord]:
-    """Stream plain or gzip FASTA while validating every nucleotide record."""
+def iter_fasta(path: str | Path, *, validate: bool = True) -> Iterator[FastaRecord]:
+    """Stream plain or gzip FASTA while validating every nucleotide record.
+
+    ``validate=False`` leaves sequence validation to a later stage such as
+    :func:`identify_source_records`; header structure is always checked.
+    """
 
     source = Path(path)
     with _open_fasta(source) as handle:
-        yield from iter_fasta_lines(handle, label=str(source))
+        yield from iter_fasta_lines(handle, label=str(source), validate=validate)
 
 
-def iter_fasta_lines(lines: Iterable[str], label: str = "FASTA") -> Iterator[FastaRecord]:
+def iter_fasta_lines(
+    lines: Iterable[str], label: str = "FASTA", *, validate: bool = True
+) -> Iterator[FastaRecord]:
     header: str | None = None
     chunks: list[str] = []
     record_number = 0
@@ -215,7 +223,8 @@ def iter_fasta_lines(lines: Iterable[str], label: str = "FASTA") -> Iterator[Fas
         if line.startswith(">"):
             if header is not None:
                 sequence = "".join(chunks)
-                validate_nucleotide_sequence(sequence, f"record {record_number} in {label}")
+                if validate:
+                    validate_nucleotide_sequence(sequence, f"record {record_number} in {label}")
                 yield FastaRecord(header, sequence)
             header = line[1:]
             record_number += 1
@@ -231,10 +240,68 @@ def iter_fasta_lines(lines: Iterable[str], label: str = "FASTA") -> Iterator[Fas
     if header is None:
         raise FastaFormatError(f"No FASTA records in {label}")
     sequence = "".join(chunks)
-    validate_nucleotide_sequence(sequence, f"record {record_number} in {label}")
+    if validate:
+        validate_nucleotide_sequence(sequence, f"record {record_number} in {label}")
     yield FastaRecord(header, sequence)
 
 
+def _identify_batch(batch: Sequence[tuple[str, str]]) -> list[str]:
+    return [sequence_identifier(sequence, label) for label, sequence in batch]
+
+
+def identify_source_records(
+    records: Iterable[PreparedSourceRecord],
+    *,
+    workers: int = 1,
+    batch_records: int = 1024,
+) -> Iterator[tuple[str, PreparedSourceRecord]]:
+    """Validate and hash prepared records, yielding ``(sequence_id, record)`` in input order.
+
+    With several workers, batches of sequences are validated and hashed in a
+    process pool while the caller keeps reading its sources. At most two
+    batches per worker are in flight, so memory stays bounded, and results are
+    consumed in submission order, so the output never depends on scheduling.
+    """
+
+    if workers < 1:
+        raise ValueError("workers must be positive")
+    if batch_records < 1:
+        raise ValueError("batch_records must be positive")
+
+    def batches() -> Iterator[list[PreparedSourceRecord]]:
+        batch: list[PreparedSourceRecord] = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_records:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def labelled(batch: list[PreparedSourceRecord]) -> list[tuple[str, str]]:
+        return [
+            (f"{record.reference_source} record {record.source_identifier}", record.sequence)
+            for record in batch
+        ]
+
+    if workers == 1:
+        for batch in batches():
+            yield from zip(_identify_batch(labelled(batch)), batch)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: collections.deque[
+            tuple[Future[list[str]], list[PreparedSourceRecord]]
+        ] = collections.deque()
+        for batch in batches():
+            pending.append((pool.submit(_identify_batch, labelled(batch)), batch))
+            if len(pending) >= 2 * workers:
+                future, completed = pending.popleft()
+                yield from zip(future.result(), completed)
+        while pending:
+            future, completed = pending.popleft()
+            yield from zip(future.result(), completed)
+
+
 def _parse_accession_coordinates(identifier: str) -> tuple[str, int | None, int | None]:
     parts = identifier.rsplit(".", 2)
     if len(parts) == 3 and parts[1].isdigit() and parts[2].isdigit():
@@ -396,11 +463,12 @@ def iter_curated_silva_records(
     rank_table_path: str | Path,
     *,
     source_version: str,
+    validate: bool = True,
 ) -> Iterator[PreparedSourceRecord]:
     """Yield rank-normalized bacterial and archaeal SILVA SSU records."""
 
     rank_by_path = load_silva_rank_table(rank_table_path)
-    for record in iter_fasta(fasta_path):
+    for record in iter_fasta(fasta_path, validate=validate):
         header = parse_silva_header(record.header)
         if not include_silva_header(header):
             continue
@@ -418,12 +486,12 @@ def iter_curated_silva_records(
 
 
 def iter_curated_pr2_records(
-    fasta_path: str | Path, *, source_version: str
+    fasta_path: str | Path, *, source_version: str, validate: bool = True
 ) -> Iterator[PreparedSourceRecord]:
     """Yield PR2 eukaryotic and organellar SSU records with fixed-rank taxonomy."""
 
     marker_by_gene = {"16S_rRNA": "16S", "18S_rRNA": "18S"}
-    for record in iter_fasta(fasta_path):
+    for record in iter_fasta(fasta_path, validate=validate):
         header = parse_pr2_header(record.header)
         if not include_pr2_header(header):
             continue
@@ -458,13 +526,13 @@ def parse_img_identifier(header: str) -> ImgIdentifier:
 
 
 def iter_img_records(
-    fasta_path: str | Path, marker: str, *, source_version: str
+    fasta_path: str | Path, marker: str, *, source_version: str, validate: bool = True
 ) -> Iterator[PreparedSourceRecord]:
     """Yield only IMG records, excluding every embedded legacy reference record."""
 
     if marker not in {"16S", "18S"}:
         raise TaxonomyError(f"Unsupported IMG marker: {marker}")
-    for record in iter_fasta(fasta_path):
+    for record in iter_fasta(fasta_path, validate=validate):
         if not record.header.startswith("IMG_"):
             continue
         parsed = parse_img_identifier(record.header)
@@ -4,7 +4,7 @@ import argparse
 from pathlib import Path
 
 from hit_processing import (
-    extract_regions,
+    extract_model_regions,
     read_covariance_model,
     read_accepted_hits,
     resolve_extraction_regions,
@@ -13,42 +13,92 @@ from hit_processing import (
 )
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
-        description="Resolve cmsearch hits and extract 1-based inclusive FASTA intervals."
+        description=(
+            "Resolve cmsearch hits and extract 1-based inclusive FASTA intervals. "
+            "Repeat --model-file with --output-directory to extract every model "
+            "of a sample from one read of its assembly."
+        )
     )
-    parser.add_argument("--model-file", required=True)
+    parser.add_argument("--model-file", required=True, action="append")
     parser.add_argument("--fasta", required=True)
     parser.add_argument("--sample", required=True)
-    parser.add_argument("--model", required=True)
+    parser.add_argument("--model")
     parser.add_argument("--accepted-hits", required=True)
     parser.add_argument("--minimum-length", type=int, required=True)
-    parser.add_argument("--fasta-output", required=True)
-    parser.add_argument("--hits-output", required=True)
-    parser.add_argument("--metadata-output", required=True)
-    return parser.parse_args()
-
-
-def main() -> None:
-    args = parse_args()
-    if Path(args.model_file).stem != args.model:
-        raise ValueError(
-            f"Model label {args.model!r} does not match covariance-model file "
-            f"{Path(args.model_file).name!r}"
+    parser.add_argument("--fasta-output")
+    parser.add_argument("--hits-output")
+    parser.add_argument("--metadata-output")
+    parser.add_argument(
+        "--output-directory",
+        type=Path,
+        help="write <sample>_<model>.fna, .hits.tsv, and .meta.tsv for every model",
+    )
+    args = parser.parse_args(argv)
+    single_model_outputs = (
+        args.model,
+        args.fasta_output,
+        args.hits_output,
+        args.metadata_output,
+    )
+    if args.output_directory is not None:
+        if any(value is not None for value in single_model_outputs):
+            parser.error(
+                "--output-directory cannot be combined with --model or per-model outputs"
+            )
+    elif len(args.model_file) != 1 or any(value is None for value in single_model_outputs):
+        parser.error(
+            "one --model-file requires --model, --fasta-output, --hits-output, and "
+            "--metadata-output; use --output-directory for several models"
         )
-    model = read_covariance_model(args.model_file)
-    hits = select_model_hits(read_accepted_hits(args.accepted_hits), model)
-    regions = resolve_extraction_regions(hits, model.length)
-    records = extract_regions(args.fasta, regions, args.minimum_length)
-    write_extraction_outputs(
-        records=records,
-        sample=args.sample,
-        model=args.model,
-        fasta_output=args.fasta_output,
-        hits_output=args.hits_output,
-        metadata_output=args.metadata_output,
+    return args
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    if args.output_directory is None:
+        model_files = {args.model: args.model_file[0]}
+    else:
+        model_files = {Path(model_file).stem: model_file for model_file in args.model_file}
+        if len(model_files) != len(args.model_file):
+            raise ValueError("Covariance-model files must have distinct names")
+    for label, model_file in model_files.items():
+        if Path(model_file).stem != label:
+            raise ValueError(
+                f"Model label {label!r} does not match covariance-model file "
+                f"{Path(model_file).name!r}"
+            )
+
+    accepted_hits = read_accepted_hits(args.accepted_hits)
+    regions_by_model = {}
+    for label, model_file in model_files.items():
+        model = read_covariance_model(model_file)
+        hits = select_model_hits(accepted_hits, model)
+        regions_by_model[label] = resolve_extraction_regions(hits, model.length)
+    records_by_model = extract_model_regions(
+        args.fasta, regions_by_model, args.minimum_length
     )
 
+    if args.output_directory is not None:
+        args.output_directory.mkdir(parents=True, exist_ok=True)
+    for label, records in records_by_model.items():
+        if args.output_directory is None:
+            outputs = (args.fasta_output, args.hits_output, args.metadata_output)
+        else:
+            prefix = args.output_directory / f"{args.sample}_{label}"
+            outputs = tuple(
+                f"{prefix}{suffix}" for suffix in (".fna", ".hits.tsv", ".meta.tsv")
+            )
+        write_extraction_outputs(
+            records=records,
+            sample=args.sample,
+            model=label,
+            fasta_output=outputs[0],
+            hits_output=outputs[1],
+            metadata_output=outputs[2],
+        )
+
 
 if __name__ == "__main__":
     main()
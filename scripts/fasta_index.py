@@ -0,0 +1,164 @@
+"""Offset index and memory-mapped interval reads for plain FASTA assemblies.
+
+The index holds the five ``.fai`` columns (name, length, byte offset of the
+first base, bases per line, bytes per line) in memory only; nothing is written
+beside the FASTA, which may sit in a read-only or user-owned assembly
+directory. Building it scans the file once without copying sequences. Unlike
+``samtools faidx`` the index keeps every record, including repeated
+identifiers, so callers can still reject duplicates. Records whose layout
+cannot be addressed by line arithmetic, such as uneven wrapping or embedded
+whitespace, raise :class:`FastaIndexError` and callers fall back to parsing.
+"""
+
+from __future__ import annotations
+
+import mmap
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+
+class FastaIndexError(ValueError):
+    """The FASTA layout cannot be served from a line-offset index."""
+
+
+@dataclass(frozen=True)
+class FastaIndexEntry:
+    name: str
+    length: int
+    offset: int
+    line_bases: int
+    line_width: int
+
+    def byte_offset(self, position: int) -> int:
+        """Return the file offset of the 0-based base ``position``."""
+
+        if self.line_bases == 0:
+            return self.offset
+        line, column = divmod(position, self.line_bases)
+        return self.offset + line * self.line_width + column
+
+
+_CR, _LF = 13, 10
+_INNER_WHITESPACE = (b" ", b"\t", b"\x0b", b"\x0c")
+
+
+def _record_entry(
+    name: str, data: mmap.mmap, codes: np.ndarray, offset: int, end: int, label: str
+) -> FastaIndexEntry:
+    """Describe the record whose sequence lines occupy ``data[offset:end]``.
+
+    The checks run on zero-copy views of the mapping, so no sequence is copied.
+    """
+
+    while end > offset and codes[end - 1] in (_CR, _LF):
+        end -= 1
+    if end == offset:
+        return FastaIndexEntry(name, 0, offset, 0, 0)
+    block = codes[offset:end]
+    newline = data.find(b"\n", offset, end)
+    line_width = (newline - offset if newline >= 0 else end - offset) + 1
+    terminator = 2 if line_width > 1 and block[line_width - 2] == _CR else 1
+    line_bases = line_width - terminator
+    breaks = int(np.count_nonzero(block == _LF))
+    # Every line but the last ends exactly at a multiple of the line width, and
+    # the last is no longer than the others.
+    if (
+        not np.all(block[line_width - 1 :: line_width] == _LF)
+        or len(block[line_width - 1 :: line_width]) != breaks
+        or int(np.count_nonzero(block == _CR)) != breaks * (terminator - 1)
+        or (terminator == 2 and not np.all(block[line_width - 2 :: line_width][:breaks] == _CR))
+        or len(block) - breaks * line_width > line_bases
+    ):
+        raise FastaIndexError(f"{label}: record {name!r} has uneven line wrapping")
+    if (
+        line_bases == 0
+        or bool(np.any(block >= 128))
+        or any(data.find(character, offset, end) >= 0 for character in _INNER_WHITESPACE)
+    ):
+        raise FastaIndexError(f"{label}: record {name!r} has irregular sequence lines")
+    return FastaIndexEntry(
+        name, len(block) - breaks * terminator, offset, line_bases, line_width
+    )
+
+
+def build_fasta_index(fasta_file: str | Path) -> list[FastaIndexEntry]:
+    """Scan a FASTA file and describe every record in file order."""
+
+    path = Path(fasta_file)
+    if not path.stat().st_size:
+        return []
+    entries: list[FastaIndexEntry] = []
+    with path.open("rb") as handle:
+        # The mapping is released with its last NumPy view rather than closed
+        # here, since a raised error's traceback may still hold a view.
+        data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    codes = np.frombuffer(data, dtype=np.uint8)
+    if data[:1] != b">":
+        raise FastaIndexError(f"{path}: does not start with a FASTA header")
+    header = 0
+    while header < len(data):
+        header_end = data.find(b"\n", header)
+        offset = len(data) if header_end < 0 else header_end + 1
+        try:
+            title = data[header + 1 : offset].decode("utf-8").strip()
+        except UnicodeDecodeError as error:
+            raise FastaIndexError(f"{path}: header is not UTF-8") from error
+        name = title.split(None, 1)[0] if title else ""
+        end = data.find(b"\n>", offset - 1) + 1 or len(data)
+        entries.append(_record_entry(name, data, codes, offset, end, str(path)))
+        header = end
+    return entries
+
+
+class IndexedFasta:
+    """Read 1-based inclusive intervals from a memory-mapped, indexed FASTA."""
+
+    def __init__(self, fasta_file: str | Path) -> None:
+        self.path = Path(fasta_file)
+        self.entries: dict[str, FastaIndexEntry] = {}
+        self.duplicates: set[str] = set()
+        for entry in build_fasta_index(self.path):
+            if entry.name in self.entries:
+                self.duplicates.add(entry.name)
+            self.entries[entry.name] = entry
+        self._handle = self.path.open("rb")
+        try:
+            self._map = (
+                mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+                if self.path.stat().st_size
+                else None
+            )
+        except BaseException:
+            self._handle.close()
+            raise
+
+    def __enter__(self) -> "IndexedFasta":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        self._handle.close()
+
+    def fetch(self, name: str, start: int, end: int) -> str:
+        """Return bases ``start``..``end`` (1-based, inclusive) of record ``name``."""
+
+        entry = self.entries[name]
+        if start < 1 or end > entry.length or start > end:
+            raise ValueError(
+                f"Invalid 1-based inclusive interval for {name}: "
+                f"{start}-{end} (sequence length {entry.length})"
+            )
+        first = entry.byte_offset(start - 1)
+        last = entry.byte_offset(end - 1)
+        return (
+            self._map[first : last + 1]
+            .replace(b"\n", b"")
+            .replace(b"\r", b"")
+            .decode("ascii")
+        )
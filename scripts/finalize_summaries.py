@@ -298,7 +298,7 @@ def merge_m8_files(pattern: str, output_file: str | Path) -> None:
                     output_handle.write(line)
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Create deterministic SSUextract detailed and category summaries."
     )
@@ -316,11 +316,11 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--merged-m8-output", required=True)
     parser.add_argument("--top-hits-output", required=True)
     parser.add_argument("--tree-neighbor-output", required=True)
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-def main() -> None:
-    args = parse_args()
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
     metadata = load_metadata(args.metadata_glob)
     rows = load_summary_rows(args.summary_glob)
     top_hit_rows = load_top_hit_rows(args.top_hits_glob)
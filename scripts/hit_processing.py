@@ -2,16 +2,20 @@
 
 from __future__ import annotations
 
+import bisect
 import csv
 import math
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Iterable, Sequence
+from typing import Iterable, Mapping, Sequence
 
 from Bio import SeqIO
 from Bio.Seq import Seq
 
+from assembly_shards import SequenceWindow
+from fasta_index import FastaIndexError, IndexedFasta
+
 
 HIT_FIELDS = [
     "name",
@@ -253,7 +257,29 @@ def _build_cm_hit(
     )
 
 
-def parse_cmsearch_tblout(tblout: str | Path) -> list[CmHit]:
+def _window_hit(hit: CmHit, window: SequenceWindow, location: str) -> CmHit:
+    if hit.sequence_end > window.length:
+        raise ValueError(
+            f"cmsearch hit at {location} ends past window {window.name} "
+            f"(length {window.length})"
+        )
+    return replace(
+        hit,
+        subject=window.contig,
+        sequence_from=hit.sequence_from + window.offset,
+        sequence_to=hit.sequence_to + window.offset,
+    )
+
+
+def parse_cmsearch_tblout(
+    tblout: str | Path, windows: Mapping[str, SequenceWindow] | None = None
+) -> list[CmHit]:
+    """Parse a cmsearch table, mapping hits on assembly windows back to contigs.
+
+    With a window map, duplicate hits found in the overlap of neighbouring
+    windows are merged with ``merge_window_hits``.
+    """
+
     hits: list[CmHit] = []
     with Path(tblout).open() as handle:
         for line_number, raw_line in enumerate(handle, start=1):
@@ -268,24 +294,56 @@ def parse_cmsearch_tblout(tblout: str | Path) -> list[CmHit]:
                     f"expected at least 17 fields, found {len(fields)}"
                 )
 
-            hits.append(
-                _build_cm_hit(
-                    subject=fields[0],
-                    model=fields[2],
-                    model_accession=None if fields[3] == "-" else fields[3],
-                    model_from=fields[5],
-                    model_to=fields[6],
-                    sequence_from=fields[7],
-                    sequence_to=fields[8],
-                    strand=fields[9],
-                    bit_score=fields[14],
-                    e_value=fields[15],
-                    included=fields[16] == "!",
-                    location=f"{tblout}:{line_number}",
-                    label="cmsearch hit",
-                )
+            hit = _build_cm_hit(
+                subject=fields[0],
+                model=fields[2],
+                model_accession=None if fields[3] == "-" else fields[3],
+                model_from=fields[5],
+                model_to=fields[6],
+                sequence_from=fields[7],
+                sequence_to=fields[8],
+                strand=fields[9],
+                bit_score=fields[14],
+                e_value=fields[15],
+                included=fields[16] == "!",
+                location=f"{tblout}:{line_number}",
+                label="cmsearch hit",
             )
-    return hits
+            if windows and hit.subject in windows:
+                hit = _window_hit(hit, windows[hit.subject], f"{tblout}:{line_number}")
+            hits.append(hit)
+    return merge_window_hits(hits) if windows else hits
+
+
+def merge_window_hits(hits: Iterable[CmHit]) -> list[CmHit]:
+    """Keep the best of overlapping same-model hits on one contig and strand.
+
+    Neighbouring windows overlap, so a hit inside the overlap is reported once
+    per window, possibly truncated at a window edge in one of them. Like
+    cmsearch's own overlap removal, hits are taken best first and dropped when
+    they overlap an already kept hit of the same model. Input order is kept.
+    """
+
+    hits = list(hits)
+    kept: dict[str, _AcceptedHitIndex] = defaultdict(_AcceptedHitIndex)
+    retained: set[int] = set()
+    for position in sorted(
+        range(len(hits)),
+        key=lambda position: (
+            not hits[position].included,
+            hits[position].e_value,
+            -hits[position].bit_score,
+            hits[position].sequence_start - hits[position].sequence_end,
+            *_hit_output_order(hits[position]),
+        ),
+    ):
+        hit = hits[position]
+        index = kept[hit.model_accession]
+        if index.overlapping(hit):
+            continue
+        index.add(hit)
+        retained.add(position)
+    return [hit for position, hit in enumerate(hits) if position in retained]
 
 
 def _same_competing_clan(left: CmHit, right: CmHit) -> bool:
@@ -296,13 +354,47 @@ def _same_competing_clan(left: CmHit, right: CmHit) -> bool:
     )
 
 
-def _sequence_intervals_overlap(left: CmHit, right: CmHit) -> bool:
-    return (
-        left.subject == right.subject
-        and left.strand == right.strand
-        and left.sequence_start <= right.sequence_end
-        and right.sequence_start <= left.sequence_end
-    )
+class _AcceptedHitIndex:
+    """Accepted hits per (subject, strand), sorted by sequence start.
+
+    The longest indexed interval bounds how far left of a query an overlapping
+    interval can start, so each lookup visits one contiguous window.
+    ``probes`` counts the accepted hits those windows have visited.
+    """
+
+    def __init__(self) -> None:
+        self._starts: dict[tuple[str, str], list[int]] = defaultdict(list)
+        self._hits: dict[tuple[str, str], list[CmHit]] = defaultdict(list)
+        self._longest: dict[tuple[str, str], int] = defaultdict(int)
+        self.accepted: list[CmHit] = []
+        self.probes = 0
+
+    def add(self, hit: CmHit) -> None:
+        key = (hit.subject, hit.strand)
+        starts = self._starts[key]
+        position = bisect.bisect_right(starts, hit.sequence_start)
+        starts.insert(position, hit.sequence_start)
+        self._hits[key].insert(position, hit)
+        self._longest[key] = max(
+            self._longest[key], hit.sequence_end - hit.sequence_start + 1
+        )
+        self.accepted.append(hit)
+
+    def overlapping(self, hit: CmHit) -> list[CmHit]:
+        key = (hit.subject, hit.strand)
+        starts = self._starts.get(key)
+        if not starts:
+            return []
+        first = bisect.bisect_left(
+            starts, hit.sequence_start - self._longest[key] + 1
+        )
+        last = bisect.bisect_right(starts, hit.sequence_end)
+        self.probes += last - first
+        return [
+            winner
+            for winner in self._hits[key][first:last]
+            if winner.sequence_end >= hit.sequence_start
+        ]
 
 
 def _hit_output_order(hit: CmHit) -> tuple[object, ...]:
@@ -324,16 +416,16 @@ def resolve_competing_model_hits(hits: Iterable[CmHit]) -> list[CmHit]:
     if len(set(included)) != len(included):
         raise ValueError("Duplicate included cmsearch hit")
 
-    accepted: list[CmHit] = []
+    accepted = _AcceptedHitIndex()
     for candidate in sorted(
         included,
         key=lambda hit: (hit.e_value, -hit.bit_score, *_hit_output_order(hit)),
     ):
+        overlapping = accepted.overlapping(candidate)
         unresolved_overlaps = [
             winner
-            for winner in accepted
+            for winner in overlapping
             if candidate.model_accession != winner.model_accession
-            and _sequence_intervals_overlap(candidate, winner)
             and not _same_competing_clan(candidate, winner)
         ]
         if unresolved_overlaps:
@@ -349,13 +441,10 @@ def resolve_competing_model_hits(hits: Iterable[CmHit]) -> list[CmHit]:
                 + ", ".join(models)
             )
         competitors = [
-            winner
-            for winner in accepted
-            if _same_competing_clan(candidate, winner)
-            and _sequence_intervals_overlap(candidate, winner)
+            winner for winner in overlapping if _same_competing_clan(candidate, winner)
         ]
         if not competitors:
-            accepted.append(candidate)
+            accepted.add(candidate)
             continue
         if any(
             candidate.e_value == winner.e_value
@@ -371,7 +460,7 @@ def resolve_competing_model_hits(hits: Iterable[CmHit]) -> list[CmHit]:
                 f"on strand {candidate.strand}: {', '.join(models)}"
             )
 
-    return sorted(accepted, key=_hit_output_order)
+    return sorted(accepted.accepted, key=_hit_output_order)
 
 
 def write_accepted_hits(hits: Iterable[CmHit], output: str | Path) -> None:
@@ -552,16 +641,7 @@ def resolve_extraction_regions(
     )
 
 
-def extract_regions(
-    fasta_file: str | Path,
-    regions: Iterable[ExtractionRegion],
-    minimum_length: int,
-) -> list[ExtractedRecord]:
-    if minimum_length < 0:
-        raise ValueError("minimum_length must be non-negative")
-
-    region_list = list(regions)
-    target_ids = {region.subject for region in region_list}
+def _parsed_sequences(fasta_file: str | Path, target_ids: set[str]) -> dict[str, str]:
     sequences: dict[str, str] = {}
     with Path(fasta_file).open() as fasta_handle:
         for record in SeqIO.parse(fasta_handle, "fasta"):
@@ -570,14 +650,63 @@ def extract_regions(
             if record.id in sequences:
                 raise ValueError(f"Duplicate FASTA identifier: {record.id}")
             sequences[record.id] = str(record.seq)
+    return sequences
 
-    missing = sorted(target_ids - sequences.keys())
-    if missing:
-        raise ValueError(
-            "cmsearch subjects missing from FASTA: " + ", ".join(missing)
-        )
 
+def _missing_subjects_error(missing: Iterable[str]) -> ValueError:
+    return ValueError("cmsearch subjects missing from FASTA: " + ", ".join(sorted(missing)))
+
+
+def _extracted_records(
+    regions: Sequence[ExtractionRegion], sequences: Sequence[str], minimum_length: int
+) -> list[ExtractedRecord]:
     extracted: list[ExtractedRecord] = []
+    for region, sequence in zip(regions, sequences):
+        if region.strand == "-":
+            sequence = str(Seq(sequence).reverse_complement())
+        if len(sequence) >= minimum_length:
+            extracted.append(ExtractedRecord(region=region, sequence=sequence))
+    return extracted
+
+
+def _indexed_region_sequences(
+    fasta_file: str | Path, region_list: Sequence[ExtractionRegion], target_ids: set[str]
+) -> list[str]:
+    with IndexedFasta(fasta_file) as fasta:
+        duplicates = sorted(target_ids & fasta.duplicates)
+        if duplicates:
+            raise ValueError(f"Duplicate FASTA identifier: {duplicates[0]}")
+        missing = target_ids - fasta.entries.keys()
+        if missing:
+            raise _missing_subjects_error(missing)
+        return [
+            fasta.fetch(region.subject, region.start, region.end) for region in region_list
+        ]
+
+
+def _region_sequences(
+    fasta_file: str | Path, region_list: Sequence[ExtractionRegion], indexed: bool
+) -> list[str]:
+    """Return the plus-strand bases of every region from one read of the FASTA.
+
+    The default path reads only the requested bytes through a ``.fai``-style
+    index; FASTA files the index cannot address, or ``indexed=False``, are
+    parsed in full instead. Both paths return the same sequences and errors.
+    """
+
+    target_ids = {region.subject for region in region_list}
+    if indexed:
+        try:
+            return _indexed_region_sequences(fasta_file, region_list, target_ids)
+        except FastaIndexError:
+            pass
+    sequences = _parsed_sequences(fasta_file, target_ids)
+
+    missing = target_ids - sequences.keys()
+    if missing:
+        raise _missing_subjects_error(missing)
+
+    region_sequences: list[str] = []
     for region in region_list:
         source = sequences[region.subject]
         if region.start < 1 or region.end > len(source) or region.start > region.end:
@@ -585,12 +714,53 @@ def extract_regions(
                 f"Invalid 1-based inclusive interval for {region.subject}: "
                 f"{region.start}-{region.end} (sequence length {len(source)})"
             )
+        region_sequences.append(source[region.start - 1 : region.end])
+    return region_sequences
 
-        sequence = source[region.start - 1 : region.end]
-        if region.strand == "-":
-            sequence = str(Seq(sequence).reverse_complement())
-        if len(sequence) >= minimum_length:
-            extracted.append(ExtractedRecord(region=region, sequence=sequence))
+
+def extract_regions(
+    fasta_file: str | Path,
+    regions: Iterable[ExtractionRegion],
+    minimum_length: int,
+    *,
+    indexed: bool = True,
+) -> list[ExtractedRecord]:
+    """Extract 1-based inclusive intervals, reverse-complementing minus-strand hits."""
+
+    if minimum_length < 0:
+        raise ValueError("minimum_length must be non-negative")
+
+    region_list = list(regions)
+    return _extracted_records(
+        region_list, _region_sequences(fasta_file, region_list, indexed), minimum_length
+    )
+
+
+def extract_model_regions(
+    fasta_file: str | Path,
+    regions_by_model: Mapping[str, Iterable[ExtractionRegion]],
+    minimum_length: int,
+    *,
+    indexed: bool = True,
+) -> dict[str, list[ExtractedRecord]]:
+    """Extract the regions of several models with one read of the FASTA.
+
+    Each model's records equal :func:`extract_regions` for that model alone.
+    """
+
+    if minimum_length < 0:
+        raise ValueError("minimum_length must be non-negative")
+
+    region_lists = {model: list(regions) for model, regions in regions_by_model.items()}
+    all_regions = [region for regions in region_lists.values() for region in regions]
+    sequences = _region_sequences(fasta_file, all_regions, indexed)
+    extracted: dict[str, list[ExtractedRecord]] = {}
+    start = 0
+    for model, regions in region_lists.items():
+        extracted[model] = _extracted_records(
+            regions, sequences[start : start + len(regions)], minimum_length
+        )
+        start += len(regions)
     return extracted
 
 
@@ -13,6 +13,7 @@ from decimal import Decimal, InvalidOperation
 from pathlib import Path
 from typing import Iterable, Mapping
 
+from sequence_index import parquet_relation
 from taxonomy_utils import taxonomy_path
 
 
@@ -260,15 +261,16 @@ def load_taxonomy_parquet(
         connection.executemany(
             "INSERT INTO wanted VALUES (?)", [(subject,) for subject in sorted(subjects)]
         )
+        relation, relation_parameters = parquet_relation(path, subjects)
         rows = connection.execute(
-            """
+            f"""
             SELECT p.sequence_id, p.taxonomy, p.taxonomy_source, p.domain, p.compartment
                  , p.cross_domain_conflict, p.taxonomy_alternatives
-            FROM read_parquet(?) AS p
+            FROM {relation} AS p
             INNER JOIN wanted AS w USING (sequence_id)
             ORDER BY p.sequence_id
             """,
-            [str(Path(path))],
+            relation_parameters,
         ).fetchall()
     finally:
         connection.close()
@@ -0,0 +1,708 @@
+#!/usr/bin/env python3
+"""Run the BLAST-mode workflow without Nextflow.
+
+``pipeline_cli.sh run --engine local`` forwards its workflow parameters here.
+Each sample runs the commands and script entry points of ``main.nf`` with the
+same arguments and file names, in a worker process of a local pool, so the
+published files match a Nextflow run with the same parameters. Nextflow
+execution reports are not written, and tree classification still requires the
+Nextflow engine.
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import annotate_hits
+import extract_hits
+import finalize_summaries
+import resolve_model_hits
+import sequence_dedup
+from adaptive_blast import adaptive_search, blastn_command, full_target_count
+from annotation_cache import AnnotationCache, cached_blast_annotation, release_digest
+from cmsearch_cache import CmsearchCache, cached_cmsearch
+from database_manager import (
+    DatabaseError,
+    ProfileDatabases,
+    load_marker_mapping,
+    resolve_profile_databases,
+)
+
+
+REPO = Path(__file__).resolve().parents[1]
+QUERY_SUFFIXES = (".fna", ".fa", ".fasta")
+_IDENTIFIER = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]*")
+
+# Published file patterns by output subdirectory, as in the publishDir rules.
+PUBLISHED_OUTPUTS = (
+    ("out", "*.out"),
+    ("extracted", "*.fna"),
+    ("stats", "*.hits.tsv"),
+    ("stats", "*.members.tsv"),
+    ("m8", "*.m8"),
+    ("m8", "*.top_hits.tsv"),
+    ("m8", "*.blast_passes.tsv"),
+    (".", "cmsearch_summary.*"),
+    (".", "blast_top_hits.tsv"),
+    (".", "tree_nearest_neighbors.tsv"),
+)
+
+
+@dataclass(frozen=True)
+class ModelTask:
+    model_id: str
+    model_file: Path
+    db_prefix: Path
+
+
+@dataclass(frozen=True)
+class RunSettings:
+    min_extract_length: int
+    threads_per_job: int
+    max_blast_targets: int
+    top_hits: int
+    taxonomy_file: Path | None
+    source_records_file: Path | None
+    lookup_socket: str | None
+    cmsearch_cache: Path | None = None
+    cmsearch_cache_max_mb: int = 4096
+    annotation_cache: Path | None = None
+    annotation_cache_max_mb: int = 1024
+    annotation_release: str = ""
+    blast_first_pass_targets: int = 0
+
+
+def validate_identifier(identifier: str, kind: str) -> str:
+    if not _IDENTIFIER.fullmatch(identifier):
+        raise ValueError(
+            f"Invalid {kind} identifier '{identifier}'. "
+            "Use letters, numbers, '.', '_', or '-'."
+        )
+    return identifier
+
+
+def _project_path(value: str | Path) -> Path:
+    path = Path(value)
+    return path if path.is_absolute() else REPO / path
+
+
+def query_samples(query: str | Path, deduplicate: bool = False) -> dict[str, Path]:
+    """Map sample identifiers to query FASTA files, as the workflow names them.
+
+    With ``deduplicate``, the pseudo-sample name of deduplicated records is
+    reserved, because its files would overwrite those of a sample of that name.
+    """
+
+    path = Path(query)
+    if path.is_dir():
+        files = sorted(
+            candidate
+            for candidate in path.iterdir()
+            if candidate.suffix in QUERY_SUFFIXES and candidate.is_file()
+        )
+        if not files:
+            raise ValueError(f"No .fna, .fa, or .fasta files in --query directory: {path}")
+    elif path.is_file():
+        if path.suffix not in QUERY_SUFFIXES:
+            raise ValueError(f"--query file must end in .fna, .fa, or .fasta: {path}")
+        files = [path]
+    else:
+        raise ValueError(f"--query must be a FASTA file or directory: {path}")
+    samples: dict[str, Path] = {}
+    for fasta in files:
+        sample_id = validate_identifier(fasta.stem, "sample")
+        if sample_id in samples:
+            raise ValueError(f"Query files share the sample identifier {sample_id!r}")
+        if deduplicate and sample_id == sequence_dedup.DEDUPLICATED_SAMPLE:
+            raise ValueError(
+                f"Sample identifier {sample_id!r} is reserved with --deduplicate_sequences"
+            )
+        samples[sample_id] = fasta.resolve()
+    return samples
+
+
+def default_output_directory(query: str | Path) -> Path:
+    path = Path(query)
+    name = path.stem if path.is_file() and path.suffix in QUERY_SUFFIXES else path.name
+    return Path("results") / name
+
+
+def _run(command: list[str]) -> None:
+    subprocess.run(command, check=True)
+
+
+def search_and_extract(
+    sample_id: str,
+    fasta: Path,
+    models: list[ModelTask],
+    settings: RunSettings,
+    work_directory: Path,
+) -> list[str]:
+    """Search, resolve, and extract one sample; return each search's cache status."""
+
+    prefix = work_directory / sample_id
+    cache = (
+        CmsearchCache(settings.cmsearch_cache, settings.cmsearch_cache_max_mb * 1024 * 1024)
+        if settings.cmsearch_cache is not None
+        else None
+    )
+    cmsearch_files = []
+    cache_statuses = []
+    for model in models:
+        tblout = f"{prefix}_{model.model_id}.out"
+        cache_statuses.append(
+            cached_cmsearch(
+                model.model_file,
+                fasta,
+                tblout,
+                cpus=settings.threads_per_job,
+                cache=cache,
+            )
+        )
+        cmsearch_files.append(tblout)
+
+    accepted_hits = f"{prefix}.accepted-hits.tsv"
+    resolve_model_hits.main(
+        [
+            *(argument for tblout in cmsearch_files for argument in ("--cmsearch", tblout)),
+            "--output", accepted_hits,
+        ]
+    )
+    extract_hits.main(
+        [
+            *(
+                argument
+                for model in models
+                for argument in ("--model-file", str(model.model_file))
+            ),
+            "--fasta", str(fasta),
+            "--sample", sample_id,
+            "--accepted-hits", accepted_hits,
+            "--minimum-length", str(settings.min_extract_length),
+            "--output-directory", str(work_directory),
+        ]
+    )
+    return cache_statuses
+
+
+def _blast(query: str | Path, model: ModelTask, settings: RunSettings, m8: str | Path) -> None:
+    _run(
+        blastn_command(
+            query,
+            model.db_prefix,
+            m8,
+            full_target_count(settings.max_blast_targets, settings.top_hits),
+            settings.threads_per_job,
+        )
+    )
+
+
+def _annotate(outputs: str, settings: RunSettings) -> None:
+    reference_arguments = []
+    if settings.taxonomy_file is not None:
+        reference_arguments += ["--taxonomy-db", str(settings.taxonomy_file)]
+    if settings.source_records_file is not None:
+        reference_arguments += ["--source-records-db", str(settings.source_records_file)]
+        if settings.lookup_socket:
+            reference_arguments += ["--lookup-socket", settings.lookup_socket]
+    annotate_hits.main(
+        [
+            "--hits", f"{outputs}.hits.tsv",
+            "--m8", f"{outputs}.m8",
+            *reference_arguments,
+            "--query-fasta", f"{outputs}.fna",
+            "--top-hits", str(settings.top_hits),
+            "--top-hits-output", f"{outputs}.top_hits.tsv",
+            "--max-targets", str(settings.max_blast_targets),
+            "--output", f"{outputs}.summary.tsv",
+        ]
+    )
+
+
+def _blast_and_annotate(outputs: str, model: ModelTask, settings: RunSettings) -> None:
+    if settings.annotation_cache is None:
+        if settings.blast_first_pass_targets:
+            adaptive_search(
+                f"{outputs}.fna",
+                model.db_prefix,
+                m8_output=f"{outputs}.m8",
+                passes_output=f"{outputs}.blast_passes.tsv",
+                threads=settings.threads_per_job,
+                max_targets=settings.max_blast_targets,
+                top_hits=settings.top_hits,
+                first_pass_targets=settings.blast_first_pass_targets,
+                source_records_file=settings.source_records_file,
+                lookup_socket=(
+                    settings.lookup_socket
+                    if settings.source_records_file is not None
+                    else None
+                ),
+            )
+        else:
+            _blast(f"{outputs}.fna", model, settings, f"{outputs}.m8")
+        _annotate(outputs, settings)
+        return
+    with AnnotationCache(
+        settings.annotation_cache,
+        settings.annotation_release,
+        settings.annotation_cache_max_mb * 1024 * 1024,
+    ) as cache:
+        cached_blast_annotation(
+            f"{outputs}.hits.tsv",
+            f"{outputs}.fna",
+            model.db_prefix,
+            m8_output=f"{outputs}.m8",
+            summary_output=f"{outputs}.summary.tsv",
+            top_hits_output=f"{outputs}.top_hits.tsv",
+            threads=settings.threads_per_job,
+            max_targets=settings.max_blast_targets,
+            top_hits=settings.top_hits,
+            cache=cache,
+            taxonomy_file=settings.taxonomy_file,
+            source_records_file=settings.source_records_file,
+            lookup_socket=(
+                settings.lookup_socket if settings.source_records_file is not None else None
+            ),
+        )
+
+
+def run_sample(
+    sample_id: str,
+    fasta: Path,
+    models: list[ModelTask],
+    settings: RunSettings,
+    work_directory: Path,
+) -> list[str]:
+    """Search, resolve, extract, and annotate one sample in ``work_directory``.
+
+    Returns the cmsearch cache status of each model search.
+    """
+
+    cache_statuses = search_and_extract(sample_id, fasta, models, settings, work_directory)
+    for model in models:
+        _blast_and_annotate(f"{work_directory / sample_id}_{model.model_id}", model, settings)
+    return cache_statuses
+
+
+def _run_single_sample(
+    samples: dict[str, Path],
+    models: list[ModelTask],
+    settings: RunSettings,
+    work_directory: Path,
+) -> list[str]:
+    ((sample_id, fasta),) = samples.items()
+    return run_sample(sample_id, fasta, models, settings, work_directory)
+
+
+def _search_single_sample(
+    samples: dict[str, Path],
+    models: list[ModelTask],
+    settings: RunSettings,
+    work_directory: Path,
+) -> list[str]:
+    ((sample_id, fasta),) = samples.items()
+    return search_and_extract(sample_id, fasta, models, settings, work_directory)
+
+
+def annotate_unique(
+    sample_ids: list[str],
+    models: list[ModelTask],
+    settings: RunSettings,
+    work_directory: Path,
+) -> None:
+    """BLAST-annotate each distinct extracted sequence of a model once.
+
+    The results are copied to the per-sample files that ``run_sample`` would
+    write, and the member table of each model is kept for publication.
+    """
+
+    for model in models:
+        hits_tables = [
+            Path(f"{work_directory / sample_id}_{model.model_id}.hits.tsv")
+            for sample_id in sample_ids
+        ]
+        with tempfile.TemporaryDirectory(prefix=".unique.", dir=work_directory) as temporary:
+            unique = f"{Path(temporary) / sequence_dedup.DEDUPLICATED_SAMPLE}_{model.model_id}"
+            sequence_dedup.collapse(hits_tables, model.model_id, unique)
+            _blast_and_annotate(unique, model, settings)
+            sequence_dedup.expand_annotations(
+                f"{unique}.m8",
+                f"{unique}.summary.tsv",
+                f"{unique}.top_hits.tsv",
+                hits_tables,
+                work_directory,
+            )
+            shutil.copyfile(
+                f"{unique}.members.tsv", work_directory / Path(f"{unique}.members.tsv").name
+            )
+            if settings.blast_first_pass_targets:
+                shutil.copyfile(
+                    f"{unique}.blast_passes.tsv",
+                    work_directory / Path(f"{unique}.blast_passes.tsv").name,
+                )
+
+
+def sample_batches(samples: dict[str, Path], batch_bases: int) -> list[dict[str, Path]]:
+    """Group samples, in order, into batches of at most ``batch_bases`` FASTA bytes.
+
+    FASTA bytes include headers and line breaks, so a batch never holds more
+    nucleotides than the budget; a larger assembly forms a batch of its own.
+    """
+
+    batches: list[dict[str, Path]] = []
+    batch: dict[str, Path] = {}
+    size = 0
+    for sample_id, fasta in samples.items():
+        fasta_bytes = fasta.stat().st_size
+        if batch and size + fasta_bytes > batch_bases:
+            batches.append(batch)
+            batch, size = {}, 0
+        batch[sample_id] = fasta
+        size += fasta_bytes
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def pack_batch_queries(
+    query_files: dict[str, Path], composite: Path
+) -> dict[str, tuple[str, str]]:
+    """Write per-sample queries to one FASTA with sample-tagged identifiers.
+
+    Returns each tag's sample and original record name.
+    """
+
+    queries: dict[str, tuple[str, str]] = {}
+    with composite.open("w") as output:
+        for sample_id, query_file in query_files.items():
+            with query_file.open() as handle:
+                for line in handle:
+                    if line.startswith(">"):
+                        tag = f"{sample_id}:{len(queries) + 1}"
+                        queries[tag] = (sample_id, line[1:].split(maxsplit=1)[0])
+                        line = f">{tag}\n"
+                    output.write(line)
+    return queries
+
+
+def split_batch_m8(
+    m8: Path, queries: dict[str, tuple[str, str]], outputs: dict[str, Path]
+) -> None:
+    """Write each sample's rows of a batch m8 file under the original query names."""
+
+    handles = {sample_id: path.open("w") for sample_id, path in outputs.items()}
+    try:
+        with m8.open() as rows:
+            for row in rows:
+                tag, separator, rest = row.partition("\t")
+                sample_id, name = queries[tag]
+                handles[sample_id].write(f"{name}{separator}{rest}")
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+
+def run_batch(
+    samples: dict[str, Path],
+    models: list[ModelTask],
+    settings: RunSettings,
+    work_directory: Path,
+) -> list[str]:
+    """Process a batch of samples with one BLAST search per model.
+
+    cmsearch E-values and filter thresholds depend on the residues searched,
+    so each assembly is still searched on its own. BLAST results for a query
+    do not depend on the other queries of a search, so the extracted sequences
+    of all samples are searched together and split back into per-sample files
+    that match a run of each sample alone.
+    """
+
+    cache_statuses = []
+    for sample_id, fasta in samples.items():
+        cache_statuses += search_and_extract(
+            sample_id, fasta, models, settings, work_directory
+        )
+    for model in models:
+        prefixes = {
+            sample_id: f"{work_directory / sample_id}_{model.model_id}"
+            for sample_id in samples
+        }
+        with tempfile.TemporaryDirectory(prefix=".batch.", dir=work_directory) as temporary:
+            composite = Path(temporary) / "queries.fna"
+            queries = pack_batch_queries(
+                {sample_id: Path(f"{prefix}.fna") for sample_id, prefix in prefixes.items()},
+                composite,
+            )
+            batch_m8 = Path(temporary) / "queries.m8"
+            _blast(composite, model, settings, batch_m8)
+            split_batch_m8(
+                batch_m8,
+                queries,
+                {sample_id: Path(f"{prefix}.m8") for sample_id, prefix in prefixes.items()},
+            )
+        for prefix in prefixes.values():
+            _annotate(prefix, settings)
+    return cache_statuses
+
+
+def finalize(work_directory: Path) -> None:
+    directory_pattern = glob.escape(str(work_directory))
+    finalize_summaries.main(
+        [
+            *(
+                argument
+                for option, pattern in (
+                    ("--summary-glob", "*.summary.tsv"),
+                    ("--metadata-glob", "*.meta.tsv"),
+                    ("--m8-glob", "*.m8"),
+                    ("--top-hits-glob", "*.top_hits.tsv"),
+                    ("--tree-assignment-glob", "*.tree_assignment.tsv"),
+                    ("--tree-neighbor-glob", "*.tree_neighbors.tsv"),
+                )
+                for argument in (option, f"{directory_pattern}/{pattern}")
+            ),
+            "--summary-output", str(work_directory / "cmsearch_summary.tsv"),
+            "--category-output", str(work_directory / "cmsearch_summary.tab"),
+            "--top-hits-output", str(work_directory / "blast_top_hits.tsv"),
+            "--taxonomy-mode", "blast",
+            "--tree-neighbor-output", str(work_directory / "tree_nearest_neighbors.tsv"),
+            "--merged-m8-output", str(work_directory / "merged.m8"),
+        ]
+    )
+
+
+def publish(work_directory: Path, output_directory: Path) -> None:
+    for subdirectory, pattern in PUBLISHED_OUTPUTS:
+        destination = output_directory / subdirectory
+        destination.mkdir(parents=True, exist_ok=True)
+        for path in sorted(work_directory.glob(pattern)):
+            shutil.copyfile(path, destination / path.name)
+
+
+def run_local(
+    samples: dict[str, Path],
+    models: list[ModelTask],
+    settings: RunSettings,
+    output_directory: Path,
+    workers: int = 1,
+    batch_bases: int = 0,
+    deduplicate: bool = False,
+) -> list[str]:
+    """Run every sample, write the final summaries, and publish the outputs.
+
+    With ``batch_bases``, samples are processed in batches by ``run_batch``;
+    with ``deduplicate``, samples are only searched and extracted in parallel
+    and ``annotate_unique`` annotates the extracted sequences of all samples.
+    Returns the cmsearch cache status of every search.
+    """
+
+    if batch_bases and deduplicate:
+        raise ValueError("--deduplicate_sequences and --sample_batch_bases cannot be combined")
+    if batch_bases and settings.annotation_cache is not None:
+        raise ValueError("--annotation_cache and --sample_batch_bases cannot be combined")
+    if settings.blast_first_pass_targets and batch_bases:
+        raise ValueError(
+            "--blast_first_pass_targets and --sample_batch_bases cannot be combined"
+        )
+    if settings.blast_first_pass_targets and settings.annotation_cache is not None:
+        raise ValueError(
+            "--blast_first_pass_targets and --annotation_cache cannot be combined"
+        )
+    output_directory.mkdir(parents=True, exist_ok=True)
+    batches = (
+        sample_batches(samples, batch_bases)
+        if batch_bases
+        else [{sample_id: fasta} for sample_id, fasta in samples.items()]
+    )
+    if batch_bases:
+        run = run_batch
+    elif deduplicate:
+        run = _search_single_sample
+    else:
+        run = _run_single_sample
+    cache_statuses = []
+    with tempfile.TemporaryDirectory(
+        prefix=".ssuextract-local.", dir=output_directory
+    ) as temporary:
+        work_directory = Path(temporary)
+        if workers == 1 or len(batches) == 1:
+            for batch in batches:
+                cache_statuses += run(batch, models, settings, work_directory)
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+                futures = [
+                    pool.submit(run, batch, models, settings, work_directory)
+                    for batch in batches
+                ]
+                for future in futures:
+                    cache_statuses += future.result()
+        if deduplicate:
+            annotate_unique(list(samples), models, settings, work_directory)
+        finalize(work_directory)
+        publish(work_directory, output_directory)
+    return cache_statuses
+
+
+def _non_negative_integer(value: str) -> int:
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError("must be non-negative")
+    return number
+
+
+def _positive_integer(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return number
+
+
+def add_workflow_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the per-sample workflow parameters, with the workflow defaults."""
+
+    parser.add_argument("--modeldir", default="resources/models")
+    parser.add_argument("--database_path", default="resources/database")
+    parser.add_argument("--database_profile", default="curated")
+    parser.add_argument("--model_marker_map", default="config/model_markers.json")
+    parser.add_argument("--min_extract_length", type=_non_negative_integer, default=500)
+    parser.add_argument("--threads_per_job", type=_positive_integer, default=2)
+    parser.add_argument("--max_blast_targets", type=_positive_integer, default=500)
+    parser.add_argument("--top_hits", type=_positive_integer, default=5)
+    parser.add_argument("--reference_lookup_socket", default="")
+    parser.add_argument("--cmsearch_cache_dir", default="")
+    parser.add_argument("--cmsearch_cache_max_mb", type=_positive_integer, default=4096)
+    parser.add_argument("--annotation_cache", default="")
+    parser.add_argument("--annotation_cache_max_mb", type=_positive_integer, default=1024)
+    parser.add_argument(
+        "--blast_first_pass_targets", type=_non_negative_integer, default=0
+    )
+
+
+def workflow_models(
+    modeldir: str | Path, model_marker_map: str | Path, databases: ProfileDatabases
+) -> list[ModelTask]:
+    """Pair every covariance model with the BLAST database of its marker."""
+
+    markers = load_marker_mapping(_project_path(model_marker_map))
+    model_files = sorted(Path(modeldir).glob("*.cm"))
+    if not model_files:
+        raise ValueError(f"No covariance models (.cm) in --modeldir: {modeldir}")
+    models = []
+    for model_file in model_files:
+        model_id = validate_identifier(model_file.stem, "model")
+        if model_id not in markers:
+            raise ValueError(
+                f"No database marker is configured for model '{model_id}'. "
+                "Add it to --model_marker_map."
+            )
+        marker = markers[model_id]
+        if marker not in databases.prefixes:
+            raise ValueError(f"Database profile has no BLAST database for marker '{marker}'")
+        models.append(ModelTask(model_id, model_file.resolve(), databases.prefixes[marker]))
+    return models
+
+
+def resolve_workflow(
+    args: argparse.Namespace,
+) -> tuple[ProfileDatabases, list[ModelTask], RunSettings]:
+    """Resolve the profile and models once for the parsed workflow parameters."""
+
+    databases = resolve_profile_databases(
+        _project_path(args.database_path),
+        validate_identifier(args.database_profile, "database profile"),
+        full=False,
+    )
+    models = workflow_models(args.modeldir, args.model_marker_map, databases)
+    annotation_release = ""
+    if args.annotation_cache:
+        if databases.legacy:
+            raise ValueError("--annotation_cache requires a managed database profile")
+        annotation_release = release_digest(
+            _project_path(args.database_path) / args.database_profile
+        )
+    settings = RunSettings(
+        min_extract_length=args.min_extract_length,
+        threads_per_job=args.threads_per_job,
+        max_blast_targets=args.max_blast_targets,
+        top_hits=args.top_hits,
+        taxonomy_file=databases.taxonomy_file,
+        source_records_file=databases.source_records_file,
+        lookup_socket=args.reference_lookup_socket or None,
+        cmsearch_cache=(
+            _project_path(args.cmsearch_cache_dir) if args.cmsearch_cache_dir else None
+        ),
+        cmsearch_cache_max_mb=args.cmsearch_cache_max_mb,
+        annotation_cache=(
+            _project_path(args.annotation_cache) if args.annotation_cache else None
+        ),
+        annotation_cache_max_mb=args.annotation_cache_max_mb,
+        annotation_release=annotation_release,
+        blast_first_pass_targets=args.blast_first_pass_targets,
+    )
+    return databases, models, settings
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Run SSUextract BLAST-mode classification in local processes without "
+            "Nextflow. Parameters and defaults match the workflow."
+        )
+    )
+    parser.add_argument("--query", default="data/example")
+    parser.add_argument("--outdir", type=Path)
+    add_workflow_arguments(parser)
+    parser.add_argument("--sample_batch_bases", type=_non_negative_integer, default=0)
+    parser.add_argument("--deduplicate_sequences", action="store_true")
+    parser.add_argument("--max_cpus", type=_positive_integer, default=16)
+    parser.add_argument(
+        "--tree_classification",
+        action="store_true",
+        help="not supported by the local engine",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    try:
+        if args.tree_classification:
+            raise ValueError("--tree_classification requires the Nextflow engine")
+        samples = query_samples(args.query, args.deduplicate_sequences)
+        _, models, settings = resolve_workflow(args)
+        output_directory = args.outdir or default_output_directory(args.query)
+        cpus = min(args.max_cpus, os.cpu_count() or 1)
+        cache_statuses = run_local(
+            samples,
+            models,
+            settings,
+            output_directory,
+            workers=max(1, cpus // args.threads_per_job),
+            batch_bases=args.sample_batch_bases,
+            deduplicate=args.deduplicate_sequences,
+        )
+    except (DatabaseError, ValueError, subprocess.CalledProcessError) as error:
+        print(f"local-runner: {error}", file=sys.stderr)
+        return 1
+    print(f"Results directory: {output_directory}", file=sys.stderr)
+    if settings.cmsearch_cache is not None:
+        print(
+            f"cmsearch cache: {cache_statuses.count('hit')} of {len(cache_statuses)} "
+            f"searches reused from {settings.cmsearch_cache}",
+            file=sys.stderr,
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
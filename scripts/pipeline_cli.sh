@@ -39,6 +39,16 @@ has_information_flag() {
     return 1
 }
 
+run_workflow() {
+    local engine="$1"
+    shift
+    if [[ "${engine}" == "local" ]]; then
+        "${PYTHON}" "${PROJECT_DIR}/scripts/local_runner.py" "$@"
+        return
+    fi
+    run_nextflow run "${PROJECT_DIR}/main.nf" "$@"
+}
+
 run_nextflow() {
     if [[ -n "${TERM:-}" ]] && ! tput colors >/dev/null 2>&1; then
         TERM=xterm-256color command nextflow "$@"
@@ -450,11 +460,24 @@ run_pipeline() {
     local profile=""
     local allow_update_prompt=1
     local include_database_path=0
-    local nextflow_args=()
+    local engine=nextflow
+    local workflow_args=()
     local normalized_args=()
 
     while [[ "$#" -gt 0 ]]; do
         case "$1" in
+            --engine)
+                if [[ "$#" -lt 2 ]]; then
+                    printf '%s\n' '--engine requires nextflow or local.' >&2
+                    return 2
+                fi
+                engine="$2"
+                shift 2
+                ;;
+            --engine=*)
+                engine="${1#*=}"
+                shift
+                ;;
             -q)
                 if [[ "$#" -lt 2 ]]; then
                     printf '%s\n' '-q requires a FASTA file or directory path.' >&2
@@ -481,6 +504,10 @@ run_pipeline() {
                 ;;
         esac
     done
+    if [[ "${engine}" != "nextflow" && "${engine}" != "local" ]]; then
+        printf -- '--engine must be nextflow or local, not %s.\n' "${engine}" >&2
+        return 2
+    fi
     if [[ "${#normalized_args[@]}" -gt 0 ]]; then
         set -- "${normalized_args[@]}"
     fi
@@ -490,7 +517,7 @@ run_pipeline() {
         return
     fi
     if has_information_flag "$@"; then
-        run_nextflow run "${PROJECT_DIR}/main.nf" "$@"
+        run_workflow "${engine}" "$@"
         return
     fi
 
@@ -510,18 +537,18 @@ run_pipeline() {
     fi
 
     if cli_has_database_path "$@" && cli_has_database_profile "$@"; then
-        run_nextflow run "${PROJECT_DIR}/main.nf" "$@"
+        run_workflow "${engine}" "$@"
         return
     fi
 
-    nextflow_args=(run_nextflow run "${PROJECT_DIR}/main.nf")
+    workflow_args=(run_workflow "${engine}")
     if ! cli_has_database_path "$@"; then
-        nextflow_args+=(--database_path "${db_dir}")
+        workflow_args+=(--database_path "${db_dir}")
     fi
     if ! cli_has_database_profile "$@"; then
-        nextflow_args+=(--database_profile "${profile}")
+        workflow_args+=(--database_profile "${profile}")
     fi
-    "${nextflow_args[@]}" "$@"
+    "${workflow_args[@]}" "$@"
 }
 
 run_smoke() {
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Precomputed covariance-model alignments of release reference sequences.
+
+``cmalign`` aligns each sequence to the model independently, so the consensus
+(match) columns of a reference's row do not depend on the other sequences of
+a joint alignment. Releases store the ``cmalign --matchonly`` row of every
+marker sequence for the marker's tree model, and tree mode aligns only the
+query, then stacks the stored reference rows under it.
+
+The stacked alignment holds exactly the match columns of a joint alignment.
+A joint alignment also holds insert columns, which
+:func:`tree_phylogeny.trim_alignment` always removes, so the trimmed alignment
+is the same; only the untrimmed ``cmalign.fna`` and the insert-column counts of
+the alignment QC differ.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+from pathlib import Path, PurePosixPath
+
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from sequence_index import parquet_relation
+from tree_schema import REFERENCE_FIELDS
+
+REFERENCE_ALIGNMENT_COLUMNS = (
+    ("sequence_id", "VARCHAR"),
+    ("alignment", "VARCHAR"),
+)
+INSERT_CHARACTERS = frozenset(".abcdefghijklmnopqrstuvwxyz")
+
+
+def reference_alignments_path(marker: str, model: str) -> PurePosixPath:
+    return PurePosixPath("alignments") / f"{marker}.{model}.parquet"
+
+
+def model_sha256(cm_model: str | Path) -> str:
+    digest = hashlib.sha256()
+    with Path(cm_model).open("rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cmalign_match_command(
+    cm_model: str | Path,
+    sequences: str | Path,
+    output: str | Path,
+    cpu: int = 1,
+    cmalign: str = "cmalign",
+) -> list[str]:
+    return [
+        cmalign,
+        "--matchonly",
+        "--outformat", "AFA",
+        "--cpu", str(cpu),
+        "-o", str(output),
+        str(cm_model),
+        str(sequences),
+    ]
+
+
+def read_match_alignment(path: str | Path) -> dict[str, str]:
+    """Return the rows of a ``cmalign --matchonly`` AFA alignment by identifier."""
+
+    rows: dict[str, str] = {}
+    with Path(path).open() as handle:
+        for record in SeqIO.parse(handle, "fasta"):
+            if record.id in rows:
+                raise ValueError(f"Duplicate aligned sequence: {record.id}")
+            rows[record.id] = str(record.seq)
+    if len({len(row) for row in rows.values()}) > 1:
+        raise ValueError(f"Aligned rows of {path} have unequal lengths")
+    for identifier, row in rows.items():
+        if not INSERT_CHARACTERS.isdisjoint(row):
+            raise ValueError(
+                f"Aligned row of {identifier} contains insert columns; "
+                "expected cmalign --matchonly output"
+            )
+    return rows
+
+
+def load_reference_alignments(
+    store: str | Path, subjects: set[str]
+) -> dict[str, str]:
+    if not subjects:
+        return {}
+    import duckdb
+
+    relation, relation_parameters = parquet_relation(store, subjects)
+    placeholders = ",".join("?" for _ in subjects)
+    connection = duckdb.connect(":memory:")
+    try:
+        connection.execute("SET threads = 1")
+        rows = connection.execute(
+            f"SELECT sequence_id, alignment FROM {relation} "
+            f"WHERE sequence_id IN ({placeholders})",
+            [*relation_parameters, *sorted(subjects)],
+        ).fetchall()
+    finally:
+        connection.close()
+    alignments: dict[str, str] = {}
+    for sequence_id, alignment in rows:
+        if sequence_id in alignments:
+            raise ValueError(f"Duplicate stored reference alignment for {sequence_id}")
+        alignments[str(sequence_id)] = str(alignment)
+    return alignments
+
+
+def assemble_alignment(
+    task_directory: str | Path,
+    query_alignment: str | Path,
+    store: str | Path,
+    output_file: str | Path,
+) -> None:
+    """Write the query row and the stored rows of the task references, by leaf."""
+
+    task = Path(task_directory)
+    with (task / "references.tsv").open(newline="") as handle:
+        reader = csv.DictReader(handle, delimiter="\t")
+        if reader.fieldnames != REFERENCE_FIELDS:
+            raise ValueError("Unexpected tree-reference table columns")
+        rows = list(reader)
+    queries = list(read_match_alignment(query_alignment).values())
+    if len(queries) != 1:
+        raise ValueError("Query alignment must contain exactly one sequence")
+    stored = load_reference_alignments(store, {row["blast_sseqid"] for row in rows})
+    missing = sorted({row["blast_sseqid"] for row in rows} - stored.keys())
+    if missing:
+        raise ValueError(
+            f"Stored reference alignments are missing tree references: {missing[:5]}"
+        )
+    records = [SeqRecord(Seq(queries[0]), id="QUERY", description="")]
+    for row in rows:
+        alignment = stored[row["blast_sseqid"]]
+        if len(alignment) != len(queries[0]):
+            raise ValueError(
+                f"Stored alignment of {row['blast_sseqid']} has {len(alignment)} "
+                f"columns; the query alignment has {len(queries[0])}"
+            )
+        records.append(SeqRecord(Seq(alignment), id=row["leaf_id"], description=""))
+    with Path(output_file).open("w") as handle:
+        SeqIO.write(records, handle, "fasta")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Stack a query's match-column alignment on stored reference rows."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    assemble = subparsers.add_parser("assemble")
+    assemble.add_argument("--task-directory", required=True)
+    assemble.add_argument("--query-alignment", required=True)
+    assemble.add_argument("--store", required=True)
+    assemble.add_argument("--output", required=True)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    assemble_alignment(
+        args.task_directory, args.query_alignment, args.store, args.output
+    )
+
+
+if __name__ == "__main__":
+    main()
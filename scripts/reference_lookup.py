@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""Sequence-keyed reference metadata lookup, direct or through a local server.
+
+Annotation and tree preparation read a few hundred rows from the preferred
+taxonomy and source-record tables. A direct read opens DuckDB and scans the
+row groups of the Parquet file that the release sequence index allows;
+``serve`` loads both tables once into a resident in-memory DuckDB database and
+answers the same queries over a Unix socket. Clients fall back to the direct
+read whenever the socket is absent or serves a different file.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import socket
+import socketserver
+import sys
+from pathlib import Path
+from typing import Callable
+
+import duckdb
+
+from sequence_index import parquet_relation
+
+TAXONOMY_TABLE = "preferred_taxonomy"
+SOURCE_RECORDS_TABLE = "source_records"
+CENTROID_COLUMNS = ("centroid_names", "centroid_taxonomy", "centroid_taxonomy_source")
+PROTOCOL_VERSION = 1
+_MAXIMUM_MESSAGE_BYTES = 256 * 1024 * 1024
+
+Rows = list[tuple]
+
+
+def _taxonomy_rows(
+    connection: duckdb.DuckDBPyConnection,
+    relation: str,
+    relation_parameters: list[str],
+    subjects: set[str],
+) -> Rows:
+    columns = {
+        str(row[0])
+        for row in connection.execute(
+            f"DESCRIBE SELECT * FROM {relation}", relation_parameters
+        ).fetchall()
+    }
+    present_centroid_columns = columns.intersection(CENTROID_COLUMNS)
+    if present_centroid_columns and present_centroid_columns != set(CENTROID_COLUMNS):
+        raise ValueError("Preferred taxonomy has an incomplete centroid schema")
+    centroid_fields = (
+        CENTROID_COLUMNS
+        if present_centroid_columns
+        else tuple(f"'' AS {column}" for column in CENTROID_COLUMNS)
+    )
+    taxon_id_field = "taxon_id" if "taxon_id" in columns else "NULL AS taxon_id"
+    placeholders = ",".join("?" for _ in subjects)
+    return connection.execute(
+        f"""
+        SELECT
+            sequence_id,
+            reference_source,
+            taxonomy,
+            taxonomy_source,
+            domain,
+            compartment,
+            assignment_method,
+            cross_domain_conflict,
+            taxonomy_alternatives,
+            {centroid_fields[0]},
+            {centroid_fields[1]},
+            {centroid_fields[2]},
+            {taxon_id_field}
+        FROM {relation}
+        WHERE sequence_id IN ({placeholders})
+        """,
+        [*relation_parameters, *sorted(subjects)],
+    ).fetchall()
+
+
+def _source_record_rows(
+    connection: duckdb.DuckDBPyConnection,
+    relation: str,
+    relation_parameters: list[str],
+    subjects: set[str],
+) -> Rows:
+    placeholders = ",".join("?" for _ in subjects)
+    return connection.execute(
+        f"""
+        SELECT sequence_id, reference_source, source_version, source_identifier
+        FROM {relation}
+        WHERE sequence_id IN ({placeholders})
+        ORDER BY sequence_id, reference_source, source_version, source_identifier
+        """,
+        [*relation_parameters, *sorted(subjects)],
+    ).fetchall()
+
+
+_QUERIES: dict[str, Callable[..., Rows]] = {
+    TAXONOMY_TABLE: _taxonomy_rows,
+    SOURCE_RECORDS_TABLE: _source_record_rows,
+}
+
+
+def _file_signature(path: str | Path) -> list[object]:
+    resolved = Path(path).resolve()
+    status = resolved.stat()
+    return [str(resolved), status.st_size, status.st_mtime_ns]
+
+
+def read_rows(table: str, parquet_file: str | Path, subjects: set[str]) -> Rows:
+    """Read matching rows directly from one release Parquet table."""
+
+    if not subjects:
+        return []
+    relation, relation_parameters = parquet_relation(parquet_file, subjects)
+    connection = duckdb.connect(":memory:")
+    try:
+        connection.execute("SET threads = 1")
+        return _QUERIES[table](connection, relation, relation_parameters, subjects)
+    finally:
+        connection.close()
+
+
+def _request_rows(
+    socket_path: str | Path, table: str, parquet_file: str | Path, subjects: set[str]
+) -> Rows | None:
+    request = {
+        "protocol_version": PROTOCOL_VERSION,
+        "table": table,
+        "file": _file_signature(parquet_file),
+        "subjects": sorted(subjects),
+    }
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(str(socket_path))
+            with client.makefile("rwb") as stream:
+                stream.write(json.dumps(request).encode() + b"\n")
+                stream.flush()
+                response = json.loads(stream.readline(_MAXIMUM_MESSAGE_BYTES))
+    except (OSError, ValueError):
+        return None
+    if not isinstance(response, dict) or "rows" not in response:
+        return None
+    if response.get("error"):
+        raise ValueError(str(response["error"]))
+    return [tuple(row) for row in response["rows"]]
+
+
+def fetch_rows(
+    table: str,
+    parquet_file: str | Path,
+    subjects: set[str],
+    lookup_socket: str | Path | None = None,
+) -> Rows:
+    """Return rows from a lookup server when it serves this file, else from Parquet."""
+
+    if not subjects:
+        return []
+    if lookup_socket:
+        rows = _request_rows(lookup_socket, table, parquet_file, subjects)
+        if rows is not None:
+            return rows
+    return read_rows(table, parquet_file, subjects)
+
+
+class ReferenceLookupServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Resident copy of one profile's taxonomy and source-record tables."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path: str | Path,
+        tables: dict[str, str | Path],
+    ) -> None:
+        self.connection = duckdb.connect(":memory:")
+        self.signatures: dict[str, list[object]] = {}
+        for table, parquet_file in tables.items():
+            if table not in _QUERIES:
+                raise ValueError(f"Unsupported lookup table: {table}")
+            self.signatures[table] = _file_signature(parquet_file)
+            self.connection.execute(
+                f"CREATE TABLE {table} AS SELECT * FROM read_parquet(?) ORDER BY sequence_id",
+                [str(Path(parquet_file))],
+            )
+        Path(socket_path).unlink(missing_ok=True)
+        super().__init__(str(socket_path), _LookupHandler)
+
+    def lookup(self, request: object) -> dict[str, object]:
+        if not isinstance(request, dict) or request.get("protocol_version") != PROTOCOL_VERSION:
+            return {"declined": "unsupported protocol"}
+        table = request.get("table")
+        subjects = request.get("subjects")
+        if table not in self.signatures or request.get("file") != self.signatures[table]:
+            return {"declined": "file is not served"}
+        if not isinstance(subjects, list) or not all(
+            isinstance(subject, str) for subject in subjects
+        ):
+            return {"declined": "subjects must be strings"}
+        cursor = self.connection.cursor()
+        try:
+            rows = _QUERIES[table](cursor, table, [], set(subjects)) if subjects else []
+        except (duckdb.Error, ValueError) as error:
+            return {"rows": [], "error": str(error)}
+        finally:
+            cursor.close()
+        return {"rows": [list(row) for row in rows]}
+
+
+class _LookupHandler(socketserver.StreamRequestHandler):
+    server: ReferenceLookupServer
+
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline(_MAXIMUM_MESSAGE_BYTES))
+        except ValueError:
+            request = None
+        self.wfile.write(json.dumps(self.server.lookup(request)).encode() + b"\n")
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Serve preferred-taxonomy and source-record lookups over a Unix socket."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve = subparsers.add_parser("serve", help="load both tables and answer lookups")
+    serve.add_argument("--socket", required=True, type=Path)
+    serve.add_argument("--taxonomy-db", required=True, type=Path)
+    serve.add_argument("--source-records-db", required=True, type=Path)
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    server = ReferenceLookupServer(
+        args.socket,
+        {
+            TAXONOMY_TABLE: args.taxonomy_db,
+            SOURCE_RECORDS_TABLE: args.source_records_db,
+        },
+    )
+    print(f"reference-lookup: serving {args.socket}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        args.socket.unlink(missing_ok=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -4,29 +4,39 @@ from __future__ import annotations
 
 import argparse
 
+from assembly_shards import read_window_map
 from hit_processing import (
+    merge_window_hits,
     parse_cmsearch_tblout,
     resolve_competing_model_hits,
     write_accepted_hits,
 )
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Resolve overlapping hits from homologous SSU covariance models."
     )
     parser.add_argument("--cmsearch", action="append", required=True)
+    parser.add_argument(
+        "--windows",
+        help="window map from assembly_shards.py for tables searched shard by shard",
+    )
     parser.add_argument("--output", required=True)
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-def main() -> None:
-    args = parse_args()
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    windows = read_window_map(args.windows) if args.windows else None
     hits = [
         hit
         for path in args.cmsearch
-        for hit in parse_cmsearch_tblout(path)
+        for hit in parse_cmsearch_tblout(path, windows)
     ]
+    if windows:
+        # Overlapping windows of one contig can land in different shards.
+        hits = merge_window_hits(hits)
     write_accepted_hits(resolve_competing_model_hits(hits), args.output)
 
 
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""Annotate each distinct extracted sequence once across all samples.
+
+``collapse`` gathers the extracted sequences of one model from every sample
+and writes each distinct sequence once, named by the reference-database
+sequence identifier (a hash of the sequence after whitespace, case, and U/T
+normalization), together with a table of the sample records it stands for.
+The unique set is annotated like an ordinary sample whose identifier is
+``unique``. BLAST results and tree placements of a query do not depend on its
+name or on the other queries of a search, so ``expand-annotations`` and
+``expand-tree`` copy the unique results back to every sample record, with the
+record's own name, coordinates, and sequence, and the copies match per-sample
+annotation.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Sequence
+
+from annotate_hits import RECORD_SUMMARY_FIELDS, SUMMARY_FIELDS, load_m8_lines
+from database_sources import sequence_identifier
+from hit_processing import HIT_FIELDS, META_FIELDS
+from top_hit_reporting import RECORD_TOP_HIT_FIELDS, TOP_HIT_FIELDS, load_query_sequences
+from tree_schema import TREE_ASSIGNMENT_FIELDS, TREE_NEIGHBOR_FIELDS
+
+DEDUPLICATED_SAMPLE = "unique"
+MEMBER_FIELDS = ["sequence_identifier", "sample", "model", "name"]
+
+
+def _read_table(path: str | Path, fields: list[str], label: str) -> list[dict[str, str]]:
+    with Path(path).open(newline="") as handle:
+        reader = csv.DictReader(handle, delimiter="\t")
+        if reader.fieldnames != fields:
+            raise ValueError(f"Unexpected {label} columns in {path}: {reader.fieldnames}")
+        return list(reader)
+
+
+def _write_table(
+    path: str | Path, fields: list[str], rows: Iterable[dict[str, object]]
+) -> None:
+    with Path(path).open("w", newline="") as handle:
+        writer = csv.DictWriter(
+            handle, fieldnames=fields, delimiter="\t", lineterminator="\n"
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _fasta_for(hits_table: Path) -> Path:
+    if not hits_table.name.endswith(".hits.tsv"):
+        raise ValueError(f"Hit table name must end in .hits.tsv: {hits_table}")
+    return hits_table.with_name(hits_table.name[: -len(".hits.tsv")] + ".fna")
+
+
+def _sample_records(
+    hits_table: Path,
+) -> tuple[list[dict[str, str]], dict[str, str]]:
+    rows = _read_table(hits_table, HIT_FIELDS, "hit-table")
+    sequences = load_query_sequences(_fasta_for(hits_table))
+    missing = sorted(row["name"] for row in rows if row["name"] not in sequences)
+    if missing:
+        raise ValueError(
+            f"{_fasta_for(hits_table)} is missing hit sequence(s): " + ", ".join(missing)
+        )
+    return rows, sequences
+
+
+def collapse(
+    hits_tables: Sequence[str | Path],
+    model_id: str,
+    output_prefix: str | Path,
+) -> int:
+    """Write the distinct sequences of one model's extracted records.
+
+    Writes ``<prefix>.fna``, ``.hits.tsv``, ``.meta.tsv``, and
+    ``.members.tsv``; returns the number of distinct sequences.
+    """
+
+    prefix = str(output_prefix)
+    unique: dict[str, str] = {}
+    members: list[dict[str, str]] = []
+    for hits_table in sorted(Path(path) for path in hits_tables):
+        rows, sequences = _sample_records(hits_table)
+        for row in rows:
+            if row["model"] != model_id:
+                raise ValueError(f"{hits_table} has a record of model {row['model']!r}")
+            sequence = sequences[row["name"]]
+            identifier = sequence_identifier(sequence, f"record {row['name']}")
+            unique.setdefault(identifier, sequence)
+            members.append(
+                {
+                    "sequence_identifier": identifier,
+                    "sample": row["sample"],
+                    "model": row["model"],
+                    "name": row["name"],
+                }
+            )
+
+    with Path(f"{prefix}.fna").open("w") as handle:
+        for identifier, sequence in unique.items():
+            handle.write(f">{identifier}\n{sequence}\n")
+    _write_table(
+        f"{prefix}.hits.tsv",
+        HIT_FIELDS,
+        (
+            {
+                "name": identifier,
+                "sample": DEDUPLICATED_SAMPLE,
+                "model": model_id,
+                "length": len(sequence),
+            }
+            for identifier, sequence in unique.items()
+        ),
+    )
+    _write_table(
+        f"{prefix}.meta.tsv",
+        META_FIELDS,
+        [{"sample": DEDUPLICATED_SAMPLE, "model": model_id}],
+    )
+    _write_table(f"{prefix}.members.tsv", MEMBER_FIELDS, members)
+    return len(unique)
+
+
+def _grouped(rows: Iterable[dict[str, str]]) -> dict[str, list[dict[str, str]]]:
+    groups: dict[str, list[dict[str, str]]] = defaultdict(list)
+    for row in rows:
+        groups[row["name"]].append(row)
+    return groups
+
+
+def expand_annotations(
+    unique_m8: str | Path,
+    unique_summary: str | Path,
+    unique_top_hits: str | Path,
+    hits_tables: Sequence[str | Path],
+    output_directory: str | Path,
+) -> list[Path]:
+    """Write per-sample m8, summary, and top-hit files from unique results.
+
+    Each hit table ``<prefix>.hits.tsv`` (with ``<prefix>.fna`` beside it)
+    yields ``<prefix>.m8``, ``<prefix>.summary.tsv``, and
+    ``<prefix>.top_hits.tsv`` in ``output_directory``.
+    """
+
+    m8_rows = load_m8_lines(unique_m8)
+    summaries = _grouped(_read_table(unique_summary, SUMMARY_FIELDS, "summary"))
+    top_hits = _grouped(_read_table(unique_top_hits, TOP_HIT_FIELDS, "top-hit"))
+    output = Path(output_directory)
+    output.mkdir(parents=True, exist_ok=True)
+    written = []
+    for hits_table in map(Path, hits_tables):
+        rows, sequences = _sample_records(hits_table)
+        identifiers = {
+            name: sequence_identifier(sequence, f"record {name}")
+            for name, sequence in sequences.items()
+        }
+        missing = sorted(
+            row["name"] for row in rows if identifiers[row["name"]] not in summaries
+        )
+        if missing:
+            raise ValueError(
+                f"No unique annotation for {hits_table} record(s): " + ", ".join(missing)
+            )
+        prefix = output / _fasta_for(hits_table).stem
+
+        # BLAST writes queries in FASTA order.
+        with Path(f"{prefix}.m8").open("w") as handle:
+            for name, identifier in identifiers.items():
+                for rest in m8_rows.get(identifier, []):
+                    handle.write(name + rest)
+
+        summary_rows = []
+        top_hit_rows = []
+        for row in rows:
+            record = {**row, "query_sequence": sequences[row["name"]]}
+            identifier = identifiers[row["name"]]
+            for summary in summaries[identifier]:
+                summary_rows.append(
+                    {**summary, **{field: record[field] for field in RECORD_SUMMARY_FIELDS}}
+                )
+            for top_hit in top_hits.get(identifier, []):
+                top_hit_rows.append(
+                    {**top_hit, **{field: record[field] for field in RECORD_TOP_HIT_FIELDS}}
+                )
+        _write_table(f"{prefix}.summary.tsv", SUMMARY_FIELDS, summary_rows)
+        _write_table(f"{prefix}.top_hits.tsv", TOP_HIT_FIELDS, top_hit_rows)
+        written += [
+            Path(f"{prefix}{suffix}") for suffix in (".m8", ".summary.tsv", ".top_hits.tsv")
+        ]
+    return written
+
+
+def load_members(
+    members_files: Sequence[str | Path],
+) -> dict[tuple[str, str], list[tuple[str, str]]]:
+    """Return the (sample, name) records of each (model, sequence identifier)."""
+
+    members: dict[tuple[str, str], list[tuple[str, str]]] = defaultdict(list)
+    for members_file in members_files:
+        for row in _read_table(members_file, MEMBER_FIELDS, "member"):
+            members[(row["model"], row["sequence_identifier"])].append(
+                (row["sample"], row["name"])
+            )
+    return members
+
+
+def _expand_rows(
+    tables: Sequence[str | Path],
+    fields: list[str],
+    label: str,
+    members: dict[tuple[str, str], list[tuple[str, str]]],
+) -> list[dict[str, str]]:
+    expanded = []
+    for table in tables:
+        for row in _read_table(table, fields, label):
+            key = (row["model"], row["name"])
+            if key not in members:
+                raise ValueError(
+                    f"{table} has a {label} row for unknown sequence {row['name']!r}"
+                )
+            for sample, name in members[key]:
+                expanded.append({**row, "sample": sample, "name": name})
+    return expanded
+
+
+def expand_tree(
+    members_files: Sequence[str | Path],
+    assignment_files: Sequence[str | Path],
+    neighbor_files: Sequence[str | Path],
+    assignment_output: str | Path,
+    neighbor_output: str | Path,
+) -> None:
+    """Copy tree assignments and neighbors of unique sequences to their records."""
+
+    members = load_members(members_files)
+    _write_table(
+        assignment_output,
+        TREE_ASSIGNMENT_FIELDS,
+        _expand_rows(assignment_files, TREE_ASSIGNMENT_FIELDS, "tree-assignment", members),
+    )
+    _write_table(
+        neighbor_output,
+        TREE_NEIGHBOR_FIELDS,
+        _expand_rows(neighbor_files, TREE_NEIGHBOR_FIELDS, "tree-neighbor", members),
+    )
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Annotate identical extracted sequences once across samples."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    collapse_parser = subparsers.add_parser(
+        "collapse", help="write the distinct sequences of one model"
+    )
+    collapse_parser.add_argument("--model", required=True)
+    collapse_parser.add_argument("--output-prefix", required=True)
+    collapse_parser.add_argument("hits_tables", nargs="+", type=Path)
+
+    annotations = subparsers.add_parser(
+        "expand-annotations", help="write per-sample BLAST annotation files"
+    )
+    annotations.add_argument("--m8", required=True, type=Path)
+    annotations.add_argument("--summary", required=True, type=Path)
+    annotations.add_argument("--top-hits", required=True, type=Path)
+    annotations.add_argument("--output-directory", type=Path, default=Path("."))
+    annotations.add_argument("hits_tables", nargs="+", type=Path)
+
+    tree = subparsers.add_parser(
+        "expand-tree", help="write per-record tree assignments and neighbors"
+    )
+    tree.add_argument("--members", action="append", required=True, type=Path)
+    tree.add_argument("--assignments", nargs="+", required=True, type=Path)
+    tree.add_argument("--neighbors", nargs="*", default=[], type=Path)
+    tree.add_argument("--assignment-output", required=True, type=Path)
+    tree.add_argument("--neighbor-output", required=True, type=Path)
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    if args.command == "collapse":
+        collapse(args.hits_tables, args.model, args.output_prefix)
+    elif args.command == "expand-annotations":
+        expand_annotations(
+            args.m8, args.summary, args.top_hits, args.hits_tables, args.output_directory
+        )
+    else:
+        expand_tree(
+            args.members,
+            args.assignments,
+            args.neighbors,
+            args.assignment_output,
+            args.neighbor_output,
+        )
+
+
+if __name__ == "__main__":
+    main()
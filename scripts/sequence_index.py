@@ -0,0 +1,131 @@
+"""Row-group index for release Parquet tables sorted by ``sequence_id``.
+
+Release tables that runtime lookups read by sequence identifier are written in
+``sequence_id`` order with bounded row groups. The sidecar index beside each
+table records the first and last identifier and the row count of every row
+group, so a reader can restrict a scan to the row groups that can hold its
+subjects. Readers fall back to the full table when the sidecar is absent,
+malformed, or describes a file of another size.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+from pathlib import Path
+from typing import Sequence
+
+
+SEQUENCE_INDEX_SUFFIX = ".sequence_index.json"
+SEQUENCE_INDEX_VERSION = 1
+ROW_GROUP_ROWS = 8192
+# Each pruned range is a separate Parquet scan; beyond this many ranges one
+# filtered scan of the whole table is cheaper.
+MAXIMUM_PRUNED_RANGES = 24
+
+
+def sequence_index_path(parquet_file: str | Path) -> Path:
+    path = Path(parquet_file)
+    return path.with_name(path.stem + SEQUENCE_INDEX_SUFFIX)
+
+
+def build_sequence_index(
+    parquet_name: str,
+    parquet_bytes: int,
+    row_groups: Sequence[tuple[str, str, int]],
+) -> dict[str, object]:
+    """Describe row groups given as ``(first key, last key, rows)`` in file order."""
+
+    previous = None
+    for first, last, _ in row_groups:
+        if first > last or (previous is not None and first < previous):
+            raise ValueError(f"{parquet_name} rows are not sorted by sequence_id")
+        previous = last
+    return {
+        "schema_version": SEQUENCE_INDEX_VERSION,
+        "parquet": parquet_name,
+        "parquet_bytes": parquet_bytes,
+        "key": "sequence_id",
+        "row_groups": [[first, last, rows] for first, last, rows in row_groups],
+    }
+
+
+def load_sequence_index(parquet_file: str | Path) -> list[tuple[str, str]] | None:
+    """Return per-row-group identifier ranges, or ``None`` when unusable."""
+
+    path = Path(parquet_file)
+    try:
+        index = json.loads(sequence_index_path(path).read_text(encoding="utf-8"))
+        parquet_bytes = path.stat().st_size
+    except (OSError, ValueError):
+        return None
+    if (
+        not isinstance(index, dict)
+        or index.get("schema_version") != SEQUENCE_INDEX_VERSION
+        or index.get("parquet") != path.name
+        or index.get("parquet_bytes") != parquet_bytes
+        or not isinstance(index.get("row_groups"), list)
+    ):
+        return None
+    ranges: list[tuple[str, str]] = []
+    for row_group in index["row_groups"]:
+        if (
+            not isinstance(row_group, list)
+            or len(row_group) != 3
+            or not all(isinstance(key, str) for key in row_group[:2])
+            or row_group[0] > row_group[1]
+            or (ranges and row_group[0] < ranges[-1][1])
+        ):
+            return None
+        ranges.append((row_group[0], row_group[1]))
+    return ranges
+
+
+def _subject_ranges(
+    ranges: list[tuple[str, str]], subjects: set[str]
+) -> list[tuple[str, str]]:
+    """Merge the row groups that can hold any subject into contiguous key ranges."""
+
+    last_keys = [last for _, last in ranges]
+    needed: set[int] = set()
+    for subject in subjects:
+        position = bisect.bisect_left(last_keys, subject)
+        # Equal boundary keys let one identifier span adjacent row groups.
+        while position < len(ranges) and ranges[position][0] <= subject:
+            needed.add(position)
+            position += 1
+    merged: list[tuple[str, str]] = []
+    previous = -2
+    for position in sorted(needed):
+        first, last = ranges[position]
+        if position == previous + 1:
+            merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+        previous = position
+    return merged
+
+
+def parquet_relation(
+    parquet_file: str | Path, subjects: set[str]
+) -> tuple[str, list[str]]:
+    """Return a DuckDB relation and parameters restricted to the needed row groups.
+
+    Callers still filter on ``sequence_id``; the relation only narrows the scan.
+    """
+
+    path = str(Path(parquet_file))
+    ranges = load_sequence_index(parquet_file)
+    if ranges is None:
+        return "read_parquet(?)", [path]
+    key_ranges = _subject_ranges(ranges, subjects)
+    if not key_ranges:
+        return "(SELECT * FROM read_parquet(?) LIMIT 0)", [path]
+    if len(key_ranges) > MAXIMUM_PRUNED_RANGES:
+        return "read_parquet(?)", [path]
+    scans = " UNION ALL ".join(
+        "SELECT * FROM read_parquet(?) WHERE sequence_id >= ? AND sequence_id <= ?"
+        for _ in key_ranges
+    )
+    parameters = [value for first, last in key_ranges for value in (path, first, last)]
+    return f"({scans})", parameters
@@ -0,0 +1,198 @@
+"""Integer taxonomy nodes and a binary-lifting lowest-common-ancestor index.
+
+Every distinct prefix of a ranked taxonomy path is one node. Node ``0`` is the
+empty root, and identifiers are assigned in first-appearance order, so each
+parent precedes its children. Releases write the nodes to
+``taxonomy_nodes.parquet`` beside the preferred-taxonomy table, whose
+``taxon_id`` column names the node of each sequence's taxonomy.
+
+The lowest common ancestor of a set of nodes matches
+:func:`taxonomy_utils.lowest_common_ancestor` of their paths: the shared prefix
+ends before the first empty rank.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Iterable, Mapping, Sequence
+
+import numpy as np
+
+TAXONOMY_NODES_NAME = "taxonomy_nodes.parquet"
+TAXONOMY_NODE_COLUMNS = (
+    ("taxon_id", "BIGINT"),
+    ("parent_id", "BIGINT"),
+    ("depth", "BIGINT"),
+    ("name", "VARCHAR"),
+)
+ROOT_ID = 0
+
+
+class TaxonomyNodes:
+    """Assign integer identifiers to taxonomy paths and their prefixes."""
+
+    def __init__(self) -> None:
+        self.parents: list[int] = [-1]
+        self.names: list[str] = [""]
+        self._children: dict[tuple[int, str], int] = {}
+
+    def add(self, path: Sequence[str]) -> int:
+        node = ROOT_ID
+        for name in path:
+            key = (node, name)
+            child = self._children.get(key)
+            if child is None:
+                child = len(self.parents)
+                self._children[key] = child
+                self.parents.append(node)
+                self.names.append(name)
+            node = child
+        return node
+
+    def rows(self) -> list[tuple[object, ...]]:
+        """Return ``(taxon_id, parent_id, depth, name)`` rows in identifier order."""
+
+        depths = [0] * len(self.parents)
+        for node in range(1, len(self.parents)):
+            depths[node] = depths[self.parents[node]] + 1
+        return [
+            (node, None if parent < 0 else parent, depths[node], self.names[node])
+            for node, parent in enumerate(self.parents)
+        ]
+
+    def index(self) -> TaxonomyIndex:
+        return TaxonomyIndex(self.parents, self.names)
+
+
+class TaxonomyIndex:
+    """Constant-depth lowest-common-ancestor queries over taxonomy nodes."""
+
+    def __init__(self, parents: Sequence[int], names: Sequence[str]) -> None:
+        parent = np.asarray(parents, dtype=np.int64)
+        count = parent.size
+        if (
+            count == 0
+            or parent[0] != -1
+            or len(names) != count
+            or names[0] != ""
+            or np.any(parent[1:] < 0)
+            or np.any(parent[1:] >= np.arange(1, count))
+        ):
+            raise ValueError("Taxonomy nodes must start at the root and list parents first")
+        self.names = list(names)
+        self.parent = parent
+        # Parents precede children, so each pass fixes at least one more level.
+        up = np.where(parent < 0, ROOT_ID, parent)
+        depth = np.zeros(count, dtype=np.int64)
+        named = np.array([bool(name) for name in self.names], dtype=bool)
+        named[ROOT_ID] = True
+        while True:
+            next_depth = np.where(parent < 0, 0, depth[up] + 1)
+            next_named = named & named[up]
+            if np.array_equal(next_depth, depth) and np.array_equal(next_named, named):
+                break
+            depth, named = next_depth, next_named
+        self.depth = depth
+        # The deepest ancestor (or self) whose path has no empty rank.
+        named_ancestor = np.where(named, np.arange(count), up)
+        while not np.all(named[named_ancestor]):
+            named_ancestor = np.where(
+                named[named_ancestor], named_ancestor, up[named_ancestor]
+            )
+        self.named_ancestor = named_ancestor
+        levels = max(int(depth.max()).bit_length(), 1)
+        self.ancestors = np.empty((levels, count), dtype=np.int64)
+        self.ancestors[0] = up
+        for level in range(1, levels):
+            self.ancestors[level] = self.ancestors[level - 1][self.ancestors[level - 1]]
+
+    @classmethod
+    def from_paths(
+        cls, paths: Iterable[Sequence[str]]
+    ) -> tuple[TaxonomyIndex, list[int]]:
+        """Index ``paths`` and return the node of each, in input order."""
+
+        nodes = TaxonomyNodes()
+        taxon_ids = [nodes.add(path) for path in paths]
+        return nodes.index(), taxon_ids
+
+    def __len__(self) -> int:
+        return self.parent.size
+
+    def lowest_common_node(self, taxon_ids: Iterable[int]) -> int | None:
+        """Return the lowest common ancestor of the nodes, or None for no nodes."""
+
+        nodes = np.unique(np.fromiter(taxon_ids, dtype=np.int64))
+        if nodes.size == 0:
+            return None
+        if nodes[0] < 0 or nodes[-1] >= len(self):
+            raise ValueError("Unknown taxonomy node identifier")
+        # Lift every node to the shallowest depth, then lift all of them
+        # together while they still differ at the next power-of-two ancestor.
+        lift = self.depth[nodes] - self.depth[nodes].min()
+        for level in range(self.ancestors.shape[0]):
+            step = (lift >> level) & 1 == 1
+            nodes[step] = self.ancestors[level][nodes[step]]
+        if np.all(nodes == nodes[0]):
+            return int(nodes[0])
+        for level in range(self.ancestors.shape[0] - 1, -1, -1):
+            lifted = self.ancestors[level][nodes]
+            if not np.all(lifted == lifted[0]):
+                nodes = lifted
+        return int(self.ancestors[0][nodes[0]])
+
+    def path(self, taxon_id: int) -> tuple[str, ...]:
+        names = []
+        node = taxon_id
+        while node != ROOT_ID:
+            names.append(self.names[node])
+            node = int(self.parent[node])
+        return tuple(reversed(names))
+
+    def lowest_common_path(self, taxon_ids: Iterable[int]) -> tuple[str, ...]:
+        """Return the shared, non-empty path prefix of the nodes."""
+
+        node = self.lowest_common_node(taxon_ids)
+        if node is None:
+            return ()
+        return self.path(int(self.named_ancestor[node]))
+
+
+class KeyedTaxonomyIndex:
+    """Lowest common ancestors of keyed taxonomy paths, such as BLAST subjects."""
+
+    def __init__(self, paths: Mapping[str, Sequence[str]]) -> None:
+        keys = sorted(paths)
+        self.index, taxon_ids = TaxonomyIndex.from_paths(paths[key] for key in keys)
+        self.taxon_ids = dict(zip(keys, taxon_ids))
+
+    def lowest_common_path(self, keys: Iterable[str]) -> tuple[str, ...]:
+        return self.index.lowest_common_path(self.taxon_ids[key] for key in keys)
+
+
+def taxonomy_nodes_path(preferred_taxonomy_file: str | Path) -> Path:
+    return Path(preferred_taxonomy_file).with_name(TAXONOMY_NODES_NAME)
+
+
+def load_taxonomy_index(preferred_taxonomy_file: str | Path) -> TaxonomyIndex | None:
+    """Load the node table released beside a preferred-taxonomy table, if any."""
+
+    path = taxonomy_nodes_path(preferred_taxonomy_file)
+    if not path.is_file():
+        return None
+    import duckdb
+
+    connection = duckdb.connect(":memory:")
+    try:
+        connection.execute("SET threads = 1")
+        columns = connection.execute(
+            "SELECT taxon_id, parent_id, name FROM read_parquet(?) ORDER BY taxon_id",
+            [str(path)],
+        ).fetchnumpy()
+    finally:
+        connection.close()
+    taxon_ids = np.asarray(columns["taxon_id"], dtype=np.int64)
+    if not np.array_equal(taxon_ids, np.arange(taxon_ids.size)):
+        raise ValueError(f"Taxonomy node identifiers of {path} are not contiguous")
+    parents = np.ma.filled(np.ma.asarray(columns["parent_id"]).astype(np.int64), -1)
+    return TaxonomyIndex(parents, [str(name) for name in columns["name"]])
@@ -3,13 +3,17 @@ from __future__ import annotations
 import csv
 from dataclasses import dataclass
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Mapping, Sequence
 
-import duckdb
 from Bio import SeqIO
 
+from reference_lookup import SOURCE_RECORDS_TABLE, fetch_rows
+
 if TYPE_CHECKING:
-    from annotate_hits import BlastHit, TaxonomyRecord
+    import numpy as np
+
+    from annotate_hits import TaxonomyRecord
+    from blast_table import BlastHit, BlastTable
 
 
 TOP_HIT_FIELDS = [
@@ -44,6 +48,8 @@ TOP_HIT_FIELDS = [
     "query_length",
     "query_sequence",
 ]
+# Top-hit columns that describe the extracted record rather than its hits.
+RECORD_TOP_HIT_FIELDS = ["name", "sample", "model", "query_sequence"]
 
 
 @dataclass(frozen=True)
@@ -56,25 +62,11 @@ class ReferenceRecord:
 def load_reference_records(
     source_records_file: str | Path,
     subjects: set[str],
+    lookup_socket: str | Path | None = None,
 ) -> dict[str, ReferenceRecord]:
     if not subjects:
         return {}
-    placeholders = ",".join("?" for _ in subjects)
-    parameters = [str(Path(source_records_file)), *sorted(subjects)]
-    connection = duckdb.connect(":memory:")
-    try:
-        connection.execute("SET threads = 1")
-        rows = connection.execute(
-            f"""
-            SELECT sequence_id, reference_source, source_version, source_identifier
-            FROM read_parquet(?)
-            WHERE sequence_id IN ({placeholders})
-            ORDER BY sequence_id, reference_source, source_version, source_identifier
-            """,
-            parameters,
-        ).fetchall()
-    finally:
-        connection.close()
+    rows = fetch_rows(SOURCE_RECORDS_TABLE, source_records_file, subjects, lookup_socket)
 
     identifiers: dict[str, set[str]] = {}
     versions: dict[str, set[str]] = {}
@@ -139,10 +131,30 @@ def _top_hit_taxonomy(record: TaxonomyRecord | None) -> str:
     return record.taxonomy or record.domain or "Unclassified"
 
 
+REPORTED_SOURCES = ("IMG", "PR2", "SILVA")
+
+
+def source_subject_masks(
+    blast_hits: BlastTable, references: dict[str, ReferenceRecord]
+) -> dict[str, np.ndarray]:
+    """Mark, per reference source, the table subjects that carry it."""
+
+    return {
+        source: blast_hits.subject_mask(
+            subject
+            for subject in blast_hits.subjects
+            if source in reference_record(subject, references).sources
+        )
+        for source in REPORTED_SOURCES
+    }
+
+
 def select_reported_hits(
-    hits: list[BlastHit],
+    blast_hits: BlastTable,
+    query: str,
     references: dict[str, ReferenceRecord],
     top_hits: int,
+    source_masks: dict[str, np.ndarray] | None = None,
 ) -> list[tuple[int, BlastHit, str]]:
     reason_order = (
         "overall_top_n",
@@ -151,48 +163,45 @@ def select_reported_hits(
         "best_PR2",
         "best_SILVA",
     )
-    reasons: dict[str, set[str]] = {}
-    for hit in hits[:top_hits]:
-        reasons.setdefault(hit.subject, set()).add("overall_top_n")
-    if hits:
-        best_score = hits[0].bit_score
-        for hit in hits:
-            if hit.bit_score != best_score:
-                break
-            reasons.setdefault(hit.subject, set()).add("equal_best_assignment")
-    for source in ("IMG", "PR2", "SILVA"):
-        best = next(
-            (
-                hit
-                for hit in hits
-                if source in reference_record(hit.subject, references).sources
-            ),
-            None,
-        )
+    if source_masks is None:
+        source_masks = source_subject_masks(blast_hits, references)
+    reasons: dict[int, set[str]] = {}
+    for rank in range(min(top_hits, blast_hits.hit_count(query))):
+        reasons.setdefault(rank, set()).add("overall_top_n")
+    for rank in range(blast_hits.tied_count(query)):
+        reasons.setdefault(rank, set()).add("equal_best_assignment")
+    for source in REPORTED_SOURCES:
+        best = blast_hits.first_rank(query, source_masks[source])
         if best is not None:
-            reasons.setdefault(best.subject, set()).add(f"best_{source}")
+            reasons.setdefault(best, set()).add(f"best_{source}")
+    ranks = sorted(reasons)
     return [
         (
-            rank,
+            rank + 1,
             hit,
-            "|".join(
-                reason for reason in reason_order if reason in reasons[hit.subject]
-            ),
+            "|".join(reason for reason in reason_order if reason in reasons[rank]),
         )
-        for rank, hit in enumerate(hits, start=1)
-        if hit.subject in reasons
+        for rank, hit in zip(ranks, blast_hits.hits_at(query, ranks))
     ]
 
 
 def write_top_hits(
     output_file: str | Path,
     hit_rows: list[dict[str, str]],
-    blast_hits: dict[str, list[BlastHit]],
+    blast_hits: BlastTable,
     taxonomy_records: dict[str, TaxonomyRecord],
     reference_records: dict[str, ReferenceRecord],
     query_sequences: dict[str, str],
     top_hits: int,
+    cached_rows: Mapping[str, Sequence[Mapping[str, str]]] | None = None,
 ) -> None:
+    """Write the reported hits of every query.
+
+    Queries in ``cached_rows`` are written from those rows, with the record
+    columns of the current query, instead of from ``blast_hits``.
+    """
+
+    source_masks = source_subject_masks(blast_hits, reference_records)
     with Path(output_file).open("w", newline="") as output_handle:
         writer = csv.DictWriter(
             output_handle,
@@ -204,8 +213,17 @@ def write_top_hits(
         for row in hit_rows:
             query = row["name"]
             query_sequence = query_sequences.get(query, "")
+            if cached_rows is not None and query in cached_rows:
+                record = {
+                    "name": query,
+                    "sample": row["sample"],
+                    "model": row["model"],
+                    "query_sequence": query_sequence,
+                }
+                writer.writerows({**cached, **record} for cached in cached_rows[query])
+                continue
             reported_hits = select_reported_hits(
-                blast_hits.get(query, []), reference_records, top_hits
+                blast_hits, query, reference_records, top_hits, source_masks
             )
             for rank, hit, selection_reason in reported_hits:
                 taxonomy = taxonomy_records.get(hit.subject)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""Align, infer, and classify tree tasks.
+
+This is the only implementation of the per-query tree steps. ``TREE_CLASSIFY``
+runs one task with ``--task`` and gives cmalign the CPUs of the workflow task.
+``tree_reference_selection.py prepare --bundle-bases`` packs the tree tasks of
+a sample into bundles, and ``TREE_CLASSIFY_BUNDLE`` runs each task of a bundle
+in a worker process of a local pool with ``--bundle``. Bundle workers run
+cmalign with one CPU. IQ-TREE always runs with one thread. Neither output
+depends on the thread count, so every ``<query_key>`` directory is the same
+in both modes.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from reference_alignments import assemble_alignment, cmalign_match_command
+from tree_phylogeny import classify_tree, trim_alignment
+from tree_reference_selection import MARKERS, build_alignment_input
+
+INFERENCE_MODEL = "GTR+F+R4"
+
+
+@dataclass(frozen=True)
+class BundleSettings:
+    covariance_models: dict[str, Path]
+    alignment_stores: dict[str, Path]
+    maximum_gap_fraction: float
+    assignment_neighbors: int
+    cmalign: str = "cmalign"
+    iqtree: str = "iqtree3"
+    cmalign_cpu: int = 1
+
+
+def _marker_path(value: str) -> tuple[str, Path]:
+    marker, separator, path = value.partition("=")
+    if not separator or marker not in MARKERS or not path:
+        raise argparse.ArgumentTypeError("expected MARKER=PATH with MARKER 16S or 18S")
+    return marker, Path(path)
+
+
+def bundle_tasks(bundle: str | Path) -> list[Path]:
+    return sorted(task.parent for task in Path(bundle).glob("*/task.json"))
+
+
+def tool_versions(settings: BundleSettings) -> str:
+    """Return the ``tool_versions.txt`` text that each per-query task writes."""
+
+    cmalign = subprocess.run(
+        [settings.cmalign, "-h"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    iqtree = subprocess.run(
+        [settings.iqtree, "--version"], stdout=subprocess.PIPE, text=True, check=True
+    )
+    lines = cmalign.stdout.splitlines()
+    return (lines[0] + "\n" if lines else "") + iqtree.stdout
+
+
+def _outgroup(references_file: Path) -> str:
+    with references_file.open(newline="") as handle:
+        rows = list(csv.reader(handle, delimiter="\t"))
+    if len(rows) < 2 or not rows[-1] or not rows[-1][0]:
+        raise ValueError(f"Tree task has no outgroup reference: {references_file}")
+    return rows[-1][0]
+
+
+def classify_task(
+    task_directory: str | Path,
+    output_directory: str | Path,
+    settings: BundleSettings,
+    versions: str,
+) -> Path:
+    """Run the per-query tree steps of one task into ``output_directory/<query_key>``."""
+
+    task = json.loads((Path(task_directory) / "task.json").read_text())
+    key = task["query_key"]
+    marker = task["tree_marker"]
+    root = Path(output_directory)
+    output = root / key
+    shutil.copytree(task_directory, output)
+    store = settings.alignment_stores.get(marker)
+    # Commands run in output_directory, so a relative model path is anchored first.
+    cm_model = settings.covariance_models[marker].absolute()
+    if store is not None:
+        subprocess.run(
+            cmalign_match_command(
+                cm_model,
+                f"{key}/query.fna",
+                f"{key}/query.cmalign.fna",
+                cpu=settings.cmalign_cpu,
+                cmalign=settings.cmalign,
+            ),
+            cwd=root,
+            check=True,
+        )
+        assemble_alignment(
+            output, output / "query.cmalign.fna", store, output / "cmalign.fna"
+        )
+    else:
+        build_alignment_input(
+            output, output / "references.fna", output / "cmalign_input.fna"
+        )
+        subprocess.run(
+            [
+                settings.cmalign,
+                "--cpu", str(settings.cmalign_cpu),
+                "--outformat", "AFA",
+                "-o", f"{key}/cmalign.fna",
+                str(cm_model),
+                f"{key}/cmalign_input.fna",
+            ],
+            cwd=root,
+            check=True,
+        )
+    trim_alignment(
+        output / "cmalign.fna",
+        output / "cmalign.trimmed.fna",
+        output / "alignment_qc.json",
+        maximum_gap_fraction=settings.maximum_gap_fraction,
+        reference_alignment="joint" if store is None else "precomputed",
+    )
+    subprocess.run(
+        [
+            settings.iqtree,
+            "-s", f"{key}/cmalign.trimmed.fna",
+            "-st", "DNA",
+            "-m", INFERENCE_MODEL,
+            "-fast",
+            "-alrt", "1000",
+            "-keep-ident",
+            "-o", _outgroup(output / "references.tsv"),
+            "-T", "1",
+            "-seed", "1",
+            "-pre", f"{key}/iqtree",
+            "-redo",
+            "-quiet",
+        ],
+        cwd=root,
+        check=True,
+    )
+    classify_tree(
+        tree_file=output / "iqtree.treefile",
+        references_file=output / "references.tsv",
+        task_file=output / "task.json",
+        assignment_output=output / f"{key}.tree_assignment.tsv",
+        neighbors_output=output / f"{key}.tree_neighbors.tsv",
+        assignment_neighbors=settings.assignment_neighbors,
+        inference_model=INFERENCE_MODEL,
+    )
+    (output / "tool_versions.txt").write_text(versions)
+    return output
+
+
+def run_bundle(
+    bundle: str | Path,
+    output_directory: str | Path,
+    settings: BundleSettings,
+    workers: int = 1,
+) -> list[Path]:
+    """Classify every task of ``bundle``; return the per-query output directories."""
+
+    tasks = bundle_tasks(bundle)
+    if not tasks:
+        raise ValueError(f"Tree bundle contains no tasks: {bundle}")
+    versions = tool_versions(settings)
+    if workers == 1 or len(tasks) == 1:
+        return [
+            classify_task(task, output_directory, settings, versions) for task in tasks
+        ]
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+        futures = [
+            pool.submit(classify_task, task, output_directory, settings, versions)
+            for task in tasks
+        ]
+        return [future.result() for future in futures]
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Align, infer, and classify one tree task or a bundle of them."
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--task", type=Path)
+    source.add_argument("--bundle", type=Path)
+    parser.add_argument("--output-directory", default=".", type=Path)
+    parser.add_argument(
+        "--covariance-model", action="append", required=True, type=_marker_path
+    )
+    parser.add_argument(
+        "--reference-alignment", action="append", default=[], type=_marker_path
+    )
+    parser.add_argument("--maximum-gap-fraction", type=float, default=0.9)
+    parser.add_argument("--assignment-neighbors", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--cmalign-cpu", type=int, default=1)
+    parser.add_argument("--cmalign", default="cmalign")
+    parser.add_argument("--iqtree", default="iqtree3")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    settings = BundleSettings(
+        covariance_models=dict(args.covariance_model),
+        alignment_stores=dict(args.reference_alignment),
+        maximum_gap_fraction=args.maximum_gap_fraction,
+        assignment_neighbors=args.assignment_neighbors,
+        cmalign=args.cmalign,
+        iqtree=args.iqtree,
+        cmalign_cpu=args.cmalign_cpu,
+    )
+    if args.task is not None:
+        classify_task(args.task, args.output_directory, settings, tool_versions(settings))
+    else:
+        run_bundle(args.bundle, args.output_directory, settings, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,15 +8,40 @@ import json
 import math
 from pathlib import Path
 
+import numpy as np
 from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 
+from newick import NewickTree
 from taxonomy_utils import common_value, lowest_common_ancestor, taxonomy_path
 from tree_schema import REFERENCE_FIELDS, TREE_ASSIGNMENT_FIELDS, TREE_NEIGHBOR_FIELDS
 
 GAP_CHARACTERS = frozenset("-.~_")
 VALID_NUCLEOTIDES = frozenset("ACGTRYSWKMBDHVN")
+REFERENCE_ALIGNMENTS = ("joint", "precomputed")
+TREE_BACKENDS = ("newick", "ete4")
+
+_GAP = ord("-")
+# Byte lookup tables: gap characters become "-", letters are upper-cased, and
+# U becomes T. Non-ASCII residues never reach these tables.
+_NORMALIZE = np.arange(256, dtype=np.uint8)
+_NORMALIZE[np.frombuffer(b"abcdefghijklmnopqrstuvwxyz", dtype=np.uint8)] -= 32
+_NORMALIZE[[ord("U"), ord("u")]] = ord("T")
+_NORMALIZE[np.frombuffer("".join(sorted(GAP_CHARACTERS)).encode(), dtype=np.uint8)] = _GAP
+_INSERT = np.zeros(256, dtype=bool)
+_INSERT[np.frombuffer(b".abcdefghijklmnopqrstuvwxyz", dtype=np.uint8)] = True
+_VALID = np.zeros(256, dtype=bool)
+_VALID[np.frombuffer("".join(sorted(VALID_NUCLEOTIDES)).encode() + b"-", dtype=np.uint8)] = True
+
+
+def _normalized_characters(sequence: str) -> str:
+    return "".join(
+        "-"
+        if character in GAP_CHARACTERS
+        else ("T" if character.upper() == "U" else character.upper())
+        for character in sequence
+    )
 
 
 def trim_alignment(
@@ -25,9 +50,21 @@ def trim_alignment(
     qc_file: str | Path,
     *,
     maximum_gap_fraction: float = 0.9,
+    reference_alignment: str = "joint",
 ) -> dict[str, object]:
+    """Mask insert and high-gap columns and write the alignment QC.
+
+    ``reference_alignment`` records how the input was built: ``joint`` for one
+    cmalign run over the query and references, ``precomputed`` for a query row
+    stacked on stored match-column reference rows. Precomputed inputs have no
+    insert columns, so their QC counts fewer input and removed insert columns;
+    the trimmed alignment is the same.
+    """
+
     if not 0 <= maximum_gap_fraction < 1:
         raise ValueError("maximum_gap_fraction must be in [0, 1)")
+    if reference_alignment not in REFERENCE_ALIGNMENTS:
+        raise ValueError(f"Unsupported reference alignment: {reference_alignment}")
     with Path(input_file).open() as handle:
         records = list(SeqIO.parse(handle, "fasta"))
     if len(records) < 4:
@@ -44,49 +81,39 @@ def trim_alignment(
         raise ValueError("cmalign output is empty")
 
     raw_sequences = [str(record.seq) for record in records]
-    insert_columns = {
-        index
-        for index in range(input_columns)
-        if any(
-            sequence[index] == "." or sequence[index].islower()
-            for sequence in raw_sequences
+    if not all(sequence.isascii() for sequence in raw_sequences):
+        for record, raw_sequence in zip(records, raw_sequences, strict=True):
+            invalid = sorted(
+                set(_normalized_characters(raw_sequence)) - VALID_NUCLEOTIDES - {"-"}
+            ) or sorted(character for character in set(raw_sequence) if not character.isascii())
+            if invalid:
+                raise ValueError(
+                    f"Unexpected aligned nucleotide character(s) for {record.id}: "
+                    + ", ".join(invalid)
+                )
+    raw = np.frombuffer("".join(raw_sequences).encode("ascii"), dtype=np.uint8).reshape(
+        len(records), input_columns
+    )
+    insert_mask = _INSERT[raw].any(axis=0)
+
+    normalized = _NORMALIZE[raw]
+    invalid_rows = np.flatnonzero(~_VALID[normalized].all(axis=1))
+    if invalid_rows.size:
+        row = normalized[invalid_rows[0]]
+        invalid = sorted(set(row[~_VALID[row]].tobytes().decode("ascii")))
+        raise ValueError(
+            f"Unexpected aligned nucleotide character(s) for {records[invalid_rows[0]].id}: "
+            + ", ".join(invalid)
         )
-    }
 
-    normalized: list[str] = []
-    for record, raw_sequence in zip(records, raw_sequences, strict=True):
-        normalized_characters: list[str] = []
-        for character in raw_sequence:
-            if character in GAP_CHARACTERS:
-                normalized_characters.append("-")
-                continue
-            nucleotide = character.upper()
-            normalized_characters.append("T" if nucleotide == "U" else nucleotide)
-        sequence = "".join(normalized_characters)
-        invalid = sorted(set(sequence) - VALID_NUCLEOTIDES - {"-"})
-        if invalid:
-            raise ValueError(
-                f"Unexpected aligned nucleotide character(s) for {record.id}: "
-                + ", ".join(invalid)
-            )
-        normalized.append(sequence)
-
-    keep_columns = [
-        index
-        for index in range(input_columns)
-        if index not in insert_columns
-        and sum(sequence[index] == "-" for sequence in normalized) / len(normalized)
-        <= maximum_gap_fraction
-    ]
-    if not keep_columns:
+    gap_fraction = (normalized == _GAP).sum(axis=0) / len(records)
+    keep_columns = np.flatnonzero(~insert_mask & (gap_fraction <= maximum_gap_fraction))
+    if not keep_columns.size:
         raise ValueError("Gap trimming removed every alignment column")
+    trimmed = np.ascontiguousarray(normalized[:, keep_columns])
     trimmed_records = [
-        SeqRecord(
-            Seq("".join(sequence[index] for index in keep_columns)),
-            id=record.id,
-            description="",
-        )
-        for record, sequence in zip(records, normalized, strict=True)
+        SeqRecord(Seq(row.tobytes().decode("ascii")), id=record.id, description="")
+        for record, row in zip(records, trimmed, strict=True)
     ]
     query = next(record for record in trimmed_records if record.id == "QUERY")
     query_sites = sum(character != "-" for character in str(query.seq))
@@ -98,14 +125,15 @@ def trim_alignment(
         "schema_version": 1,
         "sequence_count": len(records),
         "input_columns": input_columns,
-        "retained_columns": len(keep_columns),
-        "removed_columns": input_columns - len(keep_columns),
-        "removed_insert_columns": len(insert_columns),
+        "retained_columns": int(keep_columns.size),
+        "removed_columns": input_columns - int(keep_columns.size),
+        "removed_insert_columns": int(insert_mask.sum()),
         "removed_high_gap_columns": (
-            input_columns - len(insert_columns) - len(keep_columns)
+            input_columns - int(insert_mask.sum()) - int(keep_columns.size)
         ),
         "maximum_gap_fraction": maximum_gap_fraction,
         "query_residue_columns": query_sites,
+        "reference_alignment": reference_alignment,
     }
     Path(qc_file).write_text(json.dumps(qc, indent=2, sort_keys=True) + "\n")
     return qc
@@ -155,6 +183,49 @@ def _format_number(value: float | None) -> str:
     return format(value, ".10g")
 
 
+def _query_distances(
+    tree_file: str | Path, leaf_ids: set[str], tree_backend: str
+) -> tuple[dict[str, float], float | None]:
+    """Return QUERY-to-reference distances and the support of the QUERY edge.
+
+    ``newick`` reads the tree with :class:`newick.NewickTree` in one traversal;
+    ``ete4`` is the reference implementation, kept for validation.
+    """
+
+    text = Path(tree_file).read_text().strip()
+    if tree_backend == "ete4":
+        from ete4 import Tree
+
+        tree = Tree(text)
+        leaf_names = set(tree.leaf_names())
+    elif tree_backend == "newick":
+        tree = NewickTree(text)
+        leaf_names = set(tree.leaves())
+    else:
+        raise ValueError(f"Unsupported tree backend: {tree_backend}")
+    expected = {"QUERY", *leaf_ids}
+    if leaf_names != expected:
+        raise ValueError(
+            "IQ-TREE leaves differ from the prepared alignment: "
+            f"missing={sorted(expected - leaf_names)[:5]}, "
+            f"extra={sorted(leaf_names - expected)[:5]}"
+        )
+    if tree_backend == "newick":
+        return tree.leaf_distances("QUERY")
+    query = tree["QUERY"]
+    distances = {
+        leaf_id: float(tree.get_distance(query, tree[leaf_id])) for leaf_id in leaf_ids
+    }
+    query_parent = query.parent
+    parent_support = None if query_parent is None else query_parent.support
+    edge_support = (
+        None
+        if query_parent is None or query_parent.is_root or parent_support is None
+        else float(parent_support)
+    )
+    return distances, edge_support
+
+
 def classify_tree(
     *,
     tree_file: str | Path,
@@ -164,32 +235,22 @@ def classify_tree(
     neighbors_output: str | Path,
     assignment_neighbors: int = 5,
     inference_model: str = "GTR+F+R4",
+    tree_backend: str = "newick",
 ) -> dict[str, str]:
     if assignment_neighbors < 1:
         raise ValueError("assignment_neighbors must be positive")
-    from ete4 import Tree
-
     task = json.loads(Path(task_file).read_text())
     if task.get("schema_version") != 1:
         raise ValueError("Unsupported tree-task schema")
     reference_rows = _read_reference_rows(references_file)
     by_leaf = {row["leaf_id"]: row for row in reference_rows}
-    tree = Tree(Path(tree_file).read_text().strip())
-    leaf_names = set(tree.leaf_names())
-    expected = {"QUERY", *by_leaf}
-    if leaf_names != expected:
-        raise ValueError(
-            "IQ-TREE leaves differ from the prepared alignment: "
-            f"missing={sorted(expected - leaf_names)[:5]}, "
-            f"extra={sorted(leaf_names - expected)[:5]}"
-        )
-    query = tree["QUERY"]
+    distances, edge_support = _query_distances(tree_file, set(by_leaf), tree_backend)
     neighbors: list[tuple[float, int, str, dict[str, str], tuple[str, ...], str, str]] = []
     for leaf_id, row in by_leaf.items():
         lineage, lineage_source, lineage_basis = _lineage(row)
         neighbors.append(
             (
-                float(tree.get_distance(query, tree[leaf_id])),
+                distances[leaf_id],
                 int(row["hit_rank"]),
                 leaf_id,
                 row,
@@ -225,13 +286,6 @@ def classify_tree(
         (neighbor[3]["compartment"] for neighbor in basis), conflict="mixed"
     )
     nearest = neighbors[0]
-    query_parent = query.parent
-    parent_support = None if query_parent is None else query_parent.support
-    edge_support = (
-        None
-        if query_parent is None or query_parent.is_root or parent_support is None
-        else float(parent_support)
-    )
     assignment = {
         "name": str(task["name"]),
         "sample": str(task["sample"]),
@@ -313,6 +367,7 @@ def parse_args() -> argparse.Namespace:
     trim.add_argument("--output", required=True)
     trim.add_argument("--qc", required=True)
     trim.add_argument("--maximum-gap-fraction", type=float, default=0.9)
+    trim.add_argument("--reference-alignment", choices=REFERENCE_ALIGNMENTS, default="joint")
 
     classify = subparsers.add_parser("classify")
     classify.add_argument("--tree", required=True)
@@ -322,6 +377,7 @@ def parse_args() -> argparse.Namespace:
     classify.add_argument("--neighbors-output", required=True)
     classify.add_argument("--assignment-neighbors", type=int, default=5)
     classify.add_argument("--inference-model", default="GTR+F+R4")
+    classify.add_argument("--tree-backend", choices=TREE_BACKENDS, default="newick")
     return parser.parse_args()
 
 
@@ -333,6 +389,7 @@ def main() -> None:
             args.output,
             args.qc,
             maximum_gap_fraction=args.maximum_gap_fraction,
+            reference_alignment=args.reference_alignment,
         )
     else:
         classify_tree(
@@ -343,6 +400,7 @@ def main() -> None:
             neighbors_output=args.neighbors_output,
             assignment_neighbors=args.assignment_neighbors,
             inference_model=args.inference_model,
+            tree_backend=args.tree_backend,
         )
 
 
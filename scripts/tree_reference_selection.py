@@ -6,13 +6,17 @@ import argparse
 import csv
 import hashlib
 import json
+import subprocess
+import tempfile
 from pathlib import Path
 
 from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 
-from annotate_hits import BlastHit, TaxonomyRecord, load_blast_hits, load_taxonomy_records
+from adaptive_blast import blastn_command
+from annotate_hits import TaxonomyRecord, load_m8_lines, load_taxonomy_records
+from blast_table import BlastHit, BlastTable, load_blast_table
 from top_hit_reporting import (
     ReferenceRecord,
     load_query_sequences,
@@ -29,7 +33,9 @@ def _hit_key(hit: BlastHit) -> tuple[float, float, int, str]:
     return (-hit.bit_score, -hit.percent_identity, -hit.alignment_length, hit.subject)
 
 
-def _parse_assignments(values: list[str], label: str) -> dict[str, str]:
+def _parse_assignments(
+    values: list[str], label: str, required: tuple[str, ...] = MARKERS
+) -> dict[str, str]:
     assignments: dict[str, str] = {}
     for value in values:
         key, separator, item = value.partition("=")
@@ -38,12 +44,110 @@ def _parse_assignments(values: list[str], label: str) -> dict[str, str]:
         if key in assignments:
             raise ValueError(f"Duplicate {label} assignment for {key}")
         assignments[key] = item
-    missing = sorted(set(MARKERS) - assignments.keys())
+    missing = sorted(set(required) - assignments.keys())
     if missing:
         raise ValueError(f"Missing {label} assignment(s): {', '.join(missing)}")
     return assignments
 
 
+def uncovered_queries(
+    blast_hits: BlastTable,
+    queries: list[str],
+    search_targets: int,
+    required_hits: int,
+) -> list[str]:
+    """Return the queries whose top ``required_hits`` a search may have missed.
+
+    A search that asked BLAST for ``search_targets`` subjects covers a query
+    when that is at least ``required_hits``, or when BLAST returned fewer
+    subjects than it was asked for and so found every hit of the query.
+    """
+
+    if search_targets >= required_hits:
+        return []
+    return [
+        query for query in queries if blast_hits.hit_count(query) >= search_targets
+    ]
+
+
+def route_blast_files(
+    *,
+    query_fasta: str | Path,
+    databases: dict[str, str | Path],
+    reused_marker: str,
+    reused_m8: str | Path,
+    reused_targets: int,
+    required_hits: int,
+    search_targets: int,
+    threads: int,
+    output_directory: str | Path,
+    blastn: str = "blastn",
+) -> dict[str, Path]:
+    """Write the tree-routing BLAST output of each marker, reusing one search.
+
+    ``reused_m8`` is an earlier search of ``query_fasta`` against the
+    database of ``reused_marker``, such as the annotation search of the
+    detected marker. Only the queries it does not cover are searched there
+    again; every query is searched against the other marker's database.
+    """
+
+    if reused_marker not in MARKERS:
+        raise ValueError(f"Unsupported reused BLAST marker: {reused_marker}")
+    sequences = load_query_sequences(query_fasta)
+    output = Path(output_directory)
+    blast_files = {marker: output / f"{marker}.tree_route.m8" for marker in MARKERS}
+    for marker in MARKERS:
+        if marker != reused_marker:
+            subprocess.run(
+                blastn_command(
+                    query_fasta,
+                    databases[marker],
+                    blast_files[marker],
+                    search_targets,
+                    threads,
+                    blastn,
+                ),
+                check=True,
+            )
+
+    uncovered: set[str] = set()
+    if reused_targets < required_hits:
+        uncovered = set(
+            uncovered_queries(
+                load_blast_table(reused_m8), list(sequences), reused_targets, required_hits
+            )
+        )
+    searched_lines: dict[str, list[str]] = {}
+    if uncovered:
+        uncovered_fasta = output / f"{reused_marker}.tree_route.uncovered.fna"
+        uncovered_m8 = output / f"{reused_marker}.tree_route.uncovered.m8"
+        with uncovered_fasta.open("w") as handle:
+            for name, sequence in sequences.items():
+                if name in uncovered:
+                    handle.write(f">{name}\n{sequence}\n")
+        subprocess.run(
+            blastn_command(
+                uncovered_fasta,
+                databases[reused_marker],
+                uncovered_m8,
+                search_targets,
+                threads,
+                blastn,
+            ),
+            check=True,
+        )
+        searched_lines = load_m8_lines(uncovered_m8)
+        uncovered_fasta.unlink()
+        uncovered_m8.unlink()
+    reused_lines = load_m8_lines(reused_m8)
+    with blast_files[reused_marker].open("w") as handle:
+        for name in sequences:
+            lines = searched_lines if name in uncovered else reused_lines
+            for rest in lines.get(name, []):
+                handle.write(name + rest)
+    return blast_files
+
+
 def _global_route_hits(
     hits_by_marker: dict[str, list[BlastHit]],
     detected_marker: str,
@@ -199,6 +303,7 @@ def prepare_tree_tasks(
     skipped_assignments_file: str | Path,
     reference_count: int = 100,
     route_hits: int = 100,
+    lookup_socket: str | Path | None = None,
 ) -> list[Path]:
     if reference_count < 3:
         raise ValueError("reference_count must be at least 3")
@@ -206,12 +311,12 @@ def prepare_tree_tasks(
         raise ValueError("route_hits must be positive")
     query_sequences = load_query_sequences(query_fasta)
     hits_by_marker = {
-        marker: load_blast_hits(blast_files[marker]) for marker in MARKERS
+        marker: load_blast_table(blast_files[marker]) for marker in MARKERS
     }
     observed_queries = {
         query
         for marker_hits in hits_by_marker.values()
-        for query in marker_hits
+        for query in marker_hits.queries
     }
     unknown_queries = sorted(observed_queries - query_sequences.keys())
     if unknown_queries:
@@ -220,21 +325,23 @@ def prepare_tree_tasks(
             + ", ".join(unknown_queries)
         )
     subjects = {
-        hit.subject
+        subject
         for marker_hits in hits_by_marker.values()
-        for hits in marker_hits.values()
-        for hit in hits
+        for subject in marker_hits.subjects
     }
-    taxonomy_records = load_taxonomy_records(taxonomy_file, subjects)
-    reference_records = load_reference_records(source_records_file, subjects)
+    taxonomy_records = load_taxonomy_records(taxonomy_file, subjects, lookup_socket)
+    reference_records = load_reference_records(source_records_file, subjects, lookup_socket)
     output = Path(output_directory)
     output.mkdir(parents=True, exist_ok=True)
     task_directories: list[Path] = []
     skipped_assignments: list[dict[str, str]] = []
 
+    # Routing reads at most the top route_hits subjects of each marker: each
+    # subject occurs once per marker, so deeper hits never enter the global top.
+    hit_limit = max(route_hits, reference_count)
     for query, sequence in query_sequences.items():
         query_hits = {
-            marker: hits_by_marker[marker].get(query, []) for marker in MARKERS
+            marker: hits_by_marker[marker].hits(query, hit_limit) for marker in MARKERS
         }
         selected_marker, decision, votes, best_scores = choose_marker(
             query_hits, detected_marker, route_hits
@@ -321,6 +428,99 @@ def prepare_tree_tasks(
     return task_directories
 
 
+def fetch_task_references(
+    task_directories: list[Path],
+    databases: dict[str, str | Path],
+    blastdbcmd: str = "blastdbcmd",
+) -> None:
+    """Write ``references.fna`` into each task with one fetch per marker database.
+
+    Tasks of a sample share most of their references, so the union of the
+    selected subjects is fetched once and sliced per task in reference order.
+    """
+
+    subjects_by_marker: dict[str, dict[str, None]] = {}
+    for task_directory in task_directories:
+        marker = json.loads((task_directory / "task.json").read_text())["tree_marker"]
+        subjects = subjects_by_marker.setdefault(marker, {})
+        for subject in (task_directory / "reference_ids.txt").read_text().split():
+            subjects.setdefault(subject)
+    fetched: dict[str, dict[str, SeqRecord]] = {}
+    if subjects_by_marker:
+        parent = task_directories[0].parent.parent
+        with tempfile.TemporaryDirectory(prefix=".tree-references.", dir=parent) as temporary:
+            for marker, subjects in subjects_by_marker.items():
+                entry_batch = Path(temporary) / f"{marker}.reference_ids.txt"
+                entry_batch.write_text("".join(f"{subject}\n" for subject in subjects))
+                reference_fasta = Path(temporary) / f"{marker}.references.fna"
+                subprocess.run(
+                    [
+                        blastdbcmd,
+                        "-db", str(databases[marker]),
+                        "-entry_batch", str(entry_batch),
+                        "-outfmt", "%f",
+                        "-out", str(reference_fasta),
+                    ],
+                    check=True,
+                )
+                records: dict[str, SeqRecord] = {}
+                with reference_fasta.open() as handle:
+                    for record in SeqIO.parse(handle, "fasta"):
+                        records.setdefault(record.id, record)
+                fetched[marker] = records
+    for task_directory in task_directories:
+        marker = json.loads((task_directory / "task.json").read_text())["tree_marker"]
+        records = fetched[marker]
+        with (task_directory / "references.fna").open("w") as handle:
+            SeqIO.write(
+                [
+                    records[subject]
+                    for subject in (task_directory / "reference_ids.txt").read_text().split()
+                    if subject in records
+                ],
+                handle,
+                "fasta",
+            )
+
+
+def bundle_tree_tasks(
+    task_directories: list[Path], bundle_bases: int, output_directory: str | Path
+) -> list[Path]:
+    """Move tasks, in order, into bundles of at most ``bundle_bases`` FASTA bytes.
+
+    A task's cost is estimated from the bytes of its query and fetched
+    reference FASTA files, which bound the residues cmalign aligns and the
+    alignment IQ-TREE searches; a larger task forms a bundle of its own.
+    """
+
+    if bundle_bases < 1:
+        raise ValueError("bundle_bases must be positive")
+    groups: list[list[Path]] = []
+    group: list[Path] = []
+    size = 0
+    for task_directory in task_directories:
+        task_bytes = sum(
+            (task_directory / name).stat().st_size
+            for name in ("query.fna", "references.fna")
+        )
+        if group and size + task_bytes > bundle_bases:
+            groups.append(group)
+            group, size = [], 0
+        group.append(task_directory)
+        size += task_bytes
+    if group:
+        groups.append(group)
+    width = len(str(len(groups)))
+    bundles: list[Path] = []
+    for index, members in enumerate(groups, start=1):
+        bundle = Path(output_directory) / f"bundle_{index:0{width}d}"
+        bundle.mkdir()
+        for task_directory in members:
+            task_directory.rename(bundle / task_directory.name)
+        bundles.append(bundle)
+    return bundles
+
+
 def build_alignment_input(
     task_directory: str | Path,
     reference_fasta: str | Path,
@@ -371,7 +571,30 @@ def parse_args() -> argparse.Namespace:
 
     prepare = subparsers.add_parser("prepare")
     prepare.add_argument("--query-fasta", required=True)
-    prepare.add_argument("--blast", action="append", required=True)
+    prepare.add_argument(
+        "--blast",
+        action="append",
+        default=[],
+        help="MARKER=M8 tree-routing search; omit to search with --database",
+    )
+    prepare.add_argument(
+        "--database",
+        action="append",
+        default=[],
+        help="MARKER=PREFIX BLAST database; tree references are fetched from it",
+    )
+    prepare.add_argument("--blastdbcmd", default="blastdbcmd")
+    prepare.add_argument(
+        "--reuse-blast",
+        help="MARKER=M8 earlier search of the query FASTA, such as the annotation search",
+    )
+    prepare.add_argument(
+        "--reuse-blast-targets",
+        type=int,
+        help="-max_target_seqs of the --reuse-blast search, or a lower bound of it",
+    )
+    prepare.add_argument("--search-targets", type=int, default=101)
+    prepare.add_argument("--threads", type=int, default=1)
     prepare.add_argument("--taxonomy-db", required=True)
     prepare.add_argument("--source-records-db", required=True)
     prepare.add_argument("--sample", required=True)
@@ -382,6 +605,13 @@ def parse_args() -> argparse.Namespace:
     prepare.add_argument("--route-hits", type=int, default=100)
     prepare.add_argument("--output-directory", required=True)
     prepare.add_argument("--skipped-assignments-output", required=True)
+    prepare.add_argument("--lookup-socket")
+    prepare.add_argument(
+        "--bundle-bases",
+        type=int,
+        default=0,
+        help="Pack tasks into bundles of up to this many FASTA bytes; 0 disables",
+    )
 
     alignment = subparsers.add_parser("alignment-input")
     alignment.add_argument("--task-directory", required=True)
@@ -393,9 +623,32 @@ def parse_args() -> argparse.Namespace:
 def main() -> None:
     args = parse_args()
     if args.command == "prepare":
-        prepare_tree_tasks(
+        databases = _parse_assignments(args.database, "BLAST database")
+        if args.blast:
+            blast_files = _parse_assignments(args.blast, "BLAST file")
+        else:
+            if args.reuse_blast is None or args.reuse_blast_targets is None:
+                raise ValueError(
+                    "prepare needs --blast for every marker, or --reuse-blast "
+                    "and --reuse-blast-targets"
+                )
+            ((reused_marker, reused_m8),) = _parse_assignments(
+                [args.reuse_blast], "reused BLAST file", required=()
+            ).items()
+            blast_files = route_blast_files(
+                query_fasta=args.query_fasta,
+                databases=databases,
+                reused_marker=reused_marker,
+                reused_m8=reused_m8,
+                reused_targets=args.reuse_blast_targets,
+                required_hits=max(args.route_hits, args.reference_count),
+                search_targets=args.search_targets,
+                threads=args.threads,
+                output_directory=Path.cwd(),
+            )
+        task_directories = prepare_tree_tasks(
             query_fasta=args.query_fasta,
-            blast_files=_parse_assignments(args.blast, "BLAST file"),
+            blast_files=blast_files,
             taxonomy_file=args.taxonomy_db,
             source_records_file=args.source_records_db,
             sample=args.sample,
@@ -406,7 +659,13 @@ def main() -> None:
             skipped_assignments_file=args.skipped_assignments_output,
             reference_count=args.reference_count,
             route_hits=args.route_hits,
+            lookup_socket=args.lookup_socket,
         )
+        fetch_task_references(task_directories, databases, args.blastdbcmd)
+        if args.bundle_bases:
+            bundle_tree_tasks(
+                task_directories, args.bundle_bases, args.output_directory
+            )
     else:
         build_alignment_input(
             args.task_directory,
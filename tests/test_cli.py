@@ -293,6 +293,44 @@ class DatabaseConfigTests(unittest.TestCase):
             "--database_profile curated --query /queries --outdir /output",
         )
 
+    def test_local_engine_runs_python_runner_with_database_arguments(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            python = Path(tmp) / "python"
+            python.write_text("#!/usr/bin/env bash\nprintf '%s\\n' \"$*\"\n")
+            python.chmod(0o755)
+            command = (
+                'source "$1"; shift; '
+                'resolve_database_profile() { printf "img\\n"; }; '
+                'resolve_database_path() { printf "/database\\n"; }; '
+                'write_database_config() { :; }; ensure_database() { :; }; '
+                'check_database_update() { :; }; run_pipeline "$@"'
+            )
+            for arguments in (
+                ["--engine", "local", "-q", "/queries"],
+                ["-q", "/queries", "--engine=local"],
+            ):
+                with self.subTest(arguments=arguments):
+                    result = subprocess.run(
+                        ["bash", "-c", command, "bash", str(CLI), *arguments],
+                        check=True,
+                        capture_output=True,
+                        text=True,
+                        env={**os.environ, "PYTHON": str(python)},
+                    )
+                    self.assertEqual(
+                        result.stdout.strip(),
+                        f"{REPO / 'scripts' / 'local_runner.py'} --database_path "
+                        "/database --database_profile img --query /queries",
+                    )
+            rejected = subprocess.run(
+                ["bash", "-c", command, "bash", str(CLI), "--engine", "spark"],
+                capture_output=True,
+                text=True,
+                env={**os.environ, "PYTHON": str(python)},
+            )
+        self.assertEqual(rejected.returncode, 2)
+        self.assertIn("--engine must be nextflow or local", rejected.stderr)
+
     def test_query_short_alias_preserves_paths_and_reaches_nextflow_as_query(self) -> None:
         cases = (
             (["-q", "/queries with spaces"], "/queries with spaces"),
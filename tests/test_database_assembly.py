@@ -16,10 +16,25 @@ sys.path.insert(0, str(REPO / "scripts"))
 import assemble_database_profile as assembler
 import build_database_release as builder
 import database_manager as manager
+from reference_alignments import load_reference_alignments
+from sequence_index import load_sequence_index
 
 
-def tiny_model() -> builder.DatabaseModel:
-    records = [
+# Writes each input sequence as a five-column match-only row; logs its arguments.
+MATCHONLY_CMALIGN = """#!/usr/bin/env python3
+import sys
+arguments = sys.argv[1:]
+with open(sys.argv[0] + ".calls", "a") as log:
+    log.write(" ".join(arguments) + "\\n")
+names = [line[1:].split()[0] for line in open(arguments[-1]) if line.startswith(">")]
+with open(arguments[arguments.index("-o") + 1], "w") as handle:
+    for name in names:
+        handle.write(f">{name}\\n{name[:5].upper():-<5}\\n")
+"""
+
+
+def tiny_records() -> list[builder.PreparedSourceRecord]:
+    return [
         builder.PreparedSourceRecord(
             "SILVA",
             "138.2",
@@ -64,7 +79,10 @@ def tiny_model() -> builder.DatabaseModel:
             "nucleus",
         ),
     ]
-    return builder.build_deduplicated_model(records)
+
+
+def tiny_model() -> builder.DatabaseModel:
+    return builder.build_deduplicated_model(tiny_records())
 
 
 class DatabaseAssemblyTests(unittest.TestCase):
@@ -140,6 +158,32 @@ class DatabaseAssemblyTests(unittest.TestCase):
                 {("PR2", "5.1.1"), ("SILVA", "138.2")},
             )
 
+    def test_streamed_release_stages_the_same_tables_marker_fasta_and_counts(self) -> None:
+        def staged_files(directory: Path) -> dict[str, bytes]:
+            return {
+                path.relative_to(directory).as_posix(): path.read_bytes()
+                for path in sorted(directory.rglob("*"))
+                if path.is_file()
+            }
+
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            expected = assembler._stage_model(root / "model", tiny_model(), ())
+            streamed = assembler._stage_stream(
+                root / "streamed",
+                assembler.StreamedRelease(
+                    builder.iter_sequence_groups(tiny_records(), memory_limit_bytes=1024),
+                    memory_limit_bytes=64 * 1024 * 1024,
+                ),
+                (),
+            )
+            self.assertEqual(streamed, expected)
+            self.assertEqual(dict(expected.marker_sequences), {"16S": 2, "18S": 2})
+            files = staged_files(root / "model")
+            self.assertIn("fasta/18S.fasta", files)
+            self.assertNotIn("tables/markers.fasta", files)
+            self.assertEqual(staged_files(root / "streamed"), files)
+
     def test_package_is_byte_deterministic_and_has_one_top_level_directory(self) -> None:
         with tempfile.TemporaryDirectory() as tmp:
             root = Path(tmp)
@@ -478,6 +522,52 @@ class DatabaseAssemblyTests(unittest.TestCase):
                     release_files={"../NOTICE.txt": notice},
                 )
 
+    def test_reference_alignments_store_match_rows_of_every_marker_sequence(self) -> None:
+        model = tiny_model()
+        marker_sequences = assembler._marker_sequences(model)
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            cmalign = root / "cmalign"
+            cmalign.write_text(MATCHONLY_CMALIGN)
+            cmalign.chmod(0o755)
+            cm_model = root / "RF01960.cm"
+            cm_model.write_text("INFERNAL1/a\n")
+            staging = root / "transaction" / "curated"
+            staging.mkdir(parents=True)
+            fasta = Path("fasta") / "18S.fasta"
+            builder.write_marker_fasta(staging / fasta, marker_sequences["18S"])
+
+            entry = assembler._align_references(
+                staging,
+                fasta,
+                "18S",
+                cm_model,
+                str(cmalign),
+                4,
+            )
+            store = staging / entry["path"]
+            sequence_ids = {record.sequence_id for record in marker_sequences["18S"]}
+            rows = load_reference_alignments(store, sequence_ids)
+            call = Path(f"{cmalign}.calls").read_text().split()
+            leftovers = list((root / "transaction").iterdir())
+            index = load_sequence_index(store)
+
+        self.assertEqual(
+            entry,
+            {
+                "path": "alignments/18S.RF01960.parquet",
+                "model": "RF01960",
+                "model_sha256": hashlib.sha256(b"INFERNAL1/a\n").hexdigest(),
+            },
+        )
+        self.assertEqual(
+            rows,
+            {sequence_id: sequence_id[:5].upper().ljust(5, "-") for sequence_id in sequence_ids},
+        )
+        self.assertEqual(call[:5], ["--matchonly", "--outformat", "AFA", "--cpu", "4"])
+        self.assertEqual(leftovers, [staging])
+        self.assertIsNotNone(index)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -7,12 +7,24 @@ import tempfile
 import unittest
 from dataclasses import replace
 from pathlib import Path
+from unittest.mock import patch
 
 
 REPO = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(REPO / "scripts"))
 
 import build_database_release as builder
+import database_release_io
+from benchmark_release_parquet import row_insert_parquet, run_benchmark
+from reference_lookup import SOURCE_RECORDS_TABLE, TAXONOMY_TABLE, read_rows
+from sequence_index import (
+    ROW_GROUP_ROWS,
+    build_sequence_index,
+    load_sequence_index,
+    parquet_relation,
+    sequence_index_path,
+)
+from taxonomy_index import load_taxonomy_index
 
 
 PR2_HEADER = (
@@ -280,6 +292,23 @@ class HeaderParserTests(unittest.TestCase):
         self.assertEqual(records[0].taxon_oid, "3300000305")
 
 
+def _bacterial_records(count: int, distinct_sequences: int) -> list:
+    """Prepared SILVA rows where many source records share each exact sequence."""
+
+    records = []
+    for index in range(count):
+        variant = (index * 7919) % distinct_sequences
+        sequence = "".join("ACGT"[(variant >> (2 * bit)) % 4] for bit in range(12)) + "ACGT"
+        records.append(
+            builder.PreparedSourceRecord(
+                "SILVA", "138.2", f"AB{index:06d}", f"AB{index:06d}.1 Bacteria",
+                sequence, "16S" if index % 5 else "18S",
+                ("Bacteria", "Proteobacteria", f"Genus{index % 3}"), "SILVA", "",
+            )
+        )
+    return records
+
+
 class SequenceModelTests(unittest.TestCase):
     def test_u_t_and_case_normalization_deduplicates_without_trimming(self) -> None:
         first = builder.PreparedSourceRecord(
@@ -299,6 +328,127 @@ class SequenceModelTests(unittest.TestCase):
         self.assertEqual(model.sequences[0].markers, ("18S",))
         self.assertEqual(len(expected_id), 47)
 
+    def test_spilled_deduplication_matches_in_memory_model(self) -> None:
+        records = _bacterial_records(600, 97)
+        expected = builder.build_deduplicated_model(records)
+        self.assertEqual(len(expected.sequences), 97)
+        with tempfile.TemporaryDirectory() as tmp:
+            spilled = builder.build_deduplicated_model(
+                reversed(records), memory_limit_bytes=16 * 1024, spill_directory=tmp
+            )
+            self.assertEqual(list(Path(tmp).iterdir()), [])
+        self.assertEqual(spilled, expected)
+        with self.assertRaisesRegex(builder.ReleaseValidationError, "Duplicate source"):
+            builder.build_deduplicated_model(
+                [*records, records[0]], memory_limit_bytes=16 * 1024
+            )
+
+    def test_streamed_derived_assignments_match_the_model_merge(self) -> None:
+        img = [
+            builder.PreparedSourceRecord(
+                "IMG", "2025", f"IMG_33000003{index:02d}.a_contig",
+                f"IMG_33000003{index:02d}.a_contig", sequence, "18S",
+                taxon_oid=f"33000003{index:02d}",
+            )
+            for index, sequence in enumerate(("ATGC", "ATGG", "ATGC", "CCGA"))
+        ]
+        records = [
+            *img,
+            builder.PreparedSourceRecord(
+                "PR2", "5.1.1", "pr2", "pr2", "ATGG", "18S",
+                ("Eukaryota", "TSAR"), "PR2", "nucleus",
+            ),
+        ]
+        rows = [
+            {
+                "source_identifier": record.source_identifier,
+                "taxonomy": "Eukaryota;TSAR",
+                "taxonomy_source": "PR2",
+                "method": "updated_reference_cluster",
+                "evidence": f"cluster C{index} matched PR2 sequence X",
+                "compartment": "nucleus",
+                "centroid_name": f"IMG_centroid_{index}",
+                "centroid_taxonomy": "Eukaryota;TSAR;Alveolata",
+                "centroid_taxonomy_source": "PR2",
+            }
+            for index, record in enumerate(img)
+        ]
+        model = builder.build_deduplicated_model(records)
+        expected = builder.add_taxonomy_assignments(
+            model, builder.ingest_derived_cluster_assignments(rows, model.source_records)
+        )
+        groups = list(
+            builder.iter_groups_with_derived_assignments(
+                builder.iter_sequence_groups(records, memory_limit_bytes=2048), rows
+            )
+        )
+        self.assertEqual(tuple(group.sequence for group in groups), expected.sequences)
+        self.assertEqual(
+            tuple(
+                sorted(
+                    (row for group in groups for row in group.taxonomy_assignments),
+                    key=lambda assignment: assignment.taxonomy_assignment_id,
+                )
+            ),
+            expected.taxonomy_assignments,
+        )
+        self.assertEqual(
+            tuple(group.preferred_taxonomy for group in groups), expected.preferred_taxonomy
+        )
+        with self.assertRaisesRegex(builder.TaxonomyError, "assignment row 5"):
+            list(
+                builder.iter_groups_with_derived_assignments(
+                    builder.iter_sequence_groups(records),
+                    [*rows, {**rows[0], "source_identifier": "IMG_absent.a_contig"}],
+                )
+            )
+
+    def test_parallel_hashing_keeps_input_order_and_model(self) -> None:
+        records = _bacterial_records(300, 41)
+        serial = list(builder.identify_source_records(records))
+        self.assertEqual(
+            list(builder.identify_source_records(records, workers=2, batch_records=7)),
+            serial,
+        )
+        self.assertEqual(
+            [sequence_id for sequence_id, _ in serial],
+            [builder.sequence_identifier(record.sequence) for record in records],
+        )
+        self.assertEqual(
+            builder.build_deduplicated_model(records, workers=2),
+            builder.build_deduplicated_model(records),
+        )
+        invalid = replace(records[150], sequence="MEEP")
+        with self.assertRaisesRegex(
+            builder.FastaFormatError, "Invalid nucleotide SILVA record AB000150"
+        ):
+            list(
+                builder.identify_source_records(
+                    [*records[:150], invalid], workers=2, batch_records=16
+                )
+            )
+
+    def test_release_validation_rehashes_only_sequences_it_did_not_build(self) -> None:
+        model = builder.build_deduplicated_model(_bacterial_records(40, 43), workers=2)
+        with patch.object(
+            database_release_io,
+            "sequence_identifier",
+            side_effect=database_release_io.sequence_identifier,
+        ) as rehash:
+            builder.validate_release(model)
+            builder.validate_release(builder.add_taxonomy_assignments(model, ()))
+            self.assertEqual(rehash.call_count, 0)
+            first = model.sequences[0]
+            tampered = replace(
+                model,
+                sequences=(replace(first, sequence=first.sequence + "A"), *model.sequences[1:]),
+            )
+            with self.assertRaisesRegex(
+                builder.ReleaseValidationError, "invalid sequence hash"
+            ):
+                builder.validate_release(tampered)
+            self.assertEqual(rehash.call_count, len(model.sequences))
+
     def test_hash_does_not_trim_or_reverse_complement(self) -> None:
         self.assertNotEqual(builder.sequence_identifier("ATGC"), builder.sequence_identifier("ATG"))
         self.assertNotEqual(builder.sequence_identifier("ATGC"), builder.sequence_identifier("GCAT"))
@@ -319,6 +469,8 @@ class SequenceModelTests(unittest.TestCase):
     def test_rejects_invalid_nucleotide_record(self) -> None:
         with self.assertRaisesRegex(builder.FastaFormatError, "Invalid nucleotide"):
             list(builder.iter_fasta_lines([">protein\n", "MEEP\n"]))
+        unchecked = list(builder.iter_fasta_lines([">protein\n", "MEEP\n"], validate=False))
+        self.assertEqual(unchecked[0].sequence, "MEEP")
 
     def test_marker_fasta_is_stable_and_sorted(self) -> None:
         records = [
@@ -966,6 +1118,206 @@ class PrivacyAndOutputTests(unittest.TestCase):
                 }.issubset(preferred_columns)
             )
 
+    def test_streamed_build_matches_in_memory_build_byte_for_byte(self) -> None:
+        records = _bacterial_records(ROW_GROUP_ROWS + 500, 4096)
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            prepared = root / "records.jsonl"
+            prepared.write_text(
+                "".join(
+                    json.dumps(
+                        {**record.__dict__, "taxonomy": list(record.taxonomy)}
+                    )
+                    + "\n"
+                    for record in records
+                ),
+                encoding="utf-8",
+            )
+            for name, options in (
+                ("memory", []),
+                ("streamed", ["--memory-limit-mib", "64", "--spill-directory", str(root)]),
+            ):
+                builder.main(
+                    [
+                        "build-prepared",
+                        "--records-jsonl",
+                        str(prepared),
+                        "--output",
+                        str(root / name),
+                        *options,
+                    ]
+                )
+            names = sorted(path.name for path in (root / "memory").iterdir())
+            self.assertIn("preferred_taxonomy.sequence_index.json", names)
+            self.assertEqual(sorted(path.name for path in (root / "streamed").iterdir()), names)
+            for name in names:
+                self.assertEqual(
+                    (root / "streamed" / name).read_bytes(),
+                    (root / "memory" / name).read_bytes(),
+                    name,
+                )
+
+    def test_preferred_taxon_ids_name_nodes_of_the_released_taxonomy(self) -> None:
+        records = _bacterial_records(30, 12)
+        model = builder.build_deduplicated_model(records)
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp)
+            builder.write_release_tables(output, model)
+            index = load_taxonomy_index(output / "preferred_taxonomy.parquet")
+            import duckdb
+
+            connection = duckdb.connect(":memory:")
+            try:
+                rows = connection.execute(
+                    "SELECT taxonomy, taxon_id FROM read_parquet(?)",
+                    [str(output / "preferred_taxonomy.parquet")],
+                ).fetchall()
+            finally:
+                connection.close()
+        self.assertIsNotNone(index)
+        self.assertEqual(len(rows), len(model.sequences))
+        for taxonomy, taxon_id in rows:
+            self.assertEqual(index.path(taxon_id), tuple(taxonomy.split(";")))
+        self.assertEqual(
+            index.lowest_common_path(taxon_id for _taxonomy, taxon_id in rows),
+            ("Bacteria", "Proteobacteria"),
+        )
+
+    def test_lookup_tables_are_written_with_sequence_indexes(self) -> None:
+        record = builder.PreparedSourceRecord(
+            "PR2", "5.1.1", "euk", PR2_HEADER, "ATGC", "18S",
+            ("Eukaryota", "TSAR"), "PR2", "nucleus",
+        )
+        model = builder.build_deduplicated_model([record])
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp)
+            builder.write_release_tables(output, model)
+            for name in ("preferred_taxonomy.parquet", "source_records.parquet"):
+                table = output / name
+                index = json.loads(sequence_index_path(table).read_text())
+                self.assertEqual(index["parquet"], name)
+                self.assertEqual(index["parquet_bytes"], table.stat().st_size)
+                self.assertEqual(
+                    index["row_groups"],
+                    [[model.sequences[0].sequence_id, model.sequences[0].sequence_id, 1]],
+                )
+            self.assertFalse(sequence_index_path(output / "sequences.parquet").exists())
+
+    def test_sequence_index_limits_lookups_to_needed_row_groups(self) -> None:
+        import duckdb
+
+        with tempfile.TemporaryDirectory() as tmp:
+            taxonomy_file = Path(tmp) / "preferred_taxonomy.parquet"
+            source_file = Path(tmp) / "source_records.parquet"
+            connection = duckdb.connect(":memory:")
+            try:
+                connection.execute("SET threads = 1")
+                connection.execute(
+                    """
+                    COPY (
+                        SELECT printf('SSU_%06d', i) AS sequence_id, 'SILVA' AS reference_source,
+                               'Bacteria' AS taxonomy, 'SILVA' AS taxonomy_source,
+                               'Bacteria' AS domain, '' AS compartment,
+                               'source' AS assignment_method, false AS cross_domain_conflict,
+                               '' AS taxonomy_alternatives
+                        FROM range(6144) AS r(i) ORDER BY sequence_id
+                    ) TO ? (FORMAT PARQUET, ROW_GROUP_SIZE 2048)
+                    """,
+                    [str(taxonomy_file)],
+                )
+                connection.execute(
+                    """
+                    COPY (
+                        SELECT printf('SSU_%06d', i // 3) AS sequence_id,
+                               'SILVA' AS reference_source, '138.2' AS source_version,
+                               printf('AB%d', i) AS source_identifier
+                        FROM range(6146) AS r(i) ORDER BY i
+                    ) TO ? (FORMAT PARQUET, ROW_GROUP_SIZE 2048)
+                    """,
+                    [str(source_file)],
+                )
+                for table in (taxonomy_file, source_file):
+                    row_groups = connection.execute(
+                        "SELECT stats_min_value, stats_max_value, row_group_num_rows "
+                        "FROM parquet_metadata(?) WHERE path_in_schema = 'sequence_id' "
+                        "ORDER BY row_group_id",
+                        [str(table)],
+                    ).fetchall()
+                    sequence_index_path(table).write_text(
+                        json.dumps(
+                            build_sequence_index(table.name, table.stat().st_size, row_groups)
+                        )
+                    )
+            finally:
+                connection.close()
+
+            ranges = load_sequence_index(taxonomy_file)
+            self.assertEqual(len(ranges), 3)
+            subjects = {"SSU_000007", f"SSU_{2 * 2048 + 5:06d}", "SSU_absent"}
+            relation, parameters = parquet_relation(taxonomy_file, subjects)
+            self.assertEqual(relation.count("read_parquet(?)"), 2)
+            self.assertEqual(parameters[1:3], list(ranges[0]))
+            self.assertEqual(
+                sorted(row[0] for row in read_rows(TAXONOMY_TABLE, taxonomy_file, subjects)),
+                sorted(subjects - {"SSU_absent"}),
+            )
+            self.assertIn("LIMIT 0", parquet_relation(taxonomy_file, {"SSU_absent"})[0])
+
+            # Identifiers at row-group boundaries span two groups of source rows.
+            boundaries = {
+                key for first, last in load_sequence_index(source_file) for key in (first, last)
+            }
+            pruned = read_rows(SOURCE_RECORDS_TABLE, source_file, boundaries)
+            self.assertEqual(len(pruned), 3 * len(boundaries) - 1)
+            sequence_index_path(source_file).unlink()
+            self.assertEqual(pruned, read_rows(SOURCE_RECORDS_TABLE, source_file, boundaries))
+
+            index = json.loads(sequence_index_path(taxonomy_file).read_text())
+            index["parquet_bytes"] += 1
+            sequence_index_path(taxonomy_file).write_text(json.dumps(index))
+            self.assertIsNone(load_sequence_index(taxonomy_file))
+            self.assertEqual(
+                parquet_relation(taxonomy_file, subjects),
+                ("read_parquet(?)", [str(taxonomy_file)]),
+            )
+            with self.assertRaisesRegex(ValueError, "not sorted"):
+                build_sequence_index(
+                    "table.parquet", 1, [("SSU_1", "SSU_3", 2), ("SSU_2", "SSU_4", 2)]
+                )
+
+    def test_columnar_parquet_writes_match_row_inserts_byte_for_byte(self) -> None:
+        columns = (
+            ("sequence_id", "VARCHAR"),
+            ("length", "BIGINT"),
+            ("cross_domain_conflict", "BOOLEAN"),
+            ("taxon_oid", "VARCHAR"),
+            ("centroid_names", "VARCHAR"),
+            ("latitude", "DOUBLE"),
+        )
+        rows = [
+            (
+                f"SSU_{index:05d}",
+                index * 7,
+                index % 3 == 0,
+                None,
+                None if index % 5 == 0 else f"Ménage_{index % 11}",
+                None if index % 4 == 0 else index / 13 - 80,
+            )
+            for index in range(1200)
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            columnar = database_release_io._write_parquet(
+                Path(tmp) / "columnar.parquet", columns, rows
+            )
+            row_wise = row_insert_parquet(Path(tmp) / "row_wise.parquet", columns, rows)
+            self.assertEqual(columnar.read_bytes(), row_wise.read_bytes())
+
+    def test_release_parquet_benchmark_compares_both_write_paths(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            seconds = run_benchmark(300, Path(tmp))
+        self.assertEqual(list(seconds), ["row_inserts", "column_buffers"])
+        self.assertTrue(all(value > 0 for value in seconds.values()))
+
 
 class FetchTests(unittest.TestCase):
     def test_fetch_rejects_non_https_source(self) -> None:
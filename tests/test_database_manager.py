@@ -1,6 +1,7 @@
 import hashlib
 import io
 import json
+import os
 import subprocess
 import sys
 import tarfile
@@ -208,6 +209,52 @@ class DatabaseManagerTests(unittest.TestCase):
                 manager.validate_profile_directory(directory, "curated")
         run.assert_not_called()
 
+    @mock.patch.object(manager.subprocess, "run", side_effect=blast_ok)
+    def test_fast_validation_trusts_ledger_for_unchanged_artifacts(self, run) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = write_profile(Path(tmp))
+            os.utime(directory / "blast" / "ssu.unusual", ns=(10**18, 10**18))
+            manager.validate_profile_directory(directory, "curated")
+            self.assertTrue((directory / manager.VALIDATION_LEDGER_NAME).is_file())
+            run.reset_mock()
+            with mock.patch.object(manager, "_sha256", wraps=manager._sha256) as digest:
+                manager.validate_profile_directory(directory, "curated", full=False)
+            self.assertEqual(
+                [call.args[0].name for call in digest.call_args_list],
+                [manager.MANIFEST_NAME],
+            )
+            run.assert_not_called()
+
+            manager.validate_profile(Path(tmp), "curated", full=True)
+        run.assert_called_once()
+
+    @mock.patch.object(manager.subprocess, "run", side_effect=blast_ok)
+    def test_fast_validation_rehashes_artifacts_with_changed_stat_signature(self, run) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = write_profile(Path(tmp))
+            artifact = directory / "blast" / "ssu.unusual"
+            os.utime(artifact, ns=(10**18, 10**18))
+            manager.validate_profile_directory(directory, "curated")
+            artifact.write_bytes(b"blast-INDEX")
+            os.utime(artifact, ns=(10**18 + 1, 10**18 + 1))
+            with self.assertRaisesRegex(manager.IntegrityError, "SHA-256 mismatch"):
+                manager.validate_profile_directory(directory, "curated", full=False)
+
+    @mock.patch.object(manager.subprocess, "run", side_effect=blast_ok)
+    def test_ledger_is_ignored_after_manifest_change(self, run) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = write_profile(Path(tmp))
+            os.utime(directory / "blast" / "ssu.unusual", ns=(10**18, 10**18))
+            manager.validate_profile_directory(directory, "curated")
+            write_profile(Path(tmp), version="test-2")
+            os.utime(directory / "blast" / "ssu.unusual", ns=(10**18, 10**18))
+            run.reset_mock()
+            manager.validate_profile_directory(directory, "curated", full=False)
+            ledger = json.loads((directory / manager.VALIDATION_LEDGER_NAME).read_text())
+            manifest_digest = sha256((directory / manager.MANIFEST_NAME).read_bytes())
+        run.assert_called_once()
+        self.assertEqual(ledger["manifest_sha256"], manifest_digest)
+
     def test_manifest_rejects_artifact_traversal(self) -> None:
         with tempfile.TemporaryDirectory() as tmp:
             directory = Path(tmp) / "curated"
@@ -1,19 +1,30 @@
+import random
 import sys
 import tempfile
 import unittest
 from dataclasses import replace
 from pathlib import Path
+from unittest.mock import patch
+
+from Bio import SeqIO
 
 
 REPO = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(REPO / "scripts"))
 
+import extract_hits
+import hit_processing
+import resolve_model_hits
+from assembly_shards import read_window_map, shard_assembly
+from fasta_index import FastaIndexEntry, FastaIndexError, build_fasta_index
 from get_cmsequences import parse_seqmap
 from hit_processing import (
     CmHit,
     CmModel,
     ExtractionRegion,
+    extract_model_regions,
     extract_regions,
+    merge_window_hits,
     parse_cmsearch_tblout,
     read_accepted_hits,
     read_covariance_model,
@@ -58,6 +69,61 @@ def hit(
     )
 
 
+def synthetic_hits(count: int, seed: int = 177) -> list[CmHit]:
+    """Dense two-model cmsearch hits resembling a metagenome co-assembly."""
+
+    generator = random.Random(seed)
+    contigs = max(1, count // 50)
+    hits = []
+    for index in range(count):
+        start = generator.randint(1, 200_000)
+        model_accession = generator.choice(("RF00177", "RF01960"))
+        hits.append(
+            hit(
+                subject=f"contig{generator.randrange(contigs)}",
+                model_accession=model_accession,
+                model_from=1,
+                model_to=1500,
+                sequence_from=start,
+                sequence_to=start + generator.randint(100, 1800),
+                strand=generator.choice("+-"),
+                bit_score=1000.0 - index * 1e-3,
+                e_value=1e-30 * (1 + index),
+            )
+        )
+    return hits
+
+
+def quadratic_resolution(hits: list[CmHit]) -> list[CmHit]:
+    """The original all-pairs resolver, retained as the equivalence oracle."""
+
+    accepted: list[CmHit] = []
+    for candidate in sorted(
+        hits,
+        key=lambda item: (
+            item.e_value,
+            -item.bit_score,
+            item.model_accession,
+            item.subject,
+            item.sequence_start,
+            item.sequence_end,
+            item.strand,
+            item.model_start,
+            item.model_end,
+        ),
+    ):
+        if not any(
+            winner.subject == candidate.subject
+            and winner.strand == candidate.strand
+            and winner.model_accession != candidate.model_accession
+            and winner.sequence_start <= candidate.sequence_end
+            and candidate.sequence_start <= winner.sequence_end
+            for winner in accepted
+        ):
+            accepted.append(candidate)
+    return accepted
+
+
 class CmsearchParsingTests(unittest.TestCase):
     def test_description_with_spaces_stays_in_last_field(self) -> None:
         with tempfile.TemporaryDirectory() as tmp:
@@ -332,6 +398,76 @@ class CompetingModelTests(unittest.TestCase):
         with self.assertRaisesRegex(ValueError, "Indistinguishable competing"):
             resolve_competing_model_hits([left, right])
 
+    def test_indexed_resolution_matches_all_pairs_resolution(self) -> None:
+        hits = synthetic_hits(3000)
+        resolved = resolve_competing_model_hits(hits)
+        self.assertCountEqual(resolved, quadratic_resolution(hits))
+        self.assertEqual(
+            resolved,
+            sorted(
+                resolved,
+                key=lambda item: (
+                    item.model_accession,
+                    item.subject,
+                    item.sequence_start,
+                    item.sequence_end,
+                    item.strand,
+                    item.model_start,
+                    item.model_end,
+                ),
+            ),
+        )
+
+    def test_resolution_probes_grow_linearly_from_10k_to_100k_hits(self) -> None:
+        probes = {}
+        for count in (10_000, 100_000):
+            indexes = []
+
+            class RecordingIndex(hit_processing._AcceptedHitIndex):
+                def __init__(self) -> None:
+                    super().__init__()
+                    indexes.append(self)
+
+            hits = synthetic_hits(count)
+            with patch.object(hit_processing, "_AcceptedHitIndex", RecordingIndex):
+                resolved = resolve_competing_model_hits(hits)
+            self.assertLess(len(resolved), len(hits))
+            probes[count] = indexes[0].probes
+        # Contig density is fixed, so ten times the hits costs about ten times
+        # the probes; the all-pairs resolver would need about a hundred times.
+        self.assertLess(probes[100_000], 100_000)
+        self.assertLess(probes[100_000], 12 * probes[10_000])
+
+    def test_long_accepted_interval_is_found_from_distant_start(self) -> None:
+        long_winner = hit(
+            model_accession="RF00177",
+            model_from=1,
+            model_to=1500,
+            sequence_from=1,
+            sequence_to=5000,
+            e_value=1e-50,
+        )
+        short_same_model = hit(
+            model_accession="RF00177",
+            model_from=1,
+            model_to=10,
+            sequence_from=4000,
+            sequence_to=4010,
+            e_value=1e-40,
+        )
+        late_competitor = hit(
+            model_accession="RF01960",
+            model_from=1,
+            model_to=10,
+            sequence_from=4900,
+            sequence_to=4950,
+            e_value=1e-10,
+        )
+        self.assertEqual(
+            resolve_competing_model_hits([late_competitor, short_same_model, long_winner]),
+            [long_winner, short_same_model],
+        )
+
     def test_select_model_hits_uses_name_and_accession(self) -> None:
         accepted = hit(
             model_accession="RF00177",
@@ -497,6 +633,135 @@ class SequenceExtractionTests(unittest.TestCase):
                 minimum_length=0,
             )
 
+    def test_indexed_extraction_matches_parsed_extraction(self) -> None:
+        generator = random.Random(9)
+        contigs = {
+            name: "".join(generator.choice("ACGTacgtN") for _ in range(length))
+            for name, length in (("wrapped", 203), ("single", 17), ("crlf", 64))
+        }
+        layout = (
+            ">wrapped first contig\n"
+            + "".join(contigs["wrapped"][i : i + 10] + "\n" for i in range(0, 203, 10))
+            + "\n>other\nACGT\n>other\nACGT\n>single\n"
+            + contigs["single"]
+            + "\n>crlf\r\n"
+            + "".join(contigs["crlf"][i : i + 8] + "\r\n" for i in range(0, 64, 8))
+        )
+        self.fasta.write_bytes(layout.encode("ascii"))
+        regions = [
+            ExtractionRegion(name, start, end, strand, "simple", False)
+            for name, sequence in contigs.items()
+            for start, end in ((1, len(sequence)), (10, 11), (9, len(sequence) - 3))
+            for strand in "+-"
+        ]
+        parsed = extract_regions(self.fasta, regions, minimum_length=0, indexed=False)
+        self.assertEqual(extract_regions(self.fasta, regions, minimum_length=0), parsed)
+        self.assertEqual(parsed[0].sequence, contigs["wrapped"])
+        self.assertEqual(
+            build_fasta_index(self.fasta)[0], FastaIndexEntry("wrapped", 203, 22, 10, 11)
+        )
+        # The index lives in memory; nothing is written beside the input FASTA.
+        self.assertEqual(list(self.fasta.parent.iterdir()), [self.fasta])
+        self.assertEqual(extract_regions(self.fasta, regions, minimum_length=5), [
+            record for record in parsed if len(record.sequence) >= 5
+        ])
+
+        for subject, start, end, message in (
+            ("other", 1, 2, "Duplicate FASTA identifier: other"),
+            ("single", 3, 18, r"Invalid 1-based inclusive interval for single: 3-18 "
+             r"\(sequence length 17\)"),
+            ("absent", 1, 2, "missing from FASTA: absent"),
+        ):
+            for indexed in (True, False):
+                with self.assertRaisesRegex(ValueError, message):
+                    extract_regions(
+                        self.fasta,
+                        [ExtractionRegion(subject, start, end, "+", "simple", False)],
+                        minimum_length=0,
+                        indexed=indexed,
+                    )
+
+    def test_unevenly_wrapped_fasta_falls_back_to_parsing(self) -> None:
+        self.fasta.write_text(">contig1\nAACC\nGG\nTTA\n")
+        with self.assertRaisesRegex(FastaIndexError, "uneven line wrapping"):
+            build_fasta_index(self.fasta)
+        records = extract_regions(
+            self.fasta,
+            [ExtractionRegion("contig1", 3, 8, "-", "simple", False)],
+            minimum_length=0,
+        )
+        self.assertEqual(records[0].sequence, "AACCGG")
+
+    def test_per_sample_extraction_matches_one_run_per_model(self) -> None:
+        root = Path(self.tempdir.name)
+        generator = random.Random(10)
+        contigs = {
+            f"contig{index}": "".join(generator.choice("ACGT") for _ in range(2400))
+            for index in range(3)
+        }
+        self.fasta.write_text(
+            "".join(
+                f">{name}\n" + "".join(
+                    sequence[i : i + 60] + "\n" for i in range(0, len(sequence), 60)
+                )
+                for name, sequence in contigs.items()
+            )
+        )
+        accepted = root / "accepted-hits.tsv"
+        write_accepted_hits(
+            [
+                hit(subject="contig0", model_from=1, model_to=1533,
+                    sequence_from=101, sequence_to=1633),
+                hit(subject="contig1", model_from=20, model_to=1500,
+                    sequence_from=2300, sequence_to=820, strand="-"),
+                hit(subject="contig2", model_from=1, model_to=1851,
+                    sequence_from=201, sequence_to=2051, model_accession="RF01960"),
+            ],
+            accepted,
+        )
+        models = {
+            label: REPO / "resources/models" / f"{label}.cm"
+            for label in ("RF00177", "RF01960")
+        }
+        common = [
+            "--fasta", str(self.fasta), "--sample", "S1",
+            "--accepted-hits", str(accepted), "--minimum-length", "100",
+        ]
+        extract_hits.main(
+            [arg for model_file in models.values()
+             for arg in ("--model-file", str(model_file))]
+            + common
+            + ["--output-directory", str(root / "sample")]
+        )
+        for label, model_file in models.items():
+            single = root / label
+            extract_hits.main(
+                ["--model-file", str(model_file), "--model", label, *common,
+                 "--fasta-output", f"{single}.fna",
+                 "--hits-output", f"{single}.hits.tsv",
+                 "--metadata-output", f"{single}.meta.tsv"]
+            )
+            for suffix in (".fna", ".hits.tsv", ".meta.tsv"):
+                self.assertEqual(
+                    (root / "sample" / f"S1_{label}{suffix}").read_bytes(),
+                    Path(f"{single}{suffix}").read_bytes(),
+                )
+        self.assertEqual(
+            (root / "sample" / "S1_RF00177.fna").read_text().count(">"), 2
+        )
+
+        regions = {
+            "first": [ExtractionRegion("contig0", 1, 50, "+", "simple", False)],
+            "second": [ExtractionRegion("contig0", 40, 90, "-", "simple", False)],
+        }
+        self.assertEqual(
+            extract_model_regions(self.fasta, regions, minimum_length=0),
+            {
+                label: extract_regions(self.fasta, model_regions, minimum_length=0)
+                for label, model_regions in regions.items()
+            },
+        )
+
     def test_seqmap_without_final_newline_keeps_last_record(self) -> None:
         seqmap = Path(self.tempdir.name) / "input.seqmap"
         seqmap.write_text("contig1\t1\t4\t+\tsimple")
@@ -505,5 +770,159 @@ class SequenceExtractionTests(unittest.TestCase):
         self.assertEqual(records[0].sequence, "AACC")
 
 
+class ShardedSearchTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tempdir.name)
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def test_shards_are_balanced_and_windows_rebuild_each_contig(self) -> None:
+        generator = random.Random(13)
+        contigs = {
+            f"contig{index}": "".join(generator.choice("ACGT") for _ in range(length))
+            for index, length in enumerate((2500, 900, 400, 1200, 300, 0))
+        }
+        assembly = self.root / "assembly.fna"
+        assembly.write_text(
+            "".join(
+                f">{name} description\n"
+                + "".join(
+                    sequence[start : start + 60] + "\n"
+                    for start in range(0, len(sequence), 60)
+                )
+                for name, sequence in contigs.items()
+            )
+        )
+        output = self.root / "shards"
+        shards = shard_assembly(
+            assembly, output, shard_bases=1500, window_bases=1000, overlap_bases=200
+        )
+        windows = read_window_map(output / "windows.json")
+
+        records = {}
+        sizes = []
+        for shard in shards:
+            shard_records = {
+                record.id: str(record.seq) for record in SeqIO.parse(shard, "fasta")
+            }
+            sizes.append(sum(map(len, shard_records.values())))
+            records.update(shard_records)
+        self.assertEqual(len(shards), 4)
+        self.assertLessEqual(max(sizes) - min(sizes), 1000)
+        self.assertEqual(
+            sorted(windows),
+            [
+                "contig0/1-1000",
+                "contig0/1601-2500",
+                "contig0/801-1800",
+                "contig3/1-1000",
+                "contig3/801-1200",
+            ],
+        )
+        for name, sequence in records.items():
+            if name in windows:
+                window = windows[name]
+                self.assertEqual(window.length, len(sequence))
+                self.assertEqual(
+                    contigs[window.contig][window.offset : window.offset + window.length],
+                    sequence,
+                )
+            else:
+                self.assertEqual(contigs[name], sequence)
+        self.assertEqual(
+            {window.contig for window in windows.values()} | set(records) - set(windows),
+            set(contigs),
+        )
+        self.assertEqual(
+            float((output / "search_space_mb.txt").read_text()),
+            2 * sum(map(len, contigs.values())) / 1e6,
+        )
+
+    def test_window_name_may_not_shadow_an_assembly_record(self) -> None:
+        assembly = self.root / "assembly.fna"
+        assembly.write_text(">a\n" + "A" * 30 + "\n>a/1-20\nC\n")
+        with self.assertRaisesRegex(ValueError, "collides"):
+            shard_assembly(
+                assembly, self.root / "shards", shard_bases=10, window_bases=20, overlap_bases=5
+            )
+
+    def test_window_hits_resolve_like_an_unsharded_search(self) -> None:
+        assembly = self.root / "assembly.fna"
+        assembly.write_text(">contig1\n" + "A" * 1800 + "\n>contig2\n" + "C" * 700 + "\n")
+        shard_assembly(
+            assembly,
+            self.root / "shards",
+            shard_bases=1300,
+            window_bases=1000,
+            overlap_bases=200,
+        )
+        window_map = self.root / "shards" / "windows.json"
+        self.assertEqual(
+            sorted(read_window_map(window_map)), ["contig1/1-1000", "contig1/801-1800"]
+        )
+
+        def row(subject: str, start: int, end: int, bits: float, evalue: str) -> str:
+            return (
+                f"{subject} - SSU_rRNA_bacteria RF00177 cm 1 1533 {start} {end} + no 1 "
+                f"0.55 0.0 {bits} {evalue} ! -\n"
+            )
+
+        first = self.root / "sample_RF00177.shard_1.out"
+        second = self.root / "sample_RF00177.shard_2.out"
+        whole = self.root / "sample_RF00177.out"
+        # The locus at contig1:861-1100 is cut at the first window's edge and
+        # whole in the second; the locus at 810-840 lies in both windows.
+        first.write_text(
+            row("contig1/1-1000", 861, 1000, 40.0, "1e-5")
+            + row("contig1/1-1000", 810, 840, 30.0, "1e-3")
+            + row("contig2", 101, 600, 300.0, "1e-80")
+        )
+        second.write_text(
+            row("contig1/801-1800", 61, 300, 200.0, "1e-50")
+            + row("contig1/801-1800", 10, 40, 30.0, "1e-3")
+            + row("contig1/801-1800", 601, 900, 150.0, "1e-40")
+        )
+        whole.write_text(
+            row("contig1", 861, 1100, 200.0, "1e-50")
+            + row("contig1", 810, 840, 30.0, "1e-3")
+            + row("contig1", 1401, 1700, 150.0, "1e-40")
+            + row("contig2", 101, 600, 300.0, "1e-80")
+        )
+
+        remapped = parse_cmsearch_tblout(second, read_window_map(window_map))
+        self.assertEqual(
+            [(hit.subject, hit.sequence_from, hit.sequence_to) for hit in remapped],
+            [("contig1", 861, 1100), ("contig1", 810, 840), ("contig1", 1401, 1700)],
+        )
+        resolve_model_hits.main(
+            ["--cmsearch", str(first), "--cmsearch", str(second),
+             "--windows", str(window_map), "--output", str(self.root / "sharded.tsv")]
+        )
+        resolve_model_hits.main(
+            ["--cmsearch", str(whole), "--windows", str(REPO / "config/no_windows.json"),
+             "--output", str(self.root / "whole.tsv")]
+        )
+        accepted = (self.root / "sharded.tsv").read_text()
+        self.assertEqual(accepted, (self.root / "whole.tsv").read_text())
+        self.assertEqual(len(accepted.splitlines()), 5)
+
+    def test_merge_keeps_distinct_models_and_strands(self) -> None:
+        hits = [
+            hit(model_from=1, model_to=100, sequence_from=1, sequence_to=100),
+            hit(model_from=1, model_to=100, sequence_from=1, sequence_to=100, strand="-"),
+            hit(
+                model_from=1,
+                model_to=100,
+                sequence_from=1,
+                sequence_to=100,
+                model_accession="RF01960",
+            ),
+            hit(model_from=1, model_to=50, sequence_from=1, sequence_to=50, e_value=1e-3),
+        ]
+        self.assertEqual(merge_window_hits(hits), hits[:3])
+
+
 if __name__ == "__main__":
     unittest.main()
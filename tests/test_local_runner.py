@@ -0,0 +1,531 @@
+import csv
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from dataclasses import replace
+from pathlib import Path
+from unittest.mock import patch
+
+
+REPO = Path(__file__).resolve().parents[1]
+SCRIPTS = REPO / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+
+import annotation_server
+import local_runner
+from annotation_server import BUSY_RESPONSE, AnnotationServer, submit
+from annotation_cache import AnnotationCache, CachedAnnotation, cached_blast_annotation
+from cmsearch_cache import CmsearchCache
+from local_runner import ModelTask, RunSettings, run_local
+
+
+FAKE_CMSEARCH = """#!/usr/bin/env python3
+import sys
+arguments = sys.argv[1:]
+if arguments == ["-h"]:
+    print("# cmsearch :: search CM(s) against a sequence database")
+    print("# INFERNAL 1.1.5 (Sep 2023); http://eddylab.org/infernal/")
+    raise SystemExit(0)
+with open(sys.argv[0] + ".calls", "a") as log:
+    log.write(" ".join(arguments) + "\\n")
+tblout = arguments[arguments.index("--tblout") + 1]
+model, fasta = arguments[-2:]
+rows = []
+if model.endswith("RF00177.cm"):
+    for line in open(fasta):
+        if line.startswith(">"):
+            contig = line[1:].split()[0]
+            rows.append(
+                f"{contig} - SSU_rRNA_bacteria RF00177 cm 1 1533 101 1633 + no 1 "
+                "0.55 0.0 1500.0 1e-300 ! -"
+            )
+with open(tblout, "w") as handle:
+    handle.write("# cmsearch tblout\\n" + "".join(row + "\\n" for row in rows))
+"""
+
+FAKE_BLASTN = """#!/usr/bin/env python3
+import sys
+arguments = sys.argv[1:]
+if arguments == ["-version"]:
+    print("blastn: 2.16.0+")
+    raise SystemExit(0)
+with open(sys.argv[0] + ".calls", "a") as log:
+    log.write(" ".join(arguments) + "\\n")
+query = arguments[arguments.index("-query") + 1]
+output = arguments[arguments.index("-out") + 1]
+with open(output, "w") as handle:
+    for line in open(query):
+        if line.startswith(">"):
+            name = line[1:].split()[0]
+            with open(sys.argv[0] + ".queries", "a") as log:
+                log.write(name + "\\n")
+            handle.write(
+                f"{name}\\tref1\\t99.5\\t1533\\t7\\t0\\t1\\t1533\\t1\\t1533\\t0.0\\t2750\\n"
+                f"{name}\\tref2\\t98.0\\t1533\\t30\\t0\\t1\\t1533\\t1\\t1533\\t0.0\\t2600\\n"
+            )
+"""
+
+
+SETTINGS = RunSettings(
+    min_extract_length=500,
+    threads_per_job=1,
+    max_blast_targets=500,
+    top_hits=5,
+    taxonomy_file=None,
+    source_records_file=None,
+    lookup_socket=None,
+)
+
+
+class LocalRunnerTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tempdir.name)
+        executables = self.root / "bin"
+        executables.mkdir()
+        for name, text in (("cmsearch", FAKE_CMSEARCH), ("blastn", FAKE_BLASTN)):
+            path = executables / name
+            path.write_text(text)
+            path.chmod(0o755)
+        self.environment = os.environ.copy()
+        os.environ["PATH"] = f"{executables}:{os.environ['PATH']}"
+
+        generator = random.Random(11)
+        self.samples = {}
+        queries = self.root / "queries"
+        queries.mkdir()
+        for sample_id in ("sampleA", "sampleB"):
+            path = queries / f"{sample_id}.fna"
+            path.write_text(
+                "".join(
+                    f">{sample_id}_contig{index}\n"
+                    + "".join(generator.choice("ACGT") for _ in range(1800))
+                    + "\n"
+                    for index in range(2)
+                )
+            )
+            self.samples[sample_id] = path
+        self.models = [
+            ModelTask(model_id, REPO / "resources/models" / f"{model_id}.cm", Path("db"))
+            for model_id in ("RF00177", "RF01960")
+        ]
+
+    def tearDown(self) -> None:
+        os.environ.clear()
+        os.environ.update(self.environment)
+        self.tempdir.cleanup()
+
+    def _workflow_scripts(self, task_directory: Path) -> None:
+        """Run the per-task commands of main.nf with its arguments and names."""
+
+        def script(name: str, *arguments: str | Path) -> None:
+            subprocess.run(
+                [sys.executable, str(SCRIPTS / name), *map(str, arguments)],
+                check=True,
+                cwd=task_directory,
+            )
+
+        task_directory.mkdir()
+        for sample_id, fasta in self.samples.items():
+            for model in self.models:
+                subprocess.run(
+                    ["cmsearch", "--anytrunc", "--cpu", "1", "-o", os.devnull,
+                     "--tblout", f"{sample_id}_{model.model_id}.out",
+                     model.model_file, fasta],
+                    check=True,
+                    cwd=task_directory,
+                )
+            script(
+                "resolve_model_hits.py",
+                "--cmsearch", f"{sample_id}_RF00177.out",
+                "--cmsearch", f"{sample_id}_RF01960.out",
+                "--output", f"{sample_id}.accepted-hits.tsv",
+            )
+            for model in self.models:
+                outputs = f"{sample_id}_{model.model_id}"
+                script(
+                    "extract_hits.py",
+                    "--model-file", model.model_file, "--fasta", fasta,
+                    "--sample", sample_id, "--model", model.model_id,
+                    "--accepted-hits", f"{sample_id}.accepted-hits.tsv",
+                    "--minimum-length", "500",
+                    "--fasta-output", f"{outputs}.fna",
+                    "--hits-output", f"{outputs}.hits.tsv",
+                    "--metadata-output", f"{outputs}.meta.tsv",
+                )
+                subprocess.run(
+                    ["blastn", "-outfmt", "6", "-db", "db", "-query", f"{outputs}.fna",
+                     "-max_target_seqs", "501", "-max_hsps", "1", "-num_threads", "1",
+                     "-out", f"{outputs}.m8"],
+                    check=True,
+                    cwd=task_directory,
+                )
+                script(
+                    "annotate_hits.py",
+                    "--hits", f"{outputs}.hits.tsv", "--m8", f"{outputs}.m8",
+                    "--query-fasta", f"{outputs}.fna", "--top-hits", "5",
+                    "--top-hits-output", f"{outputs}.top_hits.tsv",
+                    "--max-targets", "500", "--output", f"{outputs}.summary.tsv",
+                )
+        script(
+            "finalize_summaries.py",
+            "--summary-output", "cmsearch_summary.tsv",
+            "--category-output", "cmsearch_summary.tab",
+            "--top-hits-output", "blast_top_hits.tsv",
+            "--taxonomy-mode", "blast",
+            "--tree-neighbor-output", "tree_nearest_neighbors.tsv",
+            "--merged-m8-output", "merged.m8",
+        )
+
+    def test_local_run_matches_workflow_task_outputs(self) -> None:
+        output = self.root / "results"
+        run_local(self.samples, self.models, SETTINGS, output, workers=2)
+        task_directory = self.root / "workflow"
+        self._workflow_scripts(task_directory)
+
+        published = sorted(
+            path.relative_to(output).as_posix()
+            for path in output.rglob("*")
+            if path.is_file()
+        )
+        self.assertIn("extracted/sampleA_RF00177.fna", published)
+        self.assertIn("m8/merged.m8", published)
+        self.assertEqual(len(published), 25)
+        for relative in published:
+            self.assertEqual(
+                (output / relative).read_bytes(),
+                (task_directory / Path(relative).name).read_bytes(),
+                relative,
+            )
+        summary = (output / "cmsearch_summary.tsv").read_text().splitlines()
+        self.assertEqual(len(summary), 5)
+        self.assertEqual(summary[1].split("\t")[8], "ref1")
+
+    def test_batched_samples_match_per_sample_workflow_outputs(self) -> None:
+        self.assertEqual(
+            local_runner.sample_batches(self.samples, 1),
+            [{"sampleA": self.samples["sampleA"]}, {"sampleB": self.samples["sampleB"]}],
+        )
+        self.assertEqual(local_runner.sample_batches(self.samples, 10**6), [self.samples])
+
+        batch_directory = self.root / "batch"
+        batch_directory.mkdir()
+        subprocess.run(
+            [
+                sys.executable, str(SCRIPTS / "annotate_batch.py"),
+                *(argument for fasta in self.samples.values() for argument in ("--fasta", fasta)),
+                *(
+                    argument
+                    for model in self.models
+                    for argument in (
+                        "--model-file", model.model_file,
+                        "--db-prefix", f"{model.model_id}={model.db_prefix}",
+                    )
+                ),
+                "--minimum-length", "500", "--threads", "1",
+                "--max-targets", "500", "--top-hits", "5",
+            ],
+            check=True,
+            cwd=batch_directory,
+        )
+        blast_calls = (self.root / "bin" / "blastn.calls").read_text().splitlines()
+        self.assertEqual(len(blast_calls), len(self.models))
+        task_directory = self.root / "workflow"
+        self._workflow_scripts(task_directory)
+        outputs = sorted(
+            path.name
+            for path in batch_directory.iterdir()
+            if path.name.startswith("sample") and not path.name.endswith(".accepted-hits.tsv")
+        )
+        self.assertEqual(len(outputs), 2 * 2 * 7)
+        for name in outputs:
+            self.assertEqual(
+                (batch_directory / name).read_bytes(),
+                (task_directory / name).read_bytes(),
+                name,
+            )
+
+    def test_deduplicated_run_matches_per_sample_outputs(self) -> None:
+        shared = self.samples["sampleA"].read_text().splitlines()[1]
+        with self.samples["sampleB"].open("a") as handle:
+            handle.write(f">sampleB_shared\n{shared.lower()}\n")
+        per_sample = self.root / "per-sample"
+        deduplicated = self.root / "deduplicated"
+        run_local(self.samples, self.models, SETTINGS, per_sample, workers=2)
+        calls = self.root / "bin" / "blastn.calls"
+        calls.unlink()
+        run_local(
+            self.samples, self.models, SETTINGS, deduplicated, workers=2, deduplicate=True
+        )
+
+        self.assertEqual(len(calls.read_text().splitlines()), len(self.models))
+        with (deduplicated / "stats" / "unique_RF00177.members.tsv").open() as handle:
+            members = list(csv.DictReader(handle, delimiter="\t"))
+        self.assertEqual(len(members), 5)
+        self.assertEqual(len({row["sequence_identifier"] for row in members}), 4)
+        published = sorted(
+            path.relative_to(per_sample).as_posix()
+            for path in per_sample.rglob("*")
+            if path.is_file()
+        )
+        self.assertEqual(
+            sorted(
+                path.relative_to(deduplicated).as_posix()
+                for path in deduplicated.rglob("*")
+                if path.is_file()
+            ),
+            sorted(
+                published
+                + ["stats/unique_RF00177.members.tsv", "stats/unique_RF01960.members.tsv"]
+            ),
+        )
+        for relative in published:
+            self.assertEqual(
+                (deduplicated / relative).read_bytes(),
+                (per_sample / relative).read_bytes(),
+                relative,
+            )
+        with self.assertRaisesRegex(ValueError, "cannot be combined"):
+            run_local(
+                self.samples, self.models, SETTINGS, deduplicated,
+                batch_bases=1, deduplicate=True,
+            )
+
+    def test_query_samples_follow_workflow_names(self) -> None:
+        (self.root / "queries" / "notes.txt").write_text("")
+        self.assertEqual(
+            local_runner.query_samples(self.root / "queries"),
+            {sample_id: path.resolve() for sample_id, path in self.samples.items()},
+        )
+        self.assertEqual(
+            local_runner.default_output_directory(self.samples["sampleA"]),
+            Path("results/sampleA"),
+        )
+        (self.root / "queries" / "sampleA.fa").write_text(">x\nA\n")
+        with self.assertRaisesRegex(ValueError, "share the sample identifier"):
+            local_runner.query_samples(self.root / "queries")
+        (self.root / "queries" / "sampleA.fa").unlink()
+        (self.root / "queries" / "unique.fna").write_text(">x\nA\n")
+        self.assertIn("unique", local_runner.query_samples(self.root / "queries"))
+        with self.assertRaisesRegex(ValueError, "reserved with --deduplicate_sequences"):
+            local_runner.query_samples(self.root / "queries", deduplicate=True)
+
+    def test_defaults_match_workflow_parameters(self) -> None:
+        config = (REPO / "nextflow.config").read_text()
+        workflow = {
+            name: value.strip("'")
+            for name, value in re.findall(
+                r"^\s{4}(\w+)\s+=\s+('[^']*'|\d+)\s*(?://.*)?$", config, re.MULTILINE
+            )
+        }
+        defaults = vars(local_runner.parse_args([]))
+        for name, value in defaults.items():
+            if name in workflow:
+                self.assertEqual(str(value), workflow[name], name)
+        self.assertEqual(local_runner.main(["--tree_classification"]), 1)
+
+    def test_cmsearch_cache_reuses_tables_across_runs(self) -> None:
+        settings = replace(SETTINGS, cmsearch_cache=self.root / "cache")
+        calls = self.root / "bin" / "cmsearch.calls"
+        first = self.root / "first"
+        second = self.root / "second"
+        self.assertEqual(run_local(self.samples, self.models, settings, first), ["miss"] * 4)
+        self.assertEqual(len(calls.read_text().splitlines()), 4)
+        self.assertEqual(run_local(self.samples, self.models, settings, second), ["hit"] * 4)
+        self.assertEqual(len(calls.read_text().splitlines()), 4)
+        self.assertEqual(run_local(self.samples, self.models, SETTINGS, second), ["off"] * 4)
+        for path in first.rglob("*"):
+            if path.is_file():
+                self.assertEqual(
+                    path.read_bytes(), (second / path.relative_to(first)).read_bytes()
+                )
+
+    def test_cmsearch_cache_evicts_least_recently_used_tables(self) -> None:
+        table = self.root / "table.out"
+        table.write_text("x" * 100)
+        cache = CmsearchCache(self.root / "cache", max_bytes=250)
+        for key in ("aa01", "bb02"):
+            cache.store(key, table)
+        os.utime(cache.path("aa01"), ns=(1, 1))
+        os.utime(cache.path("bb02"), ns=(2, 2))
+        self.assertTrue(cache.fetch("aa01", self.root / "copy.out"))
+        cache.store("cc03", table)
+        self.assertTrue(cache.path("aa01").is_file())
+        self.assertFalse(cache.path("bb02").exists())
+        self.assertFalse(cache.fetch("bb02", self.root / "missing.out"))
+        self.assertEqual(list((self.root / "cache").glob("*/.*")), [])
+
+    def test_adaptive_search_publishes_passes_beside_unchanged_outputs(self) -> None:
+        single = self.root / "single"
+        adaptive = self.root / "adaptive"
+        run_local(self.samples, self.models, SETTINGS, single)
+        settings = replace(SETTINGS, blast_first_pass_targets=20)
+        run_local(self.samples, self.models, settings, adaptive)
+
+        for path in single.rglob("*"):
+            if path.is_file():
+                relative = path.relative_to(single)
+                self.assertEqual(
+                    (adaptive / relative).read_bytes(), path.read_bytes(), relative
+                )
+        self.assertEqual(
+            (adaptive / "m8" / "sampleA_RF00177.blast_passes.tsv").read_text(),
+            "name\tblast_pass\tmax_target_seqs\n"
+            + "".join(
+                f"sampleA_contig{index}|101-1633|strand_+|simple\t1\t20\n"
+                for index in range(2)
+            ),
+        )
+        with self.assertRaisesRegex(ValueError, "cannot be combined"):
+            run_local(self.samples, self.models, settings, adaptive, batch_bases=1)
+
+    def test_annotation_cache_searches_only_new_sequences(self) -> None:
+        uncached = self.root / "uncached"
+        run_local(self.samples, self.models, SETTINGS, uncached)
+        settings = replace(
+            SETTINGS,
+            annotation_cache=self.root / "annotations.sqlite",
+            annotation_release="release-1",
+        )
+        queries = self.root / "bin" / "blastn.queries"
+
+        def searched(
+            samples: dict[str, Path], settings: RunSettings, output: Path
+        ) -> list[str]:
+            queries.unlink(missing_ok=True)
+            run_local(samples, self.models, settings, output)
+            if not queries.exists():
+                return []
+            return [name.split("|")[0] for name in queries.read_text().split()]
+
+        first = searched({"sampleA": self.samples["sampleA"]}, settings, self.root / "first")
+        self.assertEqual(first, ["sampleA_contig0", "sampleA_contig1"])
+        second = self.root / "second"
+        self.assertEqual(
+            searched(self.samples, settings, second), ["sampleB_contig0", "sampleB_contig1"]
+        )
+        for path in uncached.rglob("*"):
+            if path.is_file():
+                relative = path.relative_to(uncached)
+                self.assertEqual(
+                    (second / relative).read_bytes(), path.read_bytes(), relative
+                )
+        self.assertEqual(searched(self.samples, settings, self.root / "third"), [])
+        new_release = replace(settings, annotation_release="release-2")
+        self.assertEqual(len(searched(self.samples, new_release, self.root / "fourth")), 4)
+
+        with AnnotationCache(settings.annotation_cache, "release-2", max_bytes=300) as cache:
+            entry = CachedAnnotation(m8=[], summary={"taxonomy": "x" * 100}, top_hits=[])
+            cache.store({"newest": entry})
+            self.assertEqual(set(cache.fetch(["newest"])), {"newest"})
+            (count,) = cache.connection.execute(
+                "SELECT COUNT(*) FROM annotations"
+            ).fetchone()
+            self.assertEqual(count, 1)
+
+    def test_annotation_cache_entries_belong_to_one_blast_database(self) -> None:
+        searched_run = self.root / "searched"
+        run_local({"sampleA": self.samples["sampleA"]}, self.models, SETTINGS, searched_run)
+        prefix = "sampleA_RF00177"
+        counts = []
+        with AnnotationCache(self.root / "annotations.sqlite", "release-1", 2**20) as cache:
+            for index, db_prefix in enumerate(("blast/16S", "blast/18S", "blast/16S")):
+                counts.append(
+                    cached_blast_annotation(
+                        searched_run / "stats" / f"{prefix}.hits.tsv",
+                        searched_run / "extracted" / f"{prefix}.fna",
+                        db_prefix,
+                        m8_output=self.root / f"{index}.m8",
+                        summary_output=self.root / f"{index}.summary.tsv",
+                        top_hits_output=self.root / f"{index}.top_hits.tsv",
+                        threads=1,
+                        max_targets=500,
+                        top_hits=5,
+                        cache=cache,
+                    )
+                )
+        self.assertEqual(counts, [(0, 2), (0, 2), (2, 0)])
+
+    def test_server_returns_run_outputs_and_declines_beyond_its_queue(self) -> None:
+        socket_path = self.root / "annotation.sock"
+        server = AnnotationServer(
+            socket_path, self.models, SETTINGS, workers=1, queue_size=0
+        )
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            response = submit(socket_path, self.samples["sampleA"])
+            output = self.root / "results"
+            run_local({"sampleA": self.samples["sampleA"]}, self.models, SETTINGS, output)
+            self.assertEqual(
+                response,
+                {
+                    "summary": (output / "cmsearch_summary.tsv").read_text(),
+                    "top_hits": (output / "blast_top_hits.tsv").read_text(),
+                },
+            )
+
+            self.assertTrue(server.admitted.acquire(blocking=False))
+            try:
+                self.assertIn("busy", submit(socket_path, self.samples["sampleB"]))
+                self.assertEqual(
+                    annotation_server.main(
+                        ["submit", "--socket", str(socket_path),
+                         "--fasta", str(self.samples["sampleB"])]
+                    ),
+                    75,
+                )
+            finally:
+                server.admitted.release()
+            self.assertIn(
+                "Invalid sample identifier",
+                submit(socket_path, self.samples["sampleB"], "bad/name")["error"],
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_server_declines_before_reading_and_always_answers(self) -> None:
+        socket_path = self.root / "annotation.sock"
+        server = AnnotationServer(
+            socket_path, self.models, SETTINGS, workers=1, queue_size=0
+        )
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        large = self.root / "large.fna"
+        large.write_text(">contig\n" + "ACGT" * (4 * 1024 * 1024) + "\n")
+        try:
+            # A declined submission larger than the socket buffers is answered
+            # without being read, and its connection holds no slot afterwards.
+            self.assertTrue(server.admitted.acquire(blocking=False))
+            try:
+                self.assertEqual(submit(socket_path, large), BUSY_RESPONSE)
+            finally:
+                server.admitted.release()
+
+            with patch.object(server, "_annotate", side_effect=KeyError("models")):
+                self.assertEqual(
+                    submit(socket_path, self.samples["sampleA"]), {"error": "'models'"}
+                )
+            with patch.object(server, "_annotate", side_effect=RuntimeError):
+                self.assertEqual(
+                    submit(socket_path, self.samples["sampleA"]),
+                    {"error": "RuntimeError"},
+                )
+            # Each handler thread returns its slot once it has answered.
+            self.assertTrue(server.admitted.acquire(timeout=5))
+            server.admitted.release()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,11 @@
 import csv
 import json
+import random
+import subprocess
 import sys
 import tempfile
+import threading
+import time
 import unittest
 from pathlib import Path
 
@@ -16,6 +20,7 @@ from annotate_hits import (
     annotate_hits,
     load_taxonomy_records,
 )
+from blast_table import BlastHit, load_blast_table
 from finalize_summaries import (
     apply_tree_assignments,
     load_metadata,
@@ -27,7 +32,17 @@ from finalize_summaries import (
     write_top_hit_summary,
 )
 from hit_processing import HIT_FIELDS, META_FIELDS
-from top_hit_reporting import TOP_HIT_FIELDS, load_reference_records
+from reference_lookup import (
+    SOURCE_RECORDS_TABLE,
+    TAXONOMY_TABLE,
+    ReferenceLookupServer,
+)
+from top_hit_reporting import (
+    TOP_HIT_FIELDS,
+    ReferenceRecord,
+    load_reference_records,
+    select_reported_hits,
+)
 from tree_schema import TREE_ASSIGNMENT_FIELDS
 
 
@@ -109,6 +124,267 @@ def write_source_records_parquet(
     connection.close()
 
 
+def synthetic_m8(queries: int, hits: int, seed: int = 501) -> str:
+    """BLAST rows with repeated subjects, equal-best ties, and blank lines."""
+
+    generator = random.Random(seed)
+    lines = []
+    for query in range(queries):
+        for rank in range(hits):
+            score = (
+                generator.choice((2000.0, 2000.0, 1998.5)) if rank < 6 else 1990.0 - rank
+            )
+            lines.append(
+                "\t".join(
+                    str(value)
+                    for value in (
+                        f"contig{query}|101-1633|strand_+|simple",
+                        f"ref{generator.randrange(hits * 2):05d}",
+                        generator.choice((99.0, 98.5, 97.25)),
+                        generator.choice((1500, 1480)),
+                        generator.randrange(20),
+                        generator.randrange(3),
+                        1,
+                        1500,
+                        generator.randrange(1, 20),
+                        1500,
+                        generator.choice((0.0, 1e-300, 2.5e-120)),
+                        score,
+                    )
+                )
+            )
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def row_wise_blast_hits(m8_file: Path) -> dict[str, list[BlastHit]]:
+    """One-object-per-row oracle for the columnar BLAST table."""
+
+    hits_by_query: dict[str, list[BlastHit]] = {}
+    for line in m8_file.read_text().splitlines():
+        if not line:
+            continue
+        fields = line.split("\t")
+        hits_by_query.setdefault(fields[0], []).append(
+            BlastHit(
+                fields[1],
+                float(fields[2]),
+                *(int(value) for value in fields[3:10]),
+                float(fields[10]),
+                float(fields[11]),
+            )
+        )
+    for query, hits in hits_by_query.items():
+        unique: dict[str, BlastHit] = {}
+        for hit in sorted(
+            hits,
+            key=lambda hit: (
+                -hit.bit_score,
+                -hit.percent_identity,
+                -hit.alignment_length,
+                hit.subject,
+            ),
+        ):
+            unique.setdefault(hit.subject, hit)
+        hits_by_query[query] = list(unique.values())
+    return hits_by_query
+
+
+class BlastTableTests(unittest.TestCase):
+    def test_columnar_ranking_matches_row_wise_ranking(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            m8 = Path(tmp) / "sample.m8"
+            m8.write_text(synthetic_m8(200, 501))
+            expected = row_wise_blast_hits(m8)
+            started = time.perf_counter()
+            table = load_blast_table(m8)
+            elapsed = time.perf_counter() - started
+
+        self.assertEqual(table.queries, list(expected))
+        self.assertEqual(
+            set(table.subjects),
+            {hit.subject for hits in expected.values() for hit in hits},
+        )
+        sources = ("IMG", "PR2", "SILVA", "", "", "", "")
+        references = {
+            subject: ReferenceRecord(subject, "", (sources[index % len(sources)],))
+            for index, subject in enumerate(sorted(table.subjects))
+        }
+        for query, hits in expected.items():
+            self.assertEqual(table.hits(query), hits)
+            tied = [hit for hit in hits if hit.bit_score == hits[0].bit_score]
+            self.assertEqual(table.tied_hits(query), tied)
+            reported = select_reported_hits(table, query, references, 5)
+            expected_ranks = set(range(min(5, len(hits)))) | set(range(len(tied)))
+            for source in ("IMG", "PR2", "SILVA"):
+                expected_ranks |= set(
+                    next(
+                        (
+                            [rank]
+                            for rank, hit in enumerate(hits)
+                            if source in references[hit.subject].sources
+                        ),
+                        [],
+                    )
+                )
+            self.assertEqual(
+                [(rank, hit) for rank, hit, _reason in reported],
+                [(rank + 1, hits[rank]) for rank in sorted(expected_ranks)],
+            )
+        self.assertTrue(any(len(table.tied_hits(query)) > 1 for query in expected))
+        # 100,200 rows load in well under a second.
+        self.assertLess(elapsed, 5.0)
+
+    def test_malformed_row_is_reported_with_its_line(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            m8 = Path(tmp) / "sample.m8"
+            row = "q\ts\t99\t4\t0\t0\t1\t4\t1\t4\t1e-5\t10"
+            # A short row after a long one keeps the total field count intact.
+            m8.write_text(f"{row}\n\n{row}\textra\n{row[:-3]}\n")
+            with self.assertRaisesRegex(
+                ValueError, r"sample\.m8:3: expected 12 fields, found 13"
+            ):
+                load_blast_table(m8)
+
+    def test_missing_query_has_no_hits(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            m8 = Path(tmp) / "sample.m8"
+            m8.touch()
+            table = load_blast_table(m8)
+
+        self.assertEqual(table.hits("query1"), [])
+        self.assertEqual(table.tied_count("query1"), 0)
+        self.assertEqual(select_reported_hits(table, "query1", {}, 5), [])
+
+
+RANKED_BLASTN = """#!/usr/bin/env python3
+import json
+import sys
+arguments = sys.argv[1:]
+with open(sys.argv[0] + ".calls", "a") as log:
+    log.write(" ".join(arguments) + "\\n")
+targets = int(arguments[arguments.index("-max_target_seqs") + 1])
+ranked = json.load(open(sys.argv[0] + ".json"))
+with open(arguments[arguments.index("-out") + 1], "w") as handle:
+    for line in open(arguments[arguments.index("-query") + 1]):
+        if line.startswith(">"):
+            name = line[1:].split()[0]
+            for subject, score in ranked[name][:targets]:
+                handle.write(
+                    f"{name}\\t{subject}\\t99.0\\t4\\t0\\t0\\t1\\t4\\t1\\t4\\t1e-9\\t{score}\\n"
+                )
+"""
+
+
+class AdaptiveBlastTests(unittest.TestCase):
+    def test_second_pass_annotations_match_a_full_search(self) -> None:
+        from adaptive_blast import PASS_FIELDS, adaptive_search, blastn_command
+
+        # Ranked subjects and bit scores of each query in the whole database.
+        ranked = {
+            "few": [[f"few_s{rank}", 90 - rank] for rank in range(3)],
+            "closed": [[f"closed_s{rank:02d}", 900 - rank] for rank in range(30)],
+            "far_pr2": [[f"far_pr2_s{rank:02d}", 900 - rank] for rank in range(30)],
+            "tied": [[f"tied_s{rank:02d}", 500] for rank in range(30)],
+        }
+        sources = {
+            subject: "PR2" if subject in {"closed_s01", "far_pr2_s24", "tied_s29"} else "SILVA"
+            for hits in ranked.values()
+            for subject, _score in hits
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            blastn = root / "blastn"
+            blastn.write_text(RANKED_BLASTN)
+            blastn.chmod(0o755)
+            Path(f"{blastn}.json").write_text(json.dumps(ranked))
+            source_records = root / "source_records.parquet"
+            write_source_records_parquet(
+                source_records,
+                [
+                    (subject, source, "1", f"ID_{subject}")
+                    for subject, source in sorted(sources.items())
+                ],
+            )
+            fasta = root / "sample.fna"
+            fasta.write_text("".join(f">{name}\nACGT\n" for name in ranked))
+            hits = root / "sample.hits.tsv"
+            write_tsv(
+                hits,
+                HIT_FIELDS,
+                [
+                    {
+                        "name": name,
+                        "sample": "sample",
+                        "model": "RF00177",
+                        "length": 4,
+                        "coordinates": "1-4",
+                        "strand": "+",
+                        "sequence_type": "simple",
+                        "contig_name": "contig1",
+                        "is_assembled": "False",
+                    }
+                    for name in ranked
+                ],
+            )
+
+            second_pass = adaptive_search(
+                fasta,
+                "db",
+                m8_output=root / "adaptive.m8",
+                passes_output=root / "adaptive.passes.tsv",
+                threads=1,
+                max_targets=50,
+                top_hits=5,
+                first_pass_targets=10,
+                source_records_file=source_records,
+                blastn=str(blastn),
+            )
+            calls = Path(f"{blastn}.calls").read_text().splitlines()
+            subprocess.run(
+                blastn_command(fasta, "db", root / "full.m8", 51, 1, str(blastn)),
+                check=True,
+            )
+            outputs = {}
+            for name in ("adaptive", "full"):
+                annotate_hits(
+                    hits,
+                    root / f"{name}.m8",
+                    root / f"{name}.summary.tsv",
+                    max_targets=50,
+                    query_fasta=fasta,
+                    source_records_file=source_records,
+                    top_hits_output=root / f"{name}.top_hits.tsv",
+                    top_hits=5,
+                )
+                outputs[name] = [
+                    (root / f"{name}.{suffix}").read_text()
+                    for suffix in ("summary.tsv", "top_hits.tsv")
+                ]
+            with (root / "adaptive.passes.tsv").open(newline="") as handle:
+                reader = csv.DictReader(handle, delimiter="\t")
+                self.assertEqual(reader.fieldnames, PASS_FIELDS)
+                passes = {
+                    row["name"]: (row["blast_pass"], row["max_target_seqs"])
+                    for row in reader
+                }
+
+        self.assertEqual(second_pass, ["far_pr2", "tied"])
+        self.assertEqual(
+            passes,
+            {
+                "few": ("1", "10"),
+                "closed": ("1", "10"),
+                "far_pr2": ("2", "51"),
+                "tied": ("2", "51"),
+            },
+        )
+        self.assertEqual(len(calls), 2)
+        self.assertIn("-max_target_seqs 51", calls[1])
+        self.assertEqual(outputs["adaptive"], outputs["full"])
+        self.assertIn("best_PR2", outputs["adaptive"][1])
+
+
 class AnnotationTests(unittest.TestCase):
     def test_lca_does_not_collapse_missing_internal_ranks(self) -> None:
         from annotate_hits import lowest_common_taxonomy
@@ -120,6 +396,64 @@ class AnnotationTests(unittest.TestCase):
             "Bacteria;P",
         )
 
+    def test_released_taxon_ids_give_the_string_lowest_common_ancestor(self) -> None:
+        from annotate_hits import (
+            INDEXED_LCA_MIN_RECORDS,
+            TaxonomyRecord,
+            tied_lowest_common_taxonomy,
+        )
+        from taxonomy_index import TaxonomyIndex
+
+        taxonomies = [
+            "Bacteria;P;;OrderA",
+            "Bacteria;P;ClassB;OrderB",
+            "Bacteria;P;ClassB",
+            *(f"Bacteria;P;ClassB;Order{rank}" for rank in range(40)),
+        ]
+        index, taxon_ids = TaxonomyIndex.from_paths(
+            taxonomy.split(";") for taxonomy in taxonomies
+        )
+
+        def records(with_ids: bool) -> list[TaxonomyRecord]:
+            return [
+                TaxonomyRecord(
+                    "SILVA", taxonomy, "SILVA", "Bacteria", "", "native", False,
+                    "", "", "", "", taxon_id if with_ids else None,
+                )
+                for taxonomy, taxon_id in zip(taxonomies, taxon_ids)
+            ]
+
+        loads = []
+
+        def load_index() -> TaxonomyIndex:
+            loads.append(index)
+            return index
+
+        for subset, indexed_loads in (
+            (slice(0, None), 1),
+            (slice(1, 1 + INDEXED_LCA_MIN_RECORDS), 1),
+            (slice(1, INDEXED_LCA_MIN_RECORDS), 0),
+            (slice(0, 2), 0),
+            (slice(0, 1), 0),
+        ):
+            with self.subTest(subset=subset):
+                loads.clear()
+                expected = tied_lowest_common_taxonomy(records(False)[subset], None)
+                self.assertEqual(
+                    tied_lowest_common_taxonomy(records(True)[subset], load_index),
+                    expected,
+                )
+                self.assertEqual(len(loads), indexed_loads)
+                self.assertEqual(
+                    tied_lowest_common_taxonomy(records(False)[subset], load_index),
+                    expected,
+                )
+                self.assertEqual(len(loads), indexed_loads)
+        self.assertEqual(
+            tied_lowest_common_taxonomy(records(True)[1:], load_index),
+            "Bacteria;P;ClassB",
+        )
+
     def test_best_bitscore_is_selected(self) -> None:
         with tempfile.TemporaryDirectory() as tmp:
             root = Path(tmp)
@@ -505,6 +839,72 @@ class AnnotationTests(unittest.TestCase):
             with self.assertRaisesRegex(ValueError, "incomplete centroid schema"):
                 load_taxonomy_records(taxonomy, {"SSU_img"})
 
+    def test_lookup_server_matches_direct_parquet_reads(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            taxonomy = root / "taxonomy.parquet"
+            sources = root / "source_records.parquet"
+            write_taxonomy_parquet(
+                taxonomy,
+                [
+                    ("SSU_a", "SILVA", "Bacteria;Firmicutes", "SILVA", "Bacteria", "", ""),
+                    ("SSU_b", "PR2", "Eukaryota;Amoebozoa", "PR2", "Eukaryota", "", ""),
+                ],
+            )
+            write_source_records_parquet(
+                sources,
+                [
+                    ("SSU_a", "SILVA", "138.2", "AB3.1.100"),
+                    ("SSU_b", "PR2", "5.1.1", "AB1.1.100_U"),
+                    ("SSU_b", "PR2", "5.1.1", "AB2.1.100_U"),
+                ],
+            )
+            socket_path = root / "lookup.sock"
+            server = ReferenceLookupServer(
+                socket_path, {TAXONOMY_TABLE: taxonomy, SOURCE_RECORDS_TABLE: sources}
+            )
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                subjects = {"SSU_a", "SSU_b"}
+                self.assertEqual(
+                    load_taxonomy_records(taxonomy, subjects, socket_path),
+                    load_taxonomy_records(taxonomy, subjects),
+                )
+                self.assertEqual(
+                    load_reference_records(sources, subjects, socket_path),
+                    load_reference_records(sources, subjects),
+                )
+                with self.assertRaisesRegex(ValueError, "Missing source metadata"):
+                    load_reference_records(sources, {"SSU_a", "SSU_missing"}, socket_path)
+
+                write_source_records_parquet(
+                    sources, [("SSU_a", "SILVA", "138.3", "AB3.1.100")]
+                )
+                self.assertEqual(
+                    server.lookup(
+                        {
+                            "protocol_version": 1,
+                            "table": SOURCE_RECORDS_TABLE,
+                            "file": [str(sources.resolve()), 0, 0],
+                            "subjects": ["SSU_a"],
+                        }
+                    ),
+                    {"declined": "file is not served"},
+                )
+                self.assertEqual(
+                    load_reference_records(sources, {"SSU_a"}, socket_path)["SSU_a"].versions,
+                    "SILVA:138.3",
+                )
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+            self.assertEqual(
+                load_reference_records(sources, {"SSU_a"}, socket_path)["SSU_a"].versions,
+                "SILVA:138.3",
+            )
+
     def test_truncated_equal_best_set_backs_taxonomy_off_to_domain(self) -> None:
         with tempfile.TemporaryDirectory() as tmp:
             root = Path(tmp)
@@ -1,4 +1,6 @@
+import random
 import sys
+import time
 import unittest
 from pathlib import Path
 
@@ -7,6 +9,7 @@ REPO = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(REPO / "scripts"))
 
 import taxonomy_utils
+from taxonomy_index import TaxonomyIndex, TaxonomyNodes
 
 
 class TaxonomyPathTests(unittest.TestCase):
@@ -52,5 +55,70 @@ class CommonValueTests(unittest.TestCase):
         self.assertEqual(taxonomy_utils.common_value(["", "SILVA", "SILVA"]), "SILVA")
 
 
+def random_taxonomy_paths(count: int, seed: int) -> list[tuple[str, ...]]:
+    """Six-rank paths with shared prefixes and occasional internal empty ranks."""
+
+    generator = random.Random(seed)
+    paths = []
+    for _index in range(count):
+        path = [generator.choice(("Bacteria", "Archaea", "Eukaryota"))]
+        for rank in range(1, generator.randint(1, 6)):
+            name = f"{path[-1]}_{rank}{generator.randint(0, 2)}"
+            path.append("" if generator.random() < 0.1 else name)
+        paths.append(tuple(path))
+    return paths
+
+
+class TaxonomyIndexTests(unittest.TestCase):
+    def test_indexed_lowest_common_ancestor_matches_path_comparison(self) -> None:
+        paths = random_taxonomy_paths(2000, 19)
+        index, taxon_ids = TaxonomyIndex.from_paths(paths)
+        generator = random.Random(20)
+        groups = [
+            generator.sample(range(len(paths)), generator.randint(1, 12))
+            for _group in range(3000)
+        ]
+        started = time.perf_counter()
+        indexed = [
+            index.lowest_common_path(taxon_ids[member] for member in group)
+            for group in groups
+        ]
+        elapsed = time.perf_counter() - started
+
+        for taxon_id, path in zip(taxon_ids, paths):
+            self.assertEqual(index.path(taxon_id), path)
+        self.assertEqual(
+            indexed,
+            [
+                taxonomy_utils.lowest_common_ancestor(paths[member] for member in group)
+                for group in groups
+            ],
+        )
+        self.assertEqual(index.lowest_common_path([]), ())
+        self.assertLess(elapsed, 5.0)
+
+    def test_node_rows_list_parents_before_children(self) -> None:
+        nodes = TaxonomyNodes()
+        self.assertEqual(nodes.add(("Bacteria", "Firmicutes")), 2)
+        self.assertEqual(nodes.add(("Bacteria", "", "Bacillales")), 4)
+        self.assertEqual(nodes.add(("Bacteria",)), 1)
+        self.assertEqual(
+            nodes.rows(),
+            [
+                (0, None, 0, ""),
+                (1, 0, 1, "Bacteria"),
+                (2, 1, 2, "Firmicutes"),
+                (3, 1, 2, ""),
+                (4, 3, 3, "Bacillales"),
+            ],
+        )
+        self.assertEqual(nodes.index().lowest_common_path([2, 4]), ("Bacteria",))
+        self.assertEqual(nodes.index().lowest_common_path([4]), ("Bacteria",))
+
+    def test_unordered_parents_are_rejected(self) -> None:
+        with self.assertRaisesRegex(ValueError, "parents first"):
+            TaxonomyIndex([-1, 2, 0], ["", "child", "parent"])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,7 +1,10 @@
 import csv
 import json
+import random
+import subprocess
 import sys
 import tempfile
+import time
 import unittest
 from pathlib import Path
 from unittest.mock import patch
@@ -10,12 +13,21 @@ from unittest.mock import patch
 REPO = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(REPO / "scripts"))
 
-from annotate_hits import BlastHit
+from blast_table import BlastHit
+from database_release_io import write_reference_alignments_parquet
+from newick import NewickTree
+from reference_alignments import assemble_alignment
+from sequence_dedup import MEMBER_FIELDS, expand_tree
+import tree_bundle
+from tree_bundle import BundleSettings, run_bundle
 from tree_phylogeny import classify_tree, trim_alignment
 from tree_reference_selection import (
     build_alignment_input,
+    bundle_tree_tasks,
     choose_marker,
+    fetch_task_references,
     prepare_tree_tasks,
+    route_blast_files,
 )
 from tree_schema import REFERENCE_FIELDS, TREE_ASSIGNMENT_FIELDS, TREE_NEIGHBOR_FIELDS
 
@@ -36,6 +48,26 @@ def blast_hit(subject: str, score: float) -> BlastHit:
     )
 
 
+def m8_line(query: str, hit: BlastHit) -> str:
+    return "\t".join(
+        str(value)
+        for value in (
+            query,
+            hit.subject,
+            hit.percent_identity,
+            hit.alignment_length,
+            hit.mismatches,
+            hit.gap_opens,
+            hit.query_start,
+            hit.query_end,
+            hit.subject_start,
+            hit.subject_end,
+            hit.evalue,
+            hit.bit_score,
+        )
+    ) + "\n"
+
+
 def reference_row(
     leaf: str,
     subject: str,
@@ -66,6 +98,38 @@ def reference_row(
     }
 
 
+# Writes the first -max_target_seqs subjects of each query from <db>.json.
+RANKED_BLASTN = """#!/usr/bin/env python3
+import json
+import sys
+arguments = sys.argv[1:]
+with open(sys.argv[0] + ".calls", "a") as log:
+    log.write(" ".join(arguments) + "\\n")
+targets = int(arguments[arguments.index("-max_target_seqs") + 1])
+ranked = json.load(open(arguments[arguments.index("-db") + 1] + ".json"))
+with open(arguments[arguments.index("-out") + 1], "w") as handle:
+    for line in open(arguments[arguments.index("-query") + 1]):
+        if line.startswith(">"):
+            name = line[1:].split()[0]
+            for subject, score in ranked.get(name, [])[:targets]:
+                handle.write(
+                    f"{name}\\t{subject}\\t99.0\\t100\\t1\\t0\\t1\\t100\\t1\\t100"
+                    f"\\t1e-20\\t{score}\\n"
+                )
+"""
+
+# Writes each -entry_batch subject with a sequence derived from its name.
+ENTRY_BLASTDBCMD = """#!/usr/bin/env python3
+import sys
+arguments = sys.argv[1:]
+with open(sys.argv[0] + ".calls", "a") as log:
+    log.write(" ".join(arguments) + "\\n")
+with open(arguments[arguments.index("-out") + 1], "w") as handle:
+    for subject in open(arguments[arguments.index("-entry_batch") + 1]).read().split():
+        handle.write(f">{subject} reference\\nACGT{subject.upper()}\\n")
+"""
+
+
 class TreeSchemaTests(unittest.TestCase):
     def test_empty_sentinels_match_code_owned_schemas(self) -> None:
         sentinels = {
@@ -165,22 +229,95 @@ class TreeRoutingTests(unittest.TestCase):
             ]
         self.assertEqual(headers, ["QUERY", "REF0001", "REF0002", "REF0003"])
 
+    def test_sample_references_are_fetched_once_per_marker(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            blastdbcmd = root / "blastdbcmd"
+            blastdbcmd.write_text(ENTRY_BLASTDBCMD)
+            blastdbcmd.chmod(0o755)
+            # Two eukaryotic queries share most references; one query routes to 16S.
+            (root / "16S.m8").write_text(
+                "".join(
+                    m8_line("bacterium", blast_hit(f"b{rank}", 500 - rank))
+                    for rank in range(4)
+                )
+            )
+            (root / "18S.m8").write_text(
+                "".join(
+                    m8_line(query, blast_hit(f"e{rank + offset}", 400 - rank))
+                    for query, offset in (("first", 0), ("second", 1))
+                    for rank in range(5)
+                )
+            )
+            (root / "queries.fna").write_text(
+                "".join(f">{name}\nACGT\n" for name in ("first", "second", "bacterium"))
+            )
+            with (
+                patch(
+                    "tree_reference_selection.load_taxonomy_records",
+                    return_value={},
+                ),
+                patch(
+                    "tree_reference_selection.load_reference_records",
+                    return_value={},
+                ),
+            ):
+                directories = prepare_tree_tasks(
+                    query_fasta=root / "queries.fna",
+                    blast_files={"16S": root / "16S.m8", "18S": root / "18S.m8"},
+                    taxonomy_file=root / "taxonomy.parquet",
+                    source_records_file=root / "sources.parquet",
+                    sample="sample",
+                    detected_model="RF01960",
+                    detected_marker="18S",
+                    marker_models={"16S": "RF00177", "18S": "RF01960"},
+                    output_directory=root / "tasks",
+                    skipped_assignments_file=root / "skipped.tsv",
+                )
+            databases = {"16S": root / "bacteria", "18S": root / "eukaryotes"}
+            fetch_task_references(directories, databases, str(blastdbcmd))
+            calls = Path(f"{blastdbcmd}.calls").read_text().splitlines()
+            inputs = {}
+            for directory in directories:
+                output = directory / "cmalign_input.fna"
+                build_alignment_input(directory, directory / "references.fna", output)
+                inputs[json.loads((directory / "task.json").read_text())["name"]] = (
+                    output.read_text()
+                )
+            leftovers = [path.name for path in root.iterdir() if path.name.startswith(".")]
+
+        self.assertEqual(
+            sorted(call.split()[1] for call in calls),
+            [str(databases["16S"]), str(databases["18S"])],
+        )
+        self.assertEqual(leftovers, [])
+        self.assertEqual(
+            inputs["second"],
+            ">QUERY\nACGT\n"
+            + "".join(f">REF{rank:04d}\nACGTE{rank}\n" for rank in range(1, 6)),
+        )
+        self.assertEqual(
+            inputs["bacterium"],
+            ">QUERY\nACGT\n"
+            + "".join(f">REF{rank + 1:04d}\nACGTB{rank}\n" for rank in range(4)),
+        )
+
     def test_sparse_query_writes_blast_fallback_instead_of_aborting(self) -> None:
         with tempfile.TemporaryDirectory() as tmp:
             root = Path(tmp)
             skipped = root / "skipped.tsv"
+            (root / "16S.m8").touch()
+            (root / "18S.m8").write_text(
+                "".join(
+                    m8_line("query1", blast_hit(subject, score))
+                    for subject, score in (("e1", 100), ("e2", 90))
+                )
+            )
             with (
                 patch(
                     "tree_reference_selection.load_query_sequences",
                     return_value={"query1": "ACGT"},
                 ),
-                patch(
-                    "tree_reference_selection.load_blast_hits",
-                    side_effect=[
-                        {"query1": []},
-                        {"query1": [blast_hit("e1", 100), blast_hit("e2", 90)]},
-                    ],
-                ),
                 patch(
                     "tree_reference_selection.load_taxonomy_records",
                     return_value={},
@@ -214,8 +351,319 @@ class TreeRoutingTests(unittest.TestCase):
             "tree_skipped_insufficient_references",
         )
 
+    def test_reused_annotation_search_routes_like_two_fresh_searches(self) -> None:
+        ranked = {
+            "16S": {
+                "wide": [[f"b{rank:03d}", 900 - rank] for rank in range(150)],
+                "narrow": [[f"b{rank:03d}", 800 - rank] for rank in range(12)],
+            },
+            "18S": {
+                "wide": [[f"e{rank:03d}", 899 - 2 * rank] for rank in range(150)],
+                "narrow": [[f"e{rank:03d}", 805 - rank] for rank in range(40)],
+                "eukaryote": [[f"e{rank:03d}", 700 - rank] for rank in range(150)],
+            },
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            blastn = root / "blastn"
+            blastn.write_text(RANKED_BLASTN)
+            blastn.chmod(0o755)
+            databases = {}
+            for marker, hits in ranked.items():
+                databases[marker] = root / marker
+                Path(f"{databases[marker]}.json").write_text(json.dumps(hits))
+            query_fasta = root / "queries.fna"
+            query_fasta.write_text(
+                "".join(f">{name}\nACGT\n" for name in ("wide", "narrow", "eukaryote"))
+            )
+
+            def search(marker: str, targets: int, output: Path) -> Path:
+                subprocess.run(
+                    [
+                        str(blastn), "-outfmt", "6", "-db", str(databases[marker]),
+                        "-query", str(query_fasta), "-max_target_seqs", str(targets),
+                        "-max_hsps", "1", "-num_threads", "1", "-out", str(output),
+                    ],
+                    check=True,
+                )
+                return output
+
+            def tasks(name: str, blast_files: dict[str, Path]) -> dict[str, tuple[str, str]]:
+                with (
+                    patch(
+                        "tree_reference_selection.load_taxonomy_records",
+                        return_value={},
+                    ),
+                    patch(
+                        "tree_reference_selection.load_reference_records",
+                        return_value={},
+                    ),
+                ):
+                    directories = prepare_tree_tasks(
+                        query_fasta=query_fasta,
+                        blast_files=blast_files,
+                        taxonomy_file=root / "taxonomy.parquet",
+                        source_records_file=root / "sources.parquet",
+                        sample="sample",
+                        detected_model="RF01960",
+                        detected_marker="18S",
+                        marker_models={"16S": "RF00177", "18S": "RF01960"},
+                        output_directory=root / f"tasks_{name}",
+                        skipped_assignments_file=root / f"skipped_{name}.tsv",
+                    )
+                return {
+                    directory.name: (
+                        (directory / "task.json").read_text(),
+                        (directory / "references.tsv").read_text(),
+                    )
+                    for directory in directories
+                }
+
+            fresh = tasks(
+                "fresh",
+                {marker: search(marker, 101, root / f"{marker}.fresh.m8") for marker in ranked},
+            )
+            calls = Path(f"{blastn}.calls")
+            searched = {}
+            reused = {}
+            for targets in (501, 20):
+                annotation = search("18S", targets, root / f"annotation{targets}.m8")
+                route = root / f"route{targets}"
+                route.mkdir()
+                calls.unlink()
+                blast_files = route_blast_files(
+                    query_fasta=query_fasta,
+                    databases=databases,
+                    reused_marker="18S",
+                    reused_m8=annotation,
+                    reused_targets=targets,
+                    required_hits=100,
+                    search_targets=101,
+                    threads=1,
+                    output_directory=route,
+                    blastn=str(blastn),
+                )
+                searched[targets] = calls.read_text().splitlines()
+                reused[targets] = tasks(f"reused{targets}", blast_files)
+
+        self.assertEqual(len(fresh), 3)
+        self.assertEqual(reused[501], fresh)
+        self.assertEqual(reused[20], fresh)
+        # The opposite marker is always searched; the detected marker only for
+        # queries whose 20 annotation targets may hide routing hits.
+        self.assertEqual(
+            [call.split()[3] for call in searched[501]], [str(databases["16S"])]
+        )
+        self.assertEqual(
+            [call.split()[3] for call in searched[20]],
+            [str(databases["16S"]), str(databases["18S"])],
+        )
+        self.assertIn("18S.tree_route.uncovered.fna", searched[20][1])
+
+
+def synthetic_cmalign(sequence_count: int = 101, columns: int = 3000, seed: int = 1960) -> str:
+    """A cmalign-like AFA alignment with inserts, U residues, and sparse columns."""
+
+    generator = random.Random(seed)
+    insert_columns = set(generator.sample(range(columns), columns // 5))
+    records = []
+    for index in range(sequence_count):
+        characters = []
+        for column in range(columns):
+            if column in insert_columns:
+                characters.append(generator.choice("acgu.."))
+            else:
+                characters.append(generator.choice("ACGUACGUN-"))
+        name = "QUERY" if index == 0 else f"REF{index:04d}"
+        records.append(f">{name}\n{''.join(characters)}\n")
+    return "".join(records)
+
+
+def per_character_trim(text: str, maximum_gap_fraction: float) -> tuple[list[str], int]:
+    """Column-by-column trimming oracle for the vectorized implementation."""
+
+    sequences = [
+        "".join(block.splitlines()[1:]) for block in text.split(">") if block.strip()
+    ]
+    columns = len(sequences[0])
+    inserts = {
+        index
+        for index in range(columns)
+        if any(sequence[index] == "." or sequence[index].islower() for sequence in sequences)
+    }
+    normalized = [
+        "".join(
+            "-" if character in "-.~_" else character.upper().replace("U", "T")
+            for character in sequence
+        )
+        for sequence in sequences
+    ]
+    keep = [
+        index
+        for index in range(columns)
+        if index not in inserts
+        and sum(sequence[index] == "-" for sequence in normalized) / len(normalized)
+        <= maximum_gap_fraction
+    ]
+    return ["".join(sequence[index] for index in keep) for sequence in normalized], len(inserts)
+
+
+def random_iqtree_newick(rng: random.Random, leaf_count: int) -> str:
+    # Unrooted like IQ-TREE output, with SH-aLRT labels and tied branch lengths.
+    subtrees = ["QUERY:" + rng.choice(["0", "1e-06", f"{rng.uniform(0, 0.05):.6f}"])]
+    subtrees.extend(
+        f"REF{rank:04d}:" + rng.choice(["1e-06", f"{rng.uniform(0, 0.3):.6f}"])
+        for rank in range(1, leaf_count)
+    )
+    rng.shuffle(subtrees)
+    while len(subtrees) > 3:
+        first = subtrees.pop(rng.randrange(len(subtrees)))
+        second = subtrees.pop(rng.randrange(len(subtrees)))
+        support = rng.choice(["100", "95.3", "0", "76"])
+        length = rng.choice(["1e-06", f"{rng.uniform(0, 0.1):.6f}"])
+        subtrees.append(f"({first},{second}){support}:{length}")
+    return "(" + ",".join(subtrees) + ");\n"
+
 
 class TreePhylogenyTests(unittest.TestCase):
+    def test_newick_reader_matches_ete4_distances_and_assignments(self) -> None:
+        from ete4 import Tree
+
+        rng = random.Random(2401)
+        lineages = [
+            "Eukaryota;Amoebozoa;Discosea",
+            "Eukaryota;Amoebozoa;Tubulinea",
+            "Eukaryota;TSAR",
+            "Bacteria;Pseudomonadota",
+            "",
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            task = root / "task.json"
+            task.write_text(
+                json.dumps(
+                    {
+                        "schema_version": 1,
+                        "name": "query1",
+                        "sample": "sample",
+                        "detected_model": "RF01960",
+                        "tree_model": "RF01960",
+                        "tree_marker": "18S",
+                        "tree_route_decision": "majority_global_top_hits",
+                        "tree_route_16s_votes": 0,
+                        "tree_route_18s_votes": 100,
+                    }
+                )
+            )
+            tree = root / "iqtree.treefile"
+            references = root / "references.tsv"
+            for _trial in range(40):
+                text = random_iqtree_newick(rng, 101)
+                tree.write_text(text)
+                distances, support = NewickTree(text).leaf_distances("QUERY")
+                ete_tree = Tree(text.strip())
+                query = ete_tree["QUERY"]
+                self.assertEqual(
+                    distances,
+                    {
+                        leaf.name: ete_tree.get_distance(query, leaf)
+                        for leaf in ete_tree.leaves()
+                        if leaf.name != "QUERY"
+                    },
+                )
+                self.assertEqual(
+                    support, None if query.parent.is_root else query.parent.support
+                )
+
+                with references.open("w", newline="") as handle:
+                    writer = csv.DictWriter(
+                        handle, fieldnames=REFERENCE_FIELDS, delimiter="\t"
+                    )
+                    writer.writeheader()
+                    writer.writerows(
+                        reference_row(
+                            f"REF{rank:04d}",
+                            f"subject{rank}",
+                            rank,
+                            taxonomy=rng.choice(lineages),
+                        )
+                        for rank in range(1, 101)
+                    )
+                assignment_neighbors = rng.choice([1, 5])
+                outputs = {}
+                for backend in ("newick", "ete4"):
+                    assignment = classify_tree(
+                        tree_file=tree,
+                        references_file=references,
+                        task_file=task,
+                        assignment_output=root / f"{backend}.assignment.tsv",
+                        neighbors_output=root / f"{backend}.neighbors.tsv",
+                        assignment_neighbors=assignment_neighbors,
+                        tree_backend=backend,
+                    )
+                    outputs[backend] = (
+                        assignment,
+                        (root / f"{backend}.neighbors.tsv").read_text(),
+                    )
+                self.assertEqual(outputs["newick"], outputs["ete4"])
+
+    def test_newick_reader_reads_iqtree_labels_and_rejects_malformed_trees(self) -> None:
+        tree = NewickTree(
+            "('QUERY':0.1,[comment]'REF 0001':0.2,(REF0002:0.3,REF0003:0.4)88.5:0.05)100;\n"
+        )
+        self.assertEqual(set(tree.leaves()), {"QUERY", "REF 0001", "REF0002", "REF0003"})
+        self.assertEqual(
+            tree.leaf_distances("REF0002"),
+            ({"REF0003": 0.7, "QUERY": 0.3 + 0.05 + 0.1, "REF 0001": 0.3 + 0.05 + 0.2}, 88.5),
+        )
+        self.assertEqual(tree.leaf_distances("QUERY")[1], None)
+        for text, message in (
+            ("(QUERY:0.1,REF0001:0.2)", "end with ';'"),
+            ("(QUERY:0.1,REF0001:0.2;", "Unbalanced"),
+            ("((QUERY:0.1,REF0001:0.2)abc:0.1,REF0002:0.3);", "support value"),
+            ("(QUERY:0.1,REF0001:x);", "branch length"),
+            ("(QUERY:0.1,QUERY:0.2);", "Duplicate"),
+        ):
+            with self.subTest(text=text), self.assertRaisesRegex(ValueError, message):
+                NewickTree(text).leaf_distances("QUERY")
+        with self.assertRaisesRegex(ValueError, "without length"):
+            NewickTree("(QUERY:0.1,REF0001);").leaf_distances("QUERY")
+
+    def test_vectorized_trimming_matches_per_character_trimming(self) -> None:
+        text = synthetic_cmalign()
+        expected, inserts = per_character_trim(text, 0.12)
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            alignment = root / "aligned.fna"
+            alignment.write_text(text)
+            output = root / "trimmed.fna"
+            started = time.perf_counter()
+            qc = trim_alignment(
+                alignment, output, root / "qc.json", maximum_gap_fraction=0.12
+            )
+            elapsed = time.perf_counter() - started
+            trimmed = [
+                "".join(block.splitlines()[1:])
+                for block in output.read_text().split(">")
+                if block.strip()
+            ]
+        self.assertEqual(trimmed, expected)
+        self.assertEqual(qc["removed_insert_columns"], inserts)
+        self.assertEqual(qc["retained_columns"], len(expected[0]))
+        self.assertGreater(qc["removed_high_gap_columns"], 0)
+        # One 101 x 3,000 alignment trims in a few milliseconds.
+        self.assertLess(elapsed, 2.0)
+
+    def test_trimming_reports_first_invalid_record(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            alignment = root / "aligned.fna"
+            alignment.write_text(
+                ">QUERY\nACGT\n>REF0001\nAXGT\n>REF0002\nAC*T\n>REF0003\nACGT\n"
+            )
+            with self.assertRaisesRegex(ValueError, r"for REF0001: X$"):
+                trim_alignment(alignment, root / "out.fna", root / "qc.json")
+
     def test_mild_gap_trimming_retains_shared_columns(self) -> None:
         with tempfile.TemporaryDirectory() as tmp:
             root = Path(tmp)
@@ -240,6 +688,80 @@ class TreePhylogenyTests(unittest.TestCase):
         self.assertEqual(qc["removed_high_gap_columns"], 0)
         self.assertEqual(sequences, ["ATGT", "ATGT", "ATGT", "ATGT"])
 
+    def test_stored_reference_rows_trim_like_a_joint_alignment(self) -> None:
+        # Consensus rows and the insert residues each sequence has after a
+        # consensus position; a joint alignment pads inserts with ".".
+        match_rows = {
+            "QUERY": "ACG-TACGTA",
+            "REF0001": "ACGTTACGTA",
+            "REF0002": "AC--TAC-TA",
+            "REF0003": "ACGTTAC--A",
+            "REF0004": "~~GTTACGTA",
+        }
+        inserts = {"QUERY": {2: "ga"}, "REF0002": {2: "t", 6: "ccc"}, "REF0004": {9: "a"}}
+        widths = {
+            position: max(len(residues.get(position, "")) for residues in inserts.values())
+            for position in {position for residues in inserts.values() for position in residues}
+        }
+        joint = {
+            leaf: "".join(
+                character
+                + (
+                    inserts.get(leaf, {}).get(position, "").ljust(widths[position], ".")
+                    if position in widths
+                    else ""
+                )
+                for position, character in enumerate(row)
+            )
+            for leaf, row in match_rows.items()
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            (root / "joint.fna").write_text(
+                "".join(f">{leaf}\n{row}\n" for leaf, row in joint.items())
+            )
+            rows = [
+                reference_row(f"REF{rank:04d}", f"subject{rank}", rank) for rank in range(1, 5)
+            ]
+            with (root / "references.tsv").open("w", newline="") as handle:
+                writer = csv.DictWriter(
+                    handle, fieldnames=REFERENCE_FIELDS, delimiter="\t"
+                )
+                writer.writeheader()
+                writer.writerows(rows)
+            store = root / "alignments" / "18S.RF01960.parquet"
+            write_reference_alignments_parquet(
+                store,
+                {row["blast_sseqid"]: match_rows[row["leaf_id"]] for row in rows}
+                | {"unused": "A" * 10},
+            )
+            (root / "query.cmalign.fna").write_text(f">query name\n{match_rows['QUERY']}\n")
+            assemble_alignment(root, root / "query.cmalign.fna", store, root / "stacked.fna")
+            joint_qc = trim_alignment(
+                root / "joint.fna",
+                root / "joint.trimmed.fna",
+                root / "joint.qc.json",
+                maximum_gap_fraction=0.3,
+            )
+            stacked_qc = trim_alignment(
+                root / "stacked.fna",
+                root / "stacked.trimmed.fna",
+                root / "stacked.qc.json",
+                maximum_gap_fraction=0.3,
+                reference_alignment="precomputed",
+            )
+            joint_trimmed = (root / "joint.trimmed.fna").read_text()
+            stacked_trimmed = (root / "stacked.trimmed.fna").read_text()
+
+        self.assertEqual(stacked_trimmed, joint_trimmed)
+        self.assertEqual(joint_qc["removed_insert_columns"], sum(widths.values()))
+        self.assertEqual(stacked_qc["removed_insert_columns"], 0)
+        self.assertEqual(stacked_qc["input_columns"], len(match_rows["QUERY"]))
+        self.assertEqual(stacked_qc["retained_columns"], joint_qc["retained_columns"])
+        self.assertLess(stacked_qc["retained_columns"], len(match_rows["QUERY"]))
+        self.assertEqual(joint_qc["reference_alignment"], "joint")
+        self.assertEqual(stacked_qc["reference_alignment"], "precomputed")
+
     def test_tree_taxonomy_uses_nearest_named_lineages_and_centroids(self) -> None:
         with tempfile.TemporaryDirectory() as tmp:
             root = Path(tmp)
@@ -377,5 +899,370 @@ class TreePhylogenyTests(unittest.TestCase):
         self.assertEqual(assignment["tree_basis_neighbors"], "3")
 
 
+# Pads the input records to a common width, as an AFA alignment of match columns.
+PADDING_CMALIGN = """#!/usr/bin/env python3
+import sys
+arguments = sys.argv[1:]
+if arguments == ["-h"]:
+    print("# cmalign :: align sequences to a CM")
+    print("# INFERNAL 1.1.5 (Sep 2023)")
+    sys.exit()
+with open(sys.argv[0] + ".calls", "a") as log:
+    log.write(" ".join(arguments) + "\\n")
+records = []
+for line in open(arguments[-1]):
+    if line.startswith(">"):
+        records.append([line[1:].split()[0], ""])
+    else:
+        records[-1][1] += line.strip()
+width = max(len(sequence) for _, sequence in records)
+with open(arguments[arguments.index("-o") + 1], "w") as handle:
+    for name, sequence in records:
+        handle.write(f">{name}\\n{sequence.ljust(width, '-')}\\n")
+"""
+
+# Writes a star tree whose branch lengths grow with the alignment row.
+STAR_IQTREE = """#!/usr/bin/env python3
+import sys
+arguments = sys.argv[1:]
+if arguments == ["--version"]:
+    print("IQ-TREE version 3.0.1 for Linux x86 64-bit")
+    sys.exit()
+with open(sys.argv[0] + ".calls", "a") as log:
+    log.write(" ".join(arguments) + "\\n")
+alignment = arguments[arguments.index("-s") + 1]
+names = [line[1:].strip() for line in open(alignment) if line.startswith(">")]
+with open(arguments[arguments.index("-pre") + 1] + ".treefile", "w") as handle:
+    handle.write(
+        "(" + ",".join(f"{name}:{0.01 * (rank + 1):.2f}" for rank, name in enumerate(names))
+        + ");\\n"
+    )
+"""
+
+
+def write_tree_task(
+    directory: Path, query: str, marker: str, references: dict[str, str]
+) -> Path:
+    key = f"q_{query}"
+    task = directory / key
+    task.mkdir(parents=True)
+    (task / "query.fna").write_text(f">{query}\nACGTACGTAC\n")
+    rows = [
+        reference_row(f"REF{rank:04d}", subject, rank, taxonomy=taxonomy)
+        for rank, (subject, taxonomy) in enumerate(references.items(), start=1)
+    ]
+    with (task / "references.tsv").open("w", newline="") as handle:
+        writer = csv.DictWriter(
+            handle, fieldnames=REFERENCE_FIELDS, delimiter="\t", lineterminator="\n"
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+    (task / "references.fna").write_text(
+        "".join(f">{subject}\nACGTTCGTAC\n" for subject in references)
+    )
+    (task / "task.json").write_text(
+        json.dumps(
+            {
+                "schema_version": 1,
+                "query_key": key,
+                "name": query,
+                "sample": "sample",
+                "detected_model": "RF01960",
+                "tree_model": {"16S": "RF00177", "18S": "RF01960"}[marker],
+                "tree_marker": marker,
+                "tree_route_decision": "majority_global_top_hits",
+                "tree_route_16s_votes": 100 if marker == "16S" else 0,
+                "tree_route_18s_votes": 100 if marker == "18S" else 0,
+            }
+        )
+    )
+    return task
+
+
+class TreeBundleTests(unittest.TestCase):
+    def test_tasks_pack_in_order_into_byte_bounded_bundles(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            tasks = [
+                write_tree_task(
+                    root,
+                    f"query{index}",
+                    "18S",
+                    # The third task alone exceeds the bundle size.
+                    {f"e{rank}": "Eukaryota" for rank in range(9 if index == 3 else 3)},
+                )
+                for index in range(1, 6)
+            ]
+            task_bytes = sum(
+                (tasks[0] / name).stat().st_size for name in ("query.fna", "references.fna")
+            )
+            bundles = bundle_tree_tasks(tasks, 2 * task_bytes, root)
+            layout = {
+                bundle.name: sorted(path.name for path in bundle.iterdir())
+                for bundle in bundles
+            }
+            remaining = sorted(path.name for path in root.iterdir())
+
+        self.assertEqual(
+            layout,
+            {
+                "bundle_1": ["q_query1", "q_query2"],
+                "bundle_2": ["q_query3"],
+                "bundle_3": ["q_query4", "q_query5"],
+            },
+        )
+        self.assertEqual(remaining, ["bundle_1", "bundle_2", "bundle_3"])
+
+    def test_bundle_workers_classify_each_query_like_a_single_task(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            tools = {}
+            for name, script in (("cmalign", PADDING_CMALIGN), ("iqtree3", STAR_IQTREE)):
+                tools[name] = root / name
+                tools[name].write_text(script)
+                tools[name].chmod(0o755)
+            store = root / "alignments" / "18S.RF01960.parquet"
+            write_reference_alignments_parquet(
+                store, {f"e{rank}": "ACGTTCGTAC" for rank in range(1, 5)}
+            )
+            eukaryotes = {
+                "e1": "Eukaryota;Amoebozoa;Discosea",
+                "e2": "Eukaryota;Amoebozoa;Tubulinea",
+                "e3": "Eukaryota;TSAR",
+                "e4": "Eukaryota;Amoebozoa",
+            }
+            bacteria = {f"b{rank}": "Bacteria;Pseudomonadota" for rank in range(1, 4)}
+            tasks = [
+                write_tree_task(root / "tasks", "first", "18S", eukaryotes),
+                write_tree_task(root / "tasks", "second", "16S", bacteria),
+                write_tree_task(root / "tasks", "third", "18S", eukaryotes),
+            ]
+            (bundle,) = bundle_tree_tasks(tasks, 10**6, root / "tasks")
+            settings = BundleSettings(
+                covariance_models={"16S": Path("RF00177.cm"), "18S": Path("RF01960.cm")},
+                alignment_stores={"18S": store},
+                maximum_gap_fraction=0.9,
+                assignment_neighbors=2,
+                cmalign=str(tools["cmalign"]),
+                iqtree=str(tools["iqtree3"]),
+            )
+            outputs = {}
+            for workers in (1, 3):
+                output = root / f"workers{workers}"
+                output.mkdir()
+                directories = run_bundle(bundle, output, settings, workers=workers)
+                outputs[workers] = {
+                    path.relative_to(output).as_posix(): path.read_text()
+                    for directory in directories
+                    for path in directory.iterdir()
+                }
+            cmalign_calls = Path(f"{tools['cmalign']}.calls").read_text().splitlines()
+            iqtree_calls = Path(f"{tools['iqtree3']}.calls").read_text().splitlines()
+
+        self.assertEqual(outputs[1], outputs[3])
+        self.assertEqual(
+            sorted(name for name in outputs[1] if name.startswith("q_first/")),
+            [
+                f"q_first/{name}"
+                for name in sorted(
+                    [
+                        "alignment_qc.json",
+                        "cmalign.fna",
+                        "cmalign.trimmed.fna",
+                        "iqtree.treefile",
+                        "q_first.tree_assignment.tsv",
+                        "q_first.tree_neighbors.tsv",
+                        "query.cmalign.fna",
+                        "query.fna",
+                        "references.fna",
+                        "references.tsv",
+                        "task.json",
+                        "tool_versions.txt",
+                    ]
+                )
+            ],
+        )
+        self.assertIn("q_second/cmalign_input.fna", outputs[1])
+        self.assertNotIn("q_second/query.cmalign.fna", outputs[1])
+        self.assertEqual(
+            outputs[1]["q_first/tool_versions.txt"],
+            "# cmalign :: align sequences to a CM\nIQ-TREE version 3.0.1 for Linux x86 64-bit\n",
+        )
+        assignments = {}
+        for key in ("q_first", "q_second", "q_third"):
+            (row,) = csv.DictReader(
+                outputs[1][f"{key}/{key}.tree_assignment.tsv"].splitlines(), delimiter="\t"
+            )
+            assignments[row["name"]] = row["tree_taxonomy"]
+        self.assertEqual(
+            assignments,
+            {
+                "first": "Eukaryota;Amoebozoa",
+                "second": "Bacteria;Pseudomonadota",
+                "third": "Eukaryota;Amoebozoa",
+            },
+        )
+        self.assertEqual(
+            sorted(call.split()[0] for call in cmalign_calls),
+            ["--cpu", "--cpu", "--matchonly", "--matchonly", "--matchonly", "--matchonly"],
+        )
+        self.assertTrue(all("-T 1 " in call for call in iqtree_calls))
+        self.assertEqual(
+            sorted(call.split("-o ")[1].split()[0] for call in iqtree_calls),
+            ["REF0003", "REF0003", "REF0004", "REF0004", "REF0004", "REF0004"],
+        )
+
+    def test_single_task_entry_point_matches_the_bundle_with_task_cpus(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            tools = {}
+            for name, script in (("cmalign", PADDING_CMALIGN), ("iqtree3", STAR_IQTREE)):
+                tools[name] = root / name
+                tools[name].write_text(script)
+                tools[name].chmod(0o755)
+            store = root / "alignments" / "18S.RF01960.parquet"
+            write_reference_alignments_parquet(
+                store, {f"e{rank}": "ACGTTCGTAC" for rank in range(1, 5)}
+            )
+            tasks = [
+                write_tree_task(
+                    root / "tasks",
+                    "first",
+                    "18S",
+                    {
+                        "e1": "Eukaryota;Amoebozoa;Discosea",
+                        "e2": "Eukaryota;Amoebozoa;Tubulinea",
+                        "e3": "Eukaryota;TSAR",
+                        "e4": "Eukaryota;Amoebozoa",
+                    },
+                ),
+                write_tree_task(
+                    root / "tasks",
+                    "second",
+                    "16S",
+                    {f"b{rank}": "Bacteria;Pseudomonadota" for rank in range(1, 4)},
+                ),
+            ]
+            arguments = [
+                "--covariance-model", "16S=RF00177.cm",
+                "--covariance-model", "18S=RF01960.cm",
+                "--reference-alignment", f"18S={store}",
+                "--assignment-neighbors", "2",
+                "--cmalign", str(tools["cmalign"]),
+                "--iqtree", str(tools["iqtree3"]),
+            ]
+            single = root / "single"
+            single.mkdir()
+            for task in tasks:
+                tree_bundle.main(
+                    ["--task", str(task), "--output-directory", str(single),
+                     "--cmalign-cpu", "4", *arguments]
+                )
+            single_calls = Path(f"{tools['cmalign']}.calls").read_text().splitlines()
+            (bundle,) = bundle_tree_tasks(tasks, 10**6, root / "tasks")
+            bundled = root / "bundled"
+            bundled.mkdir()
+            tree_bundle.main(
+                ["--bundle", str(bundle), "--output-directory", str(bundled), *arguments]
+            )
+            outputs = {
+                name: {
+                    path.relative_to(directory).as_posix(): path.read_text()
+                    for path in directory.glob("q_*/*")
+                }
+                for name, directory in (("single", single), ("bundled", bundled))
+            }
+
+        self.assertEqual(outputs["single"], outputs["bundled"])
+        self.assertEqual(
+            sorted({path.split("/")[0] for path in outputs["single"]}),
+            ["q_first", "q_second"],
+        )
+        self.assertEqual(len(single_calls), 2)
+        self.assertTrue(all("--cpu 4 " in call for call in single_calls))
+
+
+class DeduplicatedTreeTests(unittest.TestCase):
+    def test_unique_sequence_results_fan_out_to_every_record(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            root = Path(tempdir)
+
+            def write(name: str, fields: list[str], rows: list[dict[str, object]]) -> Path:
+                path = root / name
+                with path.open("w", newline="") as handle:
+                    writer = csv.DictWriter(
+                        handle, fieldnames=fields, delimiter="\t", lineterminator="\n"
+                    )
+                    writer.writeheader()
+                    writer.writerows(rows)
+                return path
+
+            members = write(
+                "unique_RF00177.members.tsv",
+                MEMBER_FIELDS,
+                [
+                    {
+                        "sequence_identifier": "SSU_a",
+                        "sample": sample,
+                        "model": "RF00177",
+                        "name": name,
+                    }
+                    for sample, name in (("s1", "q1"), ("s2", "q7"))
+                ],
+            )
+            identity = {"name": "SSU_a", "sample": "unique", "model": "RF00177"}
+            assignments = write(
+                "key.tree_assignment.tsv",
+                TREE_ASSIGNMENT_FIELDS,
+                [{**identity, "tree_taxonomy": "Bacteria;Firmicutes"}],
+            )
+            neighbors = write(
+                "key.tree_neighbors.tsv",
+                TREE_NEIGHBOR_FIELDS,
+                [
+                    {**identity, "tree_neighbor_rank": rank, "leaf_id": f"R{rank}"}
+                    for rank in (1, 2)
+                ],
+            )
+            expand_tree(
+                [members],
+                [assignments, REPO / "config" / "empty.tree_assignment.tsv"],
+                [neighbors],
+                root / "expanded.tree_assignment.tsv",
+                root / "expanded.tree_neighbors.tsv",
+            )
+            with (root / "expanded.tree_assignment.tsv").open() as handle:
+                expanded = list(csv.DictReader(handle, delimiter="\t"))
+            self.assertEqual(
+                [(row["sample"], row["name"], row["tree_taxonomy"]) for row in expanded],
+                [("s1", "q1", "Bacteria;Firmicutes"), ("s2", "q7", "Bacteria;Firmicutes")],
+            )
+            with (root / "expanded.tree_neighbors.tsv").open() as handle:
+                expanded = list(csv.DictReader(handle, delimiter="\t"))
+            self.assertEqual(
+                [(row["sample"], row["name"], row["leaf_id"]) for row in expanded],
+                [
+                    ("s1", "q1", "R1"),
+                    ("s2", "q7", "R1"),
+                    ("s1", "q1", "R2"),
+                    ("s2", "q7", "R2"),
+                ],
+            )
+
+            write(
+                "other.tree_assignment.tsv",
+                TREE_ASSIGNMENT_FIELDS,
+                [{**identity, "name": "SSU_b"}],
+            )
+            with self.assertRaisesRegex(ValueError, "unknown sequence"):
+                expand_tree(
+                    [members],
+                    [root / "other.tree_assignment.tsv"],
+                    [],
+                    root / "expanded.tree_assignment.tsv",
+                    root / "expanded.tree_neighbors.tsv",
+                )
+
+
 if __name__ == "__main__":
     unittest.main()